@@ -1,42 +1,32 @@
+import asyncio
 import dataclasses
+import hashlib
 import io
 import json
 import logging
 import mimetypes
 import os
+import tempfile
 import time
+import uuid
 from collections.abc import AsyncGenerator
 from pathlib import Path
-from typing import Any, Union, cast
-
-from azure.cognitiveservices.speech import (
-    ResultReason,
-    SpeechConfig,
-    SpeechSynthesisOutputFormat,
-    SpeechSynthesisResult,
-    SpeechSynthesizer,
-)
+from typing import TYPE_CHECKING, Any, Optional, Union, cast
+
 from azure.core.exceptions import ResourceNotFoundError
 from azure.identity.aio import (
     AzureDeveloperCliCredential,
     ManagedIdentityCredential,
     get_bearer_token_provider,
 )
-from azure.monitor.opentelemetry import configure_azure_monitor
 from azure.search.documents.agent.aio import KnowledgeAgentRetrievalClient
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.storage.blob.aio import ContainerClient
 from azure.storage.blob.aio import StorageStreamDownloader as BlobDownloader
-from azure.storage.filedatalake.aio import FileSystemClient
+from azure.storage.filedatalake.aio import DataLakeFileClient, FileSystemClient
 from azure.storage.filedatalake.aio import StorageStreamDownloader as DatalakeDownloader
-from openai import AsyncAzureOpenAI, AsyncOpenAI
-from opentelemetry.instrumentation.aiohttp_client import AioHttpClientInstrumentor
-from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
-from opentelemetry.instrumentation.httpx import (
-    HTTPXClientInstrumentor,
-)
-from opentelemetry.instrumentation.openai import OpenAIInstrumentor
+from openai import AsyncAzureOpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
 from quart import (
     Blueprint,
     Quart,
@@ -53,6 +43,7 @@ from quart_cors import cors
 from approaches.approach import Approach
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
+from approaches.contextpacker import get_encoding
 from approaches.promptmanager import PromptyManager
 from approaches.retrievethenread import RetrieveThenReadApproach
 from approaches.retrievethenreadvision import RetrieveThenReadVisionApproach
@@ -70,14 +61,19 @@ from config import (
     CONFIG_CHAT_VISION_APPROACH,
     CONFIG_CREDENTIAL,
     CONFIG_DEFAULT_REASONING_EFFORT,
+    CONFIG_EMBEDDING_CACHE,
     CONFIG_GPT4V_DEPLOYED,
     CONFIG_INGESTER,
+    CONFIG_INGESTION_QUEUE,
     CONFIG_LANGUAGE_PICKER_ENABLED,
+    CONFIG_LOOP_MONITOR,
     CONFIG_OPENAI_CLIENT,
+    CONFIG_PROMPT_MANAGER,
     CONFIG_QUERY_REWRITING_ENABLED,
     CONFIG_REASONING_EFFORT_ENABLED,
     CONFIG_SEARCH_CLIENT,
     CONFIG_SEMANTIC_RANKER_DEPLOYED,
+    CONFIG_SPEECH_AUDIO_CACHE,
     CONFIG_SPEECH_INPUT_ENABLED,
     CONFIG_SPEECH_OUTPUT_AZURE_ENABLED,
     CONFIG_SPEECH_OUTPUT_BROWSER_ENABLED,
@@ -85,23 +81,27 @@ from config import (
     CONFIG_SPEECH_SERVICE_LOCATION,
     CONFIG_SPEECH_SERVICE_TOKEN,
     CONFIG_SPEECH_SERVICE_VOICE,
+    CONFIG_STARTUP_TIMINGS,
+    CONFIG_STREAM_FLUSH_INTERVAL,
+    CONFIG_STREAM_FLUSH_SIZE,
     CONFIG_STREAMING_ENABLED,
     CONFIG_USER_BLOB_CONTAINER_CLIENT,
     CONFIG_USER_UPLOAD_ENABLED,
     CONFIG_VECTOR_SEARCH_ENABLED,
 )
+from core.audiocache import AudioCache
 from core.authentication import AuthenticationHelper
+from core.ingestionqueue import JOB_FAILED, JOB_SUCCEEDED, IngestionQueue
+from core.loopmonitor import EventLoopMonitor
+from core.multipartstream import MultipartFileStream
+from core.openairouter import OpenAIRouterTransport
 from core.sessionhelper import create_session_id
+from core.sharedcache import SLOT_HEADER, SharedMemoryCache
 from decorators import authenticated, authenticated_path
 from error import error_dict, error_response
-from prepdocs import (
-    clean_key_if_exists,
-    setup_embeddings_service,
-    setup_file_processors,
-    setup_search_info,
-)
-from prepdocslib.filestrategy import UploadUserFileStrategy
-from prepdocslib.listfilestrategy import File
+
+if TYPE_CHECKING:
+    from azure.cognitiveservices.speech import SpeechSynthesizer
 
 bp = Blueprint("routes", __name__, static_folder="static")
 # Fix Windows registry issue with mimetypes
@@ -202,17 +202,91 @@ async def ask(auth_claims: dict[str, Any]):
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
         if dataclasses.is_dataclass(o) and not isinstance(o, type):
-            return dataclasses.asdict(o)
+            # One level at a time: the encoder calls back for nested dataclasses, so nothing is deep-copied
+            # the way dataclasses.asdict does
+            return {field.name: getattr(o, field.name) for field in dataclasses.fields(o)}
         return super().default(o)
 
 
-async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+# Built once and reused for every streamed frame, json.dumps(cls=...) would construct a new encoder per call
+NDJSON_ENCODER = JSONEncoder(ensure_ascii=False)
+
+
+# Upper bound for the write batching interval of clients that read the stream slowly
+STREAM_MAX_FLUSH_INTERVAL = 1.0
+# A write that blocks for longer than this means the client is not keeping up with the stream
+STREAM_SLOW_WRITE_SECONDS = 0.05
+
+# Uploads are sent to storage in appends of at least this size, which bounds the memory used per upload
+UPLOAD_APPEND_BYTES = 4 * 1024 * 1024
+# Uploads are written under a temporary name ending in this suffix, and renamed over the file once complete
+UPLOAD_TEMP_SUFFIX = ".uploading"
+
+
+async def format_as_ndjson(
+    r: AsyncGenerator[dict, None], flush_interval: float = 0, flush_size: int = 0
+) -> AsyncGenerator[str, None]:
+    """
+    Serializes the events as ndjson lines. Answer deltas are batched into one write until flush_interval seconds
+    have passed, whether or not another event arrived, or flush_size characters are buffered. Other events are
+    written right away.
+    With both left at 0 each event is its own write.
+    Events are only read from r when the server asks for the next write, so a slow client slows down reading the
+    model's stream (backpressure) instead of the response being buffered in memory. A write that blocks marks a slow
+    client: the batching interval grows, up to STREAM_MAX_FLUSH_INTERVAL, so that it gets fewer and larger writes
+    until it catches up. Closing this generator, as Quart does when the client disconnects, closes r and with it
+    the model's stream, so no more tokens are generated for nobody.
+    """
+    interval = flush_interval
+    buffered: list[str] = []
+    buffered_size = 0
+    flush_at = 0.0
+    # Waiting for the next event with a deadline needs it in a task, which is only made while deltas are buffered
+    next_event: Optional[asyncio.Future] = None
     try:
-        async for event in r:
-            yield json.dumps(event, ensure_ascii=False, cls=JSONEncoder) + "\n"
+        while True:
+            if buffered:
+                if next_event is None:
+                    next_event = asyncio.ensure_future(r.__anext__())
+                done, _ = await asyncio.wait([next_event], timeout=max(flush_at - time.monotonic(), 0))
+            # Buffered deltas are written when their interval ends, even if the model pauses before the next event
+            if not buffered or done:
+                try:
+                    event = await (next_event if next_event is not None else r.__anext__())
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_event = None
+                line = NDJSON_ENCODER.encode(event) + "\n"
+                if not buffered:
+                    flush_at = time.monotonic() + interval
+                buffered.append(line)
+                buffered_size += len(line)
+                if event.keys() == {"delta"} and time.monotonic() < flush_at and not 0 < flush_size <= buffered_size:
+                    continue
+            data = "".join(buffered)
+            buffered.clear()
+            buffered_size = 0
+            write_started = time.monotonic()
+            yield data
+            blocked = time.monotonic() - write_started
+            if blocked > max(interval, STREAM_SLOW_WRITE_SECONDS):
+                if interval < STREAM_MAX_FLUSH_INTERVAL:
+                    logging.info("Client is reading the stream slowly, a write blocked for %.0f ms", blocked * 1000)
+                interval = min(max(interval * 2, blocked), STREAM_MAX_FLUSH_INTERVAL)
+            elif interval > flush_interval:
+                interval = max(interval / 2, flush_interval)
+        if buffered:
+            yield "".join(buffered)
     except Exception as error:
         logging.exception("Exception while generating response stream: %s", error)
-        yield json.dumps(error_dict(error))
+        yield "".join(buffered) + json.dumps(error_dict(error))
+    finally:
+        if next_event is not None:
+            # r can only be closed once the read that's waiting on it has stopped
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+        await r.aclose()
 
 
 @bp.route("/chat", methods=["POST"])
@@ -278,7 +352,13 @@ async def chat_stream(auth_claims: dict[str, Any]):
             context=context,
             session_state=session_state,
         )
-        response = await make_response(format_as_ndjson(result))
+        response = await make_response(
+            format_as_ndjson(
+                result,
+                flush_interval=current_app.config[CONFIG_STREAM_FLUSH_INTERVAL],
+                flush_size=current_app.config[CONFIG_STREAM_FLUSH_SIZE],
+            )
+        )
         response.timeout = None  # type: ignore
         response.mimetype = "application/json-lines"
         return response
@@ -373,6 +453,22 @@ async def speech():
     request_json = await request.get_json()
     text = request_json["text"]
     try:
+        # Imported on first use, so workers without Azure speech output don't load the Speech SDK
+        from azure.cognitiveservices.speech import (
+            ResultReason,
+            SpeechConfig,
+            SpeechSynthesisOutputFormat,
+            SpeechSynthesisResult,
+            SpeechSynthesizer,
+        )
+
+        voice = current_app.config[CONFIG_SPEECH_SERVICE_VOICE]
+        output_format = SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3
+        audio_cache: Optional[AudioCache] = current_app.config.get(CONFIG_SPEECH_AUDIO_CACHE)
+        cache_key = AudioCache.key(voice, output_format.name, text)
+        if audio_cache and (audio := audio_cache.get(cache_key)) is not None:
+            return audio, 200, {"Content-Type": "audio/mp3"}
+
         # Construct a token as described in documentation:
         # https://learn.microsoft.com/azure/ai-services/speech-service/how-to-configure-azure-ad-auth?pivots=programming-language-python
         auth_token = (
@@ -382,11 +478,34 @@ async def speech():
             + current_app.config[CONFIG_SPEECH_SERVICE_TOKEN].token
         )
         speech_config = SpeechConfig(auth_token=auth_token, region=current_app.config[CONFIG_SPEECH_SERVICE_LOCATION])
-        speech_config.speech_synthesis_voice_name = current_app.config[CONFIG_SPEECH_SERVICE_VOICE]
-        speech_config.speech_synthesis_output_format = SpeechSynthesisOutputFormat.Audio16Khz32KBitRateMonoMp3
+        speech_config.speech_synthesis_voice_name = voice
+        speech_config.speech_synthesis_output_format = output_format
         synthesizer = SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-        result: SpeechSynthesisResult = synthesizer.speak_text_async(text).get()
+
+        # The SDK synthesizes on its own threads and reports audio chunks as they are produced,
+        # so waiting for the result happens off the event loop and the chunks are handed over to it
+        loop = asyncio.get_running_loop()
+        audio_chunks: asyncio.Queue[bytes] = asyncio.Queue()
+        synthesizer.synthesizing.connect(
+            lambda event: loop.call_soon_threadsafe(audio_chunks.put_nowait, event.result.audio_data)
+        )
+        synthesis = asyncio.ensure_future(asyncio.to_thread(synthesizer.speak_text_async(text).get))
+        first_chunk = asyncio.ensure_future(audio_chunks.get())
+        await asyncio.wait([synthesis, first_chunk], return_when=asyncio.FIRST_COMPLETED)
+        if not synthesis.done():
+            # Audio is arriving, so stream it instead of waiting for the whole answer to be read out
+            response = await make_response(
+                stream_speech_audio(synthesizer, synthesis, first_chunk, audio_chunks, audio_cache, cache_key)
+            )
+            response.timeout = None  # type: ignore
+            response.mimetype = "audio/mp3"
+            return response
+
+        first_chunk.cancel()
+        result: SpeechSynthesisResult = synthesis.result()
         if result.reason == ResultReason.SynthesizingAudioCompleted:
+            if audio_cache:
+                audio_cache.set(cache_key, result.audio_data)
             return result.audio_data, 200, {"Content-Type": "audio/mp3"}
         elif result.reason == ResultReason.Canceled:
             cancellation_details = result.cancellation_details
@@ -402,16 +521,74 @@ async def speech():
         return jsonify({"error": str(e)}), 500
 
 
+async def stream_speech_audio(
+    synthesizer: "SpeechSynthesizer",
+    synthesis: asyncio.Future,
+    first_chunk: asyncio.Future,
+    audio_chunks: asyncio.Queue,
+    audio_cache: Optional[AudioCache],
+    cache_key: str,
+) -> AsyncGenerator[bytes, None]:
+    from azure.cognitiveservices.speech import ResultReason
+
+    next_chunk = first_chunk
+    try:
+        while True:
+            await asyncio.wait([synthesis, next_chunk], return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                break
+            yield next_chunk.result()
+            next_chunk = asyncio.ensure_future(audio_chunks.get())
+        # Chunks reported just before the synthesis finished are still queued
+        while not audio_chunks.empty():
+            yield audio_chunks.get_nowait()
+        result = synthesis.result()
+        if result.reason == ResultReason.SynthesizingAudioCompleted:
+            if audio_cache:
+                audio_cache.set(cache_key, result.audio_data)
+        else:
+            # The response has started, so the client can only notice the audio ending early
+            logging.error("Speech synthesis stopped while streaming: %s", result.reason)
+    finally:
+        next_chunk.cancel()
+        if not synthesis.done():
+            # The client went away, so stop synthesizing audio that nobody will hear
+            synthesizer.stop_speaking_async()
+
+
+async def upload_file_stream(file_client: DataLakeFileClient, chunks: AsyncGenerator[bytes, None]) -> str:
+    """Appends the chunks to the file as they arrive, and returns the SHA-256 of its content."""
+    content_hash = hashlib.sha256()
+    pending = bytearray()
+    offset = 0
+    async for chunk in chunks:
+        content_hash.update(chunk)
+        pending += chunk
+        if len(pending) >= UPLOAD_APPEND_BYTES:
+            await file_client.append_data(bytes(pending), offset=offset, length=len(pending))
+            offset += len(pending)
+            pending.clear()
+    if pending:
+        await file_client.append_data(bytes(pending), offset=offset, length=len(pending))
+        offset += len(pending)
+    await file_client.flush_data(offset)
+    return content_hash.hexdigest()
+
+
 @bp.post("/upload")
 @authenticated
 async def upload(auth_claims: dict[str, Any]):
-    request_files = await request.files
-    if "file" not in request_files:
+    # The file is read from the request body as it arrives and sent on to storage, so it's never held in full
+    try:
+        file_stream = MultipartFileStream(request.body, request.headers.get("Content-Type", ""), "file")
+        filename = await file_stream.open()
+    except ValueError:
+        filename = None
+    if not filename:
         # If no files were included in the request, return an error response
         return jsonify({"message": "No file part in the request", "status": "failed"}), 400
 
     user_oid = auth_claims["oid"]
-    file = request_files.getlist("file")[0]
     user_blob_container_client: FileSystemClient = current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT]
     user_directory_client = user_blob_container_client.get_directory_client(user_oid)
     try:
@@ -420,15 +597,51 @@ async def upload(auth_claims: dict[str, Any]):
         current_app.logger.info("Creating directory for user %s", user_oid)
         await user_directory_client.create_directory()
     await user_directory_client.set_access_control(owner=user_oid)
-    file_client = user_directory_client.get_file_client(file.filename)
-    file_io = file
-    file_io.name = file.filename
-    file_io = io.BufferedReader(file_io)
-    await file_client.upload_data(file_io, overwrite=True, metadata={"UploadedBy": user_oid})
-    file_io.seek(0)
-    ingester: UploadUserFileStrategy = current_app.config[CONFIG_INGESTER]
-    await ingester.add_file(File(content=file_io, acls={"oids": [user_oid]}, url=file_client.url))
-    return jsonify({"message": "File uploaded successfully"}), 200
+    file_client = user_directory_client.get_file_client(filename)
+    try:
+        ingested_hash = ((await file_client.get_file_properties()).metadata or {}).get("IngestedHash")
+    except ResourceNotFoundError:
+        ingested_hash = None
+    # Until the upload completes, the previous file and its ingested hash stay in place
+    upload_client = user_directory_client.get_file_client(f"{filename}.{uuid.uuid4().hex}{UPLOAD_TEMP_SUFFIX}")
+    await upload_client.create_file(metadata={"UploadedBy": user_oid})
+    try:
+        content_hash = await upload_file_stream(upload_client, file_stream.chunks())
+        metadata = {"UploadedBy": user_oid, "ContentHash": content_hash}
+        if content_hash == ingested_hash:
+            metadata["IngestedHash"] = content_hash
+        await upload_client.set_metadata(metadata)
+        await upload_client.rename_file(f"{file_client.file_system_name}/{file_client.path_name}")
+    except BaseException:
+        # Also reached when the client disconnects, which cancels the request
+        try:
+            await upload_client.delete_file()
+        except Exception:
+            current_app.logger.exception("Failed to delete incomplete upload %s", upload_client.path_name)
+        raise
+    if content_hash == ingested_hash:
+        # The same content is already in the index, so there's nothing to parse or embed again
+        return jsonify({"message": "File uploaded successfully"}), 200
+    # Parsing, embedding and indexing can take minutes, so they run in the background
+    ingestion_queue: IngestionQueue = current_app.config[CONFIG_INGESTION_QUEUE]
+    job_id = await ingestion_queue.add(user_oid, filename)
+    return jsonify({"message": "File uploaded, processing it...", "job_id": job_id}), 202
+
+
+@bp.get("/upload_status/<job_id>")
+@authenticated
+async def upload_status(auth_claims: dict[str, Any], job_id: str):
+    ingestion_queue: IngestionQueue = current_app.config[CONFIG_INGESTION_QUEUE]
+    job = await ingestion_queue.get(job_id, auth_claims["oid"])
+    if job is None:
+        return jsonify({"error": "Upload not found"}), 404
+    # The error was logged when the job failed, it may describe the app's internals
+    del job["error"]
+    job["message"] = {
+        JOB_SUCCEEDED: "File uploaded successfully",
+        JOB_FAILED: "Processing the file failed - please try again or contact admin.",
+    }.get(job["status"], "File uploaded, processing it...")
+    return jsonify(job), 200
 
 
 @bp.post("/delete_uploaded")
@@ -455,7 +668,8 @@ async def list_uploaded(auth_claims: dict[str, Any]):
     try:
         all_paths = user_blob_container_client.get_paths(path=user_oid)
         async for path in all_paths:
-            files.append(path.name.split("/", 1)[1])
+            if not path.name.endswith(UPLOAD_TEMP_SUFFIX):
+                files.append(path.name.split("/", 1)[1])
     except ResourceNotFoundError as error:
         if error.status_code != 404:
             current_app.logger.exception("Error listing uploaded files", error)
@@ -464,6 +678,16 @@ async def list_uploaded(auth_claims: dict[str, Any]):
 
 @bp.before_app_serving
 async def setup_clients():
+    # Time spent in each phase of startup, workers are recycled regularly so this is paid often
+    startup_timings: dict[str, float] = {}
+    phase_started = time.perf_counter()
+
+    def record_phase(name: str):
+        nonlocal phase_started
+        now = time.perf_counter()
+        startup_timings[name] = round((now - phase_started) * 1000, 1)
+        phase_started = now
+
     # Replace these with your own values, either in environment variables or directly here
     AZURE_STORAGE_ACCOUNT = os.environ["AZURE_STORAGE_ACCOUNT"]
     AZURE_STORAGE_CONTAINER = os.environ["AZURE_STORAGE_CONTAINER"]
@@ -481,6 +705,12 @@ async def setup_clients():
     OPENAI_EMB_MODEL = os.getenv("AZURE_OPENAI_EMB_MODEL_NAME", "text-embedding-ada-002")
     OPENAI_EMB_DIMENSIONS = int(os.getenv("AZURE_OPENAI_EMB_DIMENSIONS") or 1536)
     OPENAI_REASONING_EFFORT = os.getenv("AZURE_OPENAI_REASONING_EFFORT")
+    # Optional cap on the tokens used for sources and history in the answer prompt
+    OPENAI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AZURE_OPENAI_CONTEXT_TOKEN_BUDGET") or 0) or None
+    # Write batching for streamed answers, 0 sends each frame as its own write
+    STREAM_FLUSH_MS = int(os.getenv("AZURE_STREAM_FLUSH_MS") or 0)
+    STREAM_FLUSH_SIZE = int(os.getenv("AZURE_STREAM_FLUSH_SIZE") or 0)
+    OPENAI_HEDGE_QUERY_REWRITE = os.getenv("AZURE_OPENAI_HEDGE_QUERY_REWRITE", "").lower() == "true"
     # Used with Azure OpenAI deployments
     AZURE_OPENAI_SERVICE = os.getenv("AZURE_OPENAI_SERVICE")
     AZURE_OPENAI_GPT4V_DEPLOYMENT = os.environ.get("AZURE_OPENAI_GPT4V_DEPLOYMENT")
@@ -490,6 +720,10 @@ async def setup_clients():
     )
     AZURE_OPENAI_EMB_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT") if OPENAI_HOST.startswith("azure") else None
     AZURE_OPENAI_CUSTOM_URL = os.getenv("AZURE_OPENAI_CUSTOM_URL")
+    # Additional Azure OpenAI endpoints with the same deployments, requests are load balanced across all of them
+    AZURE_OPENAI_ROUTER_ENDPOINTS = [
+        endpoint.strip() for endpoint in os.getenv("AZURE_OPENAI_ROUTER_ENDPOINTS", "").split(",") if endpoint.strip()
+    ]
     # https://learn.microsoft.com/azure/ai-services/openai/api-version-deprecation#latest-ga-api-release
     AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-10-21"
     AZURE_VISION_ENDPOINT = os.getenv("AZURE_VISION_ENDPOINT", "")
@@ -520,6 +754,8 @@ async def setup_clients():
     AZURE_SPEECH_SERVICE_ID = os.getenv("AZURE_SPEECH_SERVICE_ID")
     AZURE_SPEECH_SERVICE_LOCATION = os.getenv("AZURE_SPEECH_SERVICE_LOCATION")
     AZURE_SPEECH_SERVICE_VOICE = os.getenv("AZURE_SPEECH_SERVICE_VOICE") or "en-US-AndrewMultilingualNeural"
+    # Memory for synthesized answers, so replaying an answer doesn't synthesize it again
+    AZURE_SPEECH_CACHE_MB = int(os.getenv("AZURE_SPEECH_CACHE_MB") or 32)
 
     USE_GPT4V = os.getenv("USE_GPT4V", "").lower() == "true"
     USE_USER_UPLOAD = os.getenv("USE_USER_UPLOAD", "").lower() == "true"
@@ -561,6 +797,7 @@ async def setup_clients():
 
     # Set the Azure credential in the app config for use in other parts of the app
     current_app.config[CONFIG_CREDENTIAL] = azure_credential
+    record_phase("credential")
 
     # Set up clients for AI Search and Storage
     search_client = SearchClient(
@@ -576,30 +813,18 @@ async def setup_clients():
         f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", AZURE_STORAGE_CONTAINER, credential=azure_credential
     )
 
-    # Set up authentication helper
-    search_index = None
-    if AZURE_USE_AUTHENTICATION:
-        current_app.logger.info("AZURE_USE_AUTHENTICATION is true, setting up search index client")
-        search_index_client = SearchIndexClient(
-            endpoint=AZURE_SEARCH_ENDPOINT,
-            credential=azure_credential,
-        )
-        search_index = await search_index_client.get_index(AZURE_SEARCH_INDEX)
-        await search_index_client.close()
-    auth_helper = AuthenticationHelper(
-        search_index=search_index,
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-
     if USE_USER_UPLOAD:
         current_app.logger.info("USE_USER_UPLOAD is true, setting up user upload feature")
+        # Ingestion pulls in the document parsers, which are only needed with user upload
+        from prepdocs import (
+            clean_key_if_exists,
+            setup_embeddings_service,
+            setup_file_processors,
+            setup_search_info,
+        )
+        from prepdocslib.filestrategy import UploadUserFileStrategy
+        from prepdocslib.listfilestrategy import File
+
         if not AZURE_USERSTORAGE_ACCOUNT or not AZURE_USERSTORAGE_CONTAINER:
             raise ValueError(
                 "AZURE_USERSTORAGE_ACCOUNT and AZURE_USERSTORAGE_CONTAINER must be set when USE_USER_UPLOAD is true"
@@ -643,8 +868,31 @@ async def setup_clients():
         )
         current_app.config[CONFIG_INGESTER] = ingester
 
+        async def ingest_uploaded_file(user_oid: str, filename: str):
+            file_client = user_blob_container_client.get_directory_client(user_oid).get_file_client(filename)
+            downloader = await file_client.download_file()
+            content = await downloader.readall()
+            file_io = io.BytesIO(content)
+            file_io.name = filename
+            await ingester.add_file(File(content=file_io, acls={"oids": [user_oid]}, url=file_client.url))
+            # Lets an upload of the same content skip ingestion
+            metadata = dict(downloader.properties.metadata or {})
+            metadata["IngestedHash"] = hashlib.sha256(content).hexdigest()
+            await file_client.set_metadata(metadata)
+
+        # Shared by the workers of this instance, keep it on persistent storage to resume jobs after a restart
+        ingestion_queue = IngestionQueue(
+            path=os.getenv("AZURE_INGESTION_QUEUE_PATH") or os.path.join(tempfile.gettempdir(), "ingestion-queue.db"),
+            ingest=ingest_uploaded_file,
+            concurrency=int(os.getenv("AZURE_INGESTION_CONCURRENCY") or 2),
+            user_concurrency=int(os.getenv("AZURE_INGESTION_USER_CONCURRENCY") or 1),
+        )
+        ingestion_queue.start()
+        current_app.config[CONFIG_INGESTION_QUEUE] = ingestion_queue
+
     # Used by the OpenAI SDK
     openai_client: AsyncOpenAI
+    openai_token_provider = None
 
     if USE_SPEECH_OUTPUT_AZURE:
         current_app.logger.info("USE_SPEECH_OUTPUT_AZURE is true, setting up Azure speech service")
@@ -657,6 +905,8 @@ async def setup_clients():
         current_app.config[CONFIG_SPEECH_SERVICE_VOICE] = AZURE_SPEECH_SERVICE_VOICE
         # Wait until token is needed to fetch for the first time
         current_app.config[CONFIG_SPEECH_SERVICE_TOKEN] = None
+        if AZURE_SPEECH_CACHE_MB:
+            current_app.config[CONFIG_SPEECH_AUDIO_CACHE] = AudioCache(max_bytes=AZURE_SPEECH_CACHE_MB * 1024 * 1024)
 
     if OPENAI_HOST.startswith("azure"):
         if OPENAI_HOST == "azure_custom":
@@ -669,18 +919,38 @@ async def setup_clients():
             if not AZURE_OPENAI_SERVICE:
                 raise ValueError("AZURE_OPENAI_SERVICE must be set when OPENAI_HOST is azure")
             endpoint = f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
+        openai_http_client = None
+        if AZURE_OPENAI_ROUTER_ENDPOINTS:
+            # The key only works for its own instance, so the other endpoints would reject every routed request
+            if os.getenv("AZURE_OPENAI_API_KEY_OVERRIDE"):
+                raise ValueError(
+                    "AZURE_OPENAI_ROUTER_ENDPOINTS requires keyless authentication, unset AZURE_OPENAI_API_KEY_OVERRIDE"
+                )
+            current_app.logger.info(
+                "AZURE_OPENAI_ROUTER_ENDPOINTS is set, routing Azure OpenAI requests across %d endpoints",
+                len(AZURE_OPENAI_ROUTER_ENDPOINTS) + 1,
+            )
+            openai_http_client = DefaultAsyncHttpxClient(
+                transport=OpenAIRouterTransport([endpoint, *AZURE_OPENAI_ROUTER_ENDPOINTS])
+            )
         if api_key := os.getenv("AZURE_OPENAI_API_KEY_OVERRIDE"):
             current_app.logger.info("AZURE_OPENAI_API_KEY_OVERRIDE found, using as api_key for Azure OpenAI client")
             openai_client = AsyncAzureOpenAI(
-                api_version=AZURE_OPENAI_API_VERSION, azure_endpoint=endpoint, api_key=api_key
+                api_version=AZURE_OPENAI_API_VERSION,
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                http_client=openai_http_client,
             )
         else:
             current_app.logger.info("Using Azure credential (passwordless authentication) for Azure OpenAI client")
-            token_provider = get_bearer_token_provider(azure_credential, "https://cognitiveservices.azure.com/.default")
+            openai_token_provider = get_bearer_token_provider(
+                azure_credential, "https://cognitiveservices.azure.com/.default"
+            )
             openai_client = AsyncAzureOpenAI(
                 api_version=AZURE_OPENAI_API_VERSION,
                 azure_endpoint=endpoint,
-                azure_ad_token_provider=token_provider,
+                azure_ad_token_provider=openai_token_provider,
+                http_client=openai_http_client,
             )
     elif OPENAI_HOST == "local":
         current_app.logger.info("OPENAI_HOST is local, setting up local OpenAI client for OPENAI_BASE_URL with no key")
@@ -697,6 +967,47 @@ async def setup_clients():
             organization=OPENAI_ORGANIZATION,
         )
 
+    record_phase("clients")
+
+    # The network calls made at startup don't depend on each other, so they run concurrently
+    async def load_search_index():
+        if not AZURE_USE_AUTHENTICATION:
+            return None
+        current_app.logger.info("AZURE_USE_AUTHENTICATION is true, setting up search index client")
+        search_index_client = SearchIndexClient(
+            endpoint=AZURE_SEARCH_ENDPOINT,
+            credential=azure_credential,
+        )
+        try:
+            return await search_index_client.get_index(AZURE_SEARCH_INDEX)
+        finally:
+            await search_index_client.close()
+
+    async def fetch_openai_token():
+        # The token provider caches the token, so the first chat request doesn't wait for it
+        if openai_token_provider is None:
+            return
+        try:
+            await openai_token_provider()
+        except Exception:
+            current_app.logger.warning("Could not get a token for Azure OpenAI at startup, retrying on first use")
+
+    search_index, _ = await asyncio.gather(load_search_index(), fetch_openai_token())
+    record_phase("network")
+
+    # Set up authentication helper
+    auth_helper = AuthenticationHelper(
+        search_index=search_index,
+        use_authentication=AZURE_USE_AUTHENTICATION,
+        server_app_id=AZURE_SERVER_APP_ID,
+        server_app_secret=AZURE_SERVER_APP_SECRET,
+        client_app_id=AZURE_CLIENT_APP_ID,
+        tenant_id=AZURE_AUTH_TENANT_ID,
+        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
+        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
+        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
+    )
+
     current_app.config[CONFIG_OPENAI_CLIENT] = openai_client
     current_app.config[CONFIG_SEARCH_CLIENT] = search_client
     current_app.config[CONFIG_AGENT_CLIENT] = agent_client
@@ -715,6 +1026,8 @@ async def setup_clients():
         or OPENAI_CHATGPT_MODEL not in Approach.GPT_REASONING_MODELS
         or Approach.GPT_REASONING_MODELS[OPENAI_CHATGPT_MODEL].streaming
     )
+    current_app.config[CONFIG_STREAM_FLUSH_INTERVAL] = STREAM_FLUSH_MS / 1000
+    current_app.config[CONFIG_STREAM_FLUSH_SIZE] = STREAM_FLUSH_SIZE
     current_app.config[CONFIG_VECTOR_SEARCH_ENABLED] = os.getenv("USE_VECTORS", "").lower() != "false"
     current_app.config[CONFIG_USER_UPLOAD_ENABLED] = bool(USE_USER_UPLOAD)
     current_app.config[CONFIG_LANGUAGE_PICKER_ENABLED] = ENABLE_LANGUAGE_PICKER
@@ -725,7 +1038,8 @@ async def setup_clients():
     current_app.config[CONFIG_CHAT_HISTORY_COSMOS_ENABLED] = USE_CHAT_HISTORY_COSMOS
     current_app.config[CONFIG_AGENTIC_RETRIEVAL_ENABLED] = USE_AGENTIC_RETRIEVAL
 
-    prompt_manager = PromptyManager()
+    # Built by create_app, so that it is shared by all workers when gunicorn preloads the app
+    prompt_manager = current_app.config[CONFIG_PROMPT_MANAGER]
 
     # Set up the two default RAG approaches for /ask and /chat
     # RetrieveThenReadApproach is used by /ask for single-turn Q&A
@@ -749,6 +1063,7 @@ async def setup_clients():
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
         prompt_manager=prompt_manager,
         reasoning_effort=OPENAI_REASONING_EFFORT,
+        context_token_budget=OPENAI_CONTEXT_TOKEN_BUDGET,
     )
 
     # ChatReadRetrieveReadApproach is used by /chat for multi-turn conversation
@@ -772,6 +1087,8 @@ async def setup_clients():
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
         prompt_manager=prompt_manager,
         reasoning_effort=OPENAI_REASONING_EFFORT,
+        context_token_budget=OPENAI_CONTEXT_TOKEN_BUDGET,
+        hedge_query_rewrite=OPENAI_HEDGE_QUERY_REWRITE,
     )
 
     if USE_GPT4V:
@@ -835,13 +1152,45 @@ async def setup_clients():
             prompt_manager=prompt_manager,
         )
 
+    embedding_cache = current_app.config.get(CONFIG_EMBEDDING_CACHE)
+    for approach_key in [
+        CONFIG_ASK_APPROACH,
+        CONFIG_CHAT_APPROACH,
+        CONFIG_ASK_VISION_APPROACH,
+        CONFIG_CHAT_VISION_APPROACH,
+    ]:
+        if approach := current_app.config.get(approach_key):
+            approach.embedding_cache = embedding_cache
+
+    if loop_monitor_seconds := float(os.getenv("APP_LOOP_MONITOR_SECONDS") or 0):
+        current_app.logger.info("APP_LOOP_MONITOR_SECONDS is set, measuring event loop utilization")
+        loop_monitor = EventLoopMonitor(
+            interval=loop_monitor_seconds,
+            workers=int(os.getenv("WEB_CONCURRENCY") or 1),
+            cpus=os.cpu_count() or 1,
+        )
+        loop_monitor.start()
+        current_app.config[CONFIG_LOOP_MONITOR] = loop_monitor
+    record_phase("approaches")
+    current_app.config[CONFIG_STARTUP_TIMINGS] = startup_timings
+    current_app.logger.info(
+        "Startup took %.1f ms: %s",
+        sum(startup_timings.values()),
+        ", ".join(f"{phase} {duration} ms" for phase, duration in startup_timings.items()),
+    )
+
 
 @bp.after_app_serving
 async def close_clients():
+    # Running ingestion jobs still use the clients
+    if current_app.config.get(CONFIG_INGESTION_QUEUE):
+        await current_app.config[CONFIG_INGESTION_QUEUE].stop()
     await current_app.config[CONFIG_SEARCH_CLIENT].close()
     await current_app.config[CONFIG_BLOB_CONTAINER_CLIENT].close()
     if current_app.config.get(CONFIG_USER_BLOB_CONTAINER_CLIENT):
         await current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT].close()
+    if current_app.config.get(CONFIG_LOOP_MONITOR):
+        await current_app.config[CONFIG_LOOP_MONITOR].stop()
 
 
 def create_app():
@@ -851,7 +1200,19 @@ def create_app():
 
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
         app.logger.info("APPLICATIONINSIGHTS_CONNECTION_STRING is set, enabling Azure Monitor")
-        configure_azure_monitor()
+        # The exporters and instrumentors take a noticeable part of worker startup, so only import them when used
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        from opentelemetry.instrumentation.aiohttp_client import (
+            AioHttpClientInstrumentor,
+        )
+        from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
+        from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+        from opentelemetry.instrumentation.openai import OpenAIInstrumentor
+
+        # The exporters run on background threads, which don't survive a fork, so with a preloaded app
+        # gunicorn.conf.py configures Azure Monitor in each worker instead
+        if os.getenv("GUNICORN_PRELOAD_APP", "").lower() != "true":
+            configure_azure_monitor()
         # This tracks HTTP requests made by aiohttp:
         AioHttpClientInstrumentor().instrument()
         # This tracks HTTP requests made by httpx:
@@ -875,4 +1236,18 @@ def create_app():
             app.logger.info("CORS enabled for %s", allowed_origins)
             cors(app, allow_origin=allowed_origins, allow_methods=["GET", "POST"])
 
+    # Immutable state is built here rather than in setup_clients, so that when gunicorn preloads the app,
+    # it is built once in the main process and shared copy-on-write by the forked workers
+    app.config[CONFIG_PROMPT_MANAGER] = PromptyManager().preload()
+    if (chatgpt_model := os.getenv("AZURE_OPENAI_CHATGPT_MODEL")) and os.getenv("AZURE_OPENAI_CONTEXT_TOKEN_BUDGET"):
+        get_encoding(chatgpt_model)
+    if shared_cache_mb := int(os.getenv("AZURE_SHARED_CACHE_MB") or 0):
+        app.logger.info(
+            "AZURE_SHARED_CACHE_MB is set, caching query embeddings in %d MB of shared memory", shared_cache_mb
+        )
+        embedding_dimensions = int(os.getenv("AZURE_OPENAI_EMB_DIMENSIONS") or 1536)
+        app.config[CONFIG_EMBEDDING_CACHE] = SharedMemoryCache(
+            size_bytes=shared_cache_mb * 1024 * 1024, slot_bytes=SLOT_HEADER.size + 4 * embedding_dimensions
+        )
+
     return app
@@ -33,8 +33,10 @@ from openai.types.chat import (
     ChatCompletionToolParam,
 )
 
+from approaches.contextpacker import ContextPacker
 from approaches.promptmanager import PromptManager
 from core.authentication import AuthenticationHelper
+from core.sharedcache import SharedMemoryCache
 
 
 @dataclass
@@ -122,6 +124,10 @@ class TokenUsageProps:
         )
 
 
+class EmbeddingExtraArgs(TypedDict, total=False):
+    dimensions: int
+
+
 # GPT reasoning models don't support the same set of parameters as other models
 # https://learn.microsoft.com/azure/ai-services/openai/how-to/reasoning
 @dataclass
@@ -138,6 +144,8 @@ class Approach(ABC):
     # Set a higher token limit for GPT reasoning models
     RESPONSE_DEFAULT_TOKEN_LIMIT = 1024
     RESPONSE_REASONING_DEFAULT_TOKEN_LIMIT = 8192
+    # Query embeddings shared by all workers, set up by the app when AZURE_SHARED_CACHE_MB is set
+    embedding_cache: Optional[SharedMemoryCache] = None
 
     def __init__(
         self,
@@ -155,6 +163,7 @@ class Approach(ABC):
         vision_token_provider: Callable[[], Awaitable[str]],
         prompt_manager: PromptManager,
         reasoning_effort: Optional[str] = None,
+        context_token_budget: Optional[int] = None,
     ):
         self.search_client = search_client
         self.openai_client = openai_client
@@ -170,6 +179,7 @@ class Approach(ABC):
         self.vision_token_provider = vision_token_provider
         self.prompt_manager = prompt_manager
         self.reasoning_effort = reasoning_effort
+        self.context_token_budget = context_token_budget
         self.include_token_usage = True
 
     def build_filter(self, overrides: dict[str, Any], auth_claims: dict[str, Any]) -> Optional[str]:
@@ -340,6 +350,30 @@ class Approach(ABC):
                 for doc in results
             ]
 
+    def pack_context(
+        self,
+        model: str,
+        text_sources: list[str],
+        past_messages: list[ChatCompletionMessageParam],
+        user_query: str,
+        overrides: dict[str, Any],
+        response_token_limit: int,
+    ) -> tuple[list[str], list[ChatCompletionMessageParam], Optional[ThoughtStep]]:
+        """
+        Fits sources and history into the configured token budget (the "context_token_budget" override,
+        falling back to the deployment-wide setting). Packing is skipped entirely when no budget is set.
+        """
+        budget = overrides.get("context_token_budget") or self.context_token_budget
+        if not budget:
+            return text_sources, past_messages, None
+        packed = ContextPacker(model, budget, response_token_limit).pack(text_sources, past_messages, user_query)
+        thought = ThoughtStep(
+            "Pack sources and history into token budget",
+            f"Saved {packed.stats.tokens_saved} tokens",
+            packed.stats.as_props(),
+        )
+        return packed.text_sources, packed.past_messages, thought
+
     def get_citation(self, sourcepage: str, use_image_citation: bool) -> str:
         if use_image_citation:
             return sourcepage
@@ -352,30 +386,70 @@ class Approach(ABC):
 
             return sourcepage
 
-    async def compute_text_embedding(self, q: str):
+    def get_embedding_dimensions_args(self) -> EmbeddingExtraArgs:
         SUPPORTED_DIMENSIONS_MODEL = {
             "text-embedding-ada-002": False,
             "text-embedding-3-small": True,
             "text-embedding-3-large": True,
         }
+        return {"dimensions": self.embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else {}
 
-        class ExtraArgs(TypedDict, total=False):
-            dimensions: int
+    def get_embedding_cache_key(self, q: str) -> str:
+        return f"{self.embedding_deployment or self.embedding_model}:{self.embedding_dimensions}:{q}"
 
-        dimensions_args: ExtraArgs = (
-            {"dimensions": self.embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else {}
-        )
-        embedding = await self.openai_client.embeddings.create(
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
-            input=q,
-            **dimensions_args,
-        )
-        query_vector = embedding.data[0].embedding
+    async def compute_text_embedding(self, q: str):
+        cache_key = self.get_embedding_cache_key(q)
+        query_vector = self.embedding_cache.get_vector(cache_key) if self.embedding_cache else None
+        if query_vector is None:
+            embedding = await self.openai_client.embeddings.create(
+                # Azure OpenAI takes the deployment name as the model name
+                model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
+                input=q,
+                **self.get_embedding_dimensions_args(),
+            )
+            query_vector = embedding.data[0].embedding
+            if self.embedding_cache:
+                self.embedding_cache.set_vector(cache_key, query_vector)
         # This performs an oversampling due to how the search index was setup,
         # so we do not need to explicitly pass in an oversampling parameter here
         return VectorizedQuery(vector=query_vector, k_nearest_neighbors=50, fields=self.embedding_field)
 
+    async def compute_text_embeddings(self, queries: list[str]) -> list[VectorizedQuery]:
+        """Embeds several queries with a single micro-batched embeddings request."""
+        cache_keys = [self.get_embedding_cache_key(query) for query in queries]
+        vectors = [self.embedding_cache.get_vector(key) if self.embedding_cache else None for key in cache_keys]
+        missing = [index for index, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedding = await self.openai_client.embeddings.create(
+                model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
+                input=[queries[index] for index in missing],
+                **self.get_embedding_dimensions_args(),
+            )
+            # The service may return items out of order, so sort by the input index
+            for index, data in zip(missing, sorted(embedding.data, key=lambda data: data.index)):
+                vectors[index] = data.embedding
+                if self.embedding_cache:
+                    self.embedding_cache.set_vector(cache_keys[index], data.embedding)
+        return [
+            VectorizedQuery(vector=cast(list[float], vector), k_nearest_neighbors=50, fields=self.embedding_field)
+            for vector in vectors
+        ]
+
+    def fuse_search_results(self, result_lists: list[list[Document]], top: int, k: int = 60) -> list[Document]:
+        """
+        Merges the results of several searches with reciprocal rank fusion, de-duplicating documents by chunk id.
+        See https://learn.microsoft.com/azure/search/hybrid-search-ranking for the scoring formula.
+        """
+        fused_scores: dict[str, float] = {}
+        documents: dict[str, Document] = {}
+        for results in result_lists:
+            for rank, document in enumerate(results):
+                key = document.id or document.content or ""
+                fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+                documents.setdefault(key, document)
+        ranked_keys = sorted(fused_scores, key=lambda key: fused_scores[key], reverse=True)
+        return [documents[key] for key in ranked_keys[:top]]
+
     async def compute_image_embedding(self, q: str):
         endpoint = urljoin(self.vision_endpoint, "computervision/retrieval:vectorizeText")
         headers = {"Content-Type": "application/json"}
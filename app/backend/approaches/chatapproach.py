@@ -1,5 +1,7 @@
+import asyncio
 import json
 import re
+import time
 from abc import ABC, abstractmethod
 from collections.abc import AsyncGenerator, Awaitable
 from typing import Any, Optional, Union, cast
@@ -20,6 +22,8 @@ from approaches.approach import (
 class ChatApproach(Approach, ABC):
 
     NO_RESPONSE = "0"
+    # Answer deltas after the first are sent at most this many seconds late, merged into one frame (0 disables it)
+    STREAM_COALESCE_SECONDS = 0.03
 
     @abstractmethod
     async def run_until_final_call(
@@ -45,6 +49,24 @@ class ChatApproach(Approach, ABC):
                 return query_text
         return user_query
 
+    def get_search_queries(self, chat_completion: ChatCompletion, user_query: str, max_queries: int) -> list[str]:
+        """Returns the de-duplicated sub-queries emitted by the multi-query rewrite tool, falling back to a single query."""
+        response_message = chat_completion.choices[0].message
+
+        search_queries: list[str] = []
+        for tool in response_message.tool_calls or []:
+            if tool.type != "function" or tool.function.name != "search_sources":
+                continue
+            arg = json.loads(tool.function.arguments)
+            candidates = arg.get("search_queries") or [arg.get("search_query", self.NO_RESPONSE)]
+            for candidate in candidates:
+                if isinstance(candidate, str) and candidate.strip() not in ("", self.NO_RESPONSE):
+                    if candidate not in search_queries:
+                        search_queries.append(candidate)
+        if not search_queries:
+            search_queries.append(self.get_search_query(chat_completion, user_query))
+        return search_queries[:max_queries]
+
     def extract_followup_questions(self, content: Optional[str]):
         if content is None:
             return content, []
@@ -87,24 +109,25 @@ class ChatApproach(Approach, ABC):
             messages, overrides, auth_claims, should_stream=True
         )
         chat_coroutine = cast(Awaitable[AsyncStream[ChatCompletionChunk]], chat_coroutine)
+        # The full context is only sent once, later frames carry just the keys that changed
         yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
 
         followup_questions_started = False
         followup_content = ""
-        async for event_chunk in await chat_coroutine:
-            # "2023-07-01-preview" API version has a bug where first response has empty choices
-            event = event_chunk.model_dump()  # Convert pydantic model to dict
-            if event["choices"]:
-                # No usage during streaming
-                completion = {
-                    "delta": {
-                        "content": event["choices"][0]["delta"].get("content"),
-                        "role": event["choices"][0]["delta"]["role"],
-                    }
-                }
+        answer_frames = self.coalesce_deltas(self.stream_answer_deltas(await chat_coroutine))
+        try:
+            async for completion in answer_frames:
+                if isinstance(completion, ChatCompletionChunk):
+                    # Final chunk at end of streaming should contain usage
+                    # https://cookbook.openai.com/examples/how_to_stream_completions#4-how-to-get-token-usage-data-for-streamed-chat-completion-response
+                    if completion.usage and extra_info.thoughts and self.include_token_usage:
+                        extra_info.thoughts[-1].update_token_usage(completion.usage)
+                        if token_usage := (extra_info.thoughts[-1].props or {}).get("token_usage"):
+                            # Token usage belongs to the last thought step, which generated the answer
+                            yield {"delta": {"role": "assistant"}, "context": {"token_usage": token_usage}}
+                    continue
                 # if event contains << and not >>, it is start of follow-up question, truncate
-                content = completion["delta"].get("content")
-                content = content or ""  # content may either not exist in delta, or explicitly be None
+                content = completion["delta"]["content"] or ""  # content may be explicitly None
                 if overrides.get("suggest_followup_questions") and "<<" in content:
                     followup_questions_started = True
                     earlier_content = content[: content.index("<<")]
@@ -116,19 +139,85 @@ class ChatApproach(Approach, ABC):
                     followup_content += content
                 else:
                     yield completion
-            else:
-                # Final chunk at end of streaming should contain usage
-                # https://cookbook.openai.com/examples/how_to_stream_completions#4-how-to-get-token-usage-data-for-streamed-chat-completion-response
-                if event_chunk.usage and extra_info.thoughts and self.include_token_usage:
-                    extra_info.thoughts[-1].update_token_usage(event_chunk.usage)
-                    yield {"delta": {"role": "assistant"}, "context": extra_info, "session_state": session_state}
+        finally:
+            # Closing the frames closes the model's stream, e.g. when the client disconnects mid-answer
+            await answer_frames.aclose()
 
         if followup_content:
             _, followup_questions = self.extract_followup_questions(followup_content)
-            yield {
-                "delta": {"role": "assistant"},
-                "context": {"context": extra_info, "followup_questions": followup_questions},
-            }
+            yield {"delta": {"role": "assistant"}, "context": {"followup_questions": followup_questions}}
+
+    async def stream_answer_deltas(
+        self, chat_stream: AsyncStream[ChatCompletionChunk]
+    ) -> AsyncGenerator[Union[dict[str, Any], ChatCompletionChunk], None]:
+        """
+        Turns the chunks of a streamed chat completion into answer delta frames.
+        The delta fields are read directly: model_dump() serializes the whole pydantic chunk for every token.
+        Chunks without choices are passed through, since the final one carries the token usage.
+        """
+        try:
+            async for event_chunk in chat_stream:
+                # "2023-07-01-preview" API version has a bug where first response has empty choices
+                if event_chunk.choices:
+                    delta = event_chunk.choices[0].delta
+                    yield {"delta": {"content": delta.content, "role": delta.role}}
+                else:
+                    yield event_chunk
+        finally:
+            # Releases the HTTP connection right away, instead of leaving the model generating into it
+            await chat_stream.close()
+
+    async def coalesce_deltas(self, frames: AsyncGenerator[Any, None]) -> AsyncGenerator[Any, None]:
+        """
+        Merges answer deltas into one frame until STREAM_COALESCE_SECONDS have passed since the first of them.
+        Models stream a token or two per chunk, so this cuts the number of frames serialized and sent per answer.
+        The first delta of the answer is sent right away, so coalescing doesn't delay the first token, and merged
+        text is sent when its window ends even if the model pauses. Any other frame flushes the merged text first.
+        """
+        pending: Optional[dict[str, Any]] = None
+        flush_at = 0.0
+        answer_started = False
+        # Waiting for the next frame with a deadline needs it in a task, which is only made while text is merged
+        next_frame: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if pending is not None:
+                    if next_frame is None:
+                        next_frame = asyncio.ensure_future(frames.__anext__())
+                    done, _ = await asyncio.wait([next_frame], timeout=max(flush_at - time.monotonic(), 0))
+                    if not done:
+                        yield pending
+                        pending = None
+                        continue
+                try:
+                    frame = await (next_frame if next_frame is not None else frames.__anext__())
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_frame = None
+                content = frame["delta"]["content"] if isinstance(frame, dict) and frame.keys() == {"delta"} else None
+                if isinstance(content, str) and content and self.STREAM_COALESCE_SECONDS > 0:
+                    if not answer_started:
+                        answer_started = True
+                        yield frame
+                    elif pending is None:
+                        pending = frame
+                        flush_at = time.monotonic() + self.STREAM_COALESCE_SECONDS
+                    else:
+                        pending["delta"]["content"] += content
+                    continue
+                if pending is not None:
+                    yield pending
+                    pending = None
+                yield frame
+            if pending is not None:
+                yield pending
+        finally:
+            if next_frame is not None:
+                # The frames can only be closed once the read that's waiting on them has stopped
+                next_frame.cancel()
+                await asyncio.gather(next_frame, return_exceptions=True)
+            await frames.aclose()
 
     async def run(
         self,
@@ -1,3 +1,5 @@
+import asyncio
+import time
 from collections.abc import Awaitable
 from typing import Any, Optional, Union, cast
 
@@ -12,9 +14,11 @@ from openai.types.chat import (
     ChatCompletionToolParam,
 )
 
-from approaches.approach import DataPoints, ExtraInfo, ThoughtStep
+from approaches.approach import DataPoints, Document, ExtraInfo, ThoughtStep
 from approaches.chatapproach import ChatApproach
+from approaches.hedging import RequestHedger
 from approaches.promptmanager import PromptManager
+from approaches.queryrewrite import QueryRewriteCache, query_rewrite_skip_reason
 from core.authentication import AuthenticationHelper
 
 
@@ -47,6 +51,8 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         query_speller: str,
         prompt_manager: PromptManager,
         reasoning_effort: Optional[str] = None,
+        context_token_budget: Optional[int] = None,
+        hedge_query_rewrite: bool = False,
     ):
         self.search_client = search_client
         self.search_index_name = search_index_name
@@ -68,9 +74,16 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         self.prompt_manager = prompt_manager
         self.query_rewrite_prompt = self.prompt_manager.load_prompt("chat_query_rewrite.prompty")
         self.query_rewrite_tools = self.prompt_manager.load_tools("chat_query_rewrite_tools.json")
+        self.query_rewrite_multi_tools = self.prompt_manager.load_tools("chat_query_rewrite_multi_tools.json")
         self.answer_prompt = self.prompt_manager.load_prompt("chat_answer_question.prompty")
         self.reasoning_effort = reasoning_effort
+        self.context_token_budget = context_token_budget
         self.include_token_usage = True
+        # Smoothed latency of agentic retrieval, used to compare against in-process multi-query retrieval
+        self.agentic_retrieval_latency_ms: Optional[float] = None
+        # The query rewrite is small but sits in front of everything else, so its slow tail is worth a duplicate
+        self.query_rewrite_hedger = RequestHedger() if hedge_query_rewrite else None
+        self.query_rewrite_cache = QueryRewriteCache()
 
     async def run_until_final_call(
         self,
@@ -92,14 +105,27 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         else:
             extra_info = await self.run_search_approach(messages, overrides, auth_claims)
 
+        response_token_limit = self.get_response_token_limit(self.chatgpt_model, 1024)
+        text_sources, past_messages, packing_thought = self.pack_context(
+            self.chatgpt_model,
+            extra_info.data_points.text or [],
+            messages[:-1],
+            str(original_user_query),
+            overrides,
+            response_token_limit,
+        )
+        if packing_thought:
+            extra_info.data_points.text = text_sources
+            extra_info.thoughts.append(packing_thought)
+
         messages = self.prompt_manager.render_prompt(
             self.answer_prompt,
             self.get_system_prompt_variables(overrides.get("prompt_template"))
             | {
                 "include_follow_up_questions": bool(overrides.get("suggest_followup_questions")),
-                "past_messages": messages[:-1],
+                "past_messages": past_messages,
                 "user_query": original_user_query,
-                "text_sources": extra_info.data_points.text,
+                "text_sources": text_sources,
             },
         )
 
@@ -110,7 +136,7 @@ class ChatReadRetrieveReadApproach(ChatApproach):
                 self.chatgpt_model,
                 messages,
                 overrides,
-                self.get_response_token_limit(self.chatgpt_model, 1024),
+                response_token_limit,
                 should_stream,
             ),
         )
@@ -134,6 +160,10 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         use_semantic_ranker = True if overrides.get("semantic_ranker") else False
         use_semantic_captions = True if overrides.get("semantic_captions") else False
         use_query_rewriting = True if overrides.get("query_rewriting") else False
+        use_multi_query = True if overrides.get("use_multi_query_retrieval") else False
+        use_query_rewrite_shortcuts = True if overrides.get("use_query_rewrite_shortcuts") else False
+        # Separate from max_subqueries, which agentic retrieval uses to size its reranker input
+        max_search_queries = overrides.get("max_search_queries", 3)
         top = overrides.get("top", 3)
         minimum_search_score = overrides.get("minimum_search_score", 0.0)
         minimum_reranker_score = overrides.get("minimum_reranker_score", 0.0)
@@ -142,52 +172,132 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         original_user_query = messages[-1]["content"]
         if not isinstance(original_user_query, str):
             raise ValueError("The most recent message content must be a string.")
-
-        query_messages = self.prompt_manager.render_prompt(
-            self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": messages[:-1]}
-        )
-        tools: list[ChatCompletionToolParam] = self.query_rewrite_tools
+        past_messages = messages[:-1]
 
         # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
+        # Short self-contained questions are searched as they are, and repeated conversations reuse their rewrite
+        search_queries: Optional[list[str]] = None
+        cache_key: Optional[str] = None
+        skip_reason: Optional[str] = None
+        if use_query_rewrite_shortcuts:
+            skip_reason = query_rewrite_skip_reason(original_user_query, past_messages)
+            if skip_reason:
+                search_queries = [original_user_query]
+            else:
+                cache_key = self.query_rewrite_cache.key(
+                    original_user_query, past_messages, use_multi_query, max_search_queries
+                )
+                search_queries = self.query_rewrite_cache.get(cache_key)
 
-        chat_completion = cast(
-            ChatCompletion,
-            await self.create_chat_completion(
-                self.chatgpt_deployment,
-                self.chatgpt_model,
+        if search_queries is None:
+            query_messages = self.prompt_manager.render_prompt(
+                self.query_rewrite_prompt, {"user_query": original_user_query, "past_messages": past_messages}
+            )
+            tools: list[ChatCompletionToolParam] = (
+                self.query_rewrite_multi_tools if use_multi_query else self.query_rewrite_tools
+            )
+
+            def create_query_rewrite_completion():
+                return self.create_chat_completion(
+                    self.chatgpt_deployment,
+                    self.chatgpt_model,
+                    messages=query_messages,
+                    overrides=overrides,
+                    response_token_limit=self.get_response_token_limit(
+                        self.chatgpt_model, 100
+                    ),  # Setting too low risks malformed JSON, setting too high may affect performance
+                    temperature=0.0,  # Minimize creativity for search query generation
+                    tools=tools,
+                    reasoning_effort="low",  # Minimize reasoning for search query generation
+                )
+
+            if self.query_rewrite_hedger:
+                chat_completion = cast(
+                    ChatCompletion, await self.query_rewrite_hedger.run(create_query_rewrite_completion)
+                )
+            else:
+                chat_completion = cast(ChatCompletion, await create_query_rewrite_completion())
+            if use_multi_query:
+                search_queries = self.get_search_queries(chat_completion, original_user_query, max_search_queries)
+            else:
+                search_queries = [self.get_search_query(chat_completion, original_user_query)]
+            if cache_key:
+                self.query_rewrite_cache.set(cache_key, search_queries)
+
+            query_thought = self.format_thought_step_for_chatcompletion(
+                title="Prompt to generate search query",
                 messages=query_messages,
                 overrides=overrides,
-                response_token_limit=self.get_response_token_limit(
-                    self.chatgpt_model, 100
-                ),  # Setting too low risks malformed JSON, setting too high may affect performance
-                temperature=0.0,  # Minimize creativity for search query generation
-                tools=tools,
-                reasoning_effort="low",  # Minimize reasoning for search query generation
-            ),
-        )
+                model=self.chatgpt_model,
+                deployment=self.chatgpt_deployment,
+                usage=chat_completion.usage,
+                reasoning_effort="low",
+            )
+            if self.query_rewrite_hedger and query_thought.props is not None:
+                query_thought.props["query_rewrite_hedging"] = self.query_rewrite_hedger.as_props()
+            if use_query_rewrite_shortcuts and query_thought.props is not None:
+                query_thought.props["query_rewrite"] = "computed"
+        elif skip_reason:
+            query_thought = ThoughtStep(
+                "Skipped generating search query",
+                original_user_query,
+                {"query_rewrite": "skipped", "reason": skip_reason},
+            )
+        else:
+            query_thought = ThoughtStep("Reused generated search query", search_queries, {"query_rewrite": "cached"})
 
-        query_text = self.get_search_query(chat_completion, original_user_query)
+        search_props: dict[str, Any] = {
+            "use_semantic_captions": use_semantic_captions,
+            "use_semantic_ranker": use_semantic_ranker,
+            "use_query_rewriting": use_query_rewriting,
+            "top": top,
+            "filter": search_index_filter,
+            "use_vector_search": use_vector_search,
+            "use_text_search": use_text_search,
+        }
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+        if use_multi_query:
+            search_description: Union[str, list[str]] = search_queries
+            retrieval_start = time.perf_counter()
+            results = await self.run_multi_query_search(
+                search_queries,
+                top,
+                search_index_filter,
+                use_text_search,
+                use_vector_search,
+                use_semantic_ranker,
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+                use_query_rewriting,
+            )
+            search_props["latency_ms"] = round((time.perf_counter() - retrieval_start) * 1000, 1)
+            search_props["agentic_retrieval_latency_ms"] = (
+                round(self.agentic_retrieval_latency_ms, 1) if self.agentic_retrieval_latency_ms is not None else None
+            )
+        else:
+            query_text = search_queries[0]
+            search_description = query_text
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        vectors: list[VectorQuery] = []
-        if use_vector_search:
-            vectors.append(await self.compute_text_embedding(query_text))
+            # If retrieval mode includes vectors, compute an embedding for the query
+            vectors: list[VectorQuery] = []
+            if use_vector_search:
+                vectors.append(await self.compute_text_embedding(query_text))
 
-        results = await self.search(
-            top,
-            query_text,
-            search_index_filter,
-            vectors,
-            use_text_search,
-            use_vector_search,
-            use_semantic_ranker,
-            use_semantic_captions,
-            minimum_search_score,
-            minimum_reranker_score,
-            use_query_rewriting,
-        )
+            results = await self.search(
+                top,
+                query_text,
+                search_index_filter,
+                vectors,
+                use_text_search,
+                use_vector_search,
+                use_semantic_ranker,
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+                use_query_rewriting,
+            )
 
         # STEP 3: Generate a contextual and content specific answer using the search results and chat history
         text_sources = self.get_sources_content(results, use_semantic_captions, use_image_citation=False)
@@ -195,27 +305,15 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         extra_info = ExtraInfo(
             DataPoints(text=text_sources),
             thoughts=[
-                self.format_thought_step_for_chatcompletion(
-                    title="Prompt to generate search query",
-                    messages=query_messages,
-                    overrides=overrides,
-                    model=self.chatgpt_model,
-                    deployment=self.chatgpt_deployment,
-                    usage=chat_completion.usage,
-                    reasoning_effort="low",
-                ),
+                query_thought,
                 ThoughtStep(
-                    "Search using generated search query",
-                    query_text,
-                    {
-                        "use_semantic_captions": use_semantic_captions,
-                        "use_semantic_ranker": use_semantic_ranker,
-                        "use_query_rewriting": use_query_rewriting,
-                        "top": top,
-                        "filter": search_index_filter,
-                        "use_vector_search": use_vector_search,
-                        "use_text_search": use_text_search,
-                    },
+                    (
+                        "Search using generated search queries"
+                        if use_multi_query
+                        else "Search using generated search query"
+                    ),
+                    search_description,
+                    search_props,
                 ),
                 ThoughtStep(
                     "Search results",
@@ -225,6 +323,50 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         )
         return extra_info
 
+    async def run_multi_query_search(
+        self,
+        search_queries: list[str],
+        top: int,
+        search_index_filter: Optional[str],
+        use_text_search: bool,
+        use_vector_search: bool,
+        use_semantic_ranker: bool,
+        use_semantic_captions: bool,
+        minimum_search_score: Optional[float],
+        minimum_reranker_score: Optional[float],
+        use_query_rewriting: Optional[bool],
+    ) -> list[Document]:
+        # All sub-queries share a single embeddings request, then are searched concurrently
+        vectors: list[VectorQuery] = []
+        if use_vector_search:
+            vectors = list(await self.compute_text_embeddings(search_queries))
+
+        result_lists = await asyncio.gather(
+            *(
+                self.search(
+                    top,
+                    search_query,
+                    search_index_filter,
+                    [vectors[index]] if vectors else [],
+                    use_text_search,
+                    use_vector_search,
+                    use_semantic_ranker,
+                    use_semantic_captions,
+                    minimum_search_score,
+                    minimum_reranker_score,
+                    use_query_rewriting,
+                )
+                for index, search_query in enumerate(search_queries)
+            )
+        )
+        return self.fuse_search_results(list(result_lists), top)
+
+    def record_agentic_retrieval_latency(self, latency_ms: float, alpha: float = 0.2):
+        if self.agentic_retrieval_latency_ms is None:
+            self.agentic_retrieval_latency_ms = latency_ms
+        else:
+            self.agentic_retrieval_latency_ms = alpha * latency_ms + (1 - alpha) * self.agentic_retrieval_latency_ms
+
     async def run_agentic_retrieval_approach(
         self,
         messages: list[ChatCompletionMessageParam],
@@ -239,6 +381,7 @@ class ChatReadRetrieveReadApproach(ChatApproach):
         # 50 is the amount of documents that the reranker can process per query
         max_docs_for_reranker = max_subqueries * 50
 
+        retrieval_start = time.perf_counter()
         response, results = await self.run_agentic_retrieval(
             messages=messages,
             agent_client=self.agent_client,
@@ -249,6 +392,7 @@ class ChatReadRetrieveReadApproach(ChatApproach):
             max_docs_for_reranker=max_docs_for_reranker,
             results_merge_strategy=results_merge_strategy,
         )
+        self.record_agentic_retrieval_latency((time.perf_counter() - retrieval_start) * 1000)
 
         text_sources = self.get_sources_content(results, use_semantic_captions=False, use_image_citation=False)
 
@@ -0,0 +1,236 @@
+import functools
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import tiktoken
+from openai.types.chat import ChatCompletionMessageParam
+
+# Context window sizes (input + output tokens) for the chat models this app is typically deployed with.
+# Models not listed here fall back to DEFAULT_CONTEXT_WINDOW, which errs on the small side.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-35-turbo": 16385,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4.1-mini": 1047576,
+    "gpt-4.1-nano": 1047576,
+    "o1": 200000,
+    "o3-mini": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens reserved for the system prompt, follow-up instructions and chat message framing
+PROMPT_OVERHEAD_TOKENS = 1024
+# Overlaps shorter than this are likely to be coincidental (e.g. a repeated phrase), so they are kept
+MINIMUM_OVERLAP_CHARACTERS = 32
+# Older history turns are shortened to this many tokens when the history does not fit its budget
+COMPACTED_MESSAGE_TOKENS = 64
+COMPACTION_MARKER = " …"
+
+
+@functools.cache
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding for a model, loading each BPE table once per process."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Newer models are not always known to the installed tiktoken version
+        return tiktoken.get_encoding("o200k_base")
+
+
+@dataclass
+class PackingStats:
+    budget_tokens: int
+    source_tokens_before: int = 0
+    source_tokens_after: int = 0
+    history_tokens_before: int = 0
+    history_tokens_after: int = 0
+    overlap_characters_removed: int = 0
+    duplicate_sources_removed: int = 0
+    sources_truncated: int = 0
+    sources_dropped: int = 0
+    history_messages_compacted: int = 0
+    history_messages_dropped: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return (self.source_tokens_before + self.history_tokens_before) - (
+            self.source_tokens_after + self.history_tokens_after
+        )
+
+    def as_props(self) -> dict[str, Any]:
+        return {
+            "budget_tokens": self.budget_tokens,
+            "tokens_before": self.source_tokens_before + self.history_tokens_before,
+            "tokens_after": self.source_tokens_after + self.history_tokens_after,
+            "tokens_saved": self.tokens_saved,
+            "source_tokens_before": self.source_tokens_before,
+            "source_tokens_after": self.source_tokens_after,
+            "history_tokens_before": self.history_tokens_before,
+            "history_tokens_after": self.history_tokens_after,
+            "overlap_characters_removed": self.overlap_characters_removed,
+            "duplicate_sources_removed": self.duplicate_sources_removed,
+            "sources_truncated": self.sources_truncated,
+            "sources_dropped": self.sources_dropped,
+            "history_messages_compacted": self.history_messages_compacted,
+            "history_messages_dropped": self.history_messages_dropped,
+        }
+
+
+@dataclass
+class PackedContext:
+    text_sources: list[str]
+    past_messages: list[ChatCompletionMessageParam]
+    stats: PackingStats
+
+
+class ContextPacker:
+    """
+    Fits the retrieved sources and the conversation history into a token budget for the answer prompt.
+    Sources are kept in rank order after removing the text that the splitter duplicates between neighbouring chunks,
+    and older history turns are compacted before newer ones so that the latest exchange is always kept verbatim.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        budget_tokens: Optional[int] = None,
+        response_token_limit: int = 1024,
+        history_share: float = 0.25,
+        minimum_truncated_tokens: int = 50,
+    ):
+        self.model = model
+        window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+        available = max(window - response_token_limit - PROMPT_OVERHEAD_TOKENS, 0)
+        self.budget_tokens = min(budget_tokens, available) if budget_tokens else available
+        self.history_share = history_share
+        self.minimum_truncated_tokens = minimum_truncated_tokens
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        return get_encoding(self.model)
+
+    def pack(
+        self, text_sources: list[str], past_messages: list[ChatCompletionMessageParam], user_query: str = ""
+    ) -> PackedContext:
+        stats = PackingStats(budget_tokens=self.budget_tokens)
+        budget = max(self.budget_tokens - len(self.encoding.encode_ordinary(user_query)), 0)
+
+        # History gets at most its share of the budget, but never more than it needs
+        history_budget = int(budget * self.history_share)
+        packed_messages = self.pack_history(past_messages, history_budget, stats)
+        packed_sources = self.pack_sources(text_sources, budget - stats.history_tokens_after, stats)
+        return PackedContext(text_sources=packed_sources, past_messages=packed_messages, stats=stats)
+
+    def pack_sources(self, text_sources: list[str], budget: int, stats: PackingStats) -> list[str]:
+        stats.source_tokens_before = sum(len(tokens) for tokens in self.encoding.encode_ordinary_batch(text_sources))
+        deduplicated = self.remove_overlaps(text_sources, stats)
+
+        packed: list[str] = []
+        remaining = budget
+        for index, (source, tokens) in enumerate(zip(deduplicated, self.encoding.encode_ordinary_batch(deduplicated))):
+            if len(tokens) <= remaining:
+                packed.append(source)
+                remaining -= len(tokens)
+            elif remaining >= self.minimum_truncated_tokens:
+                packed.append(self.encoding.decode(tokens[:remaining]))
+                stats.sources_truncated += 1
+                remaining = 0
+            else:
+                stats.sources_dropped += len(deduplicated) - index
+                break
+        stats.source_tokens_after = budget - remaining
+        return packed
+
+    def remove_overlaps(self, text_sources: list[str], stats: PackingStats) -> list[str]:
+        """Drops exact duplicates and trims text shared with an already kept chunk (the splitter's overlap)."""
+        kept_contents: list[str] = []
+        results: list[str] = []
+        for source in text_sources:
+            citation, separator, content = source.partition(": ")
+            if not separator:
+                citation, content = "", source
+            if content in kept_contents:
+                stats.duplicate_sources_removed += 1
+                continue
+            trimmed = content
+            for kept in kept_contents:
+                # This chunk continues a kept chunk: its beginning repeats the kept chunk's ending
+                overlap = self.overlap_length(kept, trimmed)
+                if overlap:
+                    trimmed = trimmed[overlap:]
+                # This chunk precedes a kept chunk: its ending repeats the kept chunk's beginning
+                overlap = self.overlap_length(trimmed, kept)
+                if overlap:
+                    trimmed = trimmed[: len(trimmed) - overlap]
+            stats.overlap_characters_removed += len(content) - len(trimmed)
+            if not trimmed.strip():
+                stats.duplicate_sources_removed += 1
+                continue
+            kept_contents.append(content)
+            results.append(f"{citation}{separator}{trimmed.strip()}" if separator else trimmed)
+        return results
+
+    def overlap_length(self, first: str, second: str) -> int:
+        """Returns the length of the longest suffix of first that is also a prefix of second."""
+        longest = min(len(first), len(second))
+        if longest < MINIMUM_OVERLAP_CHARACTERS:
+            return 0
+        # Only positions where the anchor occurs can start an overlap, so search for it instead of every length
+        anchor = second[:MINIMUM_OVERLAP_CHARACTERS]
+        position = first.find(anchor, len(first) - longest)
+        while position != -1:
+            if second.startswith(first[position:]):
+                return len(first) - position
+            position = first.find(anchor, position + 1)
+        return 0
+
+    def pack_history(
+        self, past_messages: list[ChatCompletionMessageParam], budget: int, stats: PackingStats
+    ) -> list[ChatCompletionMessageParam]:
+        counts = [
+            len(tokens)
+            for tokens in self.encoding.encode_ordinary_batch([self.message_text(message) for message in past_messages])
+        ]
+        stats.history_tokens_before = sum(counts)
+        if stats.history_tokens_before <= budget:
+            stats.history_tokens_after = stats.history_tokens_before
+            return past_messages
+
+        # Walk from the newest message backwards: keep recent turns verbatim, compact older ones, drop the rest
+        packed: list[ChatCompletionMessageParam] = []
+        remaining = budget
+        for position in range(len(past_messages) - 1, -1, -1):
+            message, count = past_messages[position], counts[position]
+            is_latest_turn = position >= len(past_messages) - 2
+            if (is_latest_turn or not isinstance(message.get("content"), str)) and count <= remaining:
+                packed.append(message)
+                remaining -= count
+                continue
+            compacted_text = self.compact_text(self.message_text(message))
+            compacted_count = len(self.encoding.encode_ordinary(compacted_text))
+            if compacted_count > remaining:
+                stats.history_messages_dropped += position + 1
+                break
+            packed.append(self.replace_message_text(message, compacted_text))
+            stats.history_messages_compacted += 1
+            remaining -= compacted_count
+        stats.history_tokens_after = budget - remaining
+        packed.reverse()
+        return packed
+
+    def compact_text(self, text: str) -> str:
+        tokens = self.encoding.encode_ordinary(text)
+        if len(tokens) <= COMPACTED_MESSAGE_TOKENS:
+            return text
+        return self.encoding.decode(tokens[:COMPACTED_MESSAGE_TOKENS]) + COMPACTION_MARKER
+
+    def message_text(self, message: ChatCompletionMessageParam) -> str:
+        content = message.get("content")
+        return content if isinstance(content, str) else ""
+
+    def replace_message_text(self, message: ChatCompletionMessageParam, text: str) -> ChatCompletionMessageParam:
+        return {**message, "content": text}  # type: ignore[return-value]
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestHedger:
+    """
+    Hedges a small, latency-sensitive request: when no response has arrived within the observed percentile latency
+    (p90 by default), a duplicate request is sent and whichever returns first is used, the other one is cancelled.
+    With the OpenAI router, the duplicate usually goes to another endpoint, since the first one has a request in flight.
+
+    Hedging only starts once enough latencies have been observed, and stops whenever the share of hedged calls
+    reaches max_hedge_rate, which caps the extra tokens spent on duplicates.
+    """
+
+    def __init__(self, percentile: float = 0.9, max_hedge_rate: float = 0.1, min_samples: int = 20, window: int = 200):
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.hedged_calls = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged_calls / self.calls if self.calls else 0.0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Returns how long to wait before sending a duplicate, or None if this call should not be hedged."""
+        if len(self.latencies) < self.min_samples or self.hedge_rate >= self.max_hedge_rate:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(self.percentile * (len(ordered) - 1))]
+
+    def expected_remaining(self, elapsed: float) -> float:
+        """Estimates how much longer a request that has been running for elapsed seconds would have taken."""
+        slower = [latency for latency in self.latencies if latency > elapsed]
+        return sum(slower) / len(slower) - elapsed if slower else 0.0
+
+    async def run(self, make_request: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        started = time.monotonic()
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(make_request())
+        tasks = {primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedged_calls += 1
+                    tasks.add(asyncio.ensure_future(make_request()))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        # Keep waiting for the other request, and only fail if both do
+                        error = error or task.exception()
+                        continue
+                    elapsed = time.monotonic() - started
+                    if task is not primary:
+                        self.hedge_wins += 1
+                        self.latency_saved += self.expected_remaining(elapsed)
+                    # A hedged win is a lower bound of the primary's latency, which is good enough for the percentile
+                    self.latencies.append(elapsed)
+                    return task.result()
+            assert error is not None
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def as_props(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedge_rate": round(self.hedge_rate, 3),
+            "hedge_wins": self.hedge_wins,
+            "latency_saved_ms": round(self.latency_saved * 1000, 1),
+        }
@@ -1,8 +1,13 @@
 import json
 import pathlib
+from typing import Any, cast
 
 import prompty
+from jinja2 import DictLoader, Environment, Template
 from openai.types.chat import ChatCompletionMessageParam
+from prompty.core import Prompty, param_hoisting
+from prompty.parsers import PromptyChatParser
+from prompty.renderers import Jinja2Renderer
 
 
 class PromptManager:
@@ -17,15 +22,56 @@ class PromptManager:
         raise NotImplementedError
 
 
+class CompiledPrompt:
+    """
+    A prompty prompt whose Jinja template and chat parser are built once, at load time.
+    prompty.prepare creates a new Jinja environment and recompiles the template on every call, which is wasted work
+    since the prompts are static for a deployment. Rendering here produces the same messages as prompty.prepare.
+    """
+
+    def __init__(self, prompt: Prompty):
+        self.prompty = prompt
+        renderer = Jinja2Renderer(prompt)
+        self.template: Template = Environment(loader=DictLoader(renderer.templates)).get_template(renderer.name)
+        self.parser = PromptyChatParser(prompt)
+
+    def render(self, data: dict[str, Any]) -> list[ChatCompletionMessageParam]:
+        inputs = param_hoisting(data, self.prompty.sample)
+        return cast(list[ChatCompletionMessageParam], self.parser.invoke(self.template.render(**inputs)))
+
+
 class PromptyManager(PromptManager):
 
     PROMPTS_DIRECTORY = pathlib.Path(__file__).parent / "prompts"
 
+    def __init__(self):
+        # Approaches load the same prompt files, so compile each one only once per process
+        self.compiled_prompts: dict[str, CompiledPrompt] = {}
+        self.tools: dict[str, Any] = {}
+
     def load_prompt(self, path: str):
-        return prompty.load(self.PROMPTS_DIRECTORY / path)
+        if path not in self.compiled_prompts:
+            prompt = prompty.load(self.PROMPTS_DIRECTORY / path)
+            if prompt.template.type != "jinja2" or prompt.template.parser != "prompty":
+                # Only the default template format can be precompiled, leave anything else to prompty
+                return prompt
+            self.compiled_prompts[path] = CompiledPrompt(prompt)
+        return self.compiled_prompts[path]
 
     def load_tools(self, path: str):
-        return json.loads(open(self.PROMPTS_DIRECTORY / path).read())
+        if path not in self.tools:
+            self.tools[path] = json.loads((self.PROMPTS_DIRECTORY / path).read_text())
+        return self.tools[path]
+
+    def preload(self) -> "PromptyManager":
+        """Compiles every prompt and loads every tool schema up front, so they can be shared by forked workers."""
+        for path in sorted(self.PROMPTS_DIRECTORY.glob("*.prompty")):
+            self.load_prompt(path.name)
+        for path in sorted(self.PROMPTS_DIRECTORY.glob("*.json")):
+            self.load_tools(path.name)
+        return self
 
     def render_prompt(self, prompt, data) -> list[ChatCompletionMessageParam]:
+        if isinstance(prompt, CompiledPrompt):
+            return prompt.render(data)
         return prompty.prepare(prompt, data)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Optional
+
+from openai.types.chat import ChatCompletionMessageParam
+
+# Longer questions tend to be conversational, so the rewrite into search keywords is worth its latency
+MAX_KEYWORD_QUERY_WORDS = 8
+# Words that refer back to the conversation, a question using them cannot be searched for on its own
+ANAPHORA = frozenset(
+    {
+        "it", "its", "it's", "they", "them", "their", "theirs", "this", "that", "these", "those",
+        "he", "him", "his", "she", "her", "hers", "one", "ones", "former", "latter", "above",
+        "previous", "same", "such", "there", "else", "more", "other", "another", "again",
+    }
+)  # fmt: skip
+FOLLOW_UP_OPENERS = ("and ", "but ", "also ", "so ", "what about", "how about", "why", "then ")
+WORD_PATTERN = re.compile(r"[\w']+")
+
+
+def query_rewrite_skip_reason(user_query: str, past_messages: list[ChatCompletionMessageParam]) -> Optional[str]:
+    """
+    Decides with cheap local checks whether the user's question can be searched for as it is, without asking the
+    model to rewrite it. Returns why the rewrite can be skipped, or None if it is needed.
+    """
+    if not user_query.isascii():
+        # The rewrite also translates the question into the language of the index
+        return None
+    words = WORD_PATTERN.findall(user_query.lower())
+    if not words or len(words) > MAX_KEYWORD_QUERY_WORDS:
+        return None
+    if any(word in ANAPHORA for word in words):
+        return None
+    if not past_messages:
+        return "Short question without history"
+    if user_query.lower().lstrip().startswith(FOLLOW_UP_OPENERS):
+        return None
+    return "Short question without references to the history"
+
+
+class QueryRewriteCache:
+    """
+    A least recently used cache of search queries generated by the query rewrite, keyed by a hash of the history and
+    the question. Rewrites are made with temperature 0, so the same conversation produces the same queries.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, list[str]] = OrderedDict()
+
+    def key(self, user_query: str, past_messages: list[ChatCompletionMessageParam], *variant: object) -> str:
+        history = json.dumps(past_messages, sort_keys=True, default=str)
+        return hashlib.sha256(json.dumps([history, user_query, *variant]).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[list[str]]:
+        search_queries = self.entries.get(key)
+        if search_queries is not None:
+            self.entries.move_to_end(key)
+        return search_queries
+
+    def set(self, key: str, search_queries: list[str]) -> None:
+        self.entries[key] = search_queries
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -40,6 +40,7 @@ class RetrieveThenReadApproach(Approach):
         query_speller: str,
         prompt_manager: PromptManager,
         reasoning_effort: Optional[str] = None,
+        context_token_budget: Optional[int] = None,
     ):
         self.search_client = search_client
         self.search_index_name = search_index_name
@@ -62,6 +63,7 @@ class RetrieveThenReadApproach(Approach):
         self.prompt_manager = prompt_manager
         self.answer_prompt = self.prompt_manager.load_prompt("ask_answer_question.prompty")
         self.reasoning_effort = reasoning_effort
+        self.context_token_budget = context_token_budget
         self.include_token_usage = True
 
     async def run(
@@ -83,10 +85,18 @@ class RetrieveThenReadApproach(Approach):
             extra_info = await self.run_search_approach(messages, overrides, auth_claims)
 
         # Process results
+        response_token_limit = self.get_response_token_limit(self.chatgpt_model, 1024)
+        text_sources, _, packing_thought = self.pack_context(
+            self.chatgpt_model, extra_info.data_points.text or [], [], q, overrides, response_token_limit
+        )
+        if packing_thought:
+            extra_info.data_points.text = text_sources
+            extra_info.thoughts.append(packing_thought)
+
         messages = self.prompt_manager.render_prompt(
             self.answer_prompt,
             self.get_system_prompt_variables(overrides.get("prompt_template"))
-            | {"user_query": q, "text_sources": extra_info.data_points.text},
+            | {"user_query": q, "text_sources": text_sources},
         )
 
         chat_completion = cast(
@@ -96,7 +106,7 @@ class RetrieveThenReadApproach(Approach):
                 self.chatgpt_model,
                 messages=messages,
                 overrides=overrides,
-                response_token_limit=self.get_response_token_limit(self.chatgpt_model, 1024),
+                response_token_limit=response_token_limit,
             ),
         )
         extra_info.thoughts.append(
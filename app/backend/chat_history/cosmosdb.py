@@ -1,24 +1,79 @@
+import hashlib
+import json
 import os
 import time
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Union
+from itertools import zip_longest
+from typing import Any, Optional, Union
 
+from azure.core.async_paging import AsyncItemPaged
 from azure.cosmos.aio import ContainerProxy, CosmosClient
+from azure.cosmos.exceptions import (
+    CosmosBatchOperationError,
+    CosmosResourceNotFoundError,
+)
 from azure.identity.aio import AzureDeveloperCliCredential, ManagedIdentityCredential
+from opentelemetry import trace
 from quart import Blueprint, current_app, jsonify, make_response, request
 
 from config import (
     CONFIG_CHAT_HISTORY_COSMOS_ENABLED,
+    CONFIG_COSMOS_FEEDBACK_ANALYTICS,
     CONFIG_COSMOS_HISTORY_CLIENT,
     CONFIG_COSMOS_HISTORY_CONTAINER,
     CONFIG_COSMOS_HISTORY_VERSION,
+    CONFIG_COSMOS_SESSION_LIST_CACHE,
     CONFIG_CREDENTIAL,
 )
 from decorators import authenticated
 from error import error_response
 
+from .feedbackanalytics import FeedbackAnalytics, FeedbackEvent, feedback_counter
+from .sessioncache import SessionListCache
+
 chat_history_cosmosdb_bp = Blueprint("chat_history_cosmos", __name__, static_folder="static")
 
+# The most operations Cosmos DB accepts in one transactional batch
+MAX_BATCH_OPERATIONS = 100
+# Message pairs returned per page of a session, long sessions are loaded in several requests
+MESSAGE_PAIRS_PAGE_SIZE = 50
+
+
+class RequestCharge:
+    """Adds up the request units of the Cosmos DB calls made for a request, passed to each call as its response_hook."""
+
+    def __init__(self):
+        self.total = 0.0
+
+    def __call__(self, headers: Mapping[str, Any], result: Any):
+        # query_items also calls the hook when the query is created, with the headers of an earlier response
+        if isinstance(result, AsyncItemPaged):
+            return
+        self.total += float(headers.get("x-ms-request-charge", 0))
+
+
+@contextmanager
+def track_request_charge(route: str) -> Iterator[RequestCharge]:
+    """Records the request units and time the Cosmos DB calls of a route took, in its trace and the log."""
+    request_charge = RequestCharge()
+    started = time.perf_counter()
+    try:
+        yield request_charge
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        span = trace.get_current_span()
+        span.set_attribute("cosmos.request_charge", request_charge.total)
+        span.set_attribute("cosmos.duration_ms", duration_ms)
+        current_app.logger.info("%s used %.1f RU in %.0f ms", route, request_charge.total, duration_ms)
+
+
+def invalidate_session_list(entra_oid: str):
+    session_list_cache: Optional[SessionListCache] = current_app.config.get(CONFIG_COSMOS_SESSION_LIST_CACHE)
+    if session_list_cache:
+        session_list_cache.invalidate(entra_oid)
+
 
 @chat_history_cosmosdb_bp.post("/chat_history")
 @authenticated
@@ -41,54 +96,184 @@ async def post_chat_history(auth_claims: dict[str, Any]):
         feedback_data = request_json.get("feedback", {})  # Get feedback data if provided
         first_question = message_pairs[0][0]
         title = first_question + "..." if len(first_question) > 50 else first_question
-        timestamp = int(time.time() * 1000)
-
-        # Insert the session item:
-        session_item = {
-            "id": session_id,
-            "version": current_app.config[CONFIG_COSMOS_HISTORY_VERSION],
-            "session_id": session_id,
-            "entra_oid": entra_oid,
-            "type": "session",
-            "title": title,
-            "timestamp": timestamp,
-        }
+        version = current_app.config[CONFIG_COSMOS_HISTORY_VERSION]
 
         message_pair_items = []
-        # Now insert a message item for each question/response pair:
+        message_hashes = []
         for ind, message_pair in enumerate(message_pairs):
+            message_id = f"{session_id}-{ind}"
             message_item = {
-                "id": f"{session_id}-{ind}",
-                "version": current_app.config[CONFIG_COSMOS_HISTORY_VERSION],
+                "id": message_id,
+                "version": version,
                 "session_id": session_id,
                 "entra_oid": entra_oid,
                 "type": "message_pair",
                 "question": message_pair[0],
                 "response": message_pair[1],
             }
-            
+
             # Add feedback if it exists for this message
-            message_id = f"{session_id}-{ind}"
-            if message_id in feedback_data:
-                feedback = feedback_data[message_id]
+            feedback = feedback_data.get(message_id)
+            if feedback:
                 message_item["feedback"] = {
                     "type": feedback.get("type"),
                     "comment": feedback.get("comment", ""),
                     "timestamp": feedback.get("timestamp", datetime.utcnow().isoformat()),
-                    "user_oid": entra_oid
+                    "user_oid": entra_oid,
                 }
-            
-            message_pair_items.append(message_item)
 
-        batch_operations = [("upsert", (session_item,))] + [
-            ("upsert", (message_pair_item,)) for message_pair_item in message_pair_items
-        ]
-        await container.execute_item_batch(batch_operations=batch_operations, partition_key=[entra_oid, session_id])
+            message_pair_items.append(message_item)
+            message_hashes.append(message_pair_hash(message_pair, feedback))
+
+        with track_request_charge("/chat_history") as request_charge:
+            for attempt in range(2):
+                try:
+                    written, feedback_events = await save_message_pairs(
+                        container,
+                        entra_oid,
+                        session_id,
+                        title,
+                        version,
+                        message_pair_items,
+                        message_hashes,
+                        request_charge,
+                    )
+                    break
+                except CosmosBatchOperationError as error:
+                    # Another save of the same session got in first, so compare against what it wrote
+                    if attempt or error.status_code not in (409, 412):
+                        raise
+            await record_feedback_events(feedback_events, request_charge)
+        trace.get_current_span().set_attribute("chat_history.message_pairs_written", written)
+        invalidate_session_list(entra_oid)
         return jsonify({}), 201
     except Exception as error:
         return error_response(error, "/chat_history")
 
 
+async def record_feedback_events(feedback_events: list[FeedbackEvent], request_charge: Optional[RequestCharge] = None):
+    """Updates the feedback analytics after the feedback is saved, a failure there doesn't fail the save."""
+    feedback_analytics: Optional[FeedbackAnalytics] = current_app.config.get(CONFIG_COSMOS_FEEDBACK_ANALYTICS)
+    if not feedback_analytics:
+        return
+    try:
+        await feedback_analytics.record(feedback_events, request_charge)
+    except Exception:
+        current_app.logger.exception("Updating the feedback analytics failed")
+
+
+def message_pair_hash(message_pair: list, feedback: Optional[dict]) -> str:
+    return hashlib.sha256(json.dumps([message_pair, feedback], sort_keys=True).encode()).hexdigest()[:16]
+
+
+async def save_message_pairs(
+    container: ContainerProxy,
+    entra_oid: str,
+    session_id: str,
+    title: str,
+    version: str,
+    message_pair_items: list[dict[str, Any]],
+    message_hashes: list[str],
+    request_charge: RequestCharge,
+) -> tuple[int, list[FeedbackEvent]]:
+    """
+    Writes the message pairs that changed since the session was last saved, and returns how many were written
+    along with their feedback changes. The session item keeps a hash of each message pair, so the others aren't
+    rewritten every time the conversation grows, and the type of each message pair's feedback.
+    """
+    partition_key = [entra_oid, session_id]
+    try:
+        session_item = await container.read_item(
+            item=session_id, partition_key=partition_key, response_hook=request_charge
+        )
+        stored_hashes = session_item.get("message_hashes", [])
+        stored_feedback_types = session_item.get("feedback_types", {})
+    except CosmosResourceNotFoundError:
+        session_item = None
+        stored_hashes = []
+        stored_feedback_types = {}
+
+    changed_items = [
+        message_pair_item
+        for message_pair_item, message_hash, stored_hash in zip_longest(
+            message_pair_items, message_hashes, stored_hashes[: len(message_hashes)]
+        )
+        if message_hash != stored_hash
+    ]
+    operations: list[tuple] = [("upsert", (message_pair_item,)) for message_pair_item in changed_items]
+    # Message pairs beyond the end of a conversation that got shorter
+    deleted_ids = [f"{session_id}-{ind}" for ind in range(len(message_hashes), len(stored_hashes))]
+    operations += [("delete", (message_id,)) for message_id in deleted_ids]
+
+    feedback_types = {
+        item["id"]: feedback_counter(item["feedback"]["type"]) for item in message_pair_items if item.get("feedback")
+    }
+    feedback_events = [
+        FeedbackEvent(
+            message_id=item["id"],
+            session_id=session_id,
+            previous_type=stored_feedback_types.get(item["id"]),
+            feedback=item.get("feedback"),
+            question=item["question"],
+        )
+        for item in changed_items
+        if item.get("feedback") or item["id"] in stored_feedback_types
+    ]
+    feedback_events += [
+        FeedbackEvent(
+            message_id=message_id,
+            session_id=session_id,
+            previous_type=stored_feedback_types[message_id],
+            feedback=None,
+        )
+        for message_id in deleted_ids
+        if message_id in stored_feedback_types
+    ]
+
+    timestamp = int(time.time() * 1000)
+    if session_item is None:
+        session_operation: tuple = (
+            "create",
+            (
+                {
+                    "id": session_id,
+                    "version": version,
+                    "session_id": session_id,
+                    "entra_oid": entra_oid,
+                    "type": "session",
+                    "title": title,
+                    "timestamp": timestamp,
+                    "message_hashes": message_hashes,
+                    "feedback_types": feedback_types,
+                },
+            ),
+        )
+    else:
+        session_operation = (
+            "patch",
+            (
+                session_id,
+                [
+                    {"op": "set", "path": "/title", "value": title},
+                    {"op": "set", "path": "/timestamp", "value": timestamp},
+                    {"op": "set", "path": "/message_hashes", "value": message_hashes},
+                    {"op": "set", "path": "/feedback_types", "value": feedback_types},
+                ],
+            ),
+            {"if_match_etag": session_item["_etag"]},
+        )
+    # The session is written last, so its hashes only cover message pairs that were saved. If a batch fails,
+    # the next save writes its message pairs again.
+    operations.append(session_operation)
+    for start in range(0, len(operations), MAX_BATCH_OPERATIONS):
+        await container.execute_item_batch(
+            batch_operations=operations[start : start + MAX_BATCH_OPERATIONS],
+            partition_key=partition_key,
+            response_hook=request_charge,
+        )
+    return len(changed_items), feedback_events
+
+
 @chat_history_cosmosdb_bp.get("/chat_history/sessions")
 @authenticated
 async def get_chat_history_sessions(auth_claims: dict[str, Any]):
@@ -107,36 +292,46 @@ async def get_chat_history_sessions(auth_claims: dict[str, Any]):
         count = int(request.args.get("count", 10))
         continuation_token = request.args.get("continuation_token")
 
-        res = container.query_items(
-            query="SELECT c.id, c.entra_oid, c.title, c.timestamp FROM c WHERE c.entra_oid = @entra_oid AND c.type = @type ORDER BY c.timestamp DESC",
-            parameters=[dict(name="@entra_oid", value=entra_oid), dict(name="@type", value="session")],
-            partition_key=[entra_oid],
-            max_item_count=count,
-        )
+        session_list_cache: Optional[SessionListCache] = current_app.config.get(CONFIG_COSMOS_SESSION_LIST_CACHE)
+        page_key = (count, continuation_token)
+        if session_list_cache and (cached_page := session_list_cache.get(entra_oid, page_key)):
+            return jsonify(cached_page), 200
 
-        pager = res.by_page(continuation_token)
-
-        # Get the first page, and the continuation token
-        sessions = []
-        try:
-            page = await pager.__anext__()
-            continuation_token = pager.continuation_token  # type: ignore
-
-            async for item in page:
-                sessions.append(
-                    {
-                        "id": item.get("id"),
-                        "entra_oid": item.get("entra_oid"),
-                        "title": item.get("title", "untitled"),
-                        "timestamp": item.get("timestamp"),
-                    }
-                )
+        with track_request_charge("/chat_history/sessions") as request_charge:
+            res = container.query_items(
+                query="SELECT c.id, c.entra_oid, c.title, c.timestamp FROM c WHERE c.entra_oid = @entra_oid AND c.type = @type ORDER BY c.timestamp DESC",
+                parameters=[dict(name="@entra_oid", value=entra_oid), dict(name="@type", value="session")],
+                partition_key=[entra_oid],
+                max_item_count=count,
+                response_hook=request_charge,
+            )
 
-        # If there are no more pages, StopAsyncIteration is raised
-        except StopAsyncIteration:
-            continuation_token = None
+            pager = res.by_page(continuation_token)
 
-        return jsonify({"sessions": sessions, "continuation_token": continuation_token}), 200
+            # Get the first page, and the continuation token
+            sessions = []
+            try:
+                page = await pager.__anext__()
+                continuation_token = pager.continuation_token  # type: ignore
+
+                async for item in page:
+                    sessions.append(
+                        {
+                            "id": item.get("id"),
+                            "entra_oid": item.get("entra_oid"),
+                            "title": item.get("title", "untitled"),
+                            "timestamp": item.get("timestamp"),
+                        }
+                    )
+
+            # If there are no more pages, StopAsyncIteration is raised
+            except StopAsyncIteration:
+                continuation_token = None
+
+        sessions_page = {"sessions": sessions, "continuation_token": continuation_token}
+        if session_list_cache:
+            session_list_cache.set(entra_oid, page_key, sessions_page)
+        return jsonify(sessions_page), 200
 
     except Exception as error:
         return error_response(error, "/chat_history/sessions")
@@ -157,16 +352,29 @@ async def get_chat_history_session(auth_claims: dict[str, Any], session_id: str)
         return jsonify({"error": "User OID not found"}), 401
 
     try:
-        res = container.query_items(
-            query="SELECT * FROM c WHERE c.session_id = @session_id AND c.type = @type",
-            parameters=[dict(name="@session_id", value=session_id), dict(name="@type", value="message_pair")],
-            partition_key=[entra_oid, session_id],
-        )
+        count = int(request.args.get("count", MESSAGE_PAIRS_PAGE_SIZE))
+        continuation_token = request.args.get("continuation_token")
 
-        message_pairs = []
-        async for page in res.by_page():
-            async for item in page:
-                message_pairs.append([item["question"], item["response"]])
+        with track_request_charge("/chat_history/sessions/<session_id>") as request_charge:
+            # Only the fields the UI shows, the items also hold ids, versions and feedback
+            res = container.query_items(
+                query="SELECT c.question, c.response FROM c WHERE c.session_id = @session_id AND c.type = @type",
+                parameters=[dict(name="@session_id", value=session_id), dict(name="@type", value="message_pair")],
+                partition_key=[entra_oid, session_id],
+                max_item_count=count,
+                response_hook=request_charge,
+            )
+
+            pager = res.by_page(continuation_token)
+            message_pairs = []
+            try:
+                page = await pager.__anext__()
+                continuation_token = pager.continuation_token  # type: ignore
+                async for item in page:
+                    message_pairs.append([item["question"], item["response"]])
+            # If there are no more pages, StopAsyncIteration is raised
+            except StopAsyncIteration:
+                continuation_token = None
 
         return (
             jsonify(
@@ -174,6 +382,7 @@ async def get_chat_history_session(auth_claims: dict[str, Any], session_id: str)
                     "id": session_id,
                     "entra_oid": entra_oid,
                     "answers": message_pairs,
+                    "continuation_token": continuation_token,
                 }
             ),
             200,
@@ -197,19 +406,38 @@ async def delete_chat_history_session(auth_claims: dict[str, Any], session_id: s
         return jsonify({"error": "User OID not found"}), 401
 
     try:
-        res = container.query_items(
-            query="SELECT c.id FROM c WHERE c.session_id = @session_id",
-            parameters=[dict(name="@session_id", value=session_id)],
-            partition_key=[entra_oid, session_id],
-        )
-
-        ids_to_delete = []
-        async for page in res.by_page():
-            async for item in page:
-                ids_to_delete.append(item["id"])
+        with track_request_charge("/chat_history/sessions/<session_id>") as request_charge:
+            res = container.query_items(
+                query="SELECT c.id, c.feedback_types FROM c WHERE c.session_id = @session_id",
+                parameters=[dict(name="@session_id", value=session_id)],
+                partition_key=[entra_oid, session_id],
+                response_hook=request_charge,
+            )
 
-        batch_operations = [("delete", (id,)) for id in ids_to_delete]
-        await container.execute_item_batch(batch_operations=batch_operations, partition_key=[entra_oid, session_id])
+            ids_to_delete = []
+            feedback_types: dict[str, str] = {}
+            async for page in res.by_page():
+                async for item in page:
+                    ids_to_delete.append(item["id"])
+                    feedback_types.update(item.get("feedback_types") or {})
+
+            batch_operations = [("delete", (id,)) for id in ids_to_delete]
+            for start in range(0, len(batch_operations), MAX_BATCH_OPERATIONS):
+                await container.execute_item_batch(
+                    batch_operations=batch_operations[start : start + MAX_BATCH_OPERATIONS],
+                    partition_key=[entra_oid, session_id],
+                    response_hook=request_charge,
+                )
+            await record_feedback_events(
+                [
+                    FeedbackEvent(
+                        message_id=message_id, session_id=session_id, previous_type=feedback_type, feedback=None
+                    )
+                    for message_id, feedback_type in feedback_types.items()
+                ],
+                request_charge,
+            )
+        invalidate_session_list(entra_oid)
         return await make_response("", 204)
     except Exception as error:
         return error_response(error, f"/chat_history/sessions/{session_id}")
@@ -243,64 +471,77 @@ async def setup_clients():
         current_app.config[CONFIG_COSMOS_HISTORY_CLIENT] = cosmos_client
         current_app.config[CONFIG_COSMOS_HISTORY_CONTAINER] = cosmos_container
         current_app.config[CONFIG_COSMOS_HISTORY_VERSION] = os.environ["AZURE_CHAT_HISTORY_VERSION"]
+        current_app.config[CONFIG_COSMOS_FEEDBACK_ANALYTICS] = FeedbackAnalytics(cosmos_container)
+        if session_list_cache_seconds := float(os.getenv("AZURE_CHAT_HISTORY_CACHE_SECONDS") or 0):
+            current_app.config[CONFIG_COSMOS_SESSION_LIST_CACHE] = SessionListCache(session_list_cache_seconds)
 
 
-async def save_feedback_to_cosmos(conversation_id: str, message_id: str, 
-                              user_oid: str, feedback_type: str, feedback_comment: str):
+async def save_feedback_to_cosmos(
+    conversation_id: str, message_id: str, user_oid: str, feedback_type: str, feedback_comment: str
+):
     """Save user feedback for a specific message in a conversation"""
     try:
         container: ContainerProxy = current_app.config[CONFIG_COSMOS_HISTORY_CONTAINER]
         if not container:
             raise ValueError("CosmosDB container not configured")
-        
-        # Find the specific message_pair item to update
-        res = container.query_items(
-            query="SELECT * FROM c WHERE c.session_id = @session_id AND c.type = @type AND c.id = @message_id",
-            parameters=[
-                dict(name="@session_id", value=conversation_id),
-                dict(name="@type", value="message_pair"),
-                dict(name="@message_id", value=message_id)
+
+        partition_key = [user_oid, conversation_id]
+        feedback = {
+            "type": feedback_type,
+            "comment": feedback_comment,
+            "timestamp": datetime.utcnow().isoformat(),
+            "user_oid": user_oid,
+        }
+        for attempt in range(2):
+            try:
+                session_item = await container.read_item(item=conversation_id, partition_key=partition_key)
+            except CosmosResourceNotFoundError:
+                raise ValueError(f"Conversation {conversation_id} not found")
+            feedback_types = session_item.get("feedback_types", {})
+
+            # The feedback is patched into the message, and its type into the session in the same batch, so the
+            # analytics can tell which type the message had before
+            try:
+                results = await container.execute_item_batch(
+                    batch_operations=[
+                        ("patch", (message_id, [{"op": "set", "path": "/feedback", "value": feedback}])),
+                        (
+                            "patch",
+                            (
+                                conversation_id,
+                                [
+                                    {
+                                        "op": "set",
+                                        "path": "/feedback_types",
+                                        "value": {**feedback_types, message_id: feedback_counter(feedback_type)},
+                                    }
+                                ],
+                            ),
+                            {"if_match_etag": session_item["_etag"]},
+                        ),
+                    ],
+                    partition_key=partition_key,
+                )
+                break
+            except CosmosBatchOperationError as error:
+                if error.status_code == 404:
+                    raise ValueError(f"Message {message_id} not found in conversation {conversation_id}")
+                # Another save changed the session since it was read, so read its feedback types again
+                if attempt or error.status_code != 412:
+                    raise
+
+        await record_feedback_events(
+            [
+                FeedbackEvent(
+                    message_id=message_id,
+                    session_id=conversation_id,
+                    previous_type=feedback_types.get(message_id),
+                    feedback=feedback,
+                    question=results[0].get("resourceBody", {}).get("question", ""),
+                )
             ],
-            partition_key=[user_oid, conversation_id],
         )
-        
-        message_item = None
-        async for page in res.by_page():
-            async for item in page:
-                message_item = item
-                break
-        
-        if not message_item:
-            # Try alternative message ID format (session_id-index)
-            res = container.query_items(
-                query="SELECT * FROM c WHERE c.session_id = @session_id AND c.type = @type",
-                parameters=[
-                    dict(name="@session_id", value=conversation_id),
-                    dict(name="@type", value="message_pair")
-                ],
-                partition_key=[user_oid, conversation_id],
-            )
-            
-            async for page in res.by_page():
-                async for item in page:
-                    if item.get('id') == message_id:
-                        message_item = item
-                        break
-        
-        if not message_item:
-            raise ValueError(f"Message {message_id} not found in conversation {conversation_id}")
-        
-        # Add feedback to the message
-        message_item['feedback'] = {
-            'type': feedback_type,
-            'comment': feedback_comment,
-            'timestamp': datetime.utcnow().isoformat(),
-            'user_oid': user_oid
-        }
-        
-        # Update the message in CosmosDB
-        await container.upsert_item(message_item)
-        
+
     except Exception as e:
         current_app.logger.exception(f"Error saving feedback: {e}")
         raise
@@ -312,84 +553,33 @@ async def soft_delete_conversation(conversation_id: str, user_oid: str):
         container: ContainerProxy = current_app.config[CONFIG_COSMOS_HISTORY_CONTAINER]
         if not container:
             raise ValueError("CosmosDB container not configured")
-        
-        # Get the session item
-        session_item = await container.read_item(
+
+        # Mark as soft deleted
+        await container.patch_item(
             item=conversation_id,
-            partition_key=[user_oid, conversation_id]
+            partition_key=[user_oid, conversation_id],
+            patch_operations=[
+                {"op": "set", "path": "/is_deleted", "value": True},
+                {"op": "set", "path": "/deleted_at", "value": datetime.utcnow().isoformat()},
+                {"op": "set", "path": "/deleted_by", "value": user_oid},
+            ],
         )
-        
-        # Mark as soft deleted
-        session_item['is_deleted'] = True
-        session_item['deleted_at'] = datetime.utcnow().isoformat()
-        session_item['deleted_by'] = user_oid
-        
-        await container.upsert_item(session_item)
-        
+        invalidate_session_list(user_oid)
+
     except Exception as e:
         current_app.logger.exception(f"Error soft deleting conversation: {e}")
         raise
 
 
-async def get_feedback_analytics():
-    """Get feedback analytics for admin users"""
+async def get_feedback_analytics(days: int = 30):
+    """Get feedback analytics for admin users, from the aggregates kept up to date as feedback is saved"""
     try:
-        container: ContainerProxy = current_app.config[CONFIG_COSMOS_HISTORY_CONTAINER]
-        if not container:
+        feedback_analytics: Optional[FeedbackAnalytics] = current_app.config.get(CONFIG_COSMOS_FEEDBACK_ANALYTICS)
+        if not feedback_analytics:
             raise ValueError("CosmosDB container not configured")
-        
-        # Query for messages with feedback
-        res = container.query_items(
-            query="""
-                SELECT 
-                    c.feedback.type as feedback_type,
-                    c.feedback.comment as feedback_comment,
-                    c.feedback.timestamp as feedback_timestamp,
-                    c.session_id,
-                    c.question,
-                    COUNT(1) as count
-                FROM c 
-                WHERE c.type = 'message_pair' 
-                AND IS_DEFINED(c.feedback)
-                GROUP BY c.feedback.type, c.feedback.comment, c.feedback.timestamp, c.session_id, c.question
-            """,
-            enable_cross_partition_query=True
-        )
-        
-        analytics = {
-            'total_feedback': 0,
-            'positive_feedback': 0,
-            'negative_feedback': 0,
-            'recent_feedback': []
-        }
-        
-        async for page in res.by_page():
-            async for item in page:
-                analytics['total_feedback'] += 1
-                if item.get('feedback_type') == 'positive':
-                    analytics['positive_feedback'] += 1
-                elif item.get('feedback_type') == 'negative':
-                    analytics['negative_feedback'] += 1
-                
-                analytics['recent_feedback'].append({
-                    'type': item.get('feedback_type'),
-                    'comment': item.get('feedback_comment'),
-                    'timestamp': item.get('feedback_timestamp'),
-                    'session_id': item.get('session_id'),
-                    'question': item.get('question')
-                })
-        
-        # Sort recent feedback by timestamp (most recent first)
-        analytics['recent_feedback'].sort(
-            key=lambda x: x['timestamp'] if x['timestamp'] else '',
-            reverse=True
-        )
-        
-        # Limit to 100 most recent
-        analytics['recent_feedback'] = analytics['recent_feedback'][:100]
-        
-        return analytics
-        
+
+        return await feedback_analytics.read(days)
+
     except Exception as e:
         current_app.logger.exception(f"Error getting feedback analytics: {e}")
         raise
@@ -0,0 +1,235 @@
+import asyncio
+from collections import Counter
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from azure.core import MatchConditions
+from azure.cosmos.aio import ContainerProxy
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+
+# The aggregates are kept in the chat history container, under an entra_oid that no user has
+FEEDBACK_ANALYTICS_OID = "feedback_analytics"
+# Feedback of each kind is counted, any other type is counted as "other"
+FEEDBACK_TYPES = ("positive", "negative")
+RECENT_FEEDBACK_LIMIT = 100
+# Attempts at replacing the recent feedback when other workers change it at the same time
+RECENT_FEEDBACK_ATTEMPTS = 5
+
+ResponseHook = Optional[Callable[[Mapping[str, Any], Any], None]]
+
+
+@dataclass
+class FeedbackEvent:
+    """A message pair whose feedback was given, changed or removed."""
+
+    message_id: str
+    session_id: str
+    # The feedback type the aggregates already count for the message pair, if any
+    previous_type: Optional[str]
+    # The message pair's feedback now, None when it was removed
+    feedback: Optional[dict[str, Any]]
+    question: str = ""
+
+
+@dataclass
+class RecentFeedbackBatch:
+    """Feedback waiting to be added to the recent feedback, along with feedback saved at the same time."""
+
+    events: list[FeedbackEvent] = field(default_factory=list)
+    written: bool = False
+
+
+def feedback_counter(feedback_type: Optional[str]) -> str:
+    return feedback_type if feedback_type in FEEDBACK_TYPES else "other"
+
+
+def analytics_partition_key(name: str) -> list[str]:
+    return [FEEDBACK_ANALYTICS_OID, name]
+
+
+async def increment_counts(
+    container: ContainerProxy,
+    item_id: str,
+    partition: str,
+    deltas: Counter,
+    fields: dict[str, Any],
+    response_hook: ResponseHook,
+):
+    """Adds to the counts of an aggregate item with a patch, which Cosmos DB applies atomically, creating it if needed."""
+    deltas = Counter({name: delta for name, delta in deltas.items() if delta})
+    if not deltas:
+        return
+    operations = [{"op": "incr", "path": f"/counts/{name}", "value": delta} for name, delta in deltas.items()]
+    while True:
+        try:
+            await container.patch_item(
+                item=item_id,
+                partition_key=analytics_partition_key(partition),
+                patch_operations=operations,
+                response_hook=response_hook,
+            )
+            return
+        except CosmosResourceNotFoundError:
+            pass
+        try:
+            await container.create_item(
+                body={
+                    "id": item_id,
+                    "entra_oid": FEEDBACK_ANALYTICS_OID,
+                    "session_id": partition,
+                    "type": "feedback_counts",
+                    **fields,
+                    "counts": dict(deltas),
+                },
+                response_hook=response_hook,
+            )
+            return
+        except CosmosResourceExistsError:
+            # Another worker created it first, so add to its counts
+            continue
+
+
+async def update_recent_feedback(container: ContainerProxy, events: list[FeedbackEvent], response_hook: ResponseHook):
+    """Puts the latest feedback at the front of the capped list of recent feedback, replacing it if the ETag matches."""
+    # The latest change of each message pair's feedback
+    latest = {event.message_id: event for event in events}
+    added = [
+        {
+            "type": event.feedback.get("type"),
+            "comment": event.feedback.get("comment"),
+            "timestamp": event.feedback.get("timestamp"),
+            "session_id": event.session_id,
+            "message_id": event.message_id,
+            "question": event.question,
+        }
+        for event in latest.values()
+        if event.feedback
+    ]
+    partition_key = analytics_partition_key("recent")
+    for _ in range(RECENT_FEEDBACK_ATTEMPTS):
+        item: Optional[dict[str, Any]]
+        try:
+            item = await container.read_item(item="recent", partition_key=partition_key, response_hook=response_hook)
+        except CosmosResourceNotFoundError:
+            item = None
+        stored = item.get("feedback", []) if item else []
+        kept = [entry for entry in stored if entry.get("message_id") not in latest]
+        recent = sorted(added + kept, key=lambda entry: entry.get("timestamp") or "", reverse=True)
+        body = {
+            "id": "recent",
+            "entra_oid": FEEDBACK_ANALYTICS_OID,
+            "session_id": "recent",
+            "type": "recent_feedback",
+            "feedback": recent[:RECENT_FEEDBACK_LIMIT],
+        }
+        try:
+            if item is None:
+                await container.create_item(body=body, response_hook=response_hook)
+            else:
+                await container.replace_item(
+                    item="recent",
+                    body=body,
+                    etag=item["_etag"],
+                    match_condition=MatchConditions.IfNotModified,
+                    response_hook=response_hook,
+                )
+            return
+        except (CosmosResourceExistsError, CosmosAccessConditionFailedError):
+            # Another worker changed the list since it was read, so merge into its version
+            continue
+    raise RuntimeError("The recent feedback kept changing while it was being updated")
+
+
+class FeedbackAnalytics:
+    """
+    Keeps feedback aggregates in the chat history container up to date as feedback is saved, so reading the analytics
+    takes a few point reads instead of a cross-partition query of every message pair. The totals count the feedback that
+    message pairs have now, a counter per day counts the feedback given that day, and a capped list holds the most
+    recent feedback.
+    """
+
+    def __init__(self, container: ContainerProxy):
+        self.container = container
+        # Feedback saved while the recent feedback is being updated is added in one more update, instead of each
+        # save competing with the others for the item's ETag
+        self.recent_lock = asyncio.Lock()
+        self.recent_batch = RecentFeedbackBatch()
+
+    async def record(self, events: list[FeedbackEvent], response_hook: ResponseHook = None):
+        if not events:
+            return
+        totals: Counter = Counter()
+        given: Counter = Counter()
+        for event in events:
+            if event.previous_type is not None:
+                totals[feedback_counter(event.previous_type)] -= 1
+                totals["total"] -= 1
+            if event.feedback:
+                counter = feedback_counter(event.feedback.get("type"))
+                totals[counter] += 1
+                totals["total"] += 1
+                # Feedback that only had its comment edited isn't counted again
+                if counter != event.previous_type:
+                    given[counter] += 1
+                    given["total"] += 1
+        day = datetime.now(timezone.utc).date().isoformat()
+        await asyncio.gather(
+            increment_counts(self.container, "totals", "totals", totals, {}, response_hook),
+            increment_counts(self.container, f"daily-{day}", "daily", given, {"date": day}, response_hook),
+            self.record_recent(events, response_hook),
+        )
+
+    async def record_recent(self, events: list[FeedbackEvent], response_hook: ResponseHook):
+        batch = self.recent_batch
+        batch.events.extend(events)
+        async with self.recent_lock:
+            # Another save may have written the batch while this one waited, if not, this save writes it
+            if not batch.written:
+                if batch is self.recent_batch:
+                    self.recent_batch = RecentFeedbackBatch()
+                await update_recent_feedback(self.container, batch.events, response_hook)
+                batch.written = True
+
+    async def read(self, days: int = 30) -> dict[str, Any]:
+        """Reads the aggregates with two point reads and a query of the daily counters, in a single partition."""
+        since = (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+
+        async def read_item(name: str) -> dict[str, Any]:
+            try:
+                return await self.container.read_item(item=name, partition_key=analytics_partition_key(name))
+            except CosmosResourceNotFoundError:
+                return {}
+
+        async def read_daily() -> list[dict[str, Any]]:
+            res = self.container.query_items(
+                query="SELECT c.date, c.counts FROM c WHERE c.date >= @since ORDER BY c.date DESC",
+                parameters=[dict(name="@since", value=since)],
+                partition_key=analytics_partition_key("daily"),
+            )
+            return [item async for item in res]
+
+        totals_item, recent_item, daily_items = await asyncio.gather(
+            read_item("totals"), read_item("recent"), read_daily()
+        )
+        counts = totals_item.get("counts", {})
+        return {
+            "total_feedback": counts.get("total", 0),
+            "positive_feedback": counts.get("positive", 0),
+            "negative_feedback": counts.get("negative", 0),
+            "recent_feedback": recent_item.get("feedback", []),
+            "daily_feedback": [
+                {
+                    "date": item["date"],
+                    "total": item["counts"].get("total", 0),
+                    "positive": item["counts"].get("positive", 0),
+                    "negative": item["counts"].get("negative", 0),
+                }
+                for item in daily_items
+            ],
+        }
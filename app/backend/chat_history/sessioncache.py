@@ -0,0 +1,37 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class SessionListCache:
+    """
+    Caches pages of each user's session list, which is loaded every time the history panel opens.
+    Saving or deleting a session through this worker drops the user's pages right away. Each worker has its own
+    cache, so pages also expire after a short time, which bounds how stale a list can be after another worker's write.
+    That staleness is only acceptable when it's asked for, so the cache is off unless a time is configured.
+    """
+
+    def __init__(self, ttl_seconds: float, max_users: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.users: OrderedDict[str, dict[tuple, tuple[float, Any]]] = OrderedDict()
+
+    def get(self, entra_oid: str, page_key: tuple) -> Optional[Any]:
+        pages = self.users.get(entra_oid)
+        if pages is None or page_key not in pages:
+            return None
+        cached_at, page = pages[page_key]
+        if time.monotonic() - cached_at > self.ttl_seconds:
+            del pages[page_key]
+            return None
+        self.users.move_to_end(entra_oid)
+        return page
+
+    def set(self, entra_oid: str, page_key: tuple, page: Any) -> None:
+        self.users.setdefault(entra_oid, {})[page_key] = (time.monotonic(), page)
+        self.users.move_to_end(entra_oid)
+        while len(self.users) > self.max_users:
+            self.users.popitem(last=False)
+
+    def invalidate(self, entra_oid: str) -> None:
+        self.users.pop(entra_oid, None)
@@ -28,9 +28,19 @@ CONFIG_SPEECH_SERVICE_LOCATION = "speech_service_location"
 CONFIG_SPEECH_SERVICE_TOKEN = "speech_service_token"
 CONFIG_SPEECH_SERVICE_VOICE = "speech_service_voice"
 CONFIG_STREAMING_ENABLED = "streaming_enabled"
+CONFIG_STREAM_FLUSH_INTERVAL = "stream_flush_interval"
+CONFIG_STREAM_FLUSH_SIZE = "stream_flush_size"
 CONFIG_CHAT_HISTORY_BROWSER_ENABLED = "chat_history_browser_enabled"
 CONFIG_CHAT_HISTORY_COSMOS_ENABLED = "chat_history_cosmos_enabled"
 CONFIG_AGENTIC_RETRIEVAL_ENABLED = "agentic_retrieval"
 CONFIG_COSMOS_HISTORY_CLIENT = "cosmos_history_client"
 CONFIG_COSMOS_HISTORY_CONTAINER = "cosmos_history_container"
 CONFIG_COSMOS_HISTORY_VERSION = "cosmos_history_version"
+CONFIG_COSMOS_SESSION_LIST_CACHE = "cosmos_session_list_cache"
+CONFIG_COSMOS_FEEDBACK_ANALYTICS = "cosmos_feedback_analytics"
+CONFIG_STARTUP_TIMINGS = "startup_timings"
+CONFIG_PROMPT_MANAGER = "prompt_manager"
+CONFIG_EMBEDDING_CACHE = "embedding_cache"
+CONFIG_LOOP_MONITOR = "loop_monitor"
+CONFIG_SPEECH_AUDIO_CACHE = "speech_audio_cache"
+CONFIG_INGESTION_QUEUE = "ingestion_queue"
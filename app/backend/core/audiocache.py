@@ -0,0 +1,37 @@
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+
+class AudioCache:
+    """
+    A least recently used cache of synthesized speech, bounded by the total size of the audio it holds.
+    Keys are content addresses: a hash of the voice, the output format and the text, so the same answer read
+    with the same voice is only synthesized once.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+
+    @staticmethod
+    def key(voice: str, output_format: str, text: str) -> str:
+        return hashlib.sha256("\n".join([voice, output_format, text]).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        audio = self.entries.get(key)
+        if audio is not None:
+            self.entries.move_to_end(key)
+        return audio
+
+    def set(self, key: str, audio: bytes) -> None:
+        if len(audio) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = audio
+        self.size += len(audio)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
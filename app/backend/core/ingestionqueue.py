@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any, Optional
+
+logger = logging.getLogger("scripts")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_oid TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+# The oldest waiting job whose user, and the queue as a whole, are below their concurrency limits.
+# A running job whose lease has expired belongs to a worker that stopped, so it is waiting again.
+CLAIM_QUERY = """
+SELECT id FROM jobs AS job
+WHERE (status = 'queued' OR (status = 'running' AND lease_expires < :now))
+AND (SELECT COUNT(*) FROM jobs WHERE status = 'running' AND lease_expires >= :now) < :concurrency
+AND (
+    SELECT COUNT(*) FROM jobs
+    WHERE user_oid = job.user_oid AND status = 'running' AND lease_expires >= :now
+) < :user_concurrency
+ORDER BY created LIMIT 1
+"""
+
+IngestFunction = Callable[[str, str], Awaitable[None]]
+
+
+class IngestionQueue:
+    """
+    Ingests uploaded files in the background, so that uploads return as soon as the file is stored.
+    Jobs are kept in a local SQLite database that all the workers of an instance share. A worker holds a lease on the
+    job it runs and renews it while it works, so when a worker stops, its jobs are picked up again by the others or
+    after a restart. Ingestion replaces the file's sections in the index, so running a job again is safe.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ingest: IngestFunction,
+        concurrency: int = 2,
+        user_concurrency: int = 1,
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        poll_interval: float = 2,
+        retention_seconds: float = 24 * 60 * 60,
+    ):
+        self.path = path
+        self.ingest = ingest
+        self.concurrency = concurrency
+        self.user_concurrency = user_concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        # Identifies this process's claims, so it never completes a job that another worker has taken over
+        self.owner = uuid.uuid4().hex
+        self.job_added = asyncio.Event()
+        self.tasks: list[asyncio.Task] = []
+        connection = self.connect()
+        try:
+            # Lets workers read job statuses while another one is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    async def execute(self, function: Callable[[sqlite3.Connection], Any], write: bool = True) -> Any:
+        """
+        Runs a function in a write transaction, off the event loop since another worker may hold the lock.
+        With write=False the function runs in a read transaction instead, which WAL lets run alongside a writer.
+        """
+
+        def run():
+            connection = self.connect()
+            try:
+                connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+                result = function(connection)
+                connection.execute("COMMIT")
+                return result
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                connection.close()
+
+        transaction = asyncio.ensure_future(asyncio.to_thread(run))
+        try:
+            return await asyncio.shield(transaction)
+        except asyncio.CancelledError:
+            # The thread can't be interrupted, so let it commit before stopping. Otherwise a job it claims after
+            # stop() has handed this worker's jobs back would be left running with nobody to run it.
+            await transaction
+            raise
+
+    def start(self):
+        for _ in range(self.concurrency):
+            self.tasks.append(asyncio.create_task(self.run()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        # Hand this worker's jobs back right away, instead of waiting for their leases to expire
+        def release(connection: sqlite3.Connection):
+            connection.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, attempts = attempts - 1 WHERE owner = ? AND status = ?",
+                (JOB_QUEUED, self.owner, JOB_RUNNING),
+            )
+
+        await self.execute(release)
+
+    async def add(self, user_oid: str, filename: str) -> str:
+        job_id = uuid.uuid4().hex
+
+        def insert(connection: sqlite3.Connection):
+            now = time.time()
+            connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (JOB_SUCCEEDED, JOB_FAILED, now - self.retention_seconds),
+            )
+            connection.execute(
+                "INSERT INTO jobs (id, user_oid, filename, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_oid, filename, JOB_QUEUED, now, now),
+            )
+
+        await self.execute(insert)
+        self.job_added.set()
+        return job_id
+
+    async def get(self, job_id: str, user_oid: str) -> Optional[dict[str, Any]]:
+        def select(connection: sqlite3.Connection):
+            return connection.execute(
+                "SELECT id, filename, status, error, attempts, created, updated FROM jobs WHERE id = ? AND user_oid = ?",
+                (job_id, user_oid),
+            ).fetchone()
+
+        # Status polls only read, so they don't queue up behind the workers' writes for the lock
+        row = await self.execute(select, write=False)
+        return dict(row) if row else None
+
+    async def claim(self) -> Optional[sqlite3.Row]:
+        def claim_next(connection: sqlite3.Connection):
+            now = time.time()
+            # Jobs that keep stopping their workers would otherwise be retried forever
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, owner = NULL, updated = ?"
+                " WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (JOB_FAILED, "The job was interrupted too many times", now, JOB_RUNNING, now, self.max_attempts),
+            )
+            row = connection.execute(
+                CLAIM_QUERY,
+                {"now": now, "concurrency": self.concurrency, "user_concurrency": self.user_concurrency},
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, lease_expires = ?, updated = ?"
+                " WHERE id = ?",
+                (JOB_RUNNING, self.owner, now + self.lease_seconds, now, row["id"]),
+            )
+            return connection.execute("SELECT id, user_oid, filename FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+        return await self.execute(claim_next)
+
+    async def renew(self, job_id: str):
+        def extend(connection: sqlite3.Connection):
+            connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ?",
+                (time.time() + self.lease_seconds, job_id, self.owner),
+            )
+
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self.execute(extend)
+
+    async def complete(self, job_id: str, error: Optional[str] = None):
+        def finish(connection: sqlite3.Connection):
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, owner = NULL, updated = ? WHERE id = ? AND owner = ?",
+                (JOB_FAILED if error else JOB_SUCCEEDED, error, time.time(), job_id, self.owner),
+            )
+
+        await self.execute(finish)
+
+    async def run(self):
+        while True:
+            self.job_added.clear()
+            job = await self.claim()
+            if job is None:
+                # Jobs added by other workers, and leases expiring, don't set the event, so check again regularly
+                try:
+                    await asyncio.wait_for(self.job_added.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            renewal = asyncio.create_task(self.renew(job["id"]))
+            try:
+                await self.ingest(job["user_oid"], job["filename"])
+                error = None
+            except Exception as exception:
+                logger.exception("Ingesting %s failed", job["filename"])
+                error = str(exception) or type(exception).__name__
+            finally:
+                renewal.cancel()
+            await self.complete(job["id"], error)
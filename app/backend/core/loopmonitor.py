@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Optional
+
+logger = logging.getLogger("scripts")
+
+
+def recommend_workers(utilization: float, workers: int, cpus: int, target_utilization: float = 0.6) -> int:
+    """
+    Recommends a worker count from the measured event loop utilization of the current workers.
+    Requests are spread evenly over workers, so the total load is workers * utilization busy event loops, and enough
+    workers are needed to keep each below the target. More workers than CPUs can't run their loops at the same time.
+    """
+    busy_loops = workers * utilization
+    return max(1, min(cpus, math.ceil(busy_loops / target_utilization)))
+
+
+class EventLoopMonitor:
+    """
+    Measures how busy a worker's event loop is. The loop runs on a single thread, so the CPU time used by the
+    process over a wall clock interval is a good estimate of its utilization. The lag of a short sleep shows how long
+    callbacks wait for the loop, which is what requests feel when a worker is overloaded.
+    """
+
+    def __init__(self, interval: float, workers: int, cpus: int, probe_interval: float = 0.5):
+        self.interval = interval
+        self.workers = workers
+        self.cpus = cpus
+        self.probe_interval = probe_interval
+        self.task: Optional[asyncio.Task] = None
+        self.utilization = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def measure(self) -> tuple[float, float]:
+        """Returns the utilization and the longest lag over one interval."""
+        started_wall, started_cpu = time.monotonic(), time.process_time()
+        max_lag = 0.0
+        while (elapsed := time.monotonic() - started_wall) < self.interval:
+            probe_started = time.monotonic()
+            await asyncio.sleep(self.probe_interval)
+            max_lag = max(max_lag, time.monotonic() - probe_started - self.probe_interval)
+        return (time.process_time() - started_cpu) / elapsed, max_lag
+
+    async def run(self):
+        while True:
+            self.utilization, self.max_lag = await self.measure()
+            logger.info(
+                "Event loop utilization %.0f%%, longest lag %.0f ms, %d workers on %d CPUs, recommended workers: %d",
+                self.utilization * 100,
+                self.max_lag * 1000,
+                self.workers,
+                self.cpus,
+                recommend_workers(self.utilization, self.workers, self.cpus),
+            )
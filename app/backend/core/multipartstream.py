@@ -0,0 +1,57 @@
+from collections.abc import AsyncGenerator, AsyncIterable
+from typing import Optional
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    NEED_DATA,
+    Data,
+    Epilogue,
+    Event,
+    File,
+    MultipartDecoder,
+)
+
+
+class MultipartFileStream:
+    """
+    Reads a file from a multipart/form-data request body as the body arrives. Unlike request.files, which spools the
+    whole body before the handler runs, only the chunk being handled is held in memory.
+    """
+
+    def __init__(self, body: AsyncIterable[bytes], content_type: str, field_name: str):
+        mimetype, options = parse_options_header(content_type)
+        if mimetype != "multipart/form-data" or not options.get("boundary"):
+            raise ValueError("The request body is not multipart/form-data")
+        self.decoder = MultipartDecoder(options["boundary"].encode())
+        self.body = body.__aiter__()
+        self.field_name = field_name
+
+    async def next_event(self) -> Event:
+        event = self.decoder.next_event()
+        while event is NEED_DATA:
+            try:
+                self.decoder.receive_data(await self.body.__anext__())
+            except StopAsyncIteration:
+                self.decoder.receive_data(None)
+            event = self.decoder.next_event()
+        return event
+
+    async def open(self) -> Optional[str]:
+        """Skips to the file's part and returns its filename, or None if the body doesn't have the file."""
+        while True:
+            event = await self.next_event()
+            if isinstance(event, File) and event.name == self.field_name:
+                return event.filename
+            if isinstance(event, Epilogue):
+                return None
+
+    async def chunks(self) -> AsyncGenerator[bytes, None]:
+        """Yields the file's content, after open() has found it."""
+        while True:
+            event = await self.next_event()
+            if not isinstance(event, Data):
+                return
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                return
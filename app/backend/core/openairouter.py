@@ -0,0 +1,161 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+
+# Responses with these status codes are retried on the next backend, they mean the deployment is busy or unhealthy
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class OpenAIBackend:
+    """One Azure OpenAI endpoint that serves the same deployments as the others, with its observed health."""
+
+    url: httpx.URL
+    transport: httpx.AsyncBaseTransport
+    latency: Optional[float] = None  # EWMA of the seconds until the response headers arrive
+    in_flight: int = 0
+    unavailable_until: float = 0.0
+    remaining_requests: Optional[int] = None
+    remaining_tokens: Optional[int] = None
+    stats: dict[str, int] = field(default_factory=lambda: {"requests": 0, "throttled": 0, "failed": 0})
+
+    @property
+    def name(self) -> str:
+        return self.url.host
+
+    def is_available(self, now: float) -> bool:
+        return self.unavailable_until <= now
+
+    def has_quota(self, low_quota_tokens: int) -> bool:
+        if self.remaining_requests is not None and self.remaining_requests < 1:
+            return False
+        return self.remaining_tokens is None or self.remaining_tokens >= low_quota_tokens
+
+    def score(self) -> float:
+        # Backends that were not measured yet score 0, so each one gets tried early on
+        return (self.latency or 0.0) * (1 + self.in_flight)
+
+
+class OpenAIRouterTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that spreads the OpenAI SDK's requests over several Azure OpenAI endpoints.
+    Install it with AsyncAzureOpenAI(http_client=DefaultAsyncHttpxClient(transport=...)) so that every
+    chat.completions.create and embeddings.create call is routed without the approaches knowing about it.
+
+    Each request goes to the healthy backend with the lowest latency (EWMA of the time to response headers, scaled
+    by the requests it has in flight), preferring backends whose rate limit headers show quota left.
+    A backend that throttles (429), fails, or cannot be reached is benched until its retry-after time or the
+    cooldown has passed, and the request is sent to the next backend instead.
+    Only the last backend's error reaches the SDK, which then applies its own retries.
+    Streamed responses fail over until their headers arrive, not once the answer has started.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[str],
+        transports: Optional[list[httpx.AsyncBaseTransport]] = None,
+        alpha: float = 0.2,
+        cooldown: float = 10.0,
+        low_quota_tokens: int = 1000,
+    ):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        if transports is None:
+            # Same connection limits as the OpenAI SDK's default client
+            limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+            transports = [httpx.AsyncHTTPTransport(limits=limits) for _ in endpoints]
+        self.backends = [
+            OpenAIBackend(url=httpx.URL(endpoint), transport=transport)
+            for endpoint, transport in zip(endpoints, transports)
+        ]
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.low_quota_tokens = low_quota_tokens
+
+    def ordered_backends(self) -> list[OpenAIBackend]:
+        now = time.monotonic()
+        available = [backend for backend in self.backends if backend.is_available(now)]
+        available.sort(key=lambda backend: (not backend.has_quota(self.low_quota_tokens), backend.score()))
+        # Benched backends are still tried as a last resort, the one that recovers first goes first
+        benched = sorted(
+            (backend for backend in self.backends if not backend.is_available(now)),
+            key=lambda backend: backend.unavailable_until,
+        )
+        return available + benched
+
+    def route(self, request: httpx.Request, backend: OpenAIBackend) -> httpx.Request:
+        url = request.url.copy_with(scheme=backend.url.scheme, host=backend.url.host, port=backend.url.port)
+        headers = request.headers.copy()
+        headers["host"] = url.netloc.decode("ascii")
+        return httpx.Request(
+            request.method, url, headers=headers, content=request.content, extensions=request.extensions
+        )
+
+    def record_latency(self, backend: OpenAIBackend, seconds: float) -> None:
+        if backend.latency is None:
+            backend.latency = seconds
+        else:
+            backend.latency = self.alpha * seconds + (1 - self.alpha) * backend.latency
+
+    def record_response(self, backend: OpenAIBackend, response: httpx.Response) -> None:
+        if remaining_requests := response.headers.get("x-ratelimit-remaining-requests"):
+            backend.remaining_requests = int(remaining_requests)
+        if remaining_tokens := response.headers.get("x-ratelimit-remaining-tokens"):
+            backend.remaining_tokens = int(remaining_tokens)
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            backend.unavailable_until = time.monotonic() + self.retry_after(response)
+            backend.stats["throttled" if response.status_code == 429 else "failed"] += 1
+
+    def retry_after(self, response: httpx.Response) -> float:
+        try:
+            if retry_after_ms := response.headers.get("retry-after-ms"):
+                return float(retry_after_ms) / 1000
+            if retry_after := response.headers.get("retry-after"):
+                return float(retry_after)
+        except ValueError:
+            pass  # An HTTP date rather than seconds, fall back to the cooldown
+        return self.cooldown
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()  # The body is sent again when failing over, so it must not be a one-shot stream
+        backends = self.ordered_backends()
+        for position, backend in enumerate(backends):
+            is_last = position == len(backends) - 1
+            backend.stats["requests"] += 1
+            backend.in_flight += 1
+            started = time.monotonic()
+            try:
+                response = await backend.transport.handle_async_request(self.route(request, backend))
+            except httpx.TransportError as error:
+                backend.unavailable_until = time.monotonic() + self.cooldown
+                backend.stats["failed"] += 1
+                if is_last:
+                    raise
+                logging.warning(
+                    "OpenAI backend %s failed (%s), trying %s", backend.name, error, backends[position + 1].name
+                )
+                continue
+            finally:
+                backend.in_flight -= 1
+            self.record_response(backend, response)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                # Only successful responses count: throttled ones come back fast and would make a busy backend look quick
+                self.record_latency(backend, time.monotonic() - started)
+                return response
+            if is_last:
+                return response
+            logging.info(
+                "OpenAI backend %s returned %s, trying %s",
+                backend.name,
+                response.status_code,
+                backends[position + 1].name,
+            )
+            await response.aclose()
+        raise RuntimeError("No OpenAI backend was tried")  # Unreachable, there is always at least one backend
+
+    async def aclose(self) -> None:
+        for backend in self.backends:
+            await backend.transport.aclose()
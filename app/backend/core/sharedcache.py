@@ -0,0 +1,64 @@
+import hashlib
+import mmap
+import struct
+import zlib
+from array import array
+from typing import Optional
+
+# Each slot starts with the key's digest, the value's length and a checksum over both
+SLOT_HEADER = struct.Struct("<16sII")
+
+
+class SharedMemoryCache:
+    """
+    A fixed-size cache in an anonymous shared memory map. When it is created before gunicorn forks its workers
+    (with preload_app), every worker sees the same memory, so a value stored by one worker is found by the others.
+    Without preloading, each worker simply has its own cache.
+
+    Slots are direct-mapped by the key's digest, so a new key overwrites whatever shared its slot. There are no locks
+    between processes: a reader checks the digest and checksum, and treats a slot that is being written as a miss.
+    """
+
+    def __init__(self, size_bytes: int, slot_bytes: int):
+        self.slot_bytes = slot_bytes
+        self.slot_count = max(1, size_bytes // slot_bytes)
+        self.memory = mmap.mmap(-1, self.slot_count * slot_bytes)
+        self.max_value_bytes = slot_bytes - SLOT_HEADER.size
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+    def slot_offset(self, digest: bytes) -> int:
+        return int.from_bytes(digest[:8], "little") % self.slot_count * self.slot_bytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        digest = self.digest(key)
+        offset = self.slot_offset(digest)
+        stored_digest, length, checksum = SLOT_HEADER.unpack_from(self.memory, offset)
+        if stored_digest != digest or length > self.max_value_bytes:
+            return None
+        start = offset + SLOT_HEADER.size
+        value = self.memory[start : start + length]
+        if zlib.crc32(value, zlib.crc32(digest)) != checksum:
+            return None
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_value_bytes:
+            return
+        digest = self.digest(key)
+        offset = self.slot_offset(digest)
+        start = offset + SLOT_HEADER.size
+        self.memory[start : start + len(value)] = value
+        SLOT_HEADER.pack_into(self.memory, offset, digest, len(value), zlib.crc32(value, zlib.crc32(digest)))
+
+    def get_vector(self, key: str) -> Optional[list[float]]:
+        value = self.get(key)
+        if value is None:
+            return None
+        return array("f", value).tolist()
+
+    def set_vector(self, key: str, vector: list[float]) -> None:
+        # Embedding models produce float32 values, so storing them as such keeps their precision
+        self.set(key, array("f", vector).tobytes())
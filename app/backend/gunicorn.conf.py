@@ -1,3 +1,4 @@
+import gc
 import multiprocessing
 import os
 
@@ -14,5 +15,26 @@ if os.getenv("WEBSITE_SKU") == "LinuxFree":
     # Free tier reports 2 CPUs but can't handle multiple workers
     workers = 1
 else:
-    workers = (num_cpus * 2) + 1
+    # Set WEB_CONCURRENCY to the count recommended by the event loop monitor (APP_LOOP_MONITOR_SECONDS)
+    workers = int(os.getenv("WEB_CONCURRENCY") or 0) or (num_cpus * 2) + 1
+# Workers read the count back for their recommendation
+raw_env = [f"WEB_CONCURRENCY={workers}"]
 worker_class = "custom_uvicorn_worker.CustomUvicornWorker"
+
+# Create the app once in the main process, so the prompts, tokenizer tables and the shared cache are built once
+# and shared with the workers, and recycled workers start without importing the app again
+preload_app = os.getenv("GUNICORN_PRELOAD_APP", "").lower() == "true"
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # Move the preloaded objects out of the garbage collector's reach, so that collections in the workers
+        # don't write to (and copy) the memory pages they share with the main process
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app and os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        from azure.monitor.opentelemetry import configure_azure_monitor
+
+        configure_azure_monitor()
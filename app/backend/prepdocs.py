@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import logging
 import os
+import tempfile
 from typing import Optional, Union
 
 from azure.core.credentials import AzureKeyCredential
@@ -26,11 +27,17 @@ from prepdocslib.integratedvectorizerstrategy import (
 from prepdocslib.jsonparser import JsonParser
 from prepdocslib.listfilestrategy import (
     ADLSGen2ListFileStrategy,
+    ADLSGen2ListingState,
     ListFileStrategy,
     LocalListFileStrategy,
 )
+from prepdocslib.mediadescriber import MediaDescriptionCache
 from prepdocslib.parser import Parser
-from prepdocslib.pdfparser import DocumentAnalysisParser, LocalPdfParser
+from prepdocslib.pdfparser import (
+    AnalyzeResultCache,
+    DocumentAnalysisParser,
+    LocalPdfParser,
+)
 from prepdocslib.strategy import DocumentAction, SearchInfo, Strategy
 from prepdocslib.textparser import TextParser
 from prepdocslib.textsplitter import SentenceTextSplitter, SimpleTextSplitter
@@ -104,6 +111,9 @@ def setup_list_file_strategy(
     datalake_filesystem: Union[str, None],
     datalake_path: Union[str, None],
     datalake_key: Union[str, None],
+    datalake_concurrency: int = 4,
+    datalake_listing_state_path: Union[str, None] = None,
+    forget_listed_files: bool = False,
 ):
     list_file_strategy: ListFileStrategy
     if datalake_storage_account:
@@ -111,11 +121,19 @@ def setup_list_file_strategy(
             raise ValueError("DataLake file system and path are required when using Azure Data Lake Gen2")
         adls_gen2_creds: Union[AsyncTokenCredential, str] = azure_credential if datalake_key is None else datalake_key
         logger.info("Using Data Lake Gen2 Storage Account: %s", datalake_storage_account)
+        listing_state = None
+        if datalake_listing_state_path:
+            listing_state = ADLSGen2ListingState(datalake_listing_state_path)
+            # Removed documents have to be ingested again the next time they're added
+            if forget_listed_files:
+                listing_state.clear()
         list_file_strategy = ADLSGen2ListFileStrategy(
             data_lake_storage_account=datalake_storage_account,
             data_lake_filesystem=datalake_filesystem,
             data_lake_path=datalake_path,
             credential=adls_gen2_creds,
+            concurrency=datalake_concurrency,
+            listing_state=listing_state,
         )
     elif local_files:
         logger.info("Using local files: %s", local_files)
@@ -178,6 +196,11 @@ def setup_file_processors(
     search_images: bool = False,
     use_content_understanding: bool = False,
     content_understanding_endpoint: Union[str, None] = None,
+    content_understanding_concurrency: int = 4,
+    media_description_cache_path: Union[str, None] = None,
+    document_intelligence_pages_per_shard: int = 100,
+    document_intelligence_concurrency: int = 4,
+    document_intelligence_cache_dir: Union[str, None] = None,
 ):
     sentence_text_splitter = SentenceTextSplitter()
 
@@ -192,6 +215,17 @@ def setup_file_processors(
             credential=documentintelligence_creds,
             use_content_understanding=use_content_understanding,
             content_understanding_endpoint=content_understanding_endpoint,
+            figure_concurrency=content_understanding_concurrency,
+            media_description_cache=(
+                MediaDescriptionCache(media_description_cache_path)
+                if use_content_understanding and media_description_cache_path
+                else None
+            ),
+            pages_per_shard=document_intelligence_pages_per_shard,
+            shard_concurrency=document_intelligence_concurrency,
+            analyze_result_cache=(
+                AnalyzeResultCache(document_intelligence_cache_dir) if document_intelligence_cache_dir else None
+            ),
         )
 
     pdf_parser: Optional[Parser] = None
@@ -388,6 +422,18 @@ if __name__ == "__main__":
         datalake_filesystem=os.getenv("AZURE_ADLS_GEN2_FILESYSTEM"),
         datalake_path=os.getenv("AZURE_ADLS_GEN2_FILESYSTEM_PATH"),
         datalake_key=clean_key_if_exists(args.datalakekey),
+        datalake_concurrency=int(os.getenv("AZURE_ADLS_GEN2_CONCURRENCY", 4)),
+        # An empty path turns off skipping the files that haven't changed since they were ingested. The files are
+        # only skipped for the index they were ingested into, so the default database is kept per index.
+        datalake_listing_state_path=os.getenv(
+            "AZURE_ADLS_GEN2_STATE_PATH",
+            os.path.join(
+                tempfile.gettempdir(),
+                f"adls-gen2-{os.getenv('AZURE_ADLS_GEN2_STORAGE_ACCOUNT')}-{os.getenv('AZURE_ADLS_GEN2_FILESYSTEM')}"
+                f"-{os.environ['AZURE_SEARCH_SERVICE']}-{os.environ['AZURE_SEARCH_INDEX']}.db",
+            ),
+        ),
+        forget_listed_files=args.remove or args.removeall,
     )
 
     openai_host = os.environ["OPENAI_HOST"]
@@ -445,6 +491,17 @@ if __name__ == "__main__":
             search_images=use_gptvision,
             use_content_understanding=use_content_understanding,
             content_understanding_endpoint=os.getenv("AZURE_CONTENTUNDERSTANDING_ENDPOINT"),
+            content_understanding_concurrency=int(os.getenv("AZURE_CONTENTUNDERSTANDING_CONCURRENCY", 4)),
+            # An empty path turns off the cache of figure descriptions
+            media_description_cache_path=os.getenv(
+                "AZURE_CONTENTUNDERSTANDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "media-descriptions.db")
+            ),
+            document_intelligence_pages_per_shard=int(os.getenv("AZURE_DOCUMENTINTELLIGENCE_PAGES_PER_SHARD", 100)),
+            document_intelligence_concurrency=int(os.getenv("AZURE_DOCUMENTINTELLIGENCE_CONCURRENCY", 4)),
+            # An empty directory turns off the cache of analysis results
+            document_intelligence_cache_dir=os.getenv(
+                "AZURE_DOCUMENTINTELLIGENCE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "document-intelligence")
+            ),
         )
         image_embeddings_service = setup_image_embeddings_service(
             azure_credential=azd_credential,
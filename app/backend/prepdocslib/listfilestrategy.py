@@ -1,19 +1,28 @@
+import asyncio
 import base64
 import hashlib
+import json
 import logging
 import os
 import re
+import shutil
 import tempfile
 from abc import ABC
+from collections import deque
 from collections.abc import AsyncGenerator
+from dataclasses import dataclass
 from glob import glob
 from typing import IO, Optional, Union
 
 from azure.core.credentials_async import AsyncTokenCredential
+from azure.storage.filedatalake import PathProperties
 from azure.storage.filedatalake.aio import (
     DataLakeServiceClient,
+    FileSystemClient,
 )
 
+from .sqlitestore import SQLiteStore
+
 logger = logging.getLogger("scripts")
 
 
@@ -112,9 +121,57 @@ class LocalListFileStrategy(ListFileStrategy):
         return False
 
 
+def parse_acls(acl_list: str) -> dict[str, list[str]]:
+    """Parses out the user ids and group ids with read access from a data lake ACL"""
+    acls: dict[str, list[str]] = {"oids": [], "groups": []}
+    # https://learn.microsoft.com/azure/storage/blobs/data-lake-storage-access-control
+    # ACL Format: user::rwx,group::r-x,other::r--,user:xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx:r--
+    for acl in acl_list.split(","):
+        acl_parts: list = acl.split(":")
+        if len(acl_parts) != 3:
+            continue
+        if len(acl_parts[1]) == 0:
+            continue
+        if acl_parts[0] == "user" and "r" in acl_parts[2]:
+            acls["oids"].append(acl_parts[1])
+        if acl_parts[0] == "group" and "r" in acl_parts[2]:
+            acls["groups"].append(acl_parts[1])
+    return acls
+
+
+class ADLSGen2ListingState(SQLiteStore):
+    """
+    Remembers the ETag and ACLs of each data lake file that was ingested, in a local SQLite database,
+    so files that haven't changed since are skipped without downloading them.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, etag TEXT, acls TEXT)")
+
+    def get(self, path: str) -> Optional[tuple[str, str]]:
+        row = self.fetchone("SELECT etag, acls FROM files WHERE path = ?", (path,))
+        return (row[0], row[1]) if row else None
+
+    def clear(self) -> None:
+        self.execute("DELETE FROM files")
+
+    def set(self, path: str, etag: str, acls: str) -> None:
+        self.execute("INSERT OR REPLACE INTO files (path, etag, acls) VALUES (?, ?, ?)", (path, etag, acls))
+
+
+@dataclass
+class ADLSGen2Download:
+    file: File
+    path: str
+    etag: Optional[str]
+    acls: str
+    temp_dir: str
+
+
 class ADLSGen2ListFileStrategy(ListFileStrategy):
     """
     Concrete strategy for listing files that are located in a data lake storage account
+    Files are downloaded, along with their ACLs, up to concurrency at a time ahead of the consumer
     """
 
     def __init__(
@@ -123,56 +180,110 @@ class ADLSGen2ListFileStrategy(ListFileStrategy):
         data_lake_filesystem: str,
         data_lake_path: str,
         credential: Union[AsyncTokenCredential, str],
+        concurrency: int = 4,
+        listing_state: Optional[ADLSGen2ListingState] = None,
     ):
         self.data_lake_storage_account = data_lake_storage_account
         self.data_lake_filesystem = data_lake_filesystem
         self.data_lake_path = data_lake_path
         self.credential = credential
+        self.concurrency = concurrency
+        self.listing_state = listing_state
 
-    async def list_paths(self) -> AsyncGenerator[str, None]:
-        async with DataLakeServiceClient(
+    def service_client(self) -> DataLakeServiceClient:
+        return DataLakeServiceClient(
             account_url=f"https://{self.data_lake_storage_account}.dfs.core.windows.net", credential=self.credential
-        ) as service_client, service_client.get_file_system_client(self.data_lake_filesystem) as filesystem_client:
-            async for path in filesystem_client.get_paths(path=self.data_lake_path, recursive=True):
-                if path.is_directory:
-                    continue
+        )
 
+    async def list_paths(self) -> AsyncGenerator[str, None]:
+        async with self.service_client() as service_client, service_client.get_file_system_client(
+            self.data_lake_filesystem
+        ) as filesystem_client:
+            async for path in self._list_paths(filesystem_client):
                 yield path.name
 
+    async def _list_paths(self, filesystem_client: FileSystemClient) -> AsyncGenerator[PathProperties, None]:
+        async for path in filesystem_client.get_paths(path=self.data_lake_path, recursive=True):
+            if path.is_directory:
+                continue
+
+            yield path
+
     async def list(self) -> AsyncGenerator[File, None]:
-        async with DataLakeServiceClient(
-            account_url=f"https://{self.data_lake_storage_account}.dfs.core.windows.net", credential=self.credential
-        ) as service_client, service_client.get_file_system_client(self.data_lake_filesystem) as filesystem_client:
-            async for path in self.list_paths():
-                temp_file_path = os.path.join(tempfile.gettempdir(), os.path.basename(path))
-                try:
-                    async with filesystem_client.get_file_client(path) as file_client:
-                        with open(temp_file_path, "wb") as temp_file:
-                            downloader = await file_client.download_file()
-                            await downloader.readinto(temp_file)
-                    # Parse out user ids and group ids
-                    acls: dict[str, list[str]] = {"oids": [], "groups": []}
-                    # https://learn.microsoft.com/python/api/azure-storage-file-datalake/azure.storage.filedatalake.datalakefileclient?view=azure-python#azure-storage-filedatalake-datalakefileclient-get-access-control
-                    # Request ACLs as GUIDs
-                    access_control = await file_client.get_access_control(upn=False)
-                    acl_list = access_control["acl"]
-                    # https://learn.microsoft.com/azure/storage/blobs/data-lake-storage-access-control
-                    # ACL Format: user::rwx,group::r-x,other::r--,user:xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx:r--
-                    acl_list = acl_list.split(",")
-                    for acl in acl_list:
-                        acl_parts: list = acl.split(":")
-                        if len(acl_parts) != 3:
-                            continue
-                        if len(acl_parts[1]) == 0:
-                            continue
-                        if acl_parts[0] == "user" and "r" in acl_parts[2]:
-                            acls["oids"].append(acl_parts[1])
-                        if acl_parts[0] == "group" and "r" in acl_parts[2]:
-                            acls["groups"].append(acl_parts[1])
-                    yield File(content=open(temp_file_path, "rb"), acls=acls, url=file_client.url)
-                except Exception as data_lake_exception:
-                    logger.error(f"\tGot an error while reading {path} -> {data_lake_exception} --> skipping file")
+        async with self.service_client() as service_client, service_client.get_file_system_client(
+            self.data_lake_filesystem
+        ) as filesystem_client:
+            # Downloads run in listing order, up to concurrency of them ahead of the file the consumer has
+            pending: deque[asyncio.Task[Optional[ADLSGen2Download]]] = deque()
+
+            async def downloads() -> AsyncGenerator[Optional[ADLSGen2Download], None]:
+                async for path in self._list_paths(filesystem_client):
+                    pending.append(asyncio.create_task(self._download(filesystem_client, path)))
+                    if len(pending) >= self.concurrency:
+                        yield await pending.popleft()
+                while pending:
+                    yield await pending.popleft()
+
+            current: Optional[ADLSGen2Download] = None
+            listed_downloads = downloads()
+            try:
+                async for download in listed_downloads:
+                    if download is None:
+                        continue
+                    current = download
+                    yield download.file
+                    # The consumer asks for the next file once it's done with this one
+                    current = None
+                    await self._finish(download)
+            finally:
+                await listed_downloads.aclose()
+                if current is not None:
+                    shutil.rmtree(current.temp_dir, ignore_errors=True)
+                for task in pending:
+                    task.cancel()
+                for task in pending:
                     try:
-                        os.remove(temp_file_path)
-                    except Exception as file_delete_exception:
-                        logger.error(f"\tGot an error while deleting {temp_file_path} -> {file_delete_exception}")
+                        download = await task
+                    except asyncio.CancelledError:
+                        continue
+                    if download is not None:
+                        download.file.close()
+                        shutil.rmtree(download.temp_dir, ignore_errors=True)
+
+    async def _download(self, filesystem_client: FileSystemClient, path: PathProperties) -> Optional[ADLSGen2Download]:
+        temp_dir = None
+        try:
+            async with filesystem_client.get_file_client(path.name) as file_client:
+                # https://learn.microsoft.com/python/api/azure-storage-file-datalake/azure.storage.filedatalake.datalakefileclient?view=azure-python#azure-storage-filedatalake-datalakefileclient-get-access-control
+                # Request ACLs as GUIDs
+                access_control = await file_client.get_access_control(upn=False)
+                acls = parse_acls(access_control["acl"])
+                acls_json = json.dumps(acls, sort_keys=True)
+                # ACL changes don't change the ETag, so a file is unchanged only if both are the same
+                if self.listing_state is not None and path.etag:
+                    if await asyncio.to_thread(self.listing_state.get, path.name) == (path.etag, acls_json):
+                        logger.info("Skipping %s, no changes detected.", path.name)
+                        return None
+                # Files in different folders can have the same name, so each gets its own folder
+                temp_dir = tempfile.mkdtemp(prefix="adls-")
+                temp_file_path = os.path.join(temp_dir, os.path.basename(path.name))
+                with open(temp_file_path, "wb") as temp_file:
+                    downloader = await file_client.download_file()
+                    await downloader.readinto(temp_file)
+            return ADLSGen2Download(
+                file=File(content=open(temp_file_path, "rb"), acls=acls, url=file_client.url),
+                path=path.name,
+                etag=path.etag,
+                acls=acls_json,
+                temp_dir=temp_dir,
+            )
+        except Exception as data_lake_exception:
+            logger.error(f"\tGot an error while reading {path.name} -> {data_lake_exception} --> skipping file")
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            return None
+
+    async def _finish(self, download: ADLSGen2Download):
+        shutil.rmtree(download.temp_dir, ignore_errors=True)
+        if self.listing_state is not None and download.etag:
+            await asyncio.to_thread(self.listing_state.set, download.path, download.etag, download.acls)
@@ -1,14 +1,25 @@
+import asyncio
+import hashlib
+import json
 import logging
+import time
 from abc import ABC
+from typing import Optional
 
 import aiohttp
 from azure.core.credentials_async import AsyncTokenCredential
 from azure.identity.aio import get_bearer_token_provider
 from rich.progress import Progress
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
+
+from .sqlitestore import SQLiteStore
 
 logger = logging.getLogger("scripts")
 
+# Polling starts quickly, since small images are described in a second or two, and slows down for longer operations
+POLL_INITIAL_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 5
+POLL_TIMEOUT = 120
+
 
 class MediaDescriber(ABC):
 
@@ -16,6 +27,25 @@ class MediaDescriber(ABC):
         raise NotImplementedError  # pragma: no cover
 
 
+class MediaDescriptionCache(SQLiteStore):
+    """
+    Keeps image descriptions in a local SQLite database, so images that are ingested again, or that appear in many
+    documents like logos and repeated diagrams, are only sent to the service once.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(
+            path, "CREATE TABLE IF NOT EXISTS descriptions (key TEXT PRIMARY KEY, description TEXT NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.fetchone("SELECT description FROM descriptions WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    def set(self, key: str, description: str) -> None:
+        self.execute("INSERT OR REPLACE INTO descriptions (key, description) VALUES (?, ?)", (key, description))
+
+
 class ContentUnderstandingDescriber:
     CU_API_VERSION = "2024-12-01-preview"
 
@@ -42,20 +72,32 @@ class ContentUnderstandingDescriber:
         self.endpoint = endpoint
         self.credential = credential
 
-    async def poll_api(self, session, poll_url, headers):
+    def cache_key(self, image_bytes: bytes) -> str:
+        """Identifies an image's description, which depends on the image and on the analyzer that describes it."""
+        analyzer = json.dumps(self.analyzer_schema, sort_keys=True) + self.CU_API_VERSION
+        return hashlib.sha256(analyzer.encode() + image_bytes).hexdigest()
 
-        @retry(stop=stop_after_attempt(60), wait=wait_fixed(2), retry=retry_if_exception_type(ValueError))
-        async def poll():
+    async def poll_api(self, session, poll_url, headers):
+        interval = POLL_INITIAL_INTERVAL
+        deadline = time.monotonic() + POLL_TIMEOUT
+        while True:
             async with session.get(poll_url, headers=headers) as response:
                 response.raise_for_status()
                 response_json = await response.json()
-                if response_json["status"] == "Failed":
-                    raise Exception("Failed")
-                if response_json["status"] == "Running":
-                    raise ValueError("Running")
+                retry_after = response.headers.get("Retry-After")
+            if response_json["status"] == "Failed":
+                raise Exception("Failed")
+            if response_json["status"] not in ("NotStarted", "Running"):
                 return response_json
-
-        return await poll()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The operation didn't finish within {POLL_TIMEOUT} seconds")
+            # The service says when to check again, otherwise wait a little longer each time
+            try:
+                wait = float(retry_after) if retry_after else interval
+            except ValueError:
+                wait = interval
+            await asyncio.sleep(wait)
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
 
     async def create_analyzer(self):
         logger.info("Creating analyzer '%s'...", self.analyzer_schema["analyzerId"])
@@ -1,9 +1,15 @@
+import asyncio
+import hashlib
+import heapq
 import html
 import io
+import json
 import logging
+import os
+import tempfile
+from collections import defaultdict
 from collections.abc import AsyncGenerator
-from enum import Enum
-from typing import IO, Union
+from typing import IO, Optional, TypeVar, Union, cast
 
 import pymupdf
 from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
@@ -11,6 +17,7 @@ from azure.ai.documentintelligence.models import (
     AnalyzeDocumentRequest,
     AnalyzeResult,
     DocumentFigure,
+    DocumentSpan,
     DocumentTable,
 )
 from azure.core.credentials import AzureKeyCredential
@@ -18,13 +25,87 @@ from azure.core.credentials_async import AsyncTokenCredential
 from azure.core.exceptions import HttpResponseError
 from PIL import Image
 from pypdf import PdfReader
+from pypdf.errors import PyPdfError
 
-from .mediadescriber import ContentUnderstandingDescriber
+from .mediadescriber import ContentUnderstandingDescriber, MediaDescriptionCache
 from .page import Page
 from .parser import Parser
 
 logger = logging.getLogger("scripts")
 
+PageObject = TypeVar("PageObject", DocumentTable, DocumentFigure)
+
+
+def objects_by_page(objects: list[PageObject]) -> dict[int, list[PageObject]]:
+    """Groups tables or figures by the page of their first bounding region, keeping their order."""
+    by_page: dict[int, list[PageObject]] = defaultdict(list)
+    for obj in objects:
+        if obj.bounding_regions:
+            by_page[obj.bounding_regions[0].page_number].append(obj)
+    return by_page
+
+
+def mask_spans(
+    page_offset: int, page_length: int, object_spans: list[list[DocumentSpan]]
+) -> list[tuple[int, int, Optional[int]]]:
+    """
+    Splits a page into consecutive (start, end, object index) ranges, relative to the page, where the object index is
+    the object whose spans cover the range, or None for the page's own text. Where the spans of several objects
+    overlap, the last of them covers the range.
+    """
+    intervals = []
+    for object_idx, spans in enumerate(object_spans):
+        for span in spans:
+            start = max(span.offset - page_offset, 0)
+            end = min(span.offset - page_offset + span.length, page_length)
+            if start < end:
+                intervals.append((start, end, object_idx))
+    intervals.sort()
+    boundaries = sorted({0, page_length, *(start for start, _, _ in intervals), *(end for _, end, _ in intervals)})
+
+    ranges: list[tuple[int, int, Optional[int]]] = []
+    # A heap of the spans covering the current range, with the last object's on top.
+    # Spans that have ended are only dropped once they reach the top.
+    covering: list[tuple[int, int]] = []
+    next_interval = 0
+    for start, end in zip(boundaries, boundaries[1:]):
+        while next_interval < len(intervals) and intervals[next_interval][0] <= start:
+            _, interval_end, object_idx = intervals[next_interval]
+            heapq.heappush(covering, (-object_idx, interval_end))
+            next_interval += 1
+        while covering and covering[0][1] <= start:
+            heapq.heappop(covering)
+        covered_by = -covering[0][0] if covering else None
+        if ranges and ranges[-1][2] == covered_by:
+            ranges[-1] = (ranges[-1][0], end, covered_by)
+        else:
+            ranges.append((start, end, covered_by))
+    return ranges
+
+
+class AnalyzeResultCache:
+    """
+    Keeps Document Intelligence results on disk, one JSON file per analyzed file and page range, so documents that are
+    ingested again, or whose ingestion is retried after a failure, aren't analyzed again.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[AnalyzeResult]:
+        try:
+            with open(os.path.join(self.directory, f"{key}.json"), encoding="utf-8") as f:
+                return AnalyzeResult(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key: str, result: AnalyzeResult) -> None:
+        # Written to a temporary file first, so a result is never read half written
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directory, delete=False) as f:
+            json.dump(result.as_dict(), f)
+        os.replace(f.name, os.path.join(self.directory, f"{key}.json"))
+
 
 class LocalPdfParser(Parser):
     """
@@ -57,12 +138,22 @@ class DocumentAnalysisParser(Parser):
         model_id="prebuilt-layout",
         use_content_understanding=True,
         content_understanding_endpoint: Union[str, None] = None,
+        figure_concurrency: int = 4,
+        media_description_cache: Optional[MediaDescriptionCache] = None,
+        pages_per_shard: int = 100,
+        shard_concurrency: int = 4,
+        analyze_result_cache: Optional[AnalyzeResultCache] = None,
     ):
         self.model_id = model_id
         self.endpoint = endpoint
         self.credential = credential
         self.use_content_understanding = use_content_understanding
         self.content_understanding_endpoint = content_understanding_endpoint
+        self.figure_concurrency = figure_concurrency
+        self.media_description_cache = media_description_cache
+        self.pages_per_shard = pages_per_shard
+        self.shard_concurrency = shard_concurrency
+        self.analyze_result_cache = analyze_result_cache
 
     async def parse(self, content: IO) -> AsyncGenerator[Page, None]:
         logger.info("Extracting text from '%s' using Azure Document Intelligence", content.name)
@@ -70,7 +161,11 @@ class DocumentAnalysisParser(Parser):
         async with DocumentIntelligenceClient(
             endpoint=self.endpoint, credential=self.credential
         ) as document_intelligence_client:
-            file_analyzed = False
+            content_bytes = content.read()
+            page_ranges = self.page_ranges(content.name, content_bytes)
+            analyze_results: Optional[list[AnalyzeResult]] = None
+            doc_for_pymupdf = None
+            cu_describer = None
             if self.use_content_understanding:
                 if self.content_understanding_endpoint is None:
                     raise ValueError("Content Understanding is enabled but no endpoint was provided")
@@ -79,19 +174,12 @@ class DocumentAnalysisParser(Parser):
                         "AzureKeyCredential is not supported for Content Understanding, use keyless auth instead"
                     )
                 cu_describer = ContentUnderstandingDescriber(self.content_understanding_endpoint, self.credential)
-                content_bytes = content.read()
                 try:
-                    poller = await document_intelligence_client.begin_analyze_document(
-                        model_id="prebuilt-layout",
-                        analyze_request=AnalyzeDocumentRequest(bytes_source=content_bytes),
-                        output=["figures"],
-                        features=["ocrHighResolution"],
-                        output_content_format="markdown",
+                    analyze_results = await self.analyze(
+                        document_intelligence_client, content_bytes, page_ranges, describe_media=True
                     )
                     doc_for_pymupdf = pymupdf.open(stream=io.BytesIO(content_bytes))
-                    file_analyzed = True
                 except HttpResponseError as e:
-                    content.seek(0)
                     if e.error and e.error.code == "InvalidArgument":
                         logger.error(
                             "This document type does not support media description. Proceeding with standard analysis."
@@ -102,82 +190,188 @@ class DocumentAnalysisParser(Parser):
                             e,
                         )
 
-            if file_analyzed is False:
-                poller = await document_intelligence_client.begin_analyze_document(
-                    model_id=self.model_id, analyze_request=content, content_type="application/octet-stream"
+            if analyze_results is None:
+                analyze_results = await self.analyze(
+                    document_intelligence_client, content_bytes, page_ranges, describe_media=False
                 )
-            analyze_result: AnalyzeResult = await poller.result()
-
+            # Each shard's result has its own content, so the pages are renumbered into one continuous stream
             offset = 0
-            for page in analyze_result.pages:
-                tables_on_page = [
-                    table
-                    for table in (analyze_result.tables or [])
-                    if table.bounding_regions and table.bounding_regions[0].page_number == page.page_number
-                ]
-                figures_on_page = []
-                if self.use_content_understanding:
-                    figures_on_page = [
-                        figure
-                        for figure in (analyze_result.figures or [])
-                        if figure.bounding_regions and figure.bounding_regions[0].page_number == page.page_number
-                    ]
-
-                class ObjectType(Enum):
-                    NONE = -1
-                    TABLE = 0
-                    FIGURE = 1
-
-                page_offset = page.spans[0].offset
-                page_length = page.spans[0].length
-                mask_chars: list[tuple[ObjectType, Union[int, None]]] = [(ObjectType.NONE, None)] * page_length
-                # mark all positions of the table spans in the page
-                for table_idx, table in enumerate(tables_on_page):
-                    for span in table.spans:
-                        # replace all table spans with "table_id" in table_chars array
-                        for i in range(span.length):
-                            idx = span.offset - page_offset + i
-                            if idx >= 0 and idx < page_length:
-                                mask_chars[idx] = (ObjectType.TABLE, table_idx)
-                # mark all positions of the figure spans in the page
-                for figure_idx, figure in enumerate(figures_on_page):
-                    for span in figure.spans:
-                        # replace all figure spans with "figure_id" in figure_chars array
-                        for i in range(span.length):
-                            idx = span.offset - page_offset + i
-                            if idx >= 0 and idx < page_length:
-                                mask_chars[idx] = (ObjectType.FIGURE, figure_idx)
-
-                # build page text by replacing characters in table spans with table html
-                page_text = ""
-                added_objects = set()  # set of object types todo mypy
-                for idx, mask_char in enumerate(mask_chars):
-                    object_type, object_idx = mask_char
-                    if object_type == ObjectType.NONE:
-                        page_text += analyze_result.content[page_offset + idx]
-                    elif object_type == ObjectType.TABLE:
-                        if object_idx is None:
-                            raise ValueError("Expected object_idx to be set")
-                        if mask_char not in added_objects:
-                            page_text += DocumentAnalysisParser.table_to_html(tables_on_page[object_idx])
-                            added_objects.add(mask_char)
-                    elif object_type == ObjectType.FIGURE:
-                        if cu_describer is None:
-                            raise ValueError("cu_describer should not be None, unable to describe figure")
-                        if object_idx is None:
-                            raise ValueError("Expected object_idx to be set")
-                        if mask_char not in added_objects:
-                            figure_html = await DocumentAnalysisParser.figure_to_html(
-                                doc_for_pymupdf, figures_on_page[object_idx], cu_describer
-                            )
-                            page_text += figure_html
-                            added_objects.add(mask_char)
-                # We remove these comments since they are not needed and skew the page numbers
-                page_text = page_text.replace("<!-- PageBreak -->", "")
-                # We remove excess newlines at the beginning and end of the page
-                page_text = page_text.strip()
-                yield Page(page_num=page.page_number - 1, offset=offset, text=page_text)
-                offset += len(page_text)
+            for analyze_result in analyze_results:
+                async for page in self.pages_from_result(analyze_result, doc_for_pymupdf, cu_describer):
+                    yield Page(page_num=page.page_num, offset=offset, text=page.text)
+                    offset += len(page.text)
+
+    def page_ranges(self, filename: str, content_bytes: bytes) -> list[Optional[str]]:
+        """
+        Splits a PDF into ranges of pages_per_shard pages, like "1-100", to analyze separately.
+        Other files, and PDFs that fit in one shard, are analyzed whole, which is a single range of None.
+        """
+        if not filename.lower().endswith(".pdf"):
+            return [None]
+        try:
+            page_count = len(PdfReader(io.BytesIO(content_bytes)).pages)
+        except PyPdfError:
+            return [None]
+        if page_count <= self.pages_per_shard:
+            return [None]
+        return [
+            f"{first_page}-{min(first_page + self.pages_per_shard - 1, page_count)}"
+            for first_page in range(1, page_count + 1, self.pages_per_shard)
+        ]
+
+    async def analyze(
+        self,
+        document_intelligence_client: DocumentIntelligenceClient,
+        content_bytes: bytes,
+        page_ranges: list[Optional[str]],
+        describe_media: bool,
+    ) -> list[AnalyzeResult]:
+        """
+        Analyzes each page range, up to shard_concurrency at a time, and returns their results in order.
+        Every range is analyzed even if another fails, so the cache keeps them for the next attempt.
+        """
+        model_id = "prebuilt-layout" if describe_media else self.model_id
+        options: dict = {}
+        if describe_media:
+            options = {"output": ["figures"], "features": ["ocrHighResolution"], "output_content_format": "markdown"}
+        file_hash = hashlib.sha256(content_bytes).hexdigest()
+        cache = self.analyze_result_cache
+        semaphore = asyncio.Semaphore(self.shard_concurrency)
+
+        async def analyze_shard(pages: Optional[str]) -> AnalyzeResult:
+            key = hashlib.sha256(json.dumps([file_hash, model_id, options, pages]).encode()).hexdigest()
+            if cache is not None and (analyze_result := await asyncio.to_thread(cache.get, key)) is not None:
+                logger.info("Using the cached analysis of pages %s", pages or "all")
+                return analyze_result
+            async with semaphore:
+                if describe_media:
+                    poller = await document_intelligence_client.begin_analyze_document(
+                        model_id=model_id,
+                        analyze_request=AnalyzeDocumentRequest(bytes_source=content_bytes),
+                        pages=pages,
+                        **options,
+                    )
+                else:
+                    poller = await document_intelligence_client.begin_analyze_document(
+                        model_id=model_id,
+                        analyze_request=io.BytesIO(content_bytes),
+                        content_type="application/octet-stream",
+                        pages=pages,
+                    )
+                analyze_result = await poller.result()
+            if cache is not None:
+                await asyncio.to_thread(cache.set, key, analyze_result)
+            return analyze_result
+
+        if len(page_ranges) > 1:
+            logger.info("Analyzing %d shards of %d pages", len(page_ranges), self.pages_per_shard)
+        results = await asyncio.gather(*(analyze_shard(pages) for pages in page_ranges), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return cast(list[AnalyzeResult], results)
+
+    async def pages_from_result(
+        self,
+        analyze_result: AnalyzeResult,
+        doc_for_pymupdf: Optional[pymupdf.Document] = None,
+        cu_describer: Optional[ContentUnderstandingDescriber] = None,
+    ) -> AsyncGenerator[Page, None]:
+        tables_by_page = objects_by_page(analyze_result.tables or [])
+        figures_by_page = objects_by_page(analyze_result.figures or []) if self.use_content_understanding else {}
+
+        # Lay out every page first, so the figures of the whole document can be described at the same time
+        layouts = []
+        figures_to_describe: list[DocumentFigure] = []
+        for page in analyze_result.pages:
+            tables_on_page: list[DocumentTable] = tables_by_page.get(page.page_number, [])
+            figures_on_page: list[DocumentFigure] = figures_by_page.get(page.page_number, [])
+            page_offset = page.spans[0].offset
+            page_length = page.spans[0].length
+            # Figures come after tables, so where their spans overlap, the figure replaces the table
+            object_spans = [table.spans for table in tables_on_page]
+            object_spans += [figure.spans or [] for figure in figures_on_page]
+            ranges = mask_spans(page_offset, page_length, object_spans)
+            layouts.append((page, page_offset, tables_on_page, ranges))
+            added_objects = set()
+            for _, _, object_idx in ranges:
+                if object_idx is not None and object_idx not in added_objects:
+                    added_objects.add(object_idx)
+                    if object_idx >= len(tables_on_page):
+                        figures_to_describe.append(figures_on_page[object_idx - len(tables_on_page)])
+
+        figure_htmls: list[str] = []
+        if figures_to_describe:
+            if cu_describer is None or doc_for_pymupdf is None:
+                raise ValueError("cu_describer should not be None, unable to describe figure")
+            figure_htmls = await self.describe_figures(doc_for_pymupdf, figures_to_describe, cu_describer)
+        next_figure_html = iter(figure_htmls)
+
+        offset = 0
+        for page, page_offset, tables_on_page, ranges in layouts:
+            # build page text from the text between the objects, and each object's html where its spans start
+            page_parts = []
+            added_objects = set()
+            for start, end, object_idx in ranges:
+                if object_idx is None:
+                    page_parts.append(analyze_result.content[page_offset + start : page_offset + end])
+                elif object_idx not in added_objects:
+                    added_objects.add(object_idx)
+                    if object_idx < len(tables_on_page):
+                        page_parts.append(DocumentAnalysisParser.table_to_html(tables_on_page[object_idx]))
+                    else:
+                        page_parts.append(next(next_figure_html))
+            page_text = "".join(page_parts)
+            # We remove these comments since they are not needed and skew the page numbers
+            page_text = page_text.replace("<!-- PageBreak -->", "")
+            # We remove excess newlines at the beginning and end of the page
+            page_text = page_text.strip()
+            yield Page(page_num=page.page_number - 1, offset=offset, text=page_text)
+            offset += len(page_text)
+
+    async def describe_figures(
+        self, doc: pymupdf.Document, figures: list[DocumentFigure], cu_describer: ContentUnderstandingDescriber
+    ) -> list[str]:
+        """
+        Describes the figures with up to figure_concurrency descriptions at a time, and returns their html in order.
+        Identical images are only described once, and descriptions found in the cache aren't described again.
+        """
+        # pymupdf documents can't be used from several threads, and cropping is quick next to describing
+        crops = [DocumentAnalysisParser.crop_figure(doc, figure) for figure in figures]
+        semaphore = asyncio.Semaphore(self.figure_concurrency)
+        cache = self.media_description_cache
+
+        async def describe(key: str, image_bytes: bytes) -> str:
+            if cache is not None and (description := await asyncio.to_thread(cache.get, key)) is not None:
+                return description
+            async with semaphore:
+                description = await cu_describer.describe_image(image_bytes)
+            if cache is not None:
+                await asyncio.to_thread(cache.set, key, description)
+            return description
+
+        keys: list[Optional[str]] = []
+        descriptions: dict[str, asyncio.Task[str]] = {}
+        for figure, image_bytes in zip(figures, crops):
+            key = None
+            if image_bytes is not None:
+                key = cu_describer.cache_key(image_bytes)
+                if key not in descriptions:
+                    logger.info("Describing figure %s", figure.id)
+                    descriptions[key] = asyncio.create_task(describe(key, image_bytes))
+            keys.append(key)
+        try:
+            await asyncio.gather(*descriptions.values())
+        finally:
+            for task in descriptions.values():
+                task.cancel()
+            # Waits for the cancelled descriptions to stop, so none of them still writes to the cache afterwards
+            await asyncio.gather(*descriptions.values(), return_exceptions=True)
+        logger.info("Described %d figures with %d distinct images", len(figures), len(descriptions))
+        return [
+            DocumentAnalysisParser.figure_html(figure, descriptions[key].result() if key is not None else None)
+            for figure, key in zip(figures, keys)
+        ]
 
     @staticmethod
     async def figure_to_html(
@@ -185,8 +379,17 @@ class DocumentAnalysisParser(Parser):
     ) -> str:
         figure_title = (figure.caption and figure.caption.content) or ""
         logger.info("Describing figure %s with title '%s'", figure.id, figure_title)
+        cropped_img = DocumentAnalysisParser.crop_figure(doc, figure)
+        if cropped_img is None:
+            return DocumentAnalysisParser.figure_html(figure, None)
+        figure_description = await cu_describer.describe_image(cropped_img)
+        return DocumentAnalysisParser.figure_html(figure, figure_description)
+
+    @staticmethod
+    def crop_figure(doc: pymupdf.Document, figure: DocumentFigure) -> Optional[bytes]:
+        """Crops the figure's first bounding region from its page, or returns None if the figure has no region."""
         if not figure.bounding_regions:
-            return f"<figure><figcaption>{figure_title}</figcaption></figure>"
+            return None
         if len(figure.bounding_regions) > 1:
             logger.warning("Figure %s has more than one bounding region, using the first one", figure.id)
         first_region = figure.bounding_regions[0]
@@ -198,30 +401,39 @@ class DocumentAnalysisParser(Parser):
             first_region.polygon[5],  # y1 (bottom)
         )
         page_number = first_region["pageNumber"]  # 1-indexed
-        cropped_img = DocumentAnalysisParser.crop_image_from_pdf_page(doc, page_number - 1, bounding_box)
-        figure_description = await cu_describer.describe_image(cropped_img)
+        return DocumentAnalysisParser.crop_image_from_pdf_page(doc, page_number - 1, bounding_box)
+
+    @staticmethod
+    def figure_html(figure: DocumentFigure, figure_description: Optional[str]) -> str:
+        figure_title = (figure.caption and figure.caption.content) or ""
+        if figure_description is None:
+            return f"<figure><figcaption>{figure_title}</figcaption></figure>"
         return f"<figure><figcaption>{figure_title}<br>{figure_description}</figcaption></figure>"
 
     @staticmethod
     def table_to_html(table: DocumentTable):
-        table_html = "<figure><table>"
-        rows = [
-            sorted([cell for cell in table.cells if cell.row_index == i], key=lambda cell: cell.column_index)
-            for i in range(table.row_count)
-        ]
+        # Each field of a cell is deserialized when it's read, so the cells are read once, grouped by row
+        rows: list[list[tuple[int, str]]] = [[] for _ in range(table.row_count)]
+        for cell in table.cells:
+            row_index = cell.row_index
+            if not 0 <= row_index < table.row_count:
+                continue
+            kind = cell.kind
+            tag = "th" if (kind == "columnHeader" or kind == "rowHeader") else "td"
+            cell_spans = ""
+            column_span = cell.column_span
+            if column_span is not None and column_span > 1:
+                cell_spans += f" colSpan={column_span}"
+            row_span = cell.row_span
+            if row_span is not None and row_span > 1:
+                cell_spans += f" rowSpan={row_span}"
+            rows[row_index].append((cell.column_index, f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"))
+        table_html = ["<figure><table>"]
         for row_cells in rows:
-            table_html += "<tr>"
-            for cell in row_cells:
-                tag = "th" if (cell.kind == "columnHeader" or cell.kind == "rowHeader") else "td"
-                cell_spans = ""
-                if cell.column_span is not None and cell.column_span > 1:
-                    cell_spans += f" colSpan={cell.column_span}"
-                if cell.row_span is not None and cell.row_span > 1:
-                    cell_spans += f" rowSpan={cell.row_span}"
-                table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
-            table_html += "</tr>"
-        table_html += "</table></figure>"
-        return table_html
+            row_cells.sort(key=lambda cell: cell[0])
+            table_html.append("<tr>" + "".join(cell_html for _, cell_html in row_cells) + "</tr>")
+        table_html.append("</table></figure>")
+        return "".join(table_html)
 
     @staticmethod
     def crop_image_from_pdf_page(
@@ -0,0 +1,35 @@
+import sqlite3
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any, Optional
+
+
+class SQLiteStore:
+    """
+    A table in a local SQLite database that several ingestion processes can share.
+    The database uses WAL so they can read while one of them writes, and each call opens its own connection, so the
+    store can be used from the threads that parsers run in.
+    """
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(schema)
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        # Autocommit, and a wait of up to 30 seconds for another process that holds the write lock
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def fetchone(self, query: str, parameters: tuple = ()) -> Optional[tuple[Any, ...]]:
+        with self.connect() as connection:
+            return connection.execute(query, parameters).fetchone()
+
+    def execute(self, query: str, parameters: tuple = ()) -> None:
+        with self.connect() as connection:
+            connection.execute(query, parameters)
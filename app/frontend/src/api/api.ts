@@ -1,6 +1,16 @@
 const BACKEND_URI = "";
 
-import { ChatAppResponse, ChatAppResponseOrError, ChatAppRequest, Config, SimpleAPIResponse, HistoryListApiResponse, HistoryApiResponse } from "./models";
+import {
+    ChatAppResponse,
+    ChatAppResponseOrError,
+    ChatAppRequest,
+    Config,
+    SimpleAPIResponse,
+    HistoryListApiResponse,
+    HistoryApiResponse,
+    UploadFileResponse,
+    UploadStatusResponse
+} from "./models";
 import { useLogin, getToken, isUsingAppServicesLogin } from "../authConfig";
 
 export async function getHeaders(idToken: string | undefined): Promise<Record<string, string>> {
@@ -54,8 +64,8 @@ export async function chatApi(request: ChatAppRequest, shouldStream: boolean, id
     });
 }
 
-export async function getSpeechApi(text: string): Promise<string | null> {
-    return await fetch("/speech", {
+export async function getSpeechApi(text: string, onComplete: (url: string) => void): Promise<string | null> {
+    const response = await fetch("/speech", {
         method: "POST",
         headers: {
             "Content-Type": "application/json"
@@ -63,19 +73,39 @@ export async function getSpeechApi(text: string): Promise<string | null> {
         body: JSON.stringify({
             text: text
         })
-    })
-        .then(response => {
-            if (response.status == 200) {
-                return response.blob();
-            } else if (response.status == 400) {
-                console.log("Speech synthesis is not enabled.");
-                return null;
-            } else {
-                console.error("Unable to get speech synthesis.");
-                return null;
+    });
+    if (response.status == 400) {
+        console.log("Speech synthesis is not enabled.");
+        return null;
+    } else if (response.status != 200) {
+        console.error("Unable to get speech synthesis.");
+        return null;
+    }
+    if (!response.body || !window.MediaSource || !MediaSource.isTypeSupported("audio/mpeg")) {
+        const url = URL.createObjectURL(await response.blob());
+        onComplete(url);
+        return url;
+    }
+    // Start playing while the rest of the audio is still being synthesized.
+    // A MediaSource can only be played once, so a complete copy is kept for replays.
+    const reader = response.body.getReader();
+    const mediaSource = new MediaSource();
+    mediaSource.addEventListener(
+        "sourceopen",
+        async () => {
+            const sourceBuffer = mediaSource.addSourceBuffer("audio/mpeg");
+            const chunks: Uint8Array[] = [];
+            for (let result = await reader.read(); !result.done; result = await reader.read()) {
+                chunks.push(result.value);
+                sourceBuffer.appendBuffer(result.value);
+                await new Promise(resolve => sourceBuffer.addEventListener("updateend", resolve, { once: true }));
             }
-        })
-        .then(blob => (blob ? URL.createObjectURL(blob) : null));
+            mediaSource.endOfStream();
+            onComplete(URL.createObjectURL(new Blob(chunks, { type: "audio/mpeg" })));
+        },
+        { once: true }
+    );
+    return URL.createObjectURL(mediaSource);
 }
 
 export function getCitationFilePath(citation: string): string {
@@ -86,7 +116,7 @@ export function getCitationFilePath(citation: string): string {
     return `${BACKEND_URI}/content/${encodedPath}${fragment ? `#${fragment}` : ""}`;
 }
 
-export async function uploadFileApi(request: FormData, idToken: string): Promise<SimpleAPIResponse> {
+export async function uploadFileApi(request: FormData, idToken: string): Promise<UploadFileResponse> {
     const response = await fetch("/upload", {
         method: "POST",
         headers: await getHeaders(idToken),
@@ -97,7 +127,21 @@ export async function uploadFileApi(request: FormData, idToken: string): Promise
         throw new Error(`Uploading files failed: ${response.statusText}`);
     }
 
-    const dataResponse: SimpleAPIResponse = await response.json();
+    const dataResponse: UploadFileResponse = await response.json();
+    return dataResponse;
+}
+
+export async function getUploadStatusApi(jobId: string, idToken: string): Promise<UploadStatusResponse> {
+    const response = await fetch(`/upload_status/${jobId}`, {
+        method: "GET",
+        headers: await getHeaders(idToken)
+    });
+
+    if (!response.ok) {
+        throw new Error(`Getting upload status failed: ${response.statusText}`);
+    }
+
+    const dataResponse: UploadStatusResponse = await response.json();
     return dataResponse;
 }
 
@@ -151,7 +195,7 @@ export async function getChatHistoryListApi(count: number, continuationToken: st
     const headers = await getHeaders(idToken);
     let url = `${BACKEND_URI}/chat_history/sessions?count=${count}`;
     if (continuationToken) {
-        url += `&continuationToken=${continuationToken}`;
+        url += `&continuation_token=${encodeURIComponent(continuationToken)}`;
     }
 
     const response = await fetch(url.toString(), {
@@ -167,9 +211,13 @@ export async function getChatHistoryListApi(count: number, continuationToken: st
     return dataResponse;
 }
 
-export async function getChatHistoryApi(id: string, idToken: string): Promise<HistoryApiResponse> {
+export async function getChatHistoryApi(id: string, continuationToken: string | undefined, idToken: string): Promise<HistoryApiResponse> {
     const headers = await getHeaders(idToken);
-    const response = await fetch(`/chat_history/sessions/${id}`, {
+    let url = `/chat_history/sessions/${id}`;
+    if (continuationToken) {
+        url += `?continuation_token=${encodeURIComponent(continuationToken)}`;
+    }
+    const response = await fetch(url, {
         method: "GET",
         headers: { ...headers, "Content-Type": "application/json" }
     });
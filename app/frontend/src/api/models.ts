@@ -42,6 +42,10 @@ export type ChatAppRequestOverrides = {
     vector_fields: VectorFields;
     language: string;
     use_agentic_retrieval: boolean;
+    use_multi_query_retrieval?: boolean;
+    max_search_queries?: number;
+    use_query_rewrite_shortcuts?: boolean;
+    context_token_budget?: number;
 };
 
 export type ResponseMessage = {
@@ -108,6 +112,17 @@ export type SimpleAPIResponse = {
     message?: string;
 };
 
+export type UploadFileResponse = SimpleAPIResponse & {
+    // Not set when the same content was already processed
+    job_id?: string;
+};
+
+export type UploadStatusResponse = SimpleAPIResponse & {
+    id: string;
+    filename: string;
+    status: "queued" | "running" | "succeeded" | "failed";
+};
+
 export interface SpeechConfig {
     speechUrls: (string | null)[];
     setSpeechUrls: (urls: (string | null)[]) => void;
@@ -130,4 +145,5 @@ export type HistoryApiResponse = {
     id: string;
     entra_oid: string;
     answers: any;
+    continuation_token?: string;
 };
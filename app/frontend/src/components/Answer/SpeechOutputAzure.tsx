@@ -48,14 +48,15 @@ export const SpeechOutputAzure = ({ answer, speechConfig, index, isStreaming }:
             return;
         }
         setIsLoading(true);
-        await getSpeechApi(answer).then(async speechUrl => {
+        const storeSpeechUrl = (speechUrl: string) =>
+            speechConfig.setSpeechUrls(speechConfig.speechUrls.map((url, i) => (i === index ? speechUrl : url)));
+        await getSpeechApi(answer, storeSpeechUrl).then(async speechUrl => {
             if (!speechUrl) {
                 alert("Speech output is not available.");
                 console.error("Speech output is not available.");
                 return;
             }
             setIsLoading(false);
-            speechConfig.setSpeechUrls(speechConfig.speechUrls.map((url, i) => (i === index ? speechUrl : url)));
             playAudio(speechUrl);
         });
     };
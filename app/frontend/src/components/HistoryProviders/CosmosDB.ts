@@ -40,8 +40,14 @@ export class CosmosDBProvider implements IHistoryProvider {
     }
 
     async getItem(id: string, idToken?: string): Promise<Answers | null> {
-        const response = await getChatHistoryApi(id, idToken || "");
-        return response.answers || null;
+        // Long conversations are returned in pages
+        let response = await getChatHistoryApi(id, undefined, idToken || "");
+        const answers: Answers | undefined = response.answers;
+        while (answers && response.continuation_token) {
+            response = await getChatHistoryApi(id, response.continuation_token, idToken || "");
+            answers.push(...response.answers);
+        }
+        return answers || null;
     }
 
     async deleteItem(id: string, idToken?: string): Promise<void> {
@@ -5,7 +5,7 @@ import { Add24Regular, Delete24Regular } from "@fluentui/react-icons";
 import { useMsal } from "@azure/msal-react";
 import { useTranslation } from "react-i18next";
 
-import { SimpleAPIResponse, uploadFileApi, deleteUploadedFileApi, listUploadedFilesApi } from "../../api";
+import { SimpleAPIResponse, uploadFileApi, getUploadStatusApi, deleteUploadedFileApi, listUploadedFilesApi } from "../../api";
 import { useLogin, getToken } from "../../authConfig";
 import styles from "./UploadFile.module.css";
 
@@ -74,6 +74,16 @@ export const UploadFile: React.FC<Props> = ({ className, disabled }: Props) => {
         }
     };
 
+    // The file is processed in the background after it's uploaded, check until it's searchable
+    const waitForProcessing = async (jobId: string, idToken: string) => {
+        let status = await getUploadStatusApi(jobId, idToken);
+        while (status.status === "queued" || status.status === "running") {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            status = await getUploadStatusApi(jobId, idToken);
+        }
+        setUploadedFile(status);
+    };
+
     // Handler for the form submission (file upload)
     const handleUploadFile = async (e: ChangeEvent<HTMLInputElement>) => {
         e.preventDefault();
@@ -90,11 +100,14 @@ export const UploadFile: React.FC<Props> = ({ className, disabled }: Props) => {
             if (!idToken) {
                 throw new Error("No authentication token available");
             }
-            const response: SimpleAPIResponse = await uploadFileApi(formData, idToken);
+            const response = await uploadFileApi(formData, idToken);
             setUploadedFile(response);
             setIsUploading(false);
             setUploadedFileError(undefined);
             listUploadedFiles(idToken);
+            if (response.job_id) {
+                waitForProcessing(response.job_id, idToken).catch(error => console.error(error));
+            }
         } catch (error) {
             console.error(error);
             setIsUploading(false);
@@ -179,6 +179,12 @@ const Chat = () => {
                 } else if (event["delta"] && event["delta"]["content"]) {
                     setIsLoading(false);
                     await updateState(event["delta"]["content"]);
+                } else if (event["context"] && event["context"]["token_usage"]) {
+                    // Token usage arrives after the answer and belongs to the last thought step, which generated it
+                    const lastThought = askResponse.context.thoughts[askResponse.context.thoughts.length - 1];
+                    if (lastThought) {
+                        lastThought.props = { ...lastThought.props, token_usage: event["context"]["token_usage"] };
+                    }
                 } else if (event["context"]) {
                     // Update context with new keys from latest event
                     askResponse.context = { ...askResponse.context, ...event["context"] };
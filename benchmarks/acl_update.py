@@ -0,0 +1,161 @@
+"""
+Benchmark for adding an ACL to every section of a large document with scripts/manageacl.py, against a simulated
+search index.
+
+Each simulated search request takes 100 ms plus 0.2 ms per result, and each merge request 50 ms plus 1 ms per
+document, and rejects batches of more than 1000 documents, as the service does. Compares the previous
+implementation, which read all the documents in the service's default pages of 50 and merged them in one request,
+with ManageAcl's key-ordered pages and concurrent merge batches, then interrupts an update halfway and resumes it
+from its checkpoint, and compares a dry run's estimate with the time the update took.
+Times are scaled down by --time-scale so the benchmark runs quickly, and reported as the service's real times.
+
+Usage: python benchmarks/acl_update.py [--documents 20000] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import pathlib
+import re
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from azure.core.credentials import AzureKeyCredential  # noqa: E402
+from azure.search.documents.aio import SearchClient  # noqa: E402
+
+import manageacl  # noqa: E402
+from manageacl import ManageAcl  # noqa: E402
+
+URL = "https://simulated.blob.core.windows.net/content/Large Document.pdf"
+DEFAULT_PAGE_SIZE = 50
+MAX_BATCH_SIZE = 1000
+
+
+class Results:
+    def __init__(self, documents: list[dict]):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class SimulatedIndex:
+    def __init__(self, document_count: int, time_scale: float):
+        self.documents = {
+            f"section-{index:06}": {"id": f"section-{index:06}", "oids": []} for index in range(document_count)
+        }
+        self.time_scale = time_scale
+        self.fail_after_merges = None
+
+    async def search(self, search_text, filter, select, order_by=None, top=None, skip=0):
+        match = re.search(r"id gt '(.*)'", filter)
+        ids = sorted(id for id in self.documents if match is None or id > match.group(1))
+        ids = ids[skip : skip + (top or DEFAULT_PAGE_SIZE)]
+        await asyncio.sleep((0.1 + 0.0002 * len(ids)) * self.time_scale)
+        return Results([{"id": id, "oids": list(self.documents[id]["oids"])} for id in ids])
+
+    async def merge_documents(self, documents):
+        if len(documents) > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch of {len(documents)} documents is over the limit of {MAX_BATCH_SIZE}")
+        if self.fail_after_merges is not None:
+            if self.fail_after_merges == 0:
+                raise ConnectionError("Connection reset")
+            self.fail_after_merges -= 1
+        await asyncio.sleep((0.05 + 0.001 * len(documents)) * self.time_scale)
+        for document in documents:
+            self.documents[document["id"]].update(document)
+
+    def reset(self):
+        for document in self.documents.values():
+            document["oids"] = []
+
+
+async def previous_add_acl(index: SimulatedIndex, acl: str):
+    """The previous implementation, which read every document before merging them all in one request."""
+    documents = []
+    for skip in range(0, len(index.documents), DEFAULT_PAGE_SIZE):
+        async for document in await index.search("", filter=f"storageUrl eq '{URL}'", select=["id"], skip=skip):
+            documents.append(document)
+    documents_to_merge = [{"id": document["id"], "oids": document["oids"] + [acl]} for document in documents]
+    await index.merge_documents(documents_to_merge)
+
+
+def command(concurrency: int, **kwargs) -> ManageAcl:
+    return ManageAcl(
+        service_name="simulated",
+        index_name="simulated",
+        url=URL,
+        acl_action="add",
+        acl_type="oids",
+        acl="OID",
+        credentials=AzureKeyCredential("simulated"),
+        concurrency=concurrency,
+        **kwargs,
+    )
+
+
+async def main(document_count: int, concurrency: int, time_scale: float):
+    index = SimulatedIndex(document_count, time_scale)
+    SearchClient.search = lambda client, *args, **kwargs: index.search(*args, **kwargs)  # type: ignore[method-assign]
+    SearchClient.merge_documents = lambda client, documents: index.merge_documents(documents)  # type: ignore[method-assign]
+    print(f"{document_count} search documents, concurrency {concurrency}")
+
+    started = time.perf_counter()
+    try:
+        await previous_add_acl(index, "OID")
+        outcome = "succeeded"
+    except ValueError as error:
+        outcome = f"failed: {error}"
+    print(f"Previous: {(time.perf_counter() - started) / time_scale:.1f} s, {outcome}")
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        await command(concurrency, dry_run=True).run()
+    estimated_seconds = float(re.findall(r"estimated duration ([0-9.]+) seconds", output.getvalue())[0]) / time_scale
+
+    started = time.perf_counter()
+    await command(concurrency).run()
+    current_seconds = (time.perf_counter() - started) / time_scale
+    assert all(document["oids"] == ["OID"] for document in index.documents.values())
+    print(f"Current: {current_seconds:.1f} s, estimated by a dry run as {estimated_seconds:.1f} s")
+
+    index.reset()
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        checkpoint_path = os.path.join(checkpoint_dir, "checkpoint.json")
+        merge_count = document_count // manageacl.MERGE_BATCH_SIZE
+        index.fail_after_merges = merge_count // 2
+        started = time.perf_counter()
+        try:
+            await command(concurrency, checkpoint_path=checkpoint_path).run()
+        except ConnectionError:
+            pass
+        index.fail_after_merges = None
+        interrupted_seconds = (time.perf_counter() - started) / time_scale
+        changed = sum(document["oids"] == ["OID"] for document in index.documents.values())
+        started = time.perf_counter()
+        await command(concurrency, checkpoint_path=checkpoint_path).run()
+        resumed_seconds = (time.perf_counter() - started) / time_scale
+    assert all(document["oids"] == ["OID"] for document in index.documents.values())
+    print(
+        f"Interrupted after {interrupted_seconds:.1f} s with {changed} documents changed, "
+        f"resumed from the checkpoint in {resumed_seconds:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20000, help="Search documents of the document to update")
+    parser.add_argument("--concurrency", type=int, default=4, help="Merge batches sent at the same time")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Simulated seconds per real second")
+    args = parser.parse_args()
+    asyncio.run(main(args.documents, args.concurrency, args.time_scale))
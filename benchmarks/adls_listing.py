@@ -0,0 +1,138 @@
+"""
+Benchmark for listing and downloading the files of an ADLS Gen2 folder for ingestion, against a simulated data lake.
+
+Each simulated file takes 100 ms to download and 30 ms to get the ACLs of, and the consumer spends 100 ms on each file,
+as parsing and indexing would. Compares a copy of the previous implementation, which downloaded each file and then got
+its ACLs one at a time, with ADLSGen2ListFileStrategy's prefetching, then lists the folder again with nothing changed.
+
+Usage: python benchmarks/adls_listing.py [--files 200] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "app" / "backend"))
+
+from azure.storage.filedatalake import PathProperties  # noqa: E402
+
+from prepdocslib.listfilestrategy import (  # noqa: E402
+    ADLSGen2ListFileStrategy,
+    ADLSGen2ListingState,
+    File,
+    parse_acls,
+)
+
+DOWNLOAD_SECONDS = 0.1
+ACL_SECONDS = 0.03
+PROCESSING_SECONDS = 0.1
+
+
+class SimulatedFileClient:
+    def __init__(self, path: str):
+        self.path = path
+        self.url = f"https://simulated.dfs.core.windows.net/{path}"
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def get_access_control(self, upn: bool):
+        await asyncio.sleep(ACL_SECONDS)
+        return {"acl": "user:USER-ID:r-x,group:GROUP-ID:r-x"}
+
+    async def download_file(self):
+        return self
+
+    async def readinto(self, stream):
+        await asyncio.sleep(DOWNLOAD_SECONDS)
+        stream.write(self.path.encode())
+
+
+class SimulatedFileSystemClient:
+    def __init__(self, file_count: int):
+        self.file_count = file_count
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def get_paths(self, path: str, recursive: bool):
+        for index in range(self.file_count):
+            yield PathProperties(name=f"{path}/folder-{index % 10}/file-{index}.txt", etag=f"etag-{index}")
+
+    def get_file_client(self, path: str) -> SimulatedFileClient:
+        return SimulatedFileClient(path)
+
+
+class SimulatedServiceClient(SimulatedFileSystemClient):
+    def get_file_system_client(self, name: str) -> SimulatedFileSystemClient:
+        return SimulatedFileSystemClient(self.file_count)
+
+
+class SimulatedListFileStrategy(ADLSGen2ListFileStrategy):
+    file_count = 0
+
+    def service_client(self):
+        return SimulatedServiceClient(self.file_count)
+
+    async def previous_list(self):
+        """The previous implementation, which downloaded to a temporary file named after the file."""
+        async with self.service_client() as service_client, service_client.get_file_system_client(
+            self.data_lake_filesystem
+        ) as filesystem_client:
+            async for path in self.list_paths():
+                temp_file_path = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+                async with filesystem_client.get_file_client(path) as file_client:
+                    with open(temp_file_path, "wb") as temp_file:
+                        downloader = await file_client.download_file()
+                        await downloader.readinto(temp_file)
+                access_control = await file_client.get_access_control(upn=False)
+                yield File(content=open(temp_file_path, "rb"), acls=parse_acls(access_control["acl"]))
+
+
+async def consume(files) -> int:
+    count = 0
+    async for file in files:
+        await asyncio.sleep(PROCESSING_SECONDS)
+        file.close()
+        count += 1
+    return count
+
+
+async def main(file_count: int, concurrency: int):
+    SimulatedListFileStrategy.file_count = file_count
+    with tempfile.TemporaryDirectory() as state_dir:
+        strategy = SimulatedListFileStrategy(
+            data_lake_storage_account="simulated",
+            data_lake_filesystem="simulated",
+            data_lake_path="data",
+            credential="",
+            concurrency=concurrency,
+            listing_state=ADLSGen2ListingState(os.path.join(state_dir, "listing.db")),
+        )
+        print(f"{file_count} files, concurrency {concurrency}")
+        for label, files in (
+            ("Previous", strategy.previous_list()),
+            ("Prefetching", strategy.list()),
+            ("Prefetching, nothing changed", strategy.list()),
+        ):
+            started = time.perf_counter()
+            count = await consume(files)
+            print(f"{label}: {time.perf_counter() - started:.1f} s, {count} files ingested")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="Files in the folder")
+    parser.add_argument("--concurrency", type=int, default=4, help="Files downloaded at the same time")
+    args = parser.parse_args()
+    asyncio.run(main(args.files, args.concurrency))
@@ -0,0 +1,210 @@
+"""
+Benchmark for migrating chat history to the chat-history-v2 container with scripts/cosmosdb_migration.py, against a
+simulated Cosmos DB account.
+
+The old container's sessions are spread over --feed-ranges physical partitions, with up to 10 message pairs each.
+Each simulated page of the change feed or a query takes 20 ms plus 0.2 ms per item, and each transactional batch
+10 ms plus 1 ms and 6 RU per operation. Compares a copy of the previous implementation, which queried the whole
+container and wrote one session at a time, with CosmosDBMigrator, without and with a limit of request units per
+second, then stops a migration partway through and resumes it from its checkpoint.
+Times are scaled down by --time-scale so the benchmark runs quickly, and reported as the service's real times;
+local work, like building the new items, is scaled up with them, so it's overstated.
+
+Usage: python benchmarks/cosmosdb_migration.py [--sessions 5000] [--feed-ranges 4] [--concurrency 16]
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "scripts"))
+
+from cosmosdb_migration import CosmosDBMigrator  # noqa: E402
+
+PAGE_SIZE = 100
+
+
+class SimulatedPages:
+    def __init__(self, container: "SimulatedContainer", items: list[dict], name: str, start: int, response_hook):
+        self.container = container
+        self.items = items
+        self.name = name
+        self.index = start
+        self.response_hook = response_hook
+        self.continuation_token = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.index >= len(self.items):
+            raise StopAsyncIteration
+        page = self.items[self.index : self.index + PAGE_SIZE]
+        self.index += len(page)
+        await asyncio.sleep((0.02 + 0.0002 * len(page)) * self.container.time_scale)
+        self.container.items_read += len(page)
+        if self.response_hook:
+            self.response_hook({"x-ms-request-charge": str(len(page) * 0.5)}, page)
+        self.continuation_token = f"{self.name}:{self.index}"
+        return Results(page)
+
+
+class Results:
+    def __init__(self, items: list[dict]):
+        self.items = items
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for item in self.items:
+            yield item
+
+
+class SimulatedQuery:
+    def __init__(self, container: "SimulatedContainer", items: list[dict], name: str, start: int, response_hook=None):
+        self.pages = SimulatedPages(container, items, name, start, response_hook)
+
+    def by_page(self):
+        return self.pages
+
+
+class SimulatedContainer:
+    def __init__(self, feed_ranges: dict[str, list[dict]], time_scale: float):
+        self.feed_ranges = feed_ranges
+        self.time_scale = time_scale
+        self.items_read = 0
+        self.request_units = 0.0
+        self.written: dict[str, dict] = {}
+        self.fail_after_batches = None
+
+    async def read_feed_ranges(self):
+        for name in self.feed_ranges:
+            yield {"Range": name}
+
+    def query_items(self, query: str):
+        all_items = [item for items in self.feed_ranges.values() for item in items]
+        return SimulatedQuery(self, all_items, "all", 0)
+
+    def query_items_change_feed(
+        self, max_item_count, response_hook, feed_range=None, start_time=None, continuation=None
+    ):
+        if continuation:
+            name, start = continuation.split(":")
+        else:
+            name, start = feed_range["Range"], "0"
+        return SimulatedQuery(self, self.feed_ranges[name], name, int(start), response_hook)
+
+    async def execute_item_batch(self, batch_operations, partition_key, response_hook=None):
+        if self.fail_after_batches is not None:
+            if self.fail_after_batches == 0:
+                raise ConnectionError("Connection reset")
+            self.fail_after_batches -= 1
+        await asyncio.sleep((0.01 + 0.001 * len(batch_operations)) * self.time_scale)
+        self.request_units += 6 * len(batch_operations)
+        if response_hook:
+            response_hook({"x-ms-request-charge": str(6 * len(batch_operations))}, [])
+        for _, (item,) in batch_operations:
+            self.written[item["id"]] = item
+
+
+async def previous_migrate(migrator: CosmosDBMigrator):
+    """The previous implementation, which wrote the new items of each old item one at a time."""
+    query_results = migrator.old_container.query_items(query="SELECT * FROM c")
+    async for page in query_results.by_page():
+        async for old_item in page:
+            batch_operations = [("upsert", ({"id": old_item["id"], "type": "session"},))]
+            for idx, answer in enumerate(old_item.get("answers", [])):
+                batch_operations.append(("upsert", ({"id": f"{old_item['id']}-{idx}", "question": answer[0]},)))
+            await migrator.new_container.execute_item_batch(
+                batch_operations=batch_operations, partition_key=[old_item["entra_oid"], old_item["id"]]
+            )
+
+
+def make_old_items(session_count: int, feed_range_count: int) -> dict[str, list[dict]]:
+    random.seed(42)
+    feed_ranges: dict[str, list[dict]] = {f"range-{index}": [] for index in range(feed_range_count)}
+    for index in range(session_count):
+        old_item = {
+            "id": f"session-{index}",
+            "entra_oid": f"user-{index % 500}",
+            "title": f"Session {index}",
+            "timestamp": index,
+            "answers": [
+                [f"Question {turn}", {"message": {"content": "Answer"}}] for turn in range(random.randint(0, 10))
+            ],
+        }
+        feed_ranges[f"range-{index % feed_range_count}"].append(old_item)
+    return feed_ranges
+
+
+def make_migrator(container: SimulatedContainer, **kwargs) -> CosmosDBMigrator:
+    migrator = CosmosDBMigrator("simulated", "simulated", credential=object(), **kwargs)
+    migrator.client = object()  # type: ignore[assignment]
+    migrator.old_container = container  # type: ignore[assignment]
+    migrator.new_container = container  # type: ignore[assignment]
+    return migrator
+
+
+async def main(session_count: int, feed_range_count: int, concurrency: int, time_scale: float):
+    feed_ranges = make_old_items(session_count, feed_range_count)
+    new_item_count = sum(1 + len(item["answers"]) for items in feed_ranges.values() for item in items)
+    print(f"{session_count} sessions, {new_item_count} new items, {feed_range_count} feed ranges")
+
+    def report(label: str, container: SimulatedContainer, seconds: float):
+        seconds /= time_scale
+        print(
+            f"{label}: {seconds:.1f} s, {container.items_read / seconds:.0f} sessions/s, "
+            f"{container.request_units / seconds:.0f} RU/s, {container.items_read} sessions read"
+        )
+
+    container = SimulatedContainer(feed_ranges, time_scale)
+    started = time.perf_counter()
+    await previous_migrate(make_migrator(container))
+    report("Previous", container, time.perf_counter() - started)
+
+    # The budget is in the service's time, the benchmark runs it --time-scale faster
+    for label, request_units_per_second in (("Current", None), ("Current, 5,000 RU/s budget", 5000)):
+        container = SimulatedContainer(feed_ranges, time_scale)
+        migrator = make_migrator(
+            container,
+            concurrency=concurrency,
+            request_units_per_second=request_units_per_second / time_scale if request_units_per_second else None,
+        )
+        started = time.perf_counter()
+        await migrator.migrate()
+        report(label, container, time.perf_counter() - started)
+        assert len(container.written) == new_item_count
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        checkpoint_path = os.path.join(checkpoint_dir, "checkpoint.json")
+        container = SimulatedContainer(feed_ranges, time_scale)
+        container.fail_after_batches = session_count // 2
+        started = time.perf_counter()
+        try:
+            await make_migrator(container, concurrency=concurrency, checkpoint_path=checkpoint_path).migrate()
+        except ConnectionError:
+            pass
+        report("Stopped halfway", container, time.perf_counter() - started)
+        container.fail_after_batches = None
+        container.items_read = 0
+        container.request_units = 0
+        started = time.perf_counter()
+        await make_migrator(container, concurrency=concurrency, checkpoint_path=checkpoint_path).migrate()
+        report("Resumed from the checkpoint", container, time.perf_counter() - started)
+        assert len(container.written) == new_item_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5000, help="Sessions in the old container")
+    parser.add_argument("--feed-ranges", type=int, default=4, help="Physical partitions of the old container")
+    parser.add_argument("--concurrency", type=int, default=16, help="Transactional batches written at the same time")
+    parser.add_argument("--time-scale", type=float, default=0.2, help="Simulated seconds per real second")
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.feed_ranges, args.concurrency, args.time_scale))
@@ -0,0 +1,143 @@
+"""
+Benchmark for analyzing a large PDF with Document Intelligence in page-range shards, against a simulated service.
+
+Each simulated analysis takes 5 seconds plus 0.3 seconds per page. Compares analyzing the whole document in one
+operation, as the previous implementation did, with DocumentAnalysisParser's shards analyzed at the same time, then
+ingests the document again with the shards' results cached. Also retries an ingestion where one operation failed:
+the previous implementation analyzed the whole document again, the shards only analyze the failed range again.
+Times are scaled down by --time-scale so the benchmark runs quickly, and reported as the service's real times;
+local work, like reading cached results, is scaled up with them, so it's overstated.
+
+Usage: python benchmarks/document_sharding.py [--pages 1000] [--pages-per-shard 100] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import io
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Optional
+from unittest.mock import AsyncMock, MagicMock
+
+import pymupdf
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "app" / "backend"))
+
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient  # noqa: E402
+from azure.ai.documentintelligence.models import (  # noqa: E402
+    AnalyzeResult,
+    DocumentPage,
+    DocumentSpan,
+)
+from azure.core.exceptions import HttpResponseError  # noqa: E402
+
+from prepdocslib.pdfparser import (  # noqa: E402
+    AnalyzeResultCache,
+    DocumentAnalysisParser,
+)
+
+
+class SimulatedService:
+    def __init__(self, page_count: int, time_scale: float):
+        self.page_count = page_count
+        self.time_scale = time_scale
+        self.failing_pages: Optional[str] = None
+        self.pages_analyzed = 0
+
+    async def begin_analyze_document(self, model_id, analyze_request, pages=None, **kwargs):
+        first_page, last_page = (int(page) for page in pages.split("-")) if pages else (1, self.page_count)
+        self.pages_analyzed += last_page - first_page + 1
+        await asyncio.sleep((5 + 0.3 * (last_page - first_page + 1)) * self.time_scale)
+        if (pages or "all") == self.failing_pages:
+            self.failing_pages = None
+            raise HttpResponseError("Service unavailable")
+        content = "".join(f"Page {page_number:05} " for page_number in range(first_page, last_page + 1))
+        poller = MagicMock()
+        poller.result = AsyncMock(
+            return_value=AnalyzeResult(
+                content=content,
+                pages=[
+                    DocumentPage(page_number=page_number, spans=[DocumentSpan(offset=index * 11, length=11)])
+                    for index, page_number in enumerate(range(first_page, last_page + 1))
+                ],
+            )
+        )
+        return poller
+
+
+async def ingest(parser: DocumentAnalysisParser, pdf_bytes: bytes) -> list[str]:
+    content = io.BytesIO(pdf_bytes)
+    content.name = "Large Document.pdf"
+    return [page.text async for page in parser.parse(content)]
+
+
+async def main(page_count: int, pages_per_shard: int, concurrency: int, time_scale: float):
+    doc = pymupdf.open()
+    for _ in range(page_count):
+        doc.new_page()
+    pdf_bytes = doc.tobytes()
+    service = SimulatedService(page_count, time_scale)
+    DocumentIntelligenceClient.begin_analyze_document = service.begin_analyze_document  # type: ignore[method-assign]
+
+    def measure(label: str, seconds: float):
+        print(f"{label}: {seconds / time_scale:.0f} s, {service.pages_analyzed} pages analyzed")
+        service.pages_analyzed = 0
+
+    whole = DocumentAnalysisParser(
+        endpoint="https://simulated",
+        credential=MagicMock(),
+        use_content_understanding=False,
+        pages_per_shard=page_count,
+    )
+    started = time.perf_counter()
+    expected = await ingest(whole, pdf_bytes)
+    measure("Whole document", time.perf_counter() - started)
+    middle_shard = f"{page_count // 2 + 1}-{page_count // 2 + pages_per_shard}"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        sharded = DocumentAnalysisParser(
+            endpoint="https://simulated",
+            credential=MagicMock(),
+            use_content_understanding=False,
+            pages_per_shard=pages_per_shard,
+            shard_concurrency=concurrency,
+            analyze_result_cache=AnalyzeResultCache(cache_dir),
+        )
+        started = time.perf_counter()
+        assert await ingest(sharded, pdf_bytes) == expected, "The pages differ from the whole document's"
+        measure("Shards, first ingestion", time.perf_counter() - started)
+        started = time.perf_counter()
+        assert await ingest(sharded, pdf_bytes) == expected
+        measure("Shards, results cached", time.perf_counter() - started)
+
+    # An ingestion that fails partway through, and its retry
+    service.failing_pages = "all"
+    started = time.perf_counter()
+    for _ in range(2):
+        try:
+            await ingest(whole, pdf_bytes)
+        except HttpResponseError:
+            pass
+    measure("Whole document, failure and retry", time.perf_counter() - started)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        sharded.analyze_result_cache = AnalyzeResultCache(cache_dir)
+        service.failing_pages = middle_shard
+        started = time.perf_counter()
+        for _ in range(2):
+            try:
+                assert await ingest(sharded, pdf_bytes) == expected
+            except HttpResponseError:
+                pass
+        measure("Shards, failure and retry", time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1000, help="Pages in the document")
+    parser.add_argument("--pages-per-shard", type=int, default=100, help="Pages analyzed in each operation")
+    parser.add_argument("--concurrency", type=int, default=4, help="Operations running at the same time")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="Simulated seconds per real second")
+    args = parser.parse_args()
+    asyncio.run(main(args.pages, args.pages_per_shard, args.concurrency, args.time_scale))
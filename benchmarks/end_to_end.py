@@ -0,0 +1,780 @@
+"""
+End-to-end benchmark of the app's own overhead, with local stand-ins for the Azure services.
+
+Starts the app from create_app() under uvicorn in its own process, the way a worker serves it. Azure OpenAI is replaced
+by a local server that answers after --openai-latency-ms and streams the answer at --tokens-per-second. Azure AI Search,
+Blob storage, Data Lake storage and Cosmos DB are replaced in the SDKs with in-memory stand-ins, each with a latency.
+Then sends /ask, /chat, /chat/stream, /content, /upload and /chat_history requests, --concurrency at a time, and
+reports for each route:
+- the throughput,
+- the p50 and p99 latency,
+- the time to the first token of streamed answers,
+- the app process's CPU time per request,
+- the app process's peak memory.
+Uploaded files are ingested in the background, so the CPU time of /upload includes waiting for their ingestion.
+
+Each run is appended to --results with the commit and settings, and compared with the last run with the same settings.
+For use in CI, --max-regression fails the run if a route's throughput dropped, or its CPU time per request grew,
+by more than that percentage.
+
+The app loads tiktoken encodings, which tiktoken downloads on first use. The benchmark loads them before starting, so
+only its first run needs network access, or TIKTOKEN_CACHE_DIR can point to encodings cached on another machine.
+
+Usage: python benchmarks/end_to_end.py [--requests 200] [--concurrency 8] [--routes ask,chat,chat_stream]
+"""
+
+import argparse
+import asyncio
+import base64
+import copy
+import json
+import os
+import pathlib
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+import aiohttp
+import tiktoken
+from aiohttp import web
+
+ROOT = pathlib.Path(__file__).parent.parent
+BACKEND_DIRECTORY = ROOT / "app" / "backend"
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BACKEND_DIRECTORY))
+
+from evals.target_responses import percentile  # noqa: E402
+
+ROUTES = ["ask", "chat", "chat_stream", "content", "upload", "chat_history"]
+STARTUP_TIMEOUT_SECONDS = 120
+# The chat model's encoding, and the embedding model's, which the text splitter also uses
+ENCODINGS = ["o200k_base", "cl100k_base"]
+BENCHMARK_USER = "benchmark-user"
+
+# From locustfile.py
+QUESTIONS = [
+    "What is included in my Northwind Health Plus plan that is not in standard?",
+    "What does a Product Manager do?",
+    "What happens in a performance review?",
+    "Whats your whistleblower policy?",
+]
+OVERRIDES = {
+    "retrieval_mode": "hybrid",
+    "semantic_ranker": True,
+    "semantic_captions": False,
+    "top": 3,
+    "suggest_followup_questions": False,
+}
+SOURCE_FILES = ["Benefit_Options.pdf", "Northwind_Health_Plus_Benefits_Details.pdf", "employee_handbook.pdf"]
+ANSWER_WORDS = "Northwind Health Plus covers hospital stays, doctor visits, preventive care and prescriptions".split()
+# A chunk of a document is about 500 tokens
+CHUNK_CONTENT = "Northwind Health Plus covers hospital stays, doctor visits and preventive care. " * 25
+CONTENT_FILE_BYTES = 256 * 1024
+UPLOAD_FILE_BYTES = 16 * 1024
+
+
+def question(index: int) -> str:
+    # Each question is different, so the caches of query rewrites and embeddings don't answer it
+    return f"{QUESTIONS[index % len(QUESTIONS)]} ({index})"
+
+
+def chat_request(index: int) -> dict[str, Any]:
+    return {"messages": [{"content": question(index), "role": "user"}], "context": {"overrides": OVERRIDES}}
+
+
+def upload_request(index: int) -> aiohttp.FormData:
+    form = aiohttp.FormData()
+    content = f"Uploaded file {index}\n".encode() + b"Notes on the Northwind Health Plus plan.\n" * (
+        UPLOAD_FILE_BYTES // 41
+    )
+    form.add_field("file", content, filename=f"notes-{index}.txt", content_type="text/plain")
+    return form
+
+
+def chat_history_request(index: int) -> dict[str, Any]:
+    answer = {
+        "message": {"content": " ".join(ANSWER_WORDS) + " [Benefit_Options.pdf#page=1]", "role": "assistant"},
+        "context": {"data_points": {"text": [f"Benefit_Options.pdf#page=1: {CHUNK_CONTENT}"]}, "thoughts": []},
+    }
+    return {"id": f"session-{index}", "answers": [[question(index + turn), answer] for turn in range(3)]}
+
+
+# The method, path and arguments of the request for each route
+REQUESTS: dict[str, Callable[[int], tuple[str, str, dict[str, Any]]]] = {
+    "ask": lambda index: ("POST", "/ask", {"json": chat_request(index)}),
+    "chat": lambda index: ("POST", "/chat", {"json": chat_request(index)}),
+    "chat_stream": lambda index: ("POST", "/chat/stream", {"json": chat_request(index)}),
+    "content": lambda index: ("GET", f"/content/{SOURCE_FILES[index % len(SOURCE_FILES)]}", {}),
+    "upload": lambda index: ("POST", "/upload", {"data": upload_request(index)}),
+    "chat_history": lambda index: ("POST", "/chat_history", {"json": chat_history_request(index)}),
+}
+
+
+class OpenAIStandIn:
+    """Answers chat completion and embedding requests like Azure OpenAI, streaming answers a token at a time."""
+
+    def __init__(self, latency: float, tokens_per_second: float, answer_tokens: int, embedding_latency: float):
+        self.latency = latency
+        self.token_interval = 1 / tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.embedding_latency = embedding_latency
+
+    def completion_tokens(self, body: dict[str, Any]) -> list[str]:
+        if body.get("tools"):
+            # The query rewrite, which answers with a short search query
+            return [" " + word for word in ANSWER_WORDS[:4]]
+        tokens = [" " + ANSWER_WORDS[index % len(ANSWER_WORDS)] for index in range(self.answer_tokens)]
+        tokens[-1] += " [Benefit_Options.pdf#page=1]"
+        return tokens
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        tokens = self.completion_tokens(body)
+        usage = {"prompt_tokens": 3000, "completion_tokens": len(tokens), "total_tokens": 3000 + len(tokens)}
+        completion = {"id": "benchmark", "created": int(time.time()), "model": body["model"]}
+        await asyncio.sleep(self.latency)
+        if not body.get("stream"):
+            await asyncio.sleep(len(tokens) * self.token_interval)
+            message = {"role": "assistant", "content": "".join(tokens)}
+            return web.json_response(
+                {
+                    **completion,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(choices: list[dict[str, Any]], **fields):
+            chunk = {**completion, "object": "chat.completion.chunk", "choices": choices, **fields}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self.token_interval)
+            await send([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        vector = [0.01] * (body.get("dimensions") or 1536)
+        await asyncio.sleep(self.embedding_latency)
+        if body.get("encoding_format") == "base64":
+            embedding: Any = base64.b64encode(array("f", vector).tobytes()).decode()
+        else:
+            embedding = vector
+        return web.json_response(
+            {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": index, "embedding": embedding} for index in range(len(texts))
+                ],
+                "model": body["model"],
+                "usage": {"prompt_tokens": 8 * len(texts), "total_tokens": 8 * len(texts)},
+            }
+        )
+
+    def serve(self, port: int):
+        app = web.Application()
+        app.router.add_get("/health", lambda request: web.Response(text="ok"))
+        # OpenAI clients send /v1/chat/completions, Azure OpenAI clients /openai/deployments/<name>/chat/completions
+        app.router.add_post("/{prefix:.*}chat/completions", self.chat_completions)
+        app.router.add_post("/{prefix:.*}embeddings", self.embeddings)
+        web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def install_service_stand_ins(args: argparse.Namespace):
+    """Replaces the calls the app makes to Azure AI Search, Blob storage, Data Lake storage and Cosmos DB."""
+    from azure.core.credentials import AccessToken
+    from azure.core.exceptions import ResourceNotFoundError
+    from azure.cosmos.aio import ContainerProxy
+    from azure.cosmos.exceptions import CosmosResourceNotFoundError
+    from azure.search.documents.aio import SearchClient
+    from azure.storage.blob import BlobProperties
+    from azure.storage.blob.aio import ContainerClient
+    from azure.storage.filedatalake import FileProperties
+    from azure.storage.filedatalake.aio import (
+        DataLakeDirectoryClient,
+        DataLakeFileClient,
+    )
+
+    import app
+    from core.authentication import AuthenticationHelper
+
+    search_latency = args.search_latency_ms / 1000
+    storage_latency = args.storage_latency_ms / 1000
+    cosmos_latency = args.cosmos_latency_ms / 1000
+
+    class StandInCredential:
+        async def get_token(self, *scopes, **kwargs) -> AccessToken:
+            return AccessToken("benchmark-token", int(time.time()) + 3600)
+
+        async def close(self):
+            pass
+
+    app.AzureDeveloperCliCredential = lambda *args, **kwargs: StandInCredential()  # type: ignore[assignment,misc]
+
+    async def get_auth_claims(self, headers) -> dict[str, Any]:
+        # Upload and chat history need a user, logging in isn't part of the benchmark
+        return {"oid": BENCHMARK_USER, "groups": []}
+
+    AuthenticationHelper.get_auth_claims_if_enabled = get_auth_claims  # type: ignore[method-assign]
+
+    search_documents = [
+        {
+            "id": f"file-{SOURCE_FILES[index % len(SOURCE_FILES)]}-page-{index}",
+            "content": CHUNK_CONTENT,
+            "category": None,
+            "sourcepage": f"{SOURCE_FILES[index % len(SOURCE_FILES)]}#page={index + 1}",
+            "sourcefile": SOURCE_FILES[index % len(SOURCE_FILES)],
+            "@search.score": 0.03,
+            "@search.reranker_score": 2.5,
+            "@search.captions": None,
+        }
+        for index in range(50)
+    ]
+
+    class SearchResults:
+        def __init__(self, documents: list[dict[str, Any]]):
+            self.documents = documents
+
+        async def by_page(self):
+            async def page():
+                for document in self.documents:
+                    yield document
+
+            yield page()
+
+        async def get_count(self) -> int:
+            return len(self.documents)
+
+    async def search(self, *args, **kwargs) -> SearchResults:
+        await asyncio.sleep(search_latency)
+        return SearchResults(search_documents[: kwargs.get("top") or 50])
+
+    async def upload_documents(self, documents, **kwargs) -> list[dict[str, Any]]:
+        await asyncio.sleep(search_latency)
+        return [{"key": document["id"], "succeeded": True, "status_code": 201} for document in documents]
+
+    SearchClient.search = search  # type: ignore[method-assign,assignment]
+    SearchClient.upload_documents = upload_documents  # type: ignore[method-assign,assignment]
+
+    content_file = (b"%PDF-1.7\n" + b"0" * CONTENT_FILE_BYTES)[:CONTENT_FILE_BYTES]
+
+    class BlobDownloader:
+        def __init__(self, name: str):
+            self.properties = BlobProperties(name=name, content_settings={"content_type": "application/pdf"})
+
+        async def readinto(self, stream) -> int:
+            stream.write(content_file)
+            return len(content_file)
+
+    class BlobClient:
+        def __init__(self, name: str):
+            self.name = name
+
+        async def download_blob(self, **kwargs) -> BlobDownloader:
+            await asyncio.sleep(storage_latency)
+            return BlobDownloader(self.name)
+
+    ContainerClient.get_blob_client = lambda self, blob, *args, **kwargs: BlobClient(blob)  # type: ignore[method-assign,assignment]
+
+    # The user's uploaded files by "<filesystem>/<path>", the form rename_file takes
+    files: dict[str, dict[str, Any]] = {}
+
+    def file_key(file_client: DataLakeFileClient) -> str:
+        return f"{file_client.file_system_name}/{file_client.path_name}"
+
+    async def directory_call(self, *args, **kwargs):
+        await asyncio.sleep(storage_latency)
+
+    async def get_file_properties(self, **kwargs) -> FileProperties:
+        await asyncio.sleep(storage_latency)
+        if file_key(self) not in files:
+            raise ResourceNotFoundError("The specified path does not exist.")
+        return FileProperties(metadata=dict(files[file_key(self)]["metadata"]))
+
+    async def create_file(self, metadata=None, **kwargs):
+        await asyncio.sleep(storage_latency)
+        files[file_key(self)] = {"content": bytearray(), "metadata": metadata or {}}
+
+    async def append_data(self, data, offset, length=None, **kwargs):
+        await asyncio.sleep(storage_latency)
+        files[file_key(self)]["content"] += data
+
+    async def set_metadata(self, metadata, **kwargs):
+        await asyncio.sleep(storage_latency)
+        files[file_key(self)]["metadata"] = metadata
+
+    async def rename_file(self, new_name, **kwargs):
+        await asyncio.sleep(storage_latency)
+        files[new_name] = files.pop(file_key(self))
+
+    async def delete_file(self, **kwargs):
+        await asyncio.sleep(storage_latency)
+        files.pop(file_key(self), None)
+
+    class FileDownloader:
+        def __init__(self, file: dict[str, Any]):
+            self.content = bytes(file["content"])
+            self.properties = FileProperties(metadata=dict(file["metadata"]))
+
+        async def readall(self) -> bytes:
+            return self.content
+
+    async def download_file(self, **kwargs) -> FileDownloader:
+        await asyncio.sleep(storage_latency)
+        if file_key(self) not in files:
+            raise ResourceNotFoundError("The specified path does not exist.")
+        return FileDownloader(files[file_key(self)])
+
+    DataLakeDirectoryClient.get_directory_properties = directory_call  # type: ignore[method-assign]
+    DataLakeDirectoryClient.create_directory = directory_call  # type: ignore[method-assign]
+    DataLakeDirectoryClient.set_access_control = directory_call  # type: ignore[method-assign]
+    DataLakeFileClient.get_file_properties = get_file_properties  # type: ignore[method-assign]
+    DataLakeFileClient.create_file = create_file  # type: ignore[method-assign,assignment]
+    DataLakeFileClient.append_data = append_data  # type: ignore[method-assign]
+    DataLakeFileClient.flush_data = directory_call  # type: ignore[method-assign]
+    DataLakeFileClient.set_metadata = set_metadata  # type: ignore[method-assign]
+    DataLakeFileClient.rename_file = rename_file  # type: ignore[method-assign,assignment]
+    DataLakeFileClient.delete_file = delete_file  # type: ignore[method-assign,assignment]
+    DataLakeFileClient.download_file = download_file  # type: ignore[method-assign,assignment]
+
+    # The chat history items by partition key and id
+    items: dict[tuple[str, str], dict[str, Any]] = {}
+
+    def request_charge(response_hook, request_units: float, result: Any):
+        if response_hook:
+            response_hook({"x-ms-request-charge": str(request_units)}, result)
+
+    async def read_item(self, item, partition_key, response_hook=None, **kwargs) -> dict[str, Any]:
+        await asyncio.sleep(cosmos_latency)
+        stored = items.get((json.dumps(partition_key), item))
+        request_charge(response_hook, 1, stored)
+        if stored is None:
+            raise CosmosResourceNotFoundError(message="Entity with the specified id does not exist in the system.")
+        return copy.deepcopy(stored)
+
+    async def execute_item_batch(self, batch_operations, partition_key, response_hook=None, **kwargs):
+        await asyncio.sleep(cosmos_latency)
+        key = json.dumps(partition_key)
+        for operation, arguments, *_ in batch_operations:
+            if operation in ("create", "upsert"):
+                items[(key, arguments[0]["id"])] = {**copy.deepcopy(arguments[0]), "_etag": str(uuid.uuid4())}
+            elif operation == "patch":
+                stored = items[(key, arguments[0])]
+                for patch in arguments[1]:
+                    stored[patch["path"].lstrip("/")] = copy.deepcopy(patch["value"])
+                stored["_etag"] = str(uuid.uuid4())
+            elif operation == "delete":
+                items.pop((key, arguments[0]), None)
+        results = [{"statusCode": 200} for _ in batch_operations]
+        request_charge(response_hook, 6 * len(batch_operations), results)
+        return results
+
+    ContainerProxy.read_item = read_item  # type: ignore[method-assign,assignment]
+    ContainerProxy.execute_item_batch = execute_item_batch  # type: ignore[method-assign]
+
+
+def serve_app(args: argparse.Namespace):
+    import uvicorn
+    from quart import jsonify
+
+    import app
+
+    install_service_stand_ins(args)
+    quart_app = app.create_app()
+
+    @quart_app.get("/benchmark/process")
+    async def process_usage():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        return jsonify({"cpu_seconds": usage.ru_utime + usage.ru_stime, "peak_rss_bytes": peak_rss})
+
+    uvicorn.run(quart_app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def app_environment(openai_url: str, work_directory: str) -> dict[str, str]:
+    # Leave out the settings of a real deployment from the developer's shell
+    environment = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("AZURE_", "OPENAI_", "USE_", "APPLICATIONINSIGHTS_"))
+    }
+    environment.update(
+        {
+            "AZURE_STORAGE_ACCOUNT": "benchmark-storage-account",
+            "AZURE_STORAGE_CONTAINER": "content",
+            "AZURE_SEARCH_SERVICE": "benchmark-search-service",
+            "AZURE_SEARCH_INDEX": "benchmark-index",
+            "OPENAI_HOST": "local",
+            "OPENAI_BASE_URL": f"{openai_url}/v1",
+            "OPENAI_API_KEY": "benchmark-key",
+            "AZURE_OPENAI_CUSTOM_URL": openai_url,
+            "AZURE_OPENAI_CHATGPT_MODEL": "gpt-4.1-mini",
+            "AZURE_OPENAI_EMB_MODEL_NAME": "text-embedding-3-large",
+            "AZURE_OPENAI_EMB_DIMENSIONS": "1536",
+            "USE_USER_UPLOAD": "true",
+            "AZURE_USERSTORAGE_ACCOUNT": "benchmark-userstorage-account",
+            "AZURE_USERSTORAGE_CONTAINER": "user-content",
+            "USE_LOCAL_PDF_PARSER": "true",
+            "USE_LOCAL_HTML_PARSER": "true",
+            "AZURE_INGESTION_QUEUE_PATH": os.path.join(work_directory, "ingestion-queue.db"),
+            "USE_CHAT_HISTORY_COSMOS": "true",
+            "AZURE_COSMOSDB_ACCOUNT": "benchmark-cosmosdb-account",
+            "AZURE_CHAT_HISTORY_DATABASE": "chat-database",
+            "AZURE_CHAT_HISTORY_CONTAINER": "chat-history",
+            "AZURE_CHAT_HISTORY_VERSION": "cosmosdb-v2",
+        }
+    )
+    return environment
+
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+async def start_server(
+    mode: str, port: int, environment: dict[str, str], log_file, log_path: str
+) -> asyncio.subprocess.Process:
+    """Starts this script serving the app or the Azure OpenAI stand-in, and waits until it answers."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        str(pathlib.Path(__file__).resolve()),
+        *sys.argv[1:],
+        "--serve",
+        mode,
+        "--port",
+        str(port),
+        cwd=BACKEND_DIRECTORY,
+        env=environment,
+        stdout=log_file,
+        stderr=log_file,
+    )
+    ready_path = "/benchmark/process" if mode == "app" else "/health"
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    async with aiohttp.ClientSession() as session:
+        while True:
+            if process.returncode is not None:
+                raise RuntimeError(f"The {mode} server exited with {process.returncode}, see {log_path}")
+            try:
+                async with session.get(f"http://127.0.0.1:{port}{ready_path}") as response:
+                    if response.status == 200:
+                        return process
+            except aiohttp.ClientConnectionError:
+                pass
+            if time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(
+                    f"The {mode} server didn't start in {STARTUP_TIMEOUT_SECONDS} seconds, see {log_path}"
+                )
+            await asyncio.sleep(0.2)
+
+
+def load_encodings():
+    """
+    Loads the tiktoken encodings the app uses. tiktoken downloads them once and caches them in TIKTOKEN_CACHE_DIR, or
+    in the temporary directory if it isn't set, and the app's process reads the same cache, so after a first run with
+    network access the benchmark runs offline.
+    """
+    for encoding_name in ENCODINGS:
+        try:
+            tiktoken.get_encoding(encoding_name)
+        except Exception as error:
+            raise SystemExit(
+                f"Couldn't load the {encoding_name} tiktoken encoding: {error}\n"
+                "Run the benchmark once with network access, or set TIKTOKEN_CACHE_DIR to a directory with the "
+                "encodings cached by another machine."
+            )
+
+
+async def wait_for_ingestion(session: aiohttp.ClientSession, app_url: str, job_ids: list[str]):
+    """Waits for the uploaded files to be ingested, polling the last job until it's done and then the rest."""
+    pending = list(job_ids)
+    while pending:
+        async with session.get(f"{app_url}/upload_status/{pending[-1]}") as response:
+            status = (await response.json())["status"]
+        if status in ("queued", "running"):
+            await asyncio.sleep(0.2)
+            continue
+        still_pending = []
+        for job_id in pending[:-1]:
+            async with session.get(f"{app_url}/upload_status/{job_id}") as response:
+                if (await response.json())["status"] in ("queued", "running"):
+                    still_pending.append(job_id)
+        pending = still_pending
+
+
+async def process_usage(session: aiohttp.ClientSession, app_url: str) -> dict[str, float]:
+    async with session.get(f"{app_url}/benchmark/process") as response:
+        return await response.json()
+
+
+async def measure_route(
+    session: aiohttp.ClientSession, app_url: str, route: str, requests: int, warmup: int, concurrency: int
+) -> dict[str, Any]:
+    make_request = REQUESTS[route]
+    latencies: list[float] = []
+    first_token_latencies: list[float] = []
+    job_ids: list[str] = []
+    errors = 0
+
+    async def send(index: int, record: bool):
+        nonlocal errors
+        method, path, kwargs = make_request(index)
+        started = time.perf_counter()
+        first_token = None
+        try:
+            async with session.request(method, app_url + path, **kwargs) as response:
+                if route == "chat_stream":
+                    async for line in response.content:
+                        if first_token is None and line.strip() and json.loads(line).get("delta", {}).get("content"):
+                            first_token = time.perf_counter() - started
+                elif route == "upload":
+                    job_id = (await response.json()).get("job_id")
+                    if job_id:
+                        job_ids.append(job_id)
+                else:
+                    await response.read()
+                failed = response.status >= 400
+        except aiohttp.ClientError:
+            failed = True
+        if not record:
+            return
+        if failed:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - started)
+        if first_token is not None:
+            first_token_latencies.append(first_token)
+
+    async def send_requests(indexes: range, record: bool):
+        remaining = iter(indexes)
+
+        async def sender():
+            for index in remaining:
+                await send(index, record)
+
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+
+    await send_requests(range(warmup), record=False)
+    await wait_for_ingestion(session, app_url, job_ids)
+    job_ids.clear()
+    usage_before = await process_usage(session, app_url)
+    started = time.perf_counter()
+    await send_requests(range(warmup, warmup + requests), record=True)
+    elapsed = time.perf_counter() - started
+    await wait_for_ingestion(session, app_url, job_ids)
+    usage_after = await process_usage(session, app_url)
+
+    metrics = {
+        "requests": requests,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "cpu_ms_per_request": round((usage_after["cpu_seconds"] - usage_before["cpu_seconds"]) / requests * 1000, 2),
+        "peak_rss_mb": round(usage_after["peak_rss_bytes"] / 1024 / 1024, 1),
+    }
+    if first_token_latencies:
+        metrics["first_token_p50_ms"] = round(percentile(first_token_latencies, 50) * 1000, 1)
+        metrics["first_token_p99_ms"] = round(percentile(first_token_latencies, 99) * 1000, 1)
+    return metrics
+
+
+async def run_benchmark(args: argparse.Namespace, routes: list[str]) -> dict[str, dict[str, Any]]:
+    log_path = os.path.join(tempfile.gettempdir(), "end-to-end-benchmark.log")
+    with tempfile.TemporaryDirectory() as work_directory, open(log_path, "w") as log_file:
+        openai_port, app_port = free_port(), free_port()
+        openai_url = f"http://127.0.0.1:{openai_port}"
+        openai_process = await start_server("openai", openai_port, dict(os.environ), log_file, log_path)
+        try:
+            app_process = await start_server(
+                "app", app_port, app_environment(openai_url, work_directory), log_file, log_path
+            )
+            try:
+                app_url = f"http://127.0.0.1:{app_port}"
+                results = {}
+                connector = aiohttp.TCPConnector(limit=args.concurrency)
+                timeout = aiohttp.ClientTimeout(total=300)
+                async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                    for route in routes:
+                        results[route] = await measure_route(
+                            session, app_url, route, args.requests, args.warmup, args.concurrency
+                        )
+                        if results[route]["errors"]:
+                            print(f"{route}: {results[route]['errors']} requests failed, see {log_path}")
+                return results
+            finally:
+                app_process.terminate()
+                await app_process.wait()
+        finally:
+            openai_process.terminate()
+            await openai_process.wait()
+
+
+def current_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def previous_run(results_path: pathlib.Path, settings: dict[str, Any]) -> Optional[dict[str, Any]]:
+    """The last run stored in the results with the same settings."""
+    if not results_path.exists():
+        return None
+    previous = None
+    with open(results_path) as results_file:
+        for line in results_file:
+            run = json.loads(line)
+            if run["settings"] == settings:
+                previous = run
+    return previous
+
+
+def change(current: Optional[float], previous: Optional[float]) -> str:
+    if current is None or not previous:
+        return ""
+    return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+
+def report(results: dict[str, dict[str, Any]], previous: Optional[dict[str, Any]]):
+    print(
+        f"{'route':<14}{'req/s':>14}{'p50 ms':>10}{'p99 ms':>16}{'TTFT p50':>10}{'TTFT p99':>10}"
+        f"{'CPU ms/req':>18}{'peak RSS MB':>13}{'errors':>8}"
+    )
+    for route, metrics in results.items():
+        before = (previous or {}).get("routes", {}).get(route, {})
+        throughput = f"{metrics['throughput']:.1f}{change(metrics['throughput'], before.get('throughput'))}"
+        p99 = f"{metrics['latency_p99_ms']}{change(metrics['latency_p99_ms'], before.get('latency_p99_ms'))}"
+        cpu = f"{metrics['cpu_ms_per_request']:.1f}"
+        cpu += change(metrics["cpu_ms_per_request"], before.get("cpu_ms_per_request"))
+        print(
+            f"{route:<14}{throughput:>14}{metrics['latency_p50_ms']!s:>10}{p99:>16}"
+            f"{metrics.get('first_token_p50_ms', '-')!s:>10}{metrics.get('first_token_p99_ms', '-')!s:>10}"
+            f"{cpu:>18}{metrics['peak_rss_mb']:>13}{metrics['errors']:>8}"
+        )
+    if previous:
+        print(f"Changes are from the run of {previous['timestamp']} at commit {previous['commit']}")
+
+
+def regressions(results: dict[str, dict[str, Any]], previous: dict[str, Any], max_regression: float) -> list[str]:
+    found = []
+    for route, metrics in results.items():
+        before = previous["routes"].get(route)
+        if not before:
+            continue
+        if metrics["throughput"] < before["throughput"] * (1 - max_regression / 100):
+            found.append(f"{route} throughput dropped from {before['throughput']} to {metrics['throughput']} req/s")
+        if metrics["cpu_ms_per_request"] > before["cpu_ms_per_request"] * (1 + max_regression / 100):
+            found.append(
+                f"{route} CPU per request grew from {before['cpu_ms_per_request']} to "
+                f"{metrics['cpu_ms_per_request']} ms"
+            )
+    return found
+
+
+def main(args: argparse.Namespace) -> int:
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f"Unknown routes {', '.join(sorted(unknown))}, choose from {', '.join(ROUTES)}")
+    settings = {
+        "routes": routes,
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "concurrency": args.concurrency,
+        "openai_latency_ms": args.openai_latency_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "answer_tokens": args.answer_tokens,
+        "embedding_latency_ms": args.embedding_latency_ms,
+        "search_latency_ms": args.search_latency_ms,
+        "storage_latency_ms": args.storage_latency_ms,
+        "cosmos_latency_ms": args.cosmos_latency_ms,
+    }
+    load_encodings()
+    print(f"{args.requests} requests per route, concurrency {args.concurrency}")
+    results = asyncio.run(run_benchmark(args, routes))
+
+    results_path = pathlib.Path(args.results)
+    previous = previous_run(results_path, settings)
+    report(results, previous)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": current_commit(),
+        "settings": settings,
+        "routes": results,
+    }
+    with open(results_path, "a") as results_file:
+        results_file.write(json.dumps(run) + "\n")
+
+    if args.max_regression is not None and previous:
+        found = regressions(results, previous, args.max_regression)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Requests measured for each route")
+    parser.add_argument("--warmup", type=int, default=10, help="Requests sent to each route before measuring")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests sent at the same time")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="Comma-separated routes to measure")
+    parser.add_argument("--openai-latency-ms", type=float, default=300, help="Time to the first token of an answer")
+    parser.add_argument("--tokens-per-second", type=float, default=100, help="Rate answers are generated at")
+    parser.add_argument("--answer-tokens", type=int, default=100, help="Tokens in each answer")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30)
+    parser.add_argument("--search-latency-ms", type=float, default=50)
+    parser.add_argument("--storage-latency-ms", type=float, default=10)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=10)
+    parser.add_argument(
+        "--results",
+        default=str(pathlib.Path(__file__).parent / "results" / "end_to_end.jsonl"),
+        help="File the runs are appended to, for comparing them over time",
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        help="Exit with an error if throughput dropped or CPU per request grew by more than this percentage",
+    )
+    # Used by the benchmark to start the app and the Azure OpenAI stand-in in their own processes
+    parser.add_argument("--serve", choices=["app", "openai"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve == "app":
+        serve_app(args)
+    elif args.serve == "openai":
+        OpenAIStandIn(
+            args.openai_latency_ms / 1000,
+            args.tokens_per_second,
+            args.answer_tokens,
+            args.embedding_latency_ms / 1000,
+        ).serve(args.port)
+    else:
+        sys.exit(main(args))
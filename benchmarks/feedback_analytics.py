@@ -0,0 +1,122 @@
+"""
+Load test of the feedback analytics with many feedback items, against an in-memory stand-in for Cosmos DB.
+
+Records each feedback through the aggregates, with several writers at once as several workers would, then reads the
+analytics. For comparison, it also runs the previous implementation's client-side work over the same feedback, which
+needed a cross-partition GROUP BY query that read every message pair with feedback.
+
+Usage: python benchmarks/feedback_analytics.py [--feedback 1000000] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / "app" / "backend"))
+sys.path.insert(0, str(ROOT))
+
+from tests.mocks import MockCosmosContainer  # noqa: E402
+
+from chat_history.feedbackanalytics import FeedbackAnalytics, FeedbackEvent  # noqa: E402
+
+
+def make_feedback(index: int) -> dict:
+    return {
+        "type": "negative" if index % 4 == 0 else "positive",
+        "comment": "The answer missed the deductible" if index % 4 == 0 else "",
+        "timestamp": f"2025-01-01T00:00:00.{index:07}",
+    }
+
+
+def previous_analytics(rows: list[dict]) -> dict:
+    """The previous implementation, given the rows of its GROUP BY query."""
+    analytics: dict = {"total_feedback": 0, "positive_feedback": 0, "negative_feedback": 0, "recent_feedback": []}
+    for item in rows:
+        analytics["total_feedback"] += 1
+        if item.get("feedback_type") == "positive":
+            analytics["positive_feedback"] += 1
+        elif item.get("feedback_type") == "negative":
+            analytics["negative_feedback"] += 1
+        analytics["recent_feedback"].append(
+            {
+                "type": item.get("feedback_type"),
+                "comment": item.get("feedback_comment"),
+                "timestamp": item.get("feedback_timestamp"),
+                "session_id": item.get("session_id"),
+                "question": item.get("question"),
+            }
+        )
+    analytics["recent_feedback"].sort(key=lambda x: x["timestamp"] if x["timestamp"] else "", reverse=True)
+    analytics["recent_feedback"] = analytics["recent_feedback"][:100]
+    return analytics
+
+
+async def record_all(feedback_analytics: FeedbackAnalytics, count: int, concurrency: int):
+    async def writer(start: int):
+        for index in range(start, count, concurrency):
+            event = FeedbackEvent(
+                message_id=f"session-{index // 10}-{index % 10}",
+                session_id=f"session-{index // 10}",
+                previous_type=None,
+                feedback=make_feedback(index),
+                question=f"Question {index}",
+            )
+            await feedback_analytics.record([event])
+
+    await asyncio.gather(*(writer(start) for start in range(concurrency)))
+
+
+async def main(count: int, concurrency: int):
+    rows = [
+        {
+            "feedback_type": feedback["type"],
+            "feedback_comment": feedback["comment"],
+            "feedback_timestamp": feedback["timestamp"],
+            "session_id": f"session-{index // 10}",
+            "question": f"Question {index}",
+        }
+        for index, feedback in ((index, make_feedback(index)) for index in range(count))
+    ]
+    started = time.perf_counter()
+    expected = previous_analytics(rows)
+    previous_ms = (time.perf_counter() - started) * 1000
+    del rows
+
+    container = MockCosmosContainer()
+    feedback_analytics = FeedbackAnalytics(container)
+    started = time.perf_counter()
+    await record_all(feedback_analytics, count, concurrency)
+    record_seconds = time.perf_counter() - started
+    record_calls = sum(container.calls.values())
+    # Each attempt at updating the recent feedback reads it once, and feedback saved at the same time is added together
+    recent_updates = container.calls["read_item"]
+
+    container.calls.clear()
+    started = time.perf_counter()
+    analytics = await feedback_analytics.read()
+    read_ms = (time.perf_counter() - started) * 1000
+
+    assert analytics["total_feedback"] == expected["total_feedback"]
+    assert analytics["negative_feedback"] == expected["negative_feedback"]
+    assert [entry["timestamp"] for entry in analytics["recent_feedback"]] == [
+        entry["timestamp"] for entry in expected["recent_feedback"]
+    ]
+
+    print(f"{count} feedback items, {concurrency} concurrent writers")
+    print(
+        f"Recording: {record_seconds / count * 1e6:.1f} us and {record_calls / count:.2f} Cosmos DB calls per feedback, "
+        f"{recent_updates} updates of the recent feedback"
+    )
+    print(f"Previous analytics: query read {count} items, {previous_ms:.0f} ms of client-side aggregation")
+    print(f"Materialized analytics: {sum(container.calls.values())} Cosmos DB calls, {read_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--feedback", type=int, default=1_000_000, help="Feedback items to record")
+    parser.add_argument("--concurrency", type=int, default=4, help="Writers recording feedback at the same time")
+    args = parser.parse_args()
+    asyncio.run(main(args.feedback, args.concurrency))
@@ -0,0 +1,133 @@
+"""
+Benchmark for describing the figures of a document with Azure Content Understanding, against a simulated service.
+
+Each simulated analysis takes between 2 and 8 seconds, and some images (logos, repeated diagrams) appear many times.
+Compares the previous implementation, which described the figures one at a time and polled every 2 seconds, with
+DocumentAnalysisParser.describe_figures, the first time the document is ingested and again with the cache filled.
+Times are scaled down by --time-scale so the benchmark runs quickly, and reported as the service's real times.
+
+Usage: python benchmarks/figure_description.py [--figures 300] [--distinct-images 200] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / "app" / "backend"))
+sys.path.insert(0, str(ROOT))
+
+from azure.ai.documentintelligence.models import DocumentFigure  # noqa: E402
+from tests.mocks import MockAzureCredential, MockResponse  # noqa: E402
+
+from prepdocslib import mediadescriber  # noqa: E402
+from prepdocslib.mediadescriber import (  # noqa: E402
+    ContentUnderstandingDescriber,
+    MediaDescriptionCache,
+)
+from prepdocslib.pdfparser import DocumentAnalysisParser  # noqa: E402
+
+PREVIOUS_POLL_INTERVAL = 2
+
+
+class SimulatedOperation:
+    def __init__(self, duration: float):
+        self.done_at = time.monotonic() + duration
+
+    def get(self, url, headers):
+        status = "Succeeded" if time.monotonic() >= self.done_at else "Running"
+        result = {"contents": [{"fields": {"Description": {"valueString": f"Description of {url}"}}}]}
+        return MockResponse(status=200, text=json.dumps({"status": status, "result": result}))
+
+
+class SimulatedDescriber(ContentUnderstandingDescriber):
+    def __init__(self, durations: dict[bytes, float], time_scale: float, previous_polling: bool = False):
+        super().__init__("https://simulated", MockAzureCredential())
+        self.durations = durations
+        self.time_scale = time_scale
+        self.previous_polling = previous_polling
+        self.calls = 0
+
+    async def describe_image(self, image_bytes: bytes) -> str:
+        self.calls += 1
+        operation = SimulatedOperation(self.durations[image_bytes] * self.time_scale)
+        if self.previous_polling:
+            results = await self.previous_poll(operation, image_bytes.decode())
+        else:
+            results = await self.poll_api(operation, image_bytes.decode(), {})
+        return results["result"]["contents"][0]["fields"]["Description"]["valueString"]
+
+    async def previous_poll(self, operation: SimulatedOperation, poll_url: str) -> dict:
+        """The previous polling, which checked every 2 seconds."""
+        while True:
+            async with operation.get(poll_url, {}) as response:
+                response_json = await response.json()
+            if response_json["status"] != "Running":
+                return response_json
+            await asyncio.sleep(PREVIOUS_POLL_INTERVAL * self.time_scale)
+
+
+def make_figures(figure_count: int, distinct_images: int) -> tuple[list[DocumentFigure], dict[bytes, float]]:
+    random.seed(42)
+    durations = {f"image-{index}".encode(): random.uniform(2, 8) for index in range(distinct_images)}
+    images = list(durations)
+    # Every image appears at least once, the rest of the figures repeat a few common images
+    figure_images = images + [random.choice(images[:10]) for _ in range(figure_count - distinct_images)]
+    random.shuffle(figure_images)
+    figures = [
+        DocumentFigure(id=image.decode(), bounding_regions=[{"pageNumber": 1, "polygon": [0] * 8}])
+        for image in figure_images
+    ]
+    return figures, durations
+
+
+def crop_figure(doc, figure: DocumentFigure) -> bytes:
+    return figure.id.encode()
+
+
+async def main(figure_count: int, distinct_images: int, concurrency: int, time_scale: float):
+    figures, durations = make_figures(figure_count, distinct_images)
+    DocumentAnalysisParser.crop_figure = staticmethod(crop_figure)  # type: ignore[method-assign]
+    mediadescriber.POLL_INITIAL_INTERVAL *= time_scale
+    mediadescriber.POLL_MAX_INTERVAL *= time_scale
+    mediadescriber.POLL_TIMEOUT *= time_scale
+
+    previous_describer = SimulatedDescriber(durations, time_scale, previous_polling=True)
+    started = time.perf_counter()
+    expected = [await DocumentAnalysisParser.figure_to_html(None, figure, previous_describer) for figure in figures]
+    previous_seconds = (time.perf_counter() - started) / time_scale
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        parser = DocumentAnalysisParser(
+            endpoint="",
+            credential=MockAzureCredential(),
+            figure_concurrency=concurrency,
+            media_description_cache=MediaDescriptionCache(str(pathlib.Path(cache_dir) / "media-descriptions.db")),
+        )
+        timings = []
+        for _ in range(2):
+            describer = SimulatedDescriber(durations, time_scale)
+            started = time.perf_counter()
+            figure_htmls = await parser.describe_figures(None, figures, describer)
+            timings.append(((time.perf_counter() - started) / time_scale, describer.calls))
+            assert figure_htmls == expected, "The figures differ from the previous implementation's"
+
+    print(f"{figure_count} figures, {distinct_images} distinct images, concurrency {concurrency}")
+    print(f"Previous: {previous_seconds:.0f} s, {previous_describer.calls} analyses")
+    for label, (seconds, calls) in zip(("Current, first ingestion", "Current, cache filled"), timings):
+        print(f"{label}: {seconds:.1f} s, {calls} analyses")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--figures", type=int, default=300, help="Figures in the document")
+    parser.add_argument("--distinct-images", type=int, default=200, help="Distinct images among the figures")
+    parser.add_argument("--concurrency", type=int, default=4, help="Figures described at the same time")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="Simulated seconds per real second")
+    args = parser.parse_args()
+    asyncio.run(main(args.figures, args.distinct_images, args.concurrency, args.time_scale))
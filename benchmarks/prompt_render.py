@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for the cost of rendering the chat prompts once per request.
+
+Compares prompty.prepare, which recompiles the Jinja template on every call, with the precompiled prompts
+returned by PromptyManager.
+
+Usage: python benchmarks/prompt_render.py [--iterations 2000]
+"""
+
+import argparse
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "app" / "backend"))
+
+import prompty  # noqa: E402
+
+from approaches.promptmanager import PromptyManager  # noqa: E402
+
+PROMPTS = ["chat_query_rewrite.prompty", "chat_answer_question.prompty", "ask_answer_question.prompty"]
+
+SAMPLE_DATA = {
+    "user_query": "What is included in my Northwind Health Plus plan that is not in standard?",
+    "past_messages": [
+        {"role": "user", "content": "What does a product manager do?"},
+        {"role": "assistant", "content": "A product manager leads product strategy [role_library.pdf#page=29]."},
+    ]
+    * 3,
+    "text_sources": [
+        f"Benefit_Options.pdf#page={page}: " + "Northwind Health Plus covers many services. " * 20 for page in range(5)
+    ],
+    "include_follow_up_questions": True,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt rendering per request.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    prompt_manager = PromptyManager()
+    print(f"{'prompt':<32}{'prompty.prepare':>18}{'precompiled':>16}{'speedup':>10}")
+    for prompt_name in PROMPTS:
+        compiled = prompt_manager.load_prompt(prompt_name)
+        raw = prompty.load(PromptyManager.PROMPTS_DIRECTORY / prompt_name)
+        assert prompt_manager.render_prompt(compiled, SAMPLE_DATA) == prompty.prepare(raw, SAMPLE_DATA)
+
+        prepare_seconds = timeit.timeit(lambda: prompty.prepare(raw, SAMPLE_DATA), number=args.iterations)
+        compiled_seconds = timeit.timeit(
+            lambda: prompt_manager.render_prompt(compiled, SAMPLE_DATA), number=args.iterations
+        )
+        prepare_us = prepare_seconds / args.iterations * 1e6
+        compiled_us = compiled_seconds / args.iterations * 1e6
+        print(f"{prompt_name:<32}{prepare_us:>15.1f} us{compiled_us:>13.1f} us{prepare_us / compiled_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark for the cold start of a backend worker, broken down by phase.
+
+Each run starts a fresh interpreter that imports the app, creates it and runs its startup (setup_clients), the same
+work a gunicorn worker does before serving its first request. Azure services are configured with placeholder names
+and an API key, so no network calls are made. The slowest modules imported by app.py are listed from -X importtime.
+
+Usage: python benchmarks/startup.py [--runs 5] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIRECTORY = pathlib.Path(__file__).parent.parent / "app" / "backend"
+
+ENVIRONMENT = {
+    "AZURE_STORAGE_ACCOUNT": "test-storage-account",
+    "AZURE_STORAGE_CONTAINER": "test-storage-container",
+    "AZURE_SEARCH_INDEX": "test-search-index",
+    "AZURE_SEARCH_SERVICE": "test-search-service",
+    "AZURE_OPENAI_SERVICE": "test-openai-service",
+    "AZURE_OPENAI_CHATGPT_MODEL": "gpt-4.1-mini",
+    "AZURE_OPENAI_CHATGPT_DEPLOYMENT": "test-chatgpt",
+    "AZURE_OPENAI_EMB_DEPLOYMENT": "test-ada",
+    "AZURE_OPENAI_API_KEY_OVERRIDE": "placeholder-key",
+}
+
+WORKER_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+quart_app = app.create_app()
+created = time.perf_counter()
+
+async def start():
+    async with quart_app.test_app():
+        return dict(quart_app.config[app.CONFIG_STARTUP_TIMINGS])
+
+timings = {"import": (imported - started) * 1000, "create_app": (created - imported) * 1000}
+timings.update(asyncio.run(start()))
+print(json.dumps(timings))
+"""
+
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)")
+
+
+def run_worker(environment: dict[str, str]) -> dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER_SCRIPT],
+        cwd=BACKEND_DIRECTORY,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(environment: dict[str, str], top: int) -> list[tuple[str, float]]:
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BACKEND_DIRECTORY,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in output.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        # Modules imported directly by app.py are nested one level below it
+        if match and len(match.group(2)) == 3:
+            imports.append((match.group(3), int(match.group(1)) / 1000))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker startup by phase.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    environment = {**os.environ, **ENVIRONMENT}
+    runs = [run_worker(environment) for _ in range(args.runs)]
+
+    print(f"{'phase':<16}{'median':>12}{'min':>12}")
+    for phase in runs[0]:
+        durations = [run[phase] for run in runs]
+        print(f"{phase:<16}{statistics.median(durations):>9.1f} ms{min(durations):>9.1f} ms")
+    totals = [sum(run.values()) for run in runs]
+    print(f"{'total':<16}{statistics.median(totals):>9.1f} ms{min(totals):>9.1f} ms")
+
+    print(f"\n{'slowest imports of app.py':<48}{'cumulative':>12}")
+    for module, duration in slowest_imports(environment, args.top):
+        print(f"{module:<48}{duration:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark for the CPU spent on one streamed /chat/stream response, excluding the model and search calls.
+
+Replays a fake chat completion stream through ChatApproach.run_with_streaming and format_as_ndjson, and through
+a copy of the previous implementation, which called model_dump() for every chunk, serialized dataclasses with
+dataclasses.asdict and re-sent the whole context when the token usage arrived.
+
+Usage: python benchmarks/stream_serialization.py [--tokens 400] [--token-interval-ms 5] [--responses 5]
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "app" / "backend"))
+
+from openai.types.chat import ChatCompletionChunk  # noqa: E402
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta  # noqa: E402
+from openai.types.completion_usage import CompletionUsage  # noqa: E402
+
+from app import format_as_ndjson  # noqa: E402
+from approaches.approach import DataPoints, ExtraInfo, ThoughtStep  # noqa: E402
+from approaches.chatapproach import ChatApproach  # noqa: E402
+
+
+def make_extra_info() -> ExtraInfo:
+    results = [
+        {
+            "id": f"file-Benefit_Options_pdf-page-{page}",
+            "content": "Northwind Health Plus covers hospital stays, doctor visits and preventive care. " * 12,
+            "sourcepage": f"Benefit_Options.pdf#page={page}",
+            "sourcefile": "Benefit_Options.pdf",
+            "captions": [],
+            "score": 0.03,
+            "reranker_score": 2.5,
+        }
+        for page in range(10)
+    ]
+    return ExtraInfo(
+        DataPoints(text=[f"{result['sourcepage']}: {result['content']}" for result in results]),
+        thoughts=[
+            ThoughtStep("Search using generated search query", "Northwind Health Plus", {"top": 10}),
+            ThoughtStep("Search results", results),
+            ThoughtStep("Prompt to generate answer", [{"role": "user", "content": "What is covered?"}], {"model": "m"}),
+        ],
+    )
+
+
+def make_chunks(tokens: int) -> list[ChatCompletionChunk]:
+    def chunk(**kwargs) -> ChatCompletionChunk:
+        return ChatCompletionChunk(id="test", created=0, model="m", object="chat.completion.chunk", **kwargs)
+
+    chunks = [chunk(choices=[Choice(delta=ChoiceDelta(role="assistant"), index=0)])]
+    chunks += [chunk(choices=[Choice(delta=ChoiceDelta(content=" word"), index=0)]) for _ in range(tokens)]
+    chunks.append(
+        chunk(choices=[], usage=CompletionUsage(prompt_tokens=3000, completion_tokens=tokens, total_tokens=3400))
+    )
+    return chunks
+
+
+class ReplayStream:
+    """Stands in for openai.AsyncStream, yielding the chunks with a delay between them."""
+
+    def __init__(self, chunks: list[ChatCompletionChunk], interval: float):
+        self.chunks = chunks
+        self.interval = interval
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.interval)
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+class ReplayApproach(ChatApproach):
+    def __init__(self, chunks: list[ChatCompletionChunk], interval: float):
+        self.chunks = chunks
+        self.interval = interval
+        self.include_token_usage = True
+
+    async def run_until_final_call(self, messages, overrides, auth_claims, should_stream):
+        async def open_stream():
+            return ReplayStream(self.chunks, self.interval)
+
+        return make_extra_info(), open_stream()
+
+
+class LegacyJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if dataclasses.is_dataclass(o) and not isinstance(o, type):
+            return dataclasses.asdict(o)
+        return super().default(o)
+
+
+async def legacy_stream(chunks: list[ChatCompletionChunk], interval: float):
+    extra_info = make_extra_info()
+    frame = {"delta": {"role": "assistant"}, "context": extra_info}
+    yield json.dumps(frame, ensure_ascii=False, cls=LegacyJSONEncoder) + "\n"
+    async for event_chunk in ReplayStream(chunks, interval):
+        event = event_chunk.model_dump()
+        if event["choices"]:
+            completion = {
+                "delta": {
+                    "content": event["choices"][0]["delta"].get("content"),
+                    "role": event["choices"][0]["delta"]["role"],
+                }
+            }
+            yield json.dumps(completion, ensure_ascii=False, cls=LegacyJSONEncoder) + "\n"
+        elif event_chunk.usage and extra_info.thoughts:
+            extra_info.thoughts[-1].update_token_usage(event_chunk.usage)
+            frame = {"delta": {"role": "assistant"}, "context": extra_info}
+            yield json.dumps(frame, ensure_ascii=False, cls=LegacyJSONEncoder) + "\n"
+
+
+def current_stream(chunks: list[ChatCompletionChunk], interval: float):
+    return format_as_ndjson(ReplayApproach(chunks, interval).run_with_streaming([], {}, {}))
+
+
+async def measure(stream_factory, chunks: list[ChatCompletionChunk], interval: float, responses: int):
+    cpu_seconds = 0.0
+    frames = 0
+    sent_bytes = 0
+    for _ in range(responses):
+        start = time.process_time()
+        async for line in stream_factory(chunks, interval):
+            frames += 1
+            sent_bytes += len(line.encode())
+        cpu_seconds += time.process_time() - start
+    return cpu_seconds / responses * 1000, frames / responses, sent_bytes / responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU per streamed chat response.")
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-interval-ms", type=float, default=5)
+    parser.add_argument("--responses", type=int, default=5)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.tokens)
+    interval = args.token_interval_ms / 1000
+    print(f"{'path':<10}{'CPU/response':>16}{'frames':>10}{'bytes':>10}")
+    for name, stream_factory in (("previous", legacy_stream), ("current", current_stream)):
+        cpu_ms, frames, sent_bytes = asyncio.run(measure(stream_factory, chunks, interval, args.responses))
+        print(f"{name:<10}{cpu_ms:>13.1f} ms{frames:>10.0f}{sent_bytes:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
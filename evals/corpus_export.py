@@ -0,0 +1,154 @@
+"""
+Exports the chunks of the search index to a gzipped JSON Lines snapshot, streaming them a page at a time,
+and samples the snapshot stratified by source file, so building a knowledge graph never holds the whole index.
+"""
+
+import gzip
+import json
+import logging
+import random
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, Optional
+
+from azure.core.exceptions import HttpResponseError
+from azure.search.documents import SearchClient
+
+logger = logging.getLogger("ragapp")
+
+# Chunks read in each search request, the most the service returns in one page
+PAGE_SIZE = 1000
+# The fields a knowledge graph node needs, leaving out the embeddings
+SNAPSHOT_FIELDS = ["id", "content", "sourcepage", "sourcefile"]
+
+
+def search_pages(search_client: SearchClient, page_size: int = PAGE_SIZE) -> Iterator[list[dict[str, Any]]]:
+    """
+    Yields the chunks of the index a page at a time, in key order, each page filtered to the keys after the previous
+    page, so that the search service's limit on skipped results doesn't apply.
+    Indexes whose id field isn't sortable and filterable are read in a single search instead, which the service
+    limits to 100,000 results.
+    """
+    last_key: Optional[str] = None
+    while True:
+        escaped_key = last_key.replace("'", "''") if last_key is not None else None
+        try:
+            page = list(
+                search_client.search(
+                    search_text="*",
+                    select=SNAPSHOT_FIELDS,
+                    filter=f"id gt '{escaped_key}'" if escaped_key is not None else None,
+                    order_by=["id asc"],
+                    top=page_size,
+                )
+            )
+        except HttpResponseError as error:
+            if last_key is not None or error.status_code != 400:
+                raise
+            logger.warning("Searching the whole index at once, as its id field can't be used for paging: %s", error)
+            break
+        yield page
+        if len(page) < page_size:
+            return
+        last_key = page[-1]["id"]
+
+    page = []
+    for chunk in search_client.search(search_text="*", select=SNAPSHOT_FIELDS):
+        page.append(chunk)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def export_snapshot(search_client: SearchClient, snapshot_path: Path, page_size: int = PAGE_SIZE) -> int:
+    """Writes every chunk of the index to the snapshot, returning how many were written."""
+    temp_path = snapshot_path.with_name(snapshot_path.name + ".tmp")
+    count = 0
+    with gzip.open(temp_path, "wt", encoding="utf-8") as snapshot_file:
+        for page in search_pages(search_client, page_size):
+            for chunk in page:
+                snapshot_file.write(json.dumps({field: chunk.get(field) for field in SNAPSHOT_FIELDS}) + "\n")
+            count += len(page)
+            logger.info("Exported %d chunks", count)
+    # Only a complete export replaces the snapshot
+    temp_path.replace(snapshot_path)
+    return count
+
+
+def read_snapshot(snapshot_path: Path) -> Iterator[dict[str, Any]]:
+    with gzip.open(snapshot_path, "rt", encoding="utf-8") as snapshot_file:
+        for line in snapshot_file:
+            yield json.loads(line)
+
+
+def sample_allocation(counts: Counter, sample_size: int) -> dict[str, int]:
+    """
+    Splits the sample between the source files in proportion to their chunks, with at least one chunk per source file
+    while the sample is large enough, by the largest remainder.
+    """
+    total = sum(counts.values())
+    if sample_size >= total:
+        return dict(counts)
+    allocation = {sourcefile: 0 for sourcefile in counts}
+    remaining = sample_size
+    # One chunk of each source file first, from the largest, so that small files are represented
+    for sourcefile, _ in counts.most_common(min(sample_size, len(counts))):
+        allocation[sourcefile] = 1
+        remaining -= 1
+    spare = {sourcefile: count - allocation[sourcefile] for sourcefile, count in counts.items()}
+    spare_total = sum(spare.values())
+    if remaining == 0 or spare_total == 0:
+        return allocation
+    shares = {sourcefile: remaining * count / spare_total for sourcefile, count in spare.items()}
+    for sourcefile, share in shares.items():
+        allocation[sourcefile] += int(share)
+    leftover = sample_size - sum(allocation.values())
+    for sourcefile in sorted(shares, key=lambda sourcefile: shares[sourcefile] - int(shares[sourcefile]), reverse=True):
+        if leftover == 0:
+            break
+        if allocation[sourcefile] < counts[sourcefile]:
+            allocation[sourcefile] += 1
+            leftover -= 1
+    return allocation
+
+
+def stratified_sample(
+    chunks: Iterable[dict[str, Any]], counts: Counter, sample_size: int, seed: int = 42
+) -> list[dict[str, Any]]:
+    """
+    Samples sample_size chunks, allocated between source files by sample_allocation, in one pass over the chunks
+    with a reservoir per source file, so only the sample is held in memory.
+    """
+    allocation = sample_allocation(counts, sample_size)
+    randomizer = random.Random(seed)
+    reservoirs: dict[str, list[dict[str, Any]]] = {sourcefile: [] for sourcefile in allocation}
+    seen: Counter = Counter()
+    for chunk in chunks:
+        sourcefile = chunk.get("sourcefile") or ""
+        size = allocation.get(sourcefile, 0)
+        if size == 0:
+            continue
+        seen[sourcefile] += 1
+        reservoir = reservoirs[sourcefile]
+        if len(reservoir) < size:
+            reservoir.append(chunk)
+        else:
+            index = randomizer.randrange(seen[sourcefile])
+            if index < size:
+                reservoir[index] = chunk
+    return [chunk for reservoir in reservoirs.values() for chunk in reservoir]
+
+
+def snapshot_chunks(snapshot_path: Path, sample_size: Optional[int] = None, seed: int = 42) -> Iterator[dict[str, Any]]:
+    """
+    Yields the chunks of the snapshot, all of them streamed from disk, or a sample of sample_size chunks
+    stratified by source file.
+    """
+    if sample_size is None:
+        yield from read_snapshot(snapshot_path)
+        return
+    counts = Counter(chunk.get("sourcefile") or "" for chunk in read_snapshot(snapshot_path))
+    yield from stratified_sample(read_snapshot(snapshot_path), counts, sample_size, seed)
@@ -1,7 +1,10 @@
 import argparse
+import json
 import logging
 import os
 import re
+import tempfile
+import time
 from pathlib import Path
 
 from azure.identity import AzureDeveloperCliCredential
@@ -10,6 +13,7 @@ from evaltools.eval.evaluate import run_evaluate_from_config
 from evaltools.eval.evaluate_metrics import register_metric
 from evaltools.eval.evaluate_metrics.base_metric import BaseMetric
 from rich.logging import RichHandler
+from target_responses import CachedTarget, ResponseCache, get_responses, update_results
 
 logger = logging.getLogger("ragapp")
 
@@ -96,6 +100,14 @@ if __name__ == "__main__":
     parser.add_argument("--targeturl", type=str, help="Specify the target URL.")
     parser.add_argument("--resultsdir", type=Path, help="Specify the results directory.")
     parser.add_argument("--numquestions", type=int, help="Specify the number of questions.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions sent to the target at the same time.")
+    parser.add_argument(
+        "--responsecache",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "eval-responses.db",
+        help="Cache of the target's responses, reused while the question and target parameters are unchanged.",
+    )
+    parser.add_argument("--requery", action="store_true", help="Query the target again instead of using the cache.")
 
     args = parser.parse_args()
 
@@ -104,13 +116,30 @@ if __name__ == "__main__":
     register_metric(CitationsMatchedMetric)
     register_metric(AnyCitationMetric)
 
-    run_evaluate_from_config(
-        working_dir=Path(__file__).parent,
-        config_path="evaluate_config.json",
-        num_questions=args.numquestions,
-        target_url=args.targeturl,
-        results_dir=args.resultsdir,
-        openai_config=openai_config,
-        model=os.environ["AZURE_OPENAI_EVAL_MODEL"],
-        azure_credential=get_azure_credential(),
+    working_dir = Path(__file__).parent
+    config = json.loads((working_dir / "evaluate_config.json").read_text())
+    target_url = args.targeturl or config["target_url"]
+    results_dir = args.resultsdir or working_dir / config["results_dir"].replace(
+        "<TIMESTAMP>", time.strftime("%Y%m%d%H%M%S")
+    )
+    with open(working_dir / config["testdata_path"]) as testdata_file:
+        questions = [json.loads(line)["question"] for line in testdata_file if line.strip()]
+    questions = questions[: args.numquestions]
+
+    # Get the target's responses up front, several at a time, and have the evaluator replay them
+    response_cache = ResponseCache(str(args.responsecache))
+    responses = get_responses(
+        questions, target_url, config["target_parameters"], response_cache, args.concurrency, args.requery
     )
+    with CachedTarget(response_cache, target_url) as cached_target_url:
+        run_evaluate_from_config(
+            working_dir=working_dir,
+            config_path="evaluate_config.json",
+            num_questions=args.numquestions,
+            target_url=cached_target_url,
+            results_dir=results_dir,
+            openai_config=openai_config,
+            model=os.environ["AZURE_OPENAI_EVAL_MODEL"],
+            azure_credential=get_azure_credential(),
+        )
+    update_results(Path(results_dir), responses, target_url)
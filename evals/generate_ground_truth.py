@@ -7,6 +7,7 @@ import re
 
 from azure.identity import AzureDeveloperCliCredential, get_bearer_token_provider
 from azure.search.documents import SearchClient
+from corpus_export import export_snapshot, snapshot_chunks
 from dotenv_azd import load_azd_env
 from langchain_core.documents import Document as LCDocument
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
@@ -21,6 +22,9 @@ logger = logging.getLogger("ragapp")
 
 root_dir = pathlib.Path(__file__).parent
 
+# Documents whose lengths choose the knowledge graph transforms
+TRANSFORM_SAMPLE_SIZE = 1000
+
 
 def get_azure_credential():
     AZURE_TENANT_ID = os.getenv("AZURE_TENANT_ID")
@@ -33,26 +37,35 @@ def get_azure_credential():
     return azure_credential
 
 
-def get_search_documents(azure_credential, num_search_documents=None) -> str:
-    search_client = SearchClient(
-        endpoint=f"https://{os.getenv('AZURE_SEARCH_SERVICE')}.search.windows.net",
-        index_name=os.getenv("AZURE_SEARCH_INDEX"),
-        credential=azure_credential,
+def get_search_documents(azure_credential, num_search_documents=None, snapshot_file=None, refresh_snapshot=False):
+    """
+    Yields the document chunks of the search index from a snapshot on disk, exporting the index to it first
+    if it doesn't exist yet or refresh_snapshot is set. With num_search_documents, yields a sample of that many
+    chunks, stratified by source file.
+    """
+    # By default each search index has its own snapshot, so switching indexes doesn't reuse another index's chunks
+    snapshot_path = root_dir / (
+        snapshot_file
+        or f"corpus_snapshot-{os.getenv('AZURE_SEARCH_SERVICE')}-{os.getenv('AZURE_SEARCH_INDEX')}.jsonl.gz"
     )
-    all_documents = []
-    if num_search_documents is None:
-        logger.info("Fetching all document chunks from Azure AI Search")
-        num_search_documents = 100000
+    if refresh_snapshot or not snapshot_path.exists():
+        search_client = SearchClient(
+            endpoint=f"https://{os.getenv('AZURE_SEARCH_SERVICE')}.search.windows.net",
+            index_name=os.getenv("AZURE_SEARCH_INDEX"),
+            credential=azure_credential,
+        )
+        logger.info("Exporting all document chunks from Azure AI Search to %s", snapshot_path)
+        export_snapshot(search_client, snapshot_path)
     else:
-        logger.info("Fetching %d document chunks from Azure AI Search", num_search_documents)
-    response = search_client.search(search_text="*", top=num_search_documents).by_page()
-    for page in response:
-        page = list(page)
-        all_documents.extend(page)
-    return all_documents
+        logger.info("Using the existing snapshot of document chunks %s", snapshot_path)
+    if num_search_documents is not None:
+        logger.info("Sampling %d document chunks, stratified by source file", num_search_documents)
+    return snapshot_chunks(snapshot_path, num_search_documents)
 
 
-def generate_ground_truth_ragas(num_questions=200, num_search_documents=None, kg_file=None):
+def generate_ground_truth_ragas(
+    num_questions=200, num_search_documents=None, kg_file=None, snapshot_file=None, refresh_snapshot=False
+):
     azure_credential = get_azure_credential()
     azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-06-01"
     azure_endpoint = f"https://{os.getenv('AZURE_OPENAI_SERVICE')}.openai.azure.com"
@@ -89,28 +102,29 @@ def generate_ground_truth_ragas(num_questions=200, num_search_documents=None, kg
         logger.info("Loading existing knowledge graph from %s", full_path_to_kg)
         kg = KnowledgeGraph.load(full_path_to_kg)
     else:
-        # Make a knowledge_graph from Azure AI Search documents
-        search_docs = get_search_documents(azure_credential, num_search_documents)
-
-        logger.info("Creating a RAGAS knowledge graph based off of %d search documents", len(search_docs))
-        nodes = []
-        for doc in search_docs:
+        # Make a knowledge_graph from Azure AI Search documents, adding them as they're read from the snapshot
+        kg = KnowledgeGraph()
+        # The transforms are chosen by the distribution of the documents' lengths, which a sample shows
+        transform_documents = []
+        for doc in get_search_documents(azure_credential, num_search_documents, snapshot_file, refresh_snapshot):
             content = doc["content"]
             citation = doc["sourcepage"]
-            node = Node(
-                type=NodeType.DOCUMENT,
-                properties={
-                    "page_content": f"[[{citation}]]: {content}",
-                    "document_metadata": {"citation": citation},
-                },
+            kg.add(
+                Node(
+                    type=NodeType.DOCUMENT,
+                    properties={
+                        "page_content": f"[[{citation}]]: {content}",
+                        "document_metadata": {"citation": citation},
+                    },
+                )
             )
-            nodes.append(node)
-
-        kg = KnowledgeGraph(nodes=nodes)
+            if len(transform_documents) < TRANSFORM_SAMPLE_SIZE:
+                transform_documents.append(LCDocument(page_content=content))
+        logger.info("Created a RAGAS knowledge graph based off of %d search documents", len(kg.nodes))
 
         logger.info("Using RAGAS to apply transforms to knowledge graph")
         transforms = default_transforms(
-            documents=[LCDocument(page_content=doc["content"]) for doc in search_docs],
+            documents=transform_documents,
             llm=generator_llm,
             embedding_model=generator_embeddings,
         )
@@ -150,12 +164,26 @@ if __name__ == "__main__":
     load_azd_env()
 
     parser = argparse.ArgumentParser(description="Generate ground truth data using AI Search index and RAGAS.")
-    parser.add_argument("--numsearchdocs", type=int, help="Specify the number of search results to fetch")
+    parser.add_argument(
+        "--numsearchdocs", type=int, help="Specify the number of search results to sample, stratified by source file"
+    )
     parser.add_argument("--numquestions", type=int, help="Specify the number of questions to generate.", default=200)
     parser.add_argument("--kgfile", type=str, help="Specify the path to an existing knowledge graph file")
+    parser.add_argument(
+        "--snapshotfile",
+        type=str,
+        help="Specify the path of the snapshot of the search index's chunks, by default corpus_snapshot-<service>-<index>.jsonl.gz",
+    )
+    parser.add_argument(
+        "--refreshsnapshot", action="store_true", help="Export the search index again, replacing an existing snapshot"
+    )
 
     args = parser.parse_args()
 
     generate_ground_truth_ragas(
-        num_search_documents=args.numsearchdocs, num_questions=args.numquestions, kg_file=args.kgfile
+        num_search_documents=args.numsearchdocs,
+        num_questions=args.numquestions,
+        kg_file=args.kgfile,
+        snapshot_file=args.snapshotfile,
+        refresh_snapshot=args.refreshsnapshot,
     )
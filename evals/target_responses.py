@@ -0,0 +1,240 @@
+"""
+Gets the target app's responses to the ground truth questions, several at a time, and caches them by question, target
+URL and target parameters, so an evaluation that only changes the metrics doesn't query the app again.
+
+The evaluator sends its questions to a local server that replays the cached responses, and the latencies of the
+original responses, with the breakdown of each thought step that reports its latency, are written to the results.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+
+import requests
+
+logger = logging.getLogger("ragapp")
+
+
+def response_cache_key(target_url: str, target_parameters: dict[str, Any], question: str) -> str:
+    return hashlib.sha256(json.dumps([target_url, target_parameters, question], sort_keys=True).encode()).hexdigest()
+
+
+@dataclass
+class TargetResponse:
+    question: str
+    # The app's JSON response, None if the request failed
+    response: Optional[dict[str, Any]]
+    # Seconds the app took to respond
+    latency: float
+    cached: bool = False
+    latency_breakdown: dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.response is not None and not self.latency_breakdown:
+            self.latency_breakdown = latency_breakdown(self.response, self.latency)
+
+
+class ResponseCache:
+    """
+    The target's responses by response_cache_key, with their latency, in a SQLite database.
+    The evaluation scripts run without the app's code on their path, so this doesn't use prepdocslib's SQLiteStore,
+    but opens the database the same way.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        connection = self.connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, latency REAL NOT NULL)"
+            )
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def get(self, key: str) -> Optional[tuple[dict[str, Any], float]]:
+        connection = self.connect()
+        try:
+            row = connection.execute("SELECT response, latency FROM responses WHERE key = ?", (key,)).fetchone()
+        finally:
+            connection.close()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key: str, response: dict[str, Any], latency: float):
+        connection = self.connect()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, latency) VALUES (?, ?, ?)",
+                (key, json.dumps(response), latency),
+            )
+        finally:
+            connection.close()
+
+
+def send_question(target_url: str, target_parameters: dict[str, Any], question: str) -> tuple[requests.Response, float]:
+    """Sends a question to the target the way the evaluator does, returning the response and its latency."""
+    body = {"messages": [{"content": question, "role": "user"}], "context": target_parameters}
+    started = time.perf_counter()
+    response = requests.post(target_url, json=body, headers={"Content-Type": "application/json"})
+    return response, time.perf_counter() - started
+
+
+def get_responses(
+    questions: list[str],
+    target_url: str,
+    target_parameters: dict[str, Any],
+    cache: Optional[ResponseCache],
+    concurrency: int = 4,
+    requery: bool = False,
+) -> list[TargetResponse]:
+    """
+    Gets the target's response to each question, from the cache unless requery is set,
+    sending up to concurrency questions to the target at the same time.
+    Responses to failed requests are returned without a response, and aren't cached.
+    """
+
+    def get_response(question: str) -> TargetResponse:
+        key = response_cache_key(target_url, target_parameters, question)
+        cached = cache.get(key) if cache and not requery else None
+        if cached:
+            return TargetResponse(question, cached[0], cached[1], cached=True)
+        try:
+            response, latency = send_question(target_url, target_parameters, question)
+            response.raise_for_status()
+            response_json = response.json()
+        except (requests.RequestException, ValueError) as error:
+            logger.warning("Failed to get a response to %r: %s", question, error)
+            return TargetResponse(question, None, -1)
+        if cache:
+            cache.set(key, response_json, latency)
+        return TargetResponse(question, response_json, latency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(get_response, questions))
+    logger.info(
+        "Got %d responses in %.1f seconds, %d from the cache, %d failed",
+        len(responses),
+        time.perf_counter() - started,
+        sum(response.cached for response in responses),
+        sum(response.response is None for response in responses),
+    )
+    return responses
+
+
+def latency_breakdown(response: dict[str, Any], latency: float) -> dict[str, float]:
+    """
+    The milliseconds of each thought step of the response that reports its latency_ms, by the step's title,
+    and the rest of the response's latency as "other".
+    """
+    breakdown: dict[str, float] = {}
+    for thought in (response.get("context") or {}).get("thoughts") or []:
+        latency_ms = (thought.get("props") or {}).get("latency_ms")
+        if isinstance(latency_ms, (int, float)):
+            breakdown[thought["title"]] = breakdown.get(thought["title"], 0) + latency_ms
+    breakdown["other"] = round(max(latency * 1000 - sum(breakdown.values()), 0), 1)
+    return breakdown
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """The percentile of the values, interpolated between the closest ranks."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def latency_summary(responses: list[TargetResponse]) -> dict[str, float]:
+    latencies = [response.latency for response in responses if response.response is not None]
+    if not latencies:
+        return {}
+    return {
+        "mean": round(statistics.mean(latencies), 2),
+        "max": round(max(latencies), 2),
+        "min": round(min(latencies), 2),
+        "p50": round(percentile(latencies, 50), 2),
+        "p95": round(percentile(latencies, 95), 2),
+        "p99": round(percentile(latencies, 99), 2),
+    }
+
+
+class CachedTarget:
+    """
+    A local target that replays the cached responses, and forwards questions that aren't cached to the real target.
+    Used as a context manager, it serves on a free port of localhost and returns its URL.
+    """
+
+    def __init__(self, cache: ResponseCache, target_url: str):
+        self.cache = cache
+        self.target_url = target_url
+        cached_target = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status, content = cached_target.respond(body["messages"][-1]["content"], body.get("context", {}))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    def respond(self, question: str, target_parameters: dict[str, Any]) -> tuple[int, bytes]:
+        cached = self.cache.get(response_cache_key(self.target_url, target_parameters, question))
+        if cached:
+            return 200, json.dumps(cached[0]).encode()
+        response, _ = send_question(self.target_url, target_parameters, question)
+        return response.status_code, response.content
+
+    def __enter__(self) -> str:
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}/chat"
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def update_results(results_dir: Path, responses: list[TargetResponse], target_url: str):
+    """
+    Replaces the latencies the evaluator measured against the cached target with the original responses' latencies,
+    adds their breakdown to each result and their percentiles to the summary, and records the real target URL.
+    """
+    responses_by_question = {response.question: response for response in responses}
+    results_path = results_dir / "eval_results.jsonl"
+    results = [json.loads(line) for line in results_path.read_text().splitlines() if line.strip()]
+    for result in results:
+        response = responses_by_question.get(result.get("question"))
+        if response and response.response is not None:
+            result["latency"] = round(response.latency, 6)
+            result["latency_breakdown"] = response.latency_breakdown
+    results_path.write_text("".join(json.dumps(result) + "\n" for result in results))
+
+    summary_path = results_dir / "summary.json"
+    summary = json.loads(summary_path.read_text())
+    summary["latency"] = latency_summary(responses)
+    summary_path.write_text(json.dumps(summary, indent=4))
+
+    parameters_path = results_dir / "evaluate_parameters.json"
+    if parameters_path.exists():
+        parameters = json.loads(parameters_path.read_text())
+        parameters["target_url"] = target_url
+        parameters_path.write_text(json.dumps(parameters, indent=4))
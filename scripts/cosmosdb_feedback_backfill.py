@@ -0,0 +1,275 @@
+"""
+A script to build the feedback analytics from the feedback saved in chat history before the app kept them.
+
+The app counts feedback in aggregate items under the "feedback_analytics" entra_oid of the chat history container:
+For the totals and daily counters:
+id: str ("totals", or "daily-<date>")
+entra_oid: str (always "feedback_analytics")
+session_id: str ("totals" or "daily")
+type: str (always "feedback_counts")
+date: str (daily counters only)
+counts: dict of the number of "positive", "negative", "other" and "total" feedback
+
+For the recent feedback:
+id: str (always "recent")
+entra_oid: str (always "feedback_analytics")
+session_id: str (always "recent")
+type: str (always "recent_feedback")
+feedback: list of the latest feedback, newest first
+
+Each session item lists the feedback type of each of its message pairs that the aggregates count, in feedback_types.
+The script counts the feedback of message pairs that aren't listed there, and lists them, so running it again, or
+alongside the app, doesn't count any feedback twice.
+"""
+
+import argparse
+import asyncio
+import os
+from collections import Counter, defaultdict
+from datetime import date, datetime, timezone
+from typing import Any, Optional
+
+from azure.core import MatchConditions
+from azure.cosmos.aio import ContainerProxy, CosmosClient
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from azure.identity.aio import AzureDeveloperCliCredential
+
+from load_azd_env import load_azd_env
+
+# These match app/backend/chat_history/feedbackanalytics.py, which keeps the aggregates up to date. The script runs
+# without the app's code, so it updates the aggregates itself, and test_feedback_backfill_matches_app checks that both
+# write the same items.
+FEEDBACK_ANALYTICS_OID = "feedback_analytics"
+FEEDBACK_TYPES = ("positive", "negative")
+RECENT_FEEDBACK_LIMIT = 100
+# Attempts at updating an item that the app changes at the same time
+UPDATE_ATTEMPTS = 5
+
+
+def feedback_counter(feedback_type: Optional[str]) -> str:
+    return feedback_type if feedback_type in FEEDBACK_TYPES else "other"
+
+
+def analytics_partition_key(name: str) -> list[str]:
+    return [FEEDBACK_ANALYTICS_OID, name]
+
+
+def feedback_day(feedback: dict[str, Any]) -> str:
+    """The day the feedback was given, today if its timestamp can't be read."""
+    try:
+        return date.fromisoformat(str(feedback.get("timestamp"))[:10]).isoformat()
+    except ValueError:
+        return datetime.now(timezone.utc).date().isoformat()
+
+
+class FeedbackBackfill:
+    """
+    Counts the feedback of message pairs that the feedback analytics don't count yet.
+    """
+
+    def __init__(self, container: ContainerProxy, concurrency: int = 16):
+        """
+        Initialize the backfill with the chat history container.
+
+        Args:
+            container: The chat history container, with the session and message_pair items
+            concurrency: Sessions updated at the same time
+        """
+        self.container = container
+        self.concurrency = concurrency
+
+    async def read_feedback(self) -> dict[tuple[str, str], list[dict[str, Any]]]:
+        """Reads the message pairs that have feedback, grouped by the partition key of their session."""
+        res = self.container.query_items(
+            query="SELECT c.id, c.entra_oid, c.session_id, c.question, c.feedback FROM c WHERE c.type = @type AND IS_DEFINED(c.feedback) AND NOT IS_NULL(c.feedback)",
+            parameters=[dict(name="@type", value="message_pair")],
+        )
+        sessions: dict[tuple[str, str], list[dict[str, Any]]] = defaultdict(list)
+        async for item in res:
+            sessions[(item["entra_oid"], item["session_id"])].append(item)
+        return sessions
+
+    async def mark_counted(self, entra_oid: str, session_id: str, message_pairs: list[dict[str, Any]]):
+        """
+        Lists the message pairs' feedback in their session's feedback_types, and returns the ones that weren't listed.
+        The session is patched only if the app hasn't changed it since it was read, otherwise it's read again.
+        """
+        partition_key = [entra_oid, session_id]
+        for _ in range(UPDATE_ATTEMPTS):
+            try:
+                session_item = await self.container.read_item(item=session_id, partition_key=partition_key)
+            except CosmosResourceNotFoundError:
+                return []
+            feedback_types = session_item.get("feedback_types") or {}
+            uncounted = [item for item in message_pairs if item["id"] not in feedback_types]
+            if not uncounted:
+                return []
+            feedback_types = {
+                **feedback_types,
+                **{item["id"]: feedback_counter(item["feedback"].get("type")) for item in uncounted},
+            }
+            try:
+                await self.container.patch_item(
+                    item=session_id,
+                    partition_key=partition_key,
+                    patch_operations=[{"op": "set", "path": "/feedback_types", "value": feedback_types}],
+                    etag=session_item["_etag"],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+                return uncounted
+            except CosmosAccessConditionFailedError:
+                continue
+        raise RuntimeError(f"Session {session_id} kept changing while its feedback was being counted")
+
+    async def increment_counts(self, item_id: str, partition: str, deltas: Counter, fields: dict[str, Any]):
+        """Adds to the counts of an aggregate item with a patch, creating it if needed."""
+        operations = [{"op": "incr", "path": f"/counts/{name}", "value": delta} for name, delta in deltas.items()]
+        while True:
+            try:
+                await self.container.patch_item(
+                    item=item_id, partition_key=analytics_partition_key(partition), patch_operations=operations
+                )
+                return
+            except CosmosResourceNotFoundError:
+                pass
+            try:
+                await self.container.create_item(
+                    body={
+                        "id": item_id,
+                        "entra_oid": FEEDBACK_ANALYTICS_OID,
+                        "session_id": partition,
+                        "type": "feedback_counts",
+                        **fields,
+                        "counts": dict(deltas),
+                    }
+                )
+                return
+            except CosmosResourceExistsError:
+                continue
+
+    async def count(self, message_pairs: list[dict[str, Any]]):
+        """Adds the message pairs' feedback to the totals, and to the counters of the days it was given."""
+        totals: Counter = Counter()
+        days: dict[str, Counter] = defaultdict(Counter)
+        for item in message_pairs:
+            counter = feedback_counter(item["feedback"].get("type"))
+            totals.update([counter, "total"])
+            days[feedback_day(item["feedback"])].update([counter, "total"])
+        await asyncio.gather(
+            self.increment_counts("totals", "totals", totals, {}),
+            *(
+                self.increment_counts(f"daily-{day}", "daily", counts, {"date": day})
+                for day, counts in sorted(days.items())
+            ),
+        )
+
+    async def update_recent(self, message_pairs: list[dict[str, Any]]):
+        """Merges the latest feedback into the recent feedback, replacing it if the app hasn't changed it since."""
+        added = {
+            item["id"]: {
+                "type": item["feedback"].get("type"),
+                "comment": item["feedback"].get("comment"),
+                "timestamp": item["feedback"].get("timestamp"),
+                "session_id": item["session_id"],
+                "message_id": item["id"],
+                "question": item.get("question", ""),
+            }
+            for item in message_pairs
+        }
+        partition_key = analytics_partition_key("recent")
+        for _ in range(UPDATE_ATTEMPTS):
+            item: Optional[dict[str, Any]]
+            try:
+                item = await self.container.read_item(item="recent", partition_key=partition_key)
+            except CosmosResourceNotFoundError:
+                item = None
+            stored = item.get("feedback", []) if item else []
+            # The feedback the app recorded is newer than the message pairs read at the start, so it's kept
+            recent = {**added, **{entry.get("message_id"): entry for entry in stored}}
+            body = {
+                "id": "recent",
+                "entra_oid": FEEDBACK_ANALYTICS_OID,
+                "session_id": "recent",
+                "type": "recent_feedback",
+                "feedback": sorted(recent.values(), key=lambda entry: entry.get("timestamp") or "", reverse=True)[
+                    :RECENT_FEEDBACK_LIMIT
+                ],
+            }
+            try:
+                if item is None:
+                    await self.container.create_item(body=body)
+                else:
+                    await self.container.replace_item(
+                        item="recent", body=body, etag=item["_etag"], match_condition=MatchConditions.IfNotModified
+                    )
+                return
+            except (CosmosResourceExistsError, CosmosAccessConditionFailedError):
+                continue
+        raise RuntimeError("The recent feedback kept changing while it was being updated")
+
+    async def backfill(self) -> int:
+        """
+        Counts the feedback that the aggregates don't count yet, and returns how many message pairs it counted.
+
+        Each session's message pairs are listed as counted before their feedback is added to the counters, so a
+        failure in between leaves that feedback uncounted rather than counted twice.
+        """
+        sessions = await self.read_feedback()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        counted = 0
+
+        async def backfill_session(entra_oid: str, session_id: str, message_pairs: list[dict[str, Any]]):
+            nonlocal counted
+            async with semaphore:
+                uncounted = await self.mark_counted(entra_oid, session_id, message_pairs)
+                if uncounted:
+                    await self.count(uncounted)
+                    counted += len(uncounted)
+
+        await asyncio.gather(
+            *(
+                backfill_session(entra_oid, session_id, message_pairs)
+                for (entra_oid, session_id), message_pairs in sessions.items()
+            )
+        )
+        # The recent feedback keeps each message pair once, so all of it can be merged in, counted or not
+        latest = sorted(
+            (item for message_pairs in sessions.values() for item in message_pairs),
+            key=lambda item: item["feedback"].get("timestamp") or "",
+            reverse=True,
+        )
+        await self.update_recent(latest[:RECENT_FEEDBACK_LIMIT])
+        return counted
+
+
+async def backfill_feedback_analytics(concurrency: int = 16):
+    USE_CHAT_HISTORY_COSMOS = os.getenv("USE_CHAT_HISTORY_COSMOS", "").lower() == "true"
+    if not USE_CHAT_HISTORY_COSMOS:
+        raise ValueError("USE_CHAT_HISTORY_COSMOS must be set to true")
+    AZURE_COSMOSDB_ACCOUNT = os.environ["AZURE_COSMOSDB_ACCOUNT"]
+    AZURE_CHAT_HISTORY_DATABASE = os.environ["AZURE_CHAT_HISTORY_DATABASE"]
+    AZURE_CHAT_HISTORY_CONTAINER = os.environ["AZURE_CHAT_HISTORY_CONTAINER"]
+
+    async with CosmosClient(
+        url=f"https://{AZURE_COSMOSDB_ACCOUNT}.documents.azure.com:443/", credential=AzureDeveloperCliCredential()
+    ) as client:
+        container = client.get_database_client(AZURE_CHAT_HISTORY_DATABASE).get_container_client(
+            AZURE_CHAT_HISTORY_CONTAINER
+        )
+        counted = await FeedbackBackfill(container, concurrency).backfill()
+    print(f"Feedback counted: {counted}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Count the feedback saved in chat history before the app kept feedback analytics"
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Sessions updated at the same time")
+    args = parser.parse_args()
+    load_azd_env()
+
+    asyncio.run(backfill_feedback_analytics(args.concurrency))
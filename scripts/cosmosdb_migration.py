@@ -27,20 +27,154 @@ question: str
 response: dict
 """
 
+import argparse
+import asyncio
+import json
 import os
+import tempfile
+import time
+from collections.abc import Mapping
+from typing import Any, Optional
 
-from azure.cosmos.aio import CosmosClient
+from azure.core.async_paging import AsyncItemPaged
+from azure.cosmos.aio import ContainerProxy, CosmosClient, DatabaseProxy
 from azure.identity.aio import AzureDeveloperCliCredential
 
 from load_azd_env import load_azd_env
 
+# The most operations Cosmos DB accepts in one transactional batch
+MAX_BATCH_OPERATIONS = 100
+# Below the 2 MB limit of a transactional batch's request, leaving room for the batch's own overhead
+MAX_BATCH_BYTES = 1800 * 1024
+# Old items read in each page of a feed range
+PAGE_SIZE = 100
+
+
+class RequestUnitBudget:
+    """
+    Limits the request units the migration uses per second, so it doesn't throttle the app sharing the account.
+    Passed to each Cosmos DB call as its response_hook, to charge the call's request units once it's done.
+    Without a limit, it only adds up the request units used.
+    """
+
+    def __init__(self, request_units_per_second: Optional[float] = None):
+        self.request_units_per_second = request_units_per_second
+        self.total = 0.0
+        self.available = request_units_per_second or 0.0
+        self.updated = time.monotonic()
+
+    def __call__(self, headers: Mapping[str, Any], result: Any):
+        # query_items_change_feed also calls the hook when the query is created, with the headers of an earlier response
+        if isinstance(result, AsyncItemPaged):
+            return
+        charge = float(headers.get("x-ms-request-charge", 0))
+        self.total += charge
+        if self.request_units_per_second:
+            self.refill()
+            self.available -= charge
+
+    def refill(self):
+        assert self.request_units_per_second
+        now = time.monotonic()
+        self.available = min(
+            self.request_units_per_second, self.available + (now - self.updated) * self.request_units_per_second
+        )
+        self.updated = now
+
+    async def acquire(self):
+        """Waits until the request units spent so far are paid back, before the next call."""
+        while self.request_units_per_second:
+            self.refill()
+            if self.available > 0:
+                return
+            await asyncio.sleep(-self.available / self.request_units_per_second)
+
+
+class MigrationCheckpoint:
+    """
+    The change feed continuation of each feed range of the old container, saved after each page is migrated.
+    Migrating again resumes from these, only reading items that weren't migrated or changed since.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.continuations: dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.continuations = json.load(checkpoint_file)["continuations"]
+
+    def save(self, feed_range: str, continuation: str):
+        self.continuations[feed_range] = continuation
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump({"continuations": self.continuations}, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+
+def migration_batches(old_item: dict[str, Any]) -> list[list[tuple[str, tuple[dict[str, Any]]]]]:
+    """
+    Builds the new items for an old item, in transactional batches of at most MAX_BATCH_OPERATIONS and MAX_BATCH_BYTES.
+    All of an old item's new items share its partition key, [entra_oid, session_id].
+    """
+    # Build session item
+    new_items = [
+        {
+            "id": old_item["id"],
+            "version": "cosmosdb-v2",
+            "session_id": old_item["id"],
+            "entra_oid": old_item["entra_oid"],
+            "title": old_item.get("title"),
+            "timestamp": old_item.get("timestamp"),
+            "type": "session",
+        }
+    ]
+    # Build message_pair
+    answers = old_item.get("answers", [])
+    for idx, answer in enumerate(answers):
+        question = answer[0]
+        response = answer[1]
+        new_items.append(
+            {
+                "id": f"{old_item['id']}-{idx}",
+                "version": "cosmosdb-v2",
+                "session_id": old_item["id"],
+                "entra_oid": old_item["entra_oid"],
+                "type": "message_pair",
+                "question": question,
+                "response": response,
+                "order": idx,
+                "timestamp": None,
+            }
+        )
+
+    batches: list[list[tuple[str, tuple[dict[str, Any]]]]] = []
+    batch: list[tuple[str, tuple[dict[str, Any]]]] = []
+    batch_bytes = 0
+    for new_item in new_items:
+        item_bytes = len(json.dumps(new_item))
+        if batch and (len(batch) == MAX_BATCH_OPERATIONS or batch_bytes + item_bytes > MAX_BATCH_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(("upsert", (new_item,)))
+        batch_bytes += item_bytes
+    batches.append(batch)
+    return batches
+
 
 class CosmosDBMigrator:
     """
     Migrator class for CosmosDB data migration.
     """
 
-    def __init__(self, cosmos_account, database_name, credential=None):
+    def __init__(
+        self,
+        cosmos_account,
+        database_name,
+        credential=None,
+        concurrency: int = 16,
+        request_units_per_second: Optional[float] = None,
+        checkpoint_path: Optional[str] = None,
+    ):
         """
         Initialize the migrator with CosmosDB account and database.
 
@@ -48,14 +182,20 @@ class CosmosDBMigrator:
             cosmos_account: CosmosDB account name
             database_name: Database name
             credential: Azure credential, defaults to AzureDeveloperCliCredential
+            concurrency: Transactional batches written at the same time
+            request_units_per_second: Most request units the migration uses per second, None for no limit
+            checkpoint_path: File recording the migration's progress, so it resumes if stopped. None disables it.
         """
         self.cosmos_account = cosmos_account
         self.database_name = database_name
         self.credential = credential or AzureDeveloperCliCredential()
-        self.client = None
-        self.database = None
-        self.old_container = None
-        self.new_container = None
+        self.concurrency = concurrency
+        self.request_units_per_second = request_units_per_second
+        self.checkpoint_path = checkpoint_path
+        self.client: Optional[CosmosClient] = None
+        self.database: Optional[DatabaseProxy] = None
+        self.old_container: Optional[ContainerProxy] = None
+        self.new_container: Optional[ContainerProxy] = None
 
     async def connect(self):
         """
@@ -79,54 +219,82 @@ class CosmosDBMigrator:
     async def migrate(self):
         """
         Migrate data from old schema to new schema.
+
+        The feed ranges of the old container are read at the same time, each through its change feed from the
+        beginning, and each old item's new items are written in transactional batches, under a shared limit of
+        concurrent batches and request units. A page's batches are written while the next page is read, and the
+        feed range's continuation is saved once they're all written.
         """
         if not self.client:
             await self.connect()
         if not self.old_container or not self.new_container:
             raise ValueError("Containers do not exist")
+        old_container, new_container = self.old_container, self.new_container
 
-        query_results = self.old_container.query_items(query="SELECT * FROM c")
-
+        checkpoint = MigrationCheckpoint(self.checkpoint_path) if self.checkpoint_path else None
+        budget = RequestUnitBudget(self.request_units_per_second)
+        semaphore = asyncio.Semaphore(self.concurrency)
         item_migration_count = 0
-        async for page in query_results.by_page():
-            async for old_item in page:
-                batch_operations = []
-                # Build session item
-                session_item = {
-                    "id": old_item["id"],
-                    "version": "cosmosdb-v2",
-                    "session_id": old_item["id"],
-                    "entra_oid": old_item["entra_oid"],
-                    "title": old_item.get("title"),
-                    "timestamp": old_item.get("timestamp"),
-                    "type": "session",
-                }
-                batch_operations.append(("upsert", (session_item,)))
-
-                # Build message_pair
-                answers = old_item.get("answers", [])
-                for idx, answer in enumerate(answers):
-                    question = answer[0]
-                    response = answer[1]
-                    message_pair = {
-                        "id": f"{old_item['id']}-{idx}",
-                        "version": "cosmosdb-v2",
-                        "session_id": old_item["id"],
-                        "entra_oid": old_item["entra_oid"],
-                        "type": "message_pair",
-                        "question": question,
-                        "response": response,
-                        "order": idx,
-                        "timestamp": None,
-                    }
-                    batch_operations.append(("upsert", (message_pair,)))
-
-                # Execute the batch using partition key [entra_oid, session_id]
-                await self.new_container.execute_item_batch(
-                    batch_operations=batch_operations, partition_key=[old_item["entra_oid"], old_item["id"]]
+
+        async def write(batch_operations: list, partition_key: list[str]):
+            async with semaphore:
+                await budget.acquire()
+                await new_container.execute_item_batch(
+                    batch_operations=batch_operations, partition_key=partition_key, response_hook=budget
                 )
-                item_migration_count += 1
-        print(f"Total items migrated: {item_migration_count}")
+
+        async def migrate_feed_range(feed_range: dict[str, Any]):
+            feed_range_key = json.dumps(feed_range, sort_keys=True)
+            continuation = checkpoint.continuations.get(feed_range_key) if checkpoint else None
+            if continuation:
+                query_results = old_container.query_items_change_feed(
+                    continuation=continuation, max_item_count=PAGE_SIZE, response_hook=budget
+                )
+            else:
+                query_results = old_container.query_items_change_feed(
+                    feed_range=feed_range, start_time="Beginning", max_item_count=PAGE_SIZE, response_hook=budget
+                )
+            pages = query_results.by_page()
+            writes: list[asyncio.Task] = []
+            progress: Optional[tuple[int, Optional[str]]] = None
+
+            async def written(writes: list[asyncio.Task], progress: Optional[tuple[int, Optional[str]]]):
+                nonlocal item_migration_count
+                await asyncio.gather(*writes)
+                if progress:
+                    item_count, continuation = progress
+                    item_migration_count += item_count
+                    if checkpoint and continuation:
+                        checkpoint.save(feed_range_key, continuation)
+
+            try:
+                await budget.acquire()
+                async for page in pages:
+                    old_items = [old_item async for old_item in page]
+                    # The previous page's batches were written while this page was read
+                    await written(writes, progress)
+                    # Execute the batches using partition key [entra_oid, session_id]
+                    writes = [
+                        asyncio.create_task(write(batch_operations, [old_item["entra_oid"], old_item["id"]]))
+                        for old_item in old_items
+                        for batch_operations in migration_batches(old_item)
+                    ]
+                    progress = (len(old_items), pages.continuation_token)  # type: ignore
+                    await budget.acquire()
+                await written(writes, progress)
+            finally:
+                for task in writes:
+                    task.cancel()
+
+        feed_ranges = [feed_range async for feed_range in old_container.read_feed_ranges()]
+        feed_range_tasks = [asyncio.create_task(migrate_feed_range(feed_range)) for feed_range in feed_ranges]
+        try:
+            await asyncio.gather(*feed_range_tasks)
+        finally:
+            # If a feed range fails, stop the others, they resume from their continuations
+            for task in feed_range_tasks:
+                task.cancel()
+        print(f"Total items migrated: {item_migration_count}, using {budget.total:.0f} RU")
 
     async def close(self):
         """
@@ -136,7 +304,9 @@ class CosmosDBMigrator:
             await self.client.close()
 
 
-async def migrate_cosmosdb_data():
+async def migrate_cosmosdb_data(
+    concurrency: int = 16, request_units_per_second: Optional[float] = None, checkpoint_path: Optional[str] = None
+):
     """
     Legacy function for backward compatibility.
     Migrate data from CosmosDB to a new format.
@@ -147,7 +317,18 @@ async def migrate_cosmosdb_data():
     AZURE_COSMOSDB_ACCOUNT = os.environ["AZURE_COSMOSDB_ACCOUNT"]
     AZURE_CHAT_HISTORY_DATABASE = os.environ["AZURE_CHAT_HISTORY_DATABASE"]
 
-    migrator = CosmosDBMigrator(AZURE_COSMOSDB_ACCOUNT, AZURE_CHAT_HISTORY_DATABASE)
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(
+            tempfile.gettempdir(), f"cosmosdb-migration-{AZURE_COSMOSDB_ACCOUNT}-{AZURE_CHAT_HISTORY_DATABASE}.json"
+        )
+
+    migrator = CosmosDBMigrator(
+        AZURE_COSMOSDB_ACCOUNT,
+        AZURE_CHAT_HISTORY_DATABASE,
+        concurrency=concurrency,
+        request_units_per_second=request_units_per_second,
+        checkpoint_path=checkpoint_path,
+    )
     try:
         await migrator.migrate()
     finally:
@@ -155,8 +336,22 @@ async def migrate_cosmosdb_data():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate chat history from the chat-history container to chat-history-v2"
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Transactional batches written at the same time")
+    parser.add_argument(
+        "--request-units-per-second",
+        type=float,
+        default=None,
+        help="Optional. Most request units the migration uses per second, to leave throughput for the app",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="Optional. File recording the migration's progress so it resumes if stopped. Defaults to a file in the temp directory",
+    )
+    args = parser.parse_args()
     load_azd_env()
 
-    import asyncio
-
-    asyncio.run(migrate_cosmosdb_data())
+    asyncio.run(migrate_cosmosdb_data(args.concurrency, args.request_units_per_second, args.checkpoint))
@@ -1,13 +1,19 @@
 import argparse
 import asyncio
+import hashlib
 import json
 import logging
+import math
 import os
-from typing import Any, Union
+import tempfile
+import time
+from collections.abc import AsyncGenerator
+from typing import Any, Callable, Optional, Union
 from urllib.parse import urljoin
 
 from azure.core.credentials import AzureKeyCredential
 from azure.core.credentials_async import AsyncTokenCredential
+from azure.core.exceptions import HttpResponseError
 from azure.identity.aio import AzureDeveloperCliCredential
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.aio import SearchIndexClient
@@ -20,6 +26,56 @@ from load_azd_env import load_azd_env
 
 logger = logging.getLogger("scripts")
 
+# Documents read in each search request, the most the service returns in one page
+PAGE_SIZE = 1000
+# Limits of each merge request, well below the service's 1000 documents and 16 MB per batch
+MERGE_BATCH_SIZE = 500
+MERGE_BATCH_BYTES = 4 * 1024 * 1024
+
+
+def merge_batches(documents: list[dict[str, Any]]) -> list[list[dict[str, Any]]]:
+    """Splits documents into batches bounded by both the number of documents and their serialized size."""
+    batches: list[list[dict[str, Any]]] = []
+    batch: list[dict[str, Any]] = []
+    batch_bytes = 0
+    for document in documents:
+        document_bytes = len(json.dumps(document))
+        if batch and (len(batch) == MERGE_BATCH_SIZE or batch_bytes + document_bytes > MERGE_BATCH_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(document)
+        batch_bytes += document_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Checkpoint:
+    """
+    Progress of an update, saved after each page of documents so an interrupted run resumes after the last page merged.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.last_key: Optional[str] = None
+        self.found = 0
+        self.changed = 0
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                progress = json.load(checkpoint_file)
+            self.last_key, self.found, self.changed = progress["last_key"], progress["found"], progress["changed"]
+
+    def save(self, last_key: str, found: int, changed: int):
+        self.last_key, self.found, self.changed = last_key, found, changed
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump({"last_key": last_key, "found": found, "changed": changed}, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 
 class ManageAcl:
     """
@@ -35,6 +91,9 @@ class ManageAcl:
         acl_type: str,
         acl: str,
         credentials: Union[AsyncTokenCredential, AzureKeyCredential],
+        concurrency: int = 4,
+        dry_run: bool = False,
+        checkpoint_path: Optional[str] = None,
     ):
         """
         Initializes the command
@@ -55,6 +114,12 @@ class ManageAcl:
             The actual value of the acl, if the acl action is add or remove
         credentials
             Credentials for the azure search service
+        concurrency
+            Number of merge batches sent to the search service at the same time
+        dry_run
+            Report how many search documents would change and how long it would take, without changing them
+        checkpoint_path
+            File recording the progress of the update, so an interrupted run resumes where it stopped. None disables it.
         """
         self.service_name = service_name
         self.index_name = index_name
@@ -63,6 +128,9 @@ class ManageAcl:
         self.acl_action = acl_action
         self.acl_type = acl_type
         self.acl = acl
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+        self.checkpoint = Checkpoint(checkpoint_path) if checkpoint_path and not dry_run else None
 
     async def run(self):
         endpoint = f"https://{self.service_name}.search.windows.net"
@@ -87,65 +155,165 @@ class ManageAcl:
                 raise Exception(f"Unknown action {self.acl_action}")
 
     async def view_acl(self, search_client: SearchClient):
-        for document in await self.get_documents(search_client):
-            # Assumes the acls are consistent across all sections of the document
-            print(json.dumps(document[self.acl_type]))
-            return
+        async for page, _ in self.get_pages(search_client, self.url_filter(), ["id", self.acl_type]):
+            for document in page:
+                # Assumes the acls are consistent across all sections of the document
+                print(json.dumps(document[self.acl_type]))
+                return
 
     async def remove_acl(self, search_client: SearchClient):
-        documents_to_merge = []
-        for document in await self.get_documents(search_client):
-            new_acls = document[self.acl_type]
-            if any(acl_value == self.acl for acl_value in new_acls):
+        def change(document: dict[str, Any]) -> Optional[dict[str, Any]]:
+            if any(acl_value == self.acl for acl_value in document[self.acl_type]):
                 new_acls = [acl_value for acl_value in document[self.acl_type] if acl_value != self.acl]
-                documents_to_merge.append({"id": document["id"], self.acl_type: new_acls})
-            else:
-                logger.info("Search document %s does not have %s acl %s", document["id"], self.acl_type, self.acl)
+                return {"id": document["id"], self.acl_type: new_acls}
+            logger.info("Search document %s does not have %s acl %s", document["id"], self.acl_type, self.acl)
+            return None
 
-        if len(documents_to_merge) > 0:
-            logger.info("Removing acl %s from %d search documents", self.acl, len(documents_to_merge))
-            await search_client.merge_documents(documents=documents_to_merge)
+        found, changed = await self.update_documents(search_client, self.url_filter(), ["id", self.acl_type], change)
+        logger.info("Found %d search documents with storageUrl %s", found, self.url)
+        if changed > 0:
+            logger.info("Removing acl %s from %d search documents", self.acl, changed)
         else:
             logger.info("Not updating any search documents")
 
     async def remove_all_acls(self, search_client: SearchClient):
-        documents_to_merge = []
-        for document in await self.get_documents(search_client):
+        def change(document: dict[str, Any]) -> Optional[dict[str, Any]]:
             if len(document[self.acl_type]) > 0:
-                documents_to_merge.append({"id": document["id"], self.acl_type: []})
-            else:
-                logger.info("Search document %s already has no %s acls", document["id"], self.acl_type)
+                return {"id": document["id"], self.acl_type: []}
+            logger.info("Search document %s already has no %s acls", document["id"], self.acl_type)
+            return None
 
-        if len(documents_to_merge) > 0:
-            logger.info("Removing all %s acls from %d search documents", self.acl_type, len(documents_to_merge))
-            await search_client.merge_documents(documents=documents_to_merge)
+        found, changed = await self.update_documents(search_client, self.url_filter(), ["id", self.acl_type], change)
+        logger.info("Found %d search documents with storageUrl %s", found, self.url)
+        if changed > 0:
+            logger.info("Removing all %s acls from %d search documents", self.acl_type, changed)
         else:
             logger.info("Not updating any search documents")
 
     async def add_acl(self, search_client: SearchClient):
-        documents_to_merge = []
-        for document in await self.get_documents(search_client):
-            new_acls = document[self.acl_type]
-            if not any(acl_value == self.acl for acl_value in new_acls):
-                new_acls.append(self.acl)
-                documents_to_merge.append({"id": document["id"], self.acl_type: new_acls})
-            else:
-                logger.info("Search document %s already has %s acl %s", document["id"], self.acl_type, self.acl)
+        def change(document: dict[str, Any]) -> Optional[dict[str, Any]]:
+            if not any(acl_value == self.acl for acl_value in document[self.acl_type]):
+                return {"id": document["id"], self.acl_type: document[self.acl_type] + [self.acl]}
+            logger.info("Search document %s already has %s acl %s", document["id"], self.acl_type, self.acl)
+            return None
 
-        if len(documents_to_merge) > 0:
-            logger.info("Adding acl %s to %d search documents", self.acl, len(documents_to_merge))
-            await search_client.merge_documents(documents=documents_to_merge)
+        found, changed = await self.update_documents(search_client, self.url_filter(), ["id", self.acl_type], change)
+        logger.info("Found %d search documents with storageUrl %s", found, self.url)
+        if changed > 0:
+            logger.info("Adding acl %s to %d search documents", self.acl, changed)
         else:
             logger.info("Not updating any search documents")
 
-    async def get_documents(self, search_client: SearchClient):
-        filter = f"storageUrl eq '{self.url}'"
-        documents = await search_client.search("", filter=filter, select=["id", self.acl_type])
-        found_documents = []
-        async for document in documents:
-            found_documents.append(document)
-        logger.info("Found %d search documents with storageUrl %s", len(found_documents), self.url)
-        return found_documents
+    def url_filter(self) -> str:
+        return f"storageUrl eq '{self.url}'"
+
+    async def get_pages(
+        self, search_client: SearchClient, filter: str, select: list[str]
+    ) -> AsyncGenerator[tuple[list[dict[str, Any]], Optional[str]], None]:
+        """
+        Yields the documents matching the filter a page at a time, with the key of the page's last document.
+
+        Pages are read in key order, each one filtered to the keys after the previous page, so that the search
+        service's limit on skipped results doesn't apply and a run can resume after any page.
+        Indexes whose id field isn't sortable and filterable are read in a single search instead, as before,
+        and their pages have no key to resume from.
+        """
+        last_key = self.checkpoint.last_key if self.checkpoint else None
+        while True:
+            if last_key is None:
+                page_filter = filter
+            else:
+                escaped_key = last_key.replace("'", "''")
+                page_filter = f"({filter}) and id gt '{escaped_key}'"
+            try:
+                results = await search_client.search(
+                    "", filter=page_filter, select=select, order_by=["id asc"], top=PAGE_SIZE
+                )
+                page = [document async for document in results]
+            except HttpResponseError as error:
+                if last_key is not None or error.status_code != 400:
+                    raise
+                logger.warning("Searching the whole index at once, as its id field can't be used for paging: %s", error)
+                break
+            if len(page) < PAGE_SIZE:
+                # The last page, after which there's nothing to resume
+                yield page, None
+                return
+            last_key = str(page[-1]["id"])
+            yield page, last_key
+
+        # The service pages through these results by skipping the ones already returned, so they're all read before
+        # any are changed, as changed documents may stop matching the filter
+        documents = [document async for document in await search_client.search("", filter=filter, select=select)]
+        for start in range(0, len(documents), PAGE_SIZE):
+            yield documents[start : start + PAGE_SIZE], None
+
+    async def update_documents(
+        self,
+        search_client: SearchClient,
+        filter: str,
+        select: list[str],
+        change: Callable[[dict[str, Any]], Optional[dict[str, Any]]],
+    ) -> tuple[int, int]:
+        """
+        Merges the changes to the documents matching the filter, returning how many documents were found and changed.
+
+        Each page's changes are merged in concurrent batches while the next page is read, and the checkpoint is saved
+        once all of a page's batches are merged. In a dry run nothing is merged, and the report estimates how long
+        the merges would take from how long the searches took.
+        """
+        found = self.checkpoint.found if self.checkpoint else 0
+        changed = self.checkpoint.changed if self.checkpoint else 0
+        if self.checkpoint and self.checkpoint.last_key is not None:
+            logger.info(
+                "Resuming after search document %s, %d search documents already changed",
+                self.checkpoint.last_key,
+                changed,
+            )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        merges: list[asyncio.Task] = []
+        progress: Optional[tuple[str, int, int]] = None
+        started = time.monotonic()
+        requests = batches = 0
+
+        async def merge(batch: list[dict[str, Any]]):
+            async with semaphore:
+                await search_client.merge_documents(documents=batch)
+
+        async def merged(merges: list[asyncio.Task], progress: Optional[tuple[str, int, int]]):
+            await asyncio.gather(*merges)
+            if self.checkpoint and progress:
+                self.checkpoint.save(*progress)
+
+        try:
+            async for page, last_key in self.get_pages(search_client, filter, select):
+                requests += 1
+                documents_to_merge = [document for document in map(change, page) if document is not None]
+                found += len(page)
+                changed += len(documents_to_merge)
+                page_batches = merge_batches(documents_to_merge)
+                batches += len(page_batches)
+                if self.dry_run:
+                    continue
+                # The previous page's merges ran while this page was read
+                await merged(merges, progress)
+                merges = [asyncio.create_task(merge(batch)) for batch in page_batches]
+                progress = (last_key, found, changed) if last_key is not None else None
+            await merged(merges, progress)
+        finally:
+            for task in merges:
+                task.cancel()
+        if self.checkpoint:
+            self.checkpoint.remove()
+        if self.dry_run:
+            search_seconds = time.monotonic() - started
+            # Assumes a merge request takes about as long as a search request
+            merge_seconds = math.ceil(batches / self.concurrency) * search_seconds / max(requests, 1)
+            print(
+                f"Dry run: would change {changed} of {found} search documents in {batches} merge batches, "
+                f"estimated duration {search_seconds + merge_seconds:.1f} seconds"
+            )
+        return found, changed
 
     async def enable_acls(self, endpoint: str):
         async with SearchIndexClient(endpoint=endpoint, credential=self.credentials) as search_index_client:
@@ -179,31 +347,35 @@ class ManageAcl:
             await search_index_client.create_or_update_index(index_definition)
 
     async def update_storage_urls(self, search_client: SearchClient):
-        filter = "storageUrl eq ''"
-        documents = await search_client.search("", filter=filter, select=["id", "storageUrl", "oids", "sourcefile"])
-        found_documents = []
-        documents_to_merge = []
-        async for document in documents:
-            found_documents.append(document)
+        def change(document: dict[str, Any]) -> Optional[dict[str, Any]]:
             if len(document["oids"]) == 1:
                 logger.warning(
                     "Not updating storage URL of document %s as it has only one oid and may be user uploaded",
                     document["id"],
                 )
-            else:
-                storage_url = urljoin(self.url, document["sourcefile"])
-                documents_to_merge.append({"id": document["id"], "storageUrl": storage_url})
-                logger.info("Adding storage URL %s for document %s", storage_url, document["id"])
-
-        if len(documents_to_merge) > 0:
-            logger.info("Updating storage URL for %d search documents", len(documents_to_merge))
-            await search_client.merge_documents(documents=documents_to_merge)
-        elif len(found_documents) == 0:
+                return None
+            storage_url = urljoin(self.url, document["sourcefile"])
+            logger.info("Adding storage URL %s for document %s", storage_url, document["id"])
+            return {"id": document["id"], "storageUrl": storage_url}
+
+        found, changed = await self.update_documents(
+            search_client, "storageUrl eq ''", ["id", "storageUrl", "oids", "sourcefile"], change
+        )
+        if changed > 0:
+            logger.info("Updating storage URL for %d search documents", changed)
+        elif found == 0:
             logger.info("No documents found with empty storageUrl value")
         else:
             logger.info("Not updating any search documents")
 
 
+def default_checkpoint_path(args: Any) -> str:
+    """A checkpoint in the temporary directory, shared by runs of the same command on the same index."""
+    command = [os.environ["AZURE_SEARCH_SERVICE"], os.environ["AZURE_SEARCH_INDEX"], args.acl_action, args.acl_type]
+    command_hash = hashlib.sha256(json.dumps(command + [args.acl, args.url]).encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"manageacl-{command_hash}.json")
+
+
 async def main(args: Any):
     load_azd_env()
 
@@ -225,6 +397,9 @@ async def main(args: Any):
         acl_type=args.acl_type,
         acl=args.acl,
         credentials=search_credential,
+        concurrency=args.concurrency,
+        dry_run=args.dry_run,
+        checkpoint_path=args.checkpoint if args.checkpoint is not None else default_checkpoint_path(args),
     )
     await command.run()
 
@@ -251,6 +426,19 @@ if __name__ == "__main__":
     parser.add_argument(
         "--tenant-id", required=False, help="Optional. Use this to define the Azure directory where to authenticate)"
     )
+    parser.add_argument(
+        "--concurrency", required=False, type=int, default=4, help="Optional. Merge batches sent at the same time"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report how many search documents would change and the estimated duration, without changing them",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        required=False,
+        help="Optional. File recording progress so an interrupted run resumes. Defaults to a file in the temp directory",
+    )
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     args = parser.parse_args()
     if args.verbose:
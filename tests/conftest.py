@@ -206,6 +206,9 @@ def mock_openai_chatcompletion(monkeypatch):
             else:
                 raise StopAsyncIteration
 
+        async def close(self):
+            self.responses = []
+
     async def mock_acreate(*args, **kwargs):
         # The only two possible values for seed:
         assert kwargs.get("seed") is None or kwargs.get("seed") == 42
@@ -613,6 +616,7 @@ async def auth_client(
     mock_list_groups_success,
     mock_acs_search_filter,
     request,
+    tmp_path,
 ):
     monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
     monkeypatch.setenv("AZURE_STORAGE_CONTAINER", "test-storage-container")
@@ -620,6 +624,7 @@ async def auth_client(
     monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
     monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-4.1-mini")
     monkeypatch.setenv("USE_USER_UPLOAD", "true")
+    monkeypatch.setenv("AZURE_INGESTION_QUEUE_PATH", str(tmp_path / "ingestion-queue.db"))
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-userstorage-account")
     monkeypatch.setenv("AZURE_USERSTORAGE_CONTAINER", "test-userstorage-container")
     monkeypatch.setenv("USE_LOCAL_PDF_PARSER", "true")
@@ -652,6 +657,7 @@ async def auth_public_documents_client(
     mock_list_groups_success,
     mock_acs_search_filter,
     request,
+    tmp_path,
 ):
     monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
     monkeypatch.setenv("AZURE_STORAGE_CONTAINER", "test-storage-container")
@@ -659,6 +665,7 @@ async def auth_public_documents_client(
     monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
     monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-4.1-mini")
     monkeypatch.setenv("USE_USER_UPLOAD", "true")
+    monkeypatch.setenv("AZURE_INGESTION_QUEUE_PATH", str(tmp_path / "ingestion-queue.db"))
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-userstorage-account")
     monkeypatch.setenv("AZURE_USERSTORAGE_CONTAINER", "test-userstorage-container")
     monkeypatch.setenv("USE_LOCAL_PDF_PARSER", "true")
@@ -899,6 +906,8 @@ def mock_data_lake_service_client(monkeypatch):
 
     def mock_init_file(self, *args, **kwargs):
         self.path = kwargs.get("file_path")
+        self.path_name = self.path
+        self.file_system_name = kwargs.get("file_system_name")
         self.acl = ""
 
     def mock_url(self, *args, **kwargs):
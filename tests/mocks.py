@@ -1,11 +1,18 @@
+import asyncio
+import copy
 import json
-from collections import namedtuple
+from collections import Counter, namedtuple
 from io import BytesIO
 from typing import Optional
 
 import openai.types
 from azure.cognitiveservices.speech import ResultReason
 from azure.core.credentials_async import AsyncTokenCredential
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
 from azure.search.documents.agent.models import (
     KnowledgeAgentAzureSearchDocReference,
     KnowledgeAgentMessage,
@@ -302,3 +309,75 @@ def mock_speak_text_cancelled(self, text):
 
 def mock_speak_text_failed(self, text):
     return MockSynthesisResult(MockAudioFailure("mock_audio_data"))
+
+
+class MockCosmosContainer:
+    """
+    An in-memory stand-in for a Cosmos DB container, with the point reads, writes and patches of the feedback analytics.
+    Each call yields to the event loop, so that concurrent calls interleave as they would over the network.
+    """
+
+    def __init__(self):
+        self.items: dict[tuple, dict] = {}
+        self.etags = 0
+        self.calls: Counter = Counter()
+
+    async def call(self, name: str):
+        self.calls[name] += 1
+        await asyncio.sleep(0)
+
+    def store(self, body: dict) -> dict:
+        self.etags += 1
+        item = {**body, "_etag": f"etag-{self.etags}"}
+        self.items[(item["entra_oid"], item["session_id"], item["id"])] = item
+        return item
+
+    def stored(self, item: str, partition_key: list) -> dict:
+        if (*partition_key, item) not in self.items:
+            raise CosmosResourceNotFoundError()
+        return self.items[(*partition_key, item)]
+
+    async def read_item(self, item: str, partition_key: list, **kwargs):
+        await self.call("read_item")
+        return dict(self.stored(item, partition_key))
+
+    async def create_item(self, body: dict, **kwargs):
+        await self.call("create_item")
+        if (body["entra_oid"], body["session_id"], body["id"]) in self.items:
+            raise CosmosResourceExistsError()
+        return self.store(body)
+
+    async def replace_item(self, item: str, body: dict, etag=None, match_condition=None, **kwargs):
+        await self.call("replace_item")
+        if etag and self.stored(item, [body["entra_oid"], body["session_id"]])["_etag"] != etag:
+            raise CosmosAccessConditionFailedError()
+        return self.store(body)
+
+    async def patch_item(self, item: str, partition_key: list, patch_operations: list, etag=None, **kwargs):
+        await self.call("patch_item")
+        if etag and self.stored(item, partition_key)["_etag"] != etag:
+            raise CosmosAccessConditionFailedError()
+        patched = copy.deepcopy(self.stored(item, partition_key))
+        for operation in patch_operations:
+            *parents, name = operation["path"].strip("/").split("/")
+            target = patched
+            for parent in parents:
+                target = target[parent]
+            if operation["op"] == "incr":
+                target[name] = target.get(name, 0) + operation["value"]
+            elif operation["op"] == "set":
+                target[name] = operation["value"]
+            elif operation["op"] == "remove":
+                del target[name]
+        return self.store(patched)
+
+    def query_items(self, query: str, parameters: list, partition_key: list, **kwargs):
+        # Only the daily counters query: the partition's items from a date on, the latest first
+        self.calls["query_items"] += 1
+        since = parameters[0]["value"]
+        items = [
+            {"date": item["date"], "counts": item["counts"]}
+            for key, item in self.items.items()
+            if list(key[: len(partition_key)]) == partition_key and item["date"] >= since
+        ]
+        return MockAsyncPageIterator(sorted(items, key=lambda item: item["date"], reverse=True))
@@ -1,7 +1,10 @@
+import asyncio
 import json
 import os
+import time
 from unittest import mock
 
+import azure.cognitiveservices.speech
 import pytest
 import quart.testing.app
 from httpx import Request, Response
@@ -9,6 +12,8 @@ from openai import BadRequestError
 
 import app
 
+from .mocks import MockAudio, MockSynthesisResult
+
 
 def fake_response(http_code):
     return Response(http_code, request=Request(method="get", url="https://foo.bar/"))
@@ -454,6 +459,72 @@ async def test_speech_token_refresh(client_with_expiring_token, mock_speech_succ
     assert await response.get_data() == b"mock_audio_data"
 
 
+@pytest.mark.asyncio
+async def test_speech_missing_voice(client, mock_speech_success):
+    client.app.config.pop(app.CONFIG_SPEECH_SERVICE_VOICE)
+    response = await client.post("/speech", json={"text": "test"})
+    assert response.status_code == 500
+    result = await response.get_json()
+    assert "error" in result
+
+
+@pytest.mark.asyncio
+async def test_speech_cached(client, monkeypatch):
+    synthesized = []
+
+    def mock_speak_text(self, text):
+        synthesized.append(text)
+        return MockSynthesisResult(MockAudio(b"mock_audio_data"))
+
+    monkeypatch.setattr(azure.cognitiveservices.speech.SpeechSynthesizer, "speak_text_async", mock_speak_text)
+
+    for _ in range(2):
+        response = await client.post("/speech", json={"text": "test"})
+        assert response.status_code == 200
+        assert await response.get_data() == b"mock_audio_data"
+    response = await client.post("/speech", json={"text": "another test"})
+
+    assert synthesized == ["test", "another test"]
+
+
+class MockStreamingSynthesizer:
+    """Reports audio chunks through the synthesizing event from another thread, like the Speech SDK does."""
+
+    def __init__(self, *args, **kwargs):
+        self.callbacks = []
+        self.synthesizing = self
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+
+    def speak_text_async(self, text):
+        return self
+
+    def get(self):
+        for chunk in [b"chunk1", b"chunk2"]:
+            time.sleep(0.05)
+            for callback in self.callbacks:
+                callback(mock.Mock(result=mock.Mock(audio_data=chunk)))
+        return MockAudio(b"chunk1chunk2")
+
+
+@pytest.mark.asyncio
+async def test_speech_streamed(client, monkeypatch):
+    monkeypatch.setattr(azure.cognitiveservices.speech, "SpeechSynthesizer", MockStreamingSynthesizer)
+
+    async with client.request("/speech", method="POST", headers={"Content-Type": "application/json"}) as connection:
+        await connection.send(json.dumps({"text": "test"}).encode())
+        await connection.send_complete()
+        # Each chunk is sent as soon as it is synthesized
+        assert await connection.receive() == b"chunk1"
+        assert await connection.receive() == b"chunk2"
+    assert connection.status_code == 200
+
+    # The streamed audio is cached once it is complete
+    response = await client.post("/speech", json={"text": "test"})
+    assert await response.get_data() == b"chunk1chunk2"
+
+
 @pytest.mark.asyncio
 async def test_speech_request_must_be_json(client, mock_speech_success):
     response = await client.post("/speech")
@@ -1101,3 +1172,107 @@ async def test_format_as_ndjson():
 
     result = [line async for line in app.format_as_ndjson(gen())]
     assert result == ['{"a": "I ❤️ 🐍"}\n', '{"b": "Newlines inside \\n strings are fine"}\n']
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_batches_deltas():
+    async def gen():
+        yield {"delta": {"role": "assistant"}, "context": {"thoughts": []}}
+        yield {"delta": {"content": "a", "role": None}}
+        yield {"delta": {"content": "b", "role": None}}
+        yield {"delta": {"role": "assistant"}, "context": {"followup_questions": []}}
+        yield {"delta": {"content": "c", "role": None}}
+
+    result = [data async for data in app.format_as_ndjson(gen(), flush_interval=60)]
+    assert result == [
+        '{"delta": {"role": "assistant"}, "context": {"thoughts": []}}\n',
+        '{"delta": {"content": "a", "role": null}}\n{"delta": {"content": "b", "role": null}}\n'
+        '{"delta": {"role": "assistant"}, "context": {"followup_questions": []}}\n',
+        '{"delta": {"content": "c", "role": null}}\n',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_flush_size():
+    async def gen():
+        for content in "abc":
+            yield {"delta": {"content": content, "role": None}}
+
+    result = [data async for data in app.format_as_ndjson(gen(), flush_interval=60, flush_size=60)]
+    assert result == [
+        '{"delta": {"content": "a", "role": null}}\n{"delta": {"content": "b", "role": null}}\n',
+        '{"delta": {"content": "c", "role": null}}\n',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_flushes_while_model_pauses():
+    resume = asyncio.Event()
+
+    async def gen():
+        yield {"delta": {"content": "a", "role": None}}
+        yield {"delta": {"content": "b", "role": None}}
+        await resume.wait()
+        yield {"delta": {"content": "c", "role": None}}
+
+    stream = app.format_as_ndjson(gen(), flush_interval=0.05)
+    # The buffered deltas are written when the interval ends, without waiting for the model to continue
+    assert await asyncio.wait_for(stream.__anext__(), timeout=5) == (
+        '{"delta": {"content": "a", "role": null}}\n{"delta": {"content": "b", "role": null}}\n'
+    )
+    resume.set()
+    assert [data async for data in stream] == ['{"delta": {"content": "c", "role": null}}\n']
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_closes_stream_while_waiting():
+    closed = False
+
+    async def gen():
+        nonlocal closed
+        try:
+            yield {"delta": {"content": "a", "role": None}}
+            await asyncio.sleep(60)
+        finally:
+            closed = True
+
+    stream = app.format_as_ndjson(gen(), flush_interval=0.01)
+    assert await stream.__anext__() == '{"delta": {"content": "a", "role": null}}\n'
+    await stream.aclose()
+    assert closed
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_slow_client(monkeypatch):
+    monkeypatch.setattr(app, "STREAM_SLOW_WRITE_SECONDS", 0.01)
+
+    async def gen():
+        for content in "abcd":
+            yield {"delta": {"content": content, "role": None}}
+
+    result = []
+    async for data in app.format_as_ndjson(gen()):
+        result.append(data)
+        if len(result) == 1:
+            # The client is slow to accept the first write, so the following deltas are batched
+            await asyncio.sleep(0.05)
+    assert len(result) == 2
+    assert result[1].count("\n") == 3
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_closes_stream_on_disconnect():
+    closed = False
+
+    async def gen():
+        nonlocal closed
+        try:
+            yield {"delta": {"content": "a", "role": None}}
+            yield {"delta": {"content": "b", "role": None}}
+        finally:
+            closed = True
+
+    stream = app.format_as_ndjson(gen())
+    assert await stream.__anext__() == '{"delta": {"content": "a", "role": null}}\n'
+    await stream.aclose()
+    assert closed
@@ -8,8 +8,9 @@ import app
 
 
 @pytest.fixture
-def minimal_env(monkeypatch):
+def minimal_env(monkeypatch, tmp_path):
     with mock.patch.dict(os.environ, clear=True):
+        monkeypatch.setenv("AZURE_INGESTION_QUEUE_PATH", str(tmp_path / "ingestion-queue.db"))
         monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
         monkeypatch.setenv("AZURE_STORAGE_CONTAINER", "test-storage-container")
         monkeypatch.setenv("AZURE_SEARCH_INDEX", "test-search-index")
@@ -55,6 +56,56 @@ async def test_app_azure_custom_identity(monkeypatch, minimal_env):
         assert quart_app.config[app.CONFIG_OPENAI_CLIENT].base_url == "http://azureapi.com/api/v1/openai/"
 
 
+@pytest.mark.asyncio
+async def test_app_azure_router_endpoints(monkeypatch, minimal_env):
+    monkeypatch.setenv("AZURE_OPENAI_ROUTER_ENDPOINTS", "https://test-openai-2.openai.azure.com, ")
+
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        router = quart_app.config[app.CONFIG_OPENAI_CLIENT]._client._transport
+        assert isinstance(router, app.OpenAIRouterTransport)
+        assert [backend.name for backend in router.backends] == [
+            "test-openai-service.openai.azure.com",
+            "test-openai-2.openai.azure.com",
+        ]
+
+
+@pytest.mark.asyncio
+async def test_app_azure_router_endpoints_with_key(monkeypatch, minimal_env):
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY_OVERRIDE", "azure-api-key")
+    monkeypatch.setenv("AZURE_OPENAI_ROUTER_ENDPOINTS", "https://test-openai-2.openai.azure.com")
+
+    quart_app = app.create_app()
+    with pytest.raises(quart.testing.app.LifespanError, match="AZURE_OPENAI_ROUTER_ENDPOINTS requires keyless"):
+        async with quart_app.test_app():
+            pass
+
+
+@pytest.mark.asyncio
+async def test_app_startup_timings(monkeypatch, minimal_env):
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY_OVERRIDE", "azure-api-key")
+
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        timings = quart_app.config[app.CONFIG_STARTUP_TIMINGS]
+        assert list(timings) == ["credential", "clients", "network", "approaches"]
+        assert all(duration >= 0 for duration in timings.values())
+
+
+@pytest.mark.asyncio
+async def test_app_shared_embedding_cache(monkeypatch, minimal_env):
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY_OVERRIDE", "azure-api-key")
+    monkeypatch.setenv("AZURE_SHARED_CACHE_MB", "1")
+
+    quart_app = app.create_app()
+    async with quart_app.test_app():
+        cache = quart_app.config[app.CONFIG_EMBEDDING_CACHE]
+        # AZURE_OPENAI_EMB_DIMENSIONS is 3072, so each slot holds one 3072 dimension vector
+        assert cache.max_value_bytes == 4 * 3072
+        assert quart_app.config[app.CONFIG_CHAT_APPROACH].embedding_cache is cache
+        assert quart_app.config[app.CONFIG_ASK_APPROACH].embedding_cache is cache
+
+
 @pytest.mark.asyncio
 async def test_app_user_upload_processors(monkeypatch, minimal_env):
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-user-storage-account")
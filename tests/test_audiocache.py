@@ -0,0 +1,30 @@
+from core.audiocache import AudioCache
+
+
+def test_audio_cache_key_depends_on_voice_and_format():
+    key = AudioCache.key("en-US-AndrewMultilingualNeural", "Audio16Khz32KBitRateMonoMp3", "Hello")
+
+    assert key == AudioCache.key("en-US-AndrewMultilingualNeural", "Audio16Khz32KBitRateMonoMp3", "Hello")
+    assert key != AudioCache.key("en-US-AvaMultilingualNeural", "Audio16Khz32KBitRateMonoMp3", "Hello")
+    assert key != AudioCache.key("en-US-AndrewMultilingualNeural", "Riff16Khz16BitMonoPcm", "Hello")
+
+
+def test_audio_cache_evicts_least_recently_used_by_size():
+    cache = AudioCache(max_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    cache.get("a")
+    cache.set("c", b"cccc")
+
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("b") is None
+    assert cache.get("c") == b"cccc"
+    assert cache.size == 8
+
+
+def test_audio_cache_skips_audio_larger_than_cache():
+    cache = AudioCache(max_bytes=4)
+    cache.set("a", b"aaaaa")
+
+    assert cache.get("a") is None
+    assert cache.size == 0
@@ -1,18 +1,25 @@
+import asyncio
 import json
 
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.agent.aio import KnowledgeAgentRetrievalClient
 from azure.search.documents.aio import SearchClient
-from openai.types.chat import ChatCompletion
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from openai.types.create_embedding_response import Usage
 
+from approaches.approach import Document
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.promptmanager import PromptyManager
+from core.sharedcache import SLOT_HEADER, SharedMemoryCache
 
 from .mocks import (
     MOCK_EMBEDDING_DIMENSIONS,
     MOCK_EMBEDDING_MODEL_NAME,
     MockAsyncSearchResultsIterator,
+    MockClient,
+    MockEmbeddingsClient,
     mock_retrieval_response,
 )
 
@@ -300,3 +307,365 @@ async def test_agent_retrieval_results(monkeypatch):
     assert results[0].content == "There is a whistleblower policy."
     assert results[0].sourcepage == "Benefit_Options-2.pdf"
     assert results[0].search_agent_query == "whistleblower query"
+
+
+def test_get_search_queries(chat_approach):
+    payload = {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1695324963,
+        "model": "gpt-4.1-mini",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "content": None,
+                    "role": "assistant",
+                    "tool_calls": [
+                        {
+                            "id": "search_sources1235",
+                            "type": "function",
+                            "function": {
+                                "name": "search_sources",
+                                "arguments": json.dumps(
+                                    {"search_queries": ["dental coverage", "vision coverage", "dental coverage", "0"]}
+                                ),
+                            },
+                        }
+                    ],
+                },
+            }
+        ],
+    }
+    chatcompletions = ChatCompletion.model_validate(payload, strict=False)
+
+    assert chat_approach.get_search_queries(chatcompletions, "hello", max_queries=5) == [
+        "dental coverage",
+        "vision coverage",
+    ]
+    assert chat_approach.get_search_queries(chatcompletions, "hello", max_queries=1) == ["dental coverage"]
+
+
+def test_get_search_queries_returns_default(chat_approach):
+    payload = '{"id":"chatcmpl-1","object":"chat.completion","created":1695324963,"model":"gpt-4.1-mini","choices":[{"index":0,"finish_reason":"stop","message":{"content":"0","role":"assistant"}}]}'
+    chatcompletions = ChatCompletion.model_validate(json.loads(payload), strict=False)
+
+    assert chat_approach.get_search_queries(chatcompletions, "hello", max_queries=3) == ["hello"]
+
+
+def test_fuse_search_results(chat_approach):
+    doc_a = Document(id="a", content="A")
+    doc_b = Document(id="b", content="B")
+    doc_c = Document(id="c", content="C")
+
+    fused = chat_approach.fuse_search_results([[doc_a, doc_b], [doc_c, doc_b], [doc_b]], top=2)
+
+    assert [doc.id for doc in fused] == ["b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_run_multi_query_search(monkeypatch):
+    chat_approach = ChatReadRetrieveReadApproach(
+        search_client=SearchClient(endpoint="", index_name="", credential=AzureKeyCredential("")),
+        search_index_name=None,
+        agent_model=None,
+        agent_deployment=None,
+        agent_client=None,
+        auth_helper=None,
+        openai_client=MockClient(
+            MockEmbeddingsClient(
+                CreateEmbeddingResponse(
+                    object="list",
+                    data=[
+                        Embedding(embedding=[0.2], index=1, object="embedding"),
+                        Embedding(embedding=[0.1], index=0, object="embedding"),
+                    ],
+                    model=MOCK_EMBEDDING_MODEL_NAME,
+                    usage=Usage(prompt_tokens=8, total_tokens=8),
+                )
+            )
+        ),
+        chatgpt_model="gpt-4.1-mini",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        embedding_field="embedding3",
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+        prompt_manager=PromptyManager(),
+    )
+
+    searched = []
+
+    async def record_and_mock_search(*args, **kwargs):
+        searched.append((kwargs.get("search_text"), [vector.vector for vector in kwargs.get("vector_queries")]))
+        return await mock_search(*args, **kwargs)
+
+    monkeypatch.setattr(SearchClient, "search", record_and_mock_search)
+
+    results = await chat_approach.run_multi_query_search(
+        ["interest rates", "whistleblower"],
+        top=3,
+        search_index_filter=None,
+        use_text_search=True,
+        use_vector_search=True,
+        use_semantic_ranker=False,
+        use_semantic_captions=False,
+        minimum_search_score=None,
+        minimum_reranker_score=None,
+        use_query_rewriting=False,
+    )
+
+    assert sorted(searched) == [("interest rates", [[0.1]]), ("whistleblower", [[0.2]])]
+    assert len(results) == 2
+    assert {result.sourcepage for result in results} == {
+        "Financial Market Analysis Report 2023-6.png",
+        "Benefit_Options-2.pdf",
+    }
+
+
+@pytest.mark.asyncio
+async def test_compute_text_embeddings_uses_shared_cache(chat_approach):
+    requested = []
+
+    class RecordingEmbeddingsClient:
+        async def create(self, *args, **kwargs):
+            requested.append(kwargs["input"])
+            return CreateEmbeddingResponse(
+                object="list",
+                data=[Embedding(embedding=[0.25], index=0, object="embedding")],
+                model=MOCK_EMBEDDING_MODEL_NAME,
+                usage=Usage(prompt_tokens=8, total_tokens=8),
+            )
+
+    chat_approach.openai_client = MockClient(RecordingEmbeddingsClient())
+    chat_approach.embedding_cache = SharedMemoryCache(size_bytes=64 * 1024, slot_bytes=SLOT_HEADER.size + 4 * 8)
+    chat_approach.embedding_cache.set_vector(chat_approach.get_embedding_cache_key("interest rates"), [0.5])
+
+    vectors = await chat_approach.compute_text_embeddings(["interest rates", "whistleblower"])
+    single = await chat_approach.compute_text_embedding("whistleblower")
+
+    assert requested == [["whistleblower"]]
+    assert [vector.vector for vector in vectors] == [[0.5], [0.25]]
+    assert single.vector == [0.25]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_deltas(chat_approach):
+    async def frames():
+        yield {"delta": {"content": None, "role": "assistant"}}
+        yield {"delta": {"content": "The capital ", "role": None}}
+        yield {"delta": {"content": "of France ", "role": None}}
+        yield {"delta": {"content": "is Paris.", "role": None}}
+        yield {"delta": {"role": "assistant"}, "context": {"followup_questions": []}}
+        yield {"delta": {"content": "!", "role": None}}
+
+    coalesced = [frame async for frame in chat_approach.coalesce_deltas(frames())]
+
+    assert coalesced == [
+        {"delta": {"content": None, "role": "assistant"}},
+        # The first delta isn't held back, so the first token arrives as soon as the model sends it
+        {"delta": {"content": "The capital ", "role": None}},
+        {"delta": {"content": "of France is Paris.", "role": None}},
+        {"delta": {"role": "assistant"}, "context": {"followup_questions": []}},
+        {"delta": {"content": "!", "role": None}},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_deltas_flushes_after_window(chat_approach, monkeypatch):
+    monkeypatch.setattr(chat_approach, "STREAM_COALESCE_SECONDS", 0.01)
+
+    async def frames():
+        yield {"delta": {"content": "Hello", "role": None}}
+        yield {"delta": {"content": " wor", "role": None}}
+        yield {"delta": {"content": "ld", "role": None}}
+        await asyncio.sleep(0.05)
+        yield {"delta": {"content": "!", "role": None}}
+
+    coalesced = [frame["delta"]["content"] async for frame in chat_approach.coalesce_deltas(frames())]
+
+    assert coalesced == ["Hello", " world", "!"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_deltas_flushes_while_model_pauses(chat_approach, monkeypatch):
+    monkeypatch.setattr(chat_approach, "STREAM_COALESCE_SECONDS", 0.01)
+
+    async def frames():
+        yield {"delta": {"content": "Hello", "role": None}}
+        yield {"delta": {"content": " world", "role": None}}
+        await asyncio.sleep(10)
+        yield {"delta": {"content": "never sent", "role": None}}
+
+    coalesced = chat_approach.coalesce_deltas(frames())
+    assert (await coalesced.__anext__())["delta"]["content"] == "Hello"
+    # The merged text is sent when its window ends, without waiting for the next chunk
+    assert (await asyncio.wait_for(coalesced.__anext__(), timeout=1))["delta"]["content"] == " world"
+    await coalesced.aclose()
+
+
+@pytest.mark.asyncio
+async def test_coalesce_deltas_closes_upstream(chat_approach):
+    closed = False
+
+    async def frames():
+        nonlocal closed
+        try:
+            yield {"delta": {"content": None, "role": "assistant"}}
+            await asyncio.sleep(10)
+            yield {"delta": {"content": "never sent", "role": None}}
+        finally:
+            closed = True
+
+    coalesced = chat_approach.coalesce_deltas(frames())
+    assert await coalesced.__anext__() == {"delta": {"content": None, "role": "assistant"}}
+    await coalesced.aclose()
+
+    assert closed
+
+
+@pytest.mark.asyncio
+async def test_stream_answer_deltas_closes_chat_stream(chat_approach, monkeypatch):
+    monkeypatch.setattr(chat_approach, "STREAM_COALESCE_SECONDS", 0)
+
+    class ChatStream:
+        closed = False
+
+        async def __aiter__(self):
+            for content in ["The", " capital"]:
+                yield ChatCompletionChunk.model_validate(
+                    {
+                        "object": "chat.completion.chunk",
+                        "choices": [{"delta": {"content": content}, "index": 0}],
+                        "id": "test-id",
+                        "model": "gpt-4.1-mini",
+                        "created": 1,
+                    }
+                )
+
+        async def close(self):
+            self.closed = True
+
+    chat_stream = ChatStream()
+    frames = chat_approach.coalesce_deltas(chat_approach.stream_answer_deltas(chat_stream))
+    assert await frames.__anext__() == {"delta": {"content": "The", "role": None}}
+    await frames.aclose()
+
+    assert chat_stream.closed
+
+
+@pytest.mark.asyncio
+async def test_run_search_approach_query_rewrite_shortcuts(chat_approach, monkeypatch):
+    chat_approach.search_client = SearchClient(endpoint="", index_name="", credential=AzureKeyCredential(""))
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    rewrites = 0
+
+    async def mock_create_chat_completion(*args, **kwargs):
+        nonlocal rewrites
+        rewrites += 1
+        return ChatCompletion.model_validate(
+            {
+                "id": "test-123",
+                "object": "chat.completion",
+                "created": 1,
+                "model": "gpt-4.1-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "tool_calls",
+                        "message": {
+                            "role": "assistant",
+                            "tool_calls": [
+                                {
+                                    "id": "call_1",
+                                    "type": "function",
+                                    "function": {
+                                        "name": "search_sources",
+                                        "arguments": '{"search_query": "Northwind Plus eye exams"}',
+                                    },
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        )
+
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    overrides = {"retrieval_mode": "text", "use_query_rewrite_shortcuts": True}
+    follow_up = [
+        {"role": "user", "content": "What is included in my Northwind Health Plus plan?"},
+        {"role": "assistant", "content": "It includes medical, vision, and dental coverage."},
+        {"role": "user", "content": "Does it cover eye exams?"},
+    ]
+
+    skipped = await chat_approach.run_search_approach([{"role": "user", "content": "Eye exams"}], overrides, {})
+    computed = await chat_approach.run_search_approach(follow_up, overrides, {})
+    cached = await chat_approach.run_search_approach(follow_up, overrides, {})
+
+    assert rewrites == 1
+    assert [info.thoughts[0].props["query_rewrite"] for info in (skipped, computed, cached)] == [
+        "skipped",
+        "computed",
+        "cached",
+    ]
+    assert skipped.thoughts[1].description == "Eye exams"
+    assert cached.thoughts[1].description == "Northwind Plus eye exams"
+
+
+@pytest.mark.asyncio
+async def test_run_search_approach_max_search_queries(chat_approach, monkeypatch):
+    async def mock_create_chat_completion(*args, **kwargs):
+        return ChatCompletion.model_validate(
+            {
+                "id": "test-123",
+                "object": "chat.completion",
+                "created": 1,
+                "model": "gpt-4.1-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "tool_calls",
+                        "message": {
+                            "role": "assistant",
+                            "tool_calls": [
+                                {
+                                    "id": "call_1",
+                                    "type": "function",
+                                    "function": {
+                                        "name": "search_sources",
+                                        "arguments": json.dumps(
+                                            {"search_queries": ["dental", "vision", "hearing", "eye exams"]}
+                                        ),
+                                    },
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        )
+
+    searched = []
+
+    async def mock_run_multi_query_search(search_queries, *args):
+        searched.append(search_queries)
+        return []
+
+    monkeypatch.setattr(chat_approach, "create_chat_completion", mock_create_chat_completion)
+    monkeypatch.setattr(chat_approach, "run_multi_query_search", mock_run_multi_query_search)
+    monkeypatch.setattr(chat_approach, "build_filter", lambda overrides, auth_claims: None)
+    messages = [{"role": "user", "content": "What does my plan cover?"}]
+
+    await chat_approach.run_search_approach(messages, {"use_multi_query_retrieval": True}, {})
+    # max_subqueries sizes agentic retrieval's reranker input, so it doesn't limit the sub-queries
+    await chat_approach.run_search_approach(
+        messages, {"use_multi_query_retrieval": True, "max_subqueries": 10, "max_search_queries": 2}, {}
+    )
+    assert searched == [["dental", "vision", "hearing"], ["dental", "vision"]]
@@ -0,0 +1,87 @@
+from approaches.contextpacker import (
+    COMPACTION_MARKER,
+    MODEL_CONTEXT_WINDOWS,
+    ContextPacker,
+    PackingStats,
+)
+
+OVERLAP = "The overlapping sentence is repeated at the end of one chunk and the start of the next."
+
+
+def test_context_packer_budget_respects_model_window():
+    packer = ContextPacker("gpt-4", budget_tokens=100000, response_token_limit=1024)
+    assert packer.budget_tokens < MODEL_CONTEXT_WINDOWS["gpt-4"]
+
+    packer = ContextPacker("gpt-4o", budget_tokens=2000)
+    assert packer.budget_tokens == 2000
+
+
+def test_remove_overlaps():
+    packer = ContextPacker("gpt-4o", budget_tokens=2000)
+    stats = PackingStats(budget_tokens=2000)
+    sources = [
+        f"doc.pdf#page=1: First chunk text. {OVERLAP}",
+        f"doc.pdf#page=2: {OVERLAP} Second chunk text.",
+        f"doc.pdf#page=1: First chunk text. {OVERLAP}",
+        "other.pdf#page=4: Unrelated content.",
+    ]
+
+    packed = packer.remove_overlaps(sources, stats)
+
+    assert packed == [
+        f"doc.pdf#page=1: First chunk text. {OVERLAP}",
+        "doc.pdf#page=2: Second chunk text.",
+        "other.pdf#page=4: Unrelated content.",
+    ]
+    assert stats.duplicate_sources_removed == 1
+    assert stats.overlap_characters_removed == len(OVERLAP)
+
+
+def test_remove_overlaps_preceding_chunk():
+    packer = ContextPacker("gpt-4o", budget_tokens=2000)
+    stats = PackingStats(budget_tokens=2000)
+    sources = [f"doc.pdf#page=2: {OVERLAP} Second chunk text.", f"doc.pdf#page=1: First chunk text. {OVERLAP}"]
+
+    packed = packer.remove_overlaps(sources, stats)
+
+    assert packed == [sources[0], "doc.pdf#page=1: First chunk text."]
+
+
+def test_overlap_length_ignores_short_coincidences():
+    packer = ContextPacker("gpt-4o", budget_tokens=2000)
+    assert packer.overlap_length("ends with the plan.", "the plan. starts here") == 0
+    assert packer.overlap_length(f"prefix {OVERLAP}", f"{OVERLAP} suffix") == len(OVERLAP)
+
+
+def test_pack_within_budget_is_unchanged():
+    packer = ContextPacker("gpt-4o", budget_tokens=2000)
+    sources = ["doc.pdf#page=1: Short source."]
+    past_messages = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+
+    packed = packer.pack(sources, past_messages, "What is covered?")
+
+    assert packed.text_sources == sources
+    assert packed.past_messages == past_messages
+    assert packed.stats.tokens_saved == 0
+
+
+def test_pack_truncates_sources_and_compacts_history():
+    packer = ContextPacker("gpt-4o", budget_tokens=400, minimum_truncated_tokens=20)
+    long_text = " ".join(f"word{i}" for i in range(400))
+    sources = [f"a.pdf#page=1: {long_text}", f"b.pdf#page=1: {long_text}", "c.pdf#page=1: tail"]
+    past_messages = [
+        {"role": "user", "content": long_text},
+        {"role": "assistant", "content": long_text},
+        {"role": "user", "content": "Follow up?"},
+        {"role": "assistant", "content": "Sure."},
+    ]
+
+    packed = packer.pack(sources, past_messages, "Question?")
+
+    assert packed.past_messages[-2:] == past_messages[-2:]
+    assert all(message["content"].endswith(COMPACTION_MARKER) for message in packed.past_messages[:-2])
+    assert packed.stats.history_messages_compacted + packed.stats.history_messages_dropped == 2
+    assert packed.text_sources[0].startswith("a.pdf#page=1: word0")
+    assert packed.stats.sources_truncated + packed.stats.sources_dropped >= 1
+    assert packed.stats.source_tokens_after + packed.stats.history_tokens_after <= packer.budget_tokens
+    assert packed.stats.tokens_saved > 0
@@ -2,7 +2,22 @@ import copy
 import json
 
 import pytest
+from azure.core.async_paging import AsyncItemPaged
+from azure.cosmos import CosmosDict, CosmosList
 from azure.cosmos.aio import ContainerProxy
+from azure.cosmos.exceptions import (
+    CosmosBatchOperationError,
+    CosmosResourceNotFoundError,
+)
+
+from chat_history.cosmosdb import (
+    RequestCharge,
+    message_pair_hash,
+    save_feedback_to_cosmos,
+)
+from chat_history.feedbackanalytics import FeedbackAnalytics
+from chat_history.sessioncache import SessionListCache
+from config import CONFIG_COSMOS_SESSION_LIST_CACHE
 
 from .mocks import MockAsyncPageIterator
 
@@ -97,30 +112,57 @@ class MockCosmosDBResultsIterator:
         return self
 
 
-@pytest.mark.asyncio
-async def test_chathistory_newitem(auth_public_documents_client, monkeypatch):
+def mock_read_session(monkeypatch, session_item=None):
+    async def mock_read_item(container_proxy, item, partition_key, **kwargs):
+        assert item == "123"
+        assert partition_key == ["OID_X", "123"]
+        if session_item is None:
+            raise CosmosResourceNotFoundError()
+        return CosmosDict(copy.deepcopy(session_item), response_headers={"x-ms-request-charge": "1"})
+
+    monkeypatch.setattr(ContainerProxy, "read_item", mock_read_item)
+
 
+def mock_execute_batches(monkeypatch, batches):
     async def mock_execute_item_batch(container_proxy, **kwargs):
-        partition_key = kwargs["partition_key"]
-        assert partition_key == ["OID_X", "123"]
-        operations = kwargs["batch_operations"]
-        assert len(operations) == 2
-        assert operations[0][0] == "upsert"
-        assert operations[1][0] == "upsert"
-        session = operations[0][1][0]
-        assert session["id"] == "123"
-        assert session["session_id"] == "123"
-        assert session["entra_oid"] == "OID_X"
-        assert session["title"] == "This is a test message"
-        message = operations[1][1][0]
-        assert message["id"] == "123-0"
-        assert message["session_id"] == "123"
-        assert message["entra_oid"] == "OID_X"
-        assert message["question"] == "This is a test message"
-        assert message["response"] == "This is a test answer"
+        assert kwargs["partition_key"] == ["OID_X", "123"]
+        assert len(kwargs["batch_operations"]) <= 100
+        batches.append(kwargs["batch_operations"])
+        headers = {"x-ms-request-charge": "10"}
+        kwargs["response_hook"](headers, [])
+        return CosmosList([], response_headers=headers)
 
     monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
 
+
+def mock_record_feedback(monkeypatch, recorded):
+    async def mock_record(feedback_analytics, events, response_hook=None):
+        recorded.extend(events)
+
+    monkeypatch.setattr(FeedbackAnalytics, "record", mock_record)
+
+
+def saved_session(answers, feedback=None):
+    feedback = feedback or {}
+    return {
+        "id": "123",
+        "session_id": "123",
+        "entra_oid": "OID_X",
+        "type": "session",
+        "title": answers[0][0],
+        "timestamp": 123456789,
+        "message_hashes": [message_pair_hash(pair, feedback.get(f"123-{ind}")) for ind, pair in enumerate(answers)],
+        "feedback_types": {message_id: message_feedback["type"] for message_id, message_feedback in feedback.items()},
+        "_etag": "etag-1",
+    }
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem(auth_public_documents_client, monkeypatch):
+    mock_read_session(monkeypatch)
+    batches = []
+    mock_execute_batches(monkeypatch, batches)
+
     response = await auth_public_documents_client.post(
         "/chat_history",
         headers={"Authorization": "Bearer MockToken"},
@@ -130,6 +172,164 @@ async def test_chathistory_newitem(auth_public_documents_client, monkeypatch):
         },
     )
     assert response.status_code == 201
+    assert len(batches) == 1
+    operations = batches[0]
+    assert len(operations) == 2
+    assert operations[0][0] == "upsert"
+    message = operations[0][1][0]
+    assert message["id"] == "123-0"
+    assert message["session_id"] == "123"
+    assert message["entra_oid"] == "OID_X"
+    assert message["question"] == "This is a test message"
+    assert message["response"] == "This is a test answer"
+    # The session is written last, once its message pairs are saved
+    assert operations[1][0] == "create"
+    session = operations[1][1][0]
+    assert session["id"] == "123"
+    assert session["session_id"] == "123"
+    assert session["entra_oid"] == "OID_X"
+    assert session["title"] == "This is a test message"
+    assert len(session["message_hashes"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_incremental(auth_public_documents_client, monkeypatch):
+    answers = [["First question", "First answer"], ["Second question", "Second answer"]]
+    mock_read_session(monkeypatch, saved_session(answers))
+    batches = []
+    mock_execute_batches(monkeypatch, batches)
+    recorded = []
+    mock_record_feedback(monkeypatch, recorded)
+
+    feedback = {"123-1": {"type": "positive", "comment": "", "timestamp": "2025-01-01T00:00:00"}}
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": answers + [["Third question", "Third answer"]], "feedback": feedback},
+    )
+    assert response.status_code == 201
+    operations = batches[0]
+    # Only the pair with new feedback and the new pair are written
+    assert [operation[1][0]["id"] for operation in operations[:-1]] == ["123-1", "123-2"]
+    assert operations[0][1][0]["feedback"]["type"] == "positive"
+    assert operations[-1][0] == "patch"
+    assert operations[-1][1][0] == "123"
+    assert operations[-1][2] == {"if_match_etag": "etag-1"}
+    patched = {patch["path"]: patch["value"] for patch in operations[-1][1][1]}
+    assert len(patched["/message_hashes"]) == 3
+    assert patched["/feedback_types"] == {"123-1": "positive"}
+    # The new feedback is added to the analytics
+    assert len(recorded) == 1
+    assert recorded[0].message_id == "123-1"
+    assert recorded[0].previous_type is None
+    assert recorded[0].feedback["type"] == "positive"
+    assert recorded[0].question == "Second question"
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_feedback_removed(auth_public_documents_client, monkeypatch):
+    answers = [["First question", "First answer"], ["Second question", "Second answer"]]
+    feedback = {
+        "123-0": {"type": "positive", "comment": "", "timestamp": "2025-01-01T00:00:00"},
+        "123-1": {"type": "negative", "comment": "", "timestamp": "2025-01-01T00:00:00"},
+    }
+    mock_read_session(monkeypatch, saved_session(answers, feedback))
+    mock_execute_batches(monkeypatch, [])
+    recorded = []
+    mock_record_feedback(monkeypatch, recorded)
+
+    # The first pair's feedback is taken back, and the second pair is gone
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": answers[:1]},
+    )
+    assert response.status_code == 201
+    assert [(event.message_id, event.previous_type, event.feedback) for event in recorded] == [
+        ("123-0", "positive", None),
+        ("123-1", "negative", None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_analytics_error(auth_public_documents_client, monkeypatch):
+    mock_read_session(monkeypatch)
+    mock_execute_batches(monkeypatch, [])
+
+    async def mock_record(feedback_analytics, events, response_hook=None):
+        raise Exception("Test Exception")
+
+    monkeypatch.setattr(FeedbackAnalytics, "record", mock_record)
+
+    # The conversation is saved even when the analytics can't be updated
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={
+            "id": "123",
+            "answers": [["This is a test message", "This is a test answer"]],
+            "feedback": {"123-0": {"type": "positive", "comment": "", "timestamp": "2025-01-01T00:00:00"}},
+        },
+    )
+    assert response.status_code == 201
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_shorter(auth_public_documents_client, monkeypatch):
+    answers = [["First question", "First answer"], ["Second question", "Second answer"]]
+    mock_read_session(monkeypatch, saved_session(answers))
+    batches = []
+    mock_execute_batches(monkeypatch, batches)
+
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": answers[:1]},
+    )
+    assert response.status_code == 201
+    assert [operation[0] for operation in batches[0]] == ["delete", "patch"]
+    assert batches[0][0][1] == ("123-1",)
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_many_batches(auth_public_documents_client, monkeypatch):
+    mock_read_session(monkeypatch)
+    batches = []
+    mock_execute_batches(monkeypatch, batches)
+
+    answers = [[f"Question {ind}", f"Answer {ind}"] for ind in range(250)]
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": answers},
+    )
+    assert response.status_code == 201
+    assert [len(batch) for batch in batches] == [100, 100, 51]
+    assert batches[-1][-1][0] == "create"
+
+
+@pytest.mark.asyncio
+async def test_chathistory_newitem_conflict(auth_public_documents_client, monkeypatch):
+    answers = [["First question", "First answer"]]
+    mock_read_session(monkeypatch, saved_session(answers))
+    batches = []
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        batches.append(kwargs["batch_operations"])
+        if len(batches) == 1:
+            # Another tab saved the session after it was read
+            raise CosmosBatchOperationError(error_index=1, headers={}, status_code=412, message="Precondition failed")
+        return CosmosList([], response_headers={"x-ms-request-charge": "10"})
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": answers + [["Second question", "Second answer"]]},
+    )
+    assert response.status_code == 201
+    assert len(batches) == 2
 
 
 @pytest.mark.asyncio
@@ -283,6 +483,143 @@ async def test_chathistory_getitem(auth_public_documents_client, monkeypatch, sn
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+@pytest.mark.asyncio
+async def test_chathistory_getitem_page(auth_public_documents_client, monkeypatch):
+    queries = []
+
+    def mock_query_items(container_proxy, query, **kwargs):
+        queries.append((query, kwargs))
+        return MockCosmosDBResultsIterator(for_message_pairs_query)
+
+    monkeypatch.setattr(ContainerProxy, "query_items", mock_query_items)
+
+    response = await auth_public_documents_client.get(
+        "/chat_history/sessions/123?count=5&continuation_token=abc",
+        headers={"Authorization": "Bearer MockToken"},
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["continuation_token"] == "abcnext"
+    assert result["answers"][0][0] == "What does a Product Manager do?"
+    query, kwargs = queries[0]
+    assert query.startswith("SELECT c.question, c.response FROM c")
+    assert kwargs["max_item_count"] == 5
+
+
+@pytest.mark.asyncio
+async def test_chathistory_query_cached(auth_public_documents_client, monkeypatch):
+    queries = []
+
+    def mock_query_items(container_proxy, query, **kwargs):
+        queries.append(query)
+        return MockCosmosDBResultsIterator(for_sessions_query)
+
+    monkeypatch.setattr(ContainerProxy, "query_items", mock_query_items)
+    mock_read_session(monkeypatch)
+    mock_execute_batches(monkeypatch, [])
+    # Each worker has its own cache, so it's only used when AZURE_CHAT_HISTORY_CACHE_SECONDS is set
+    assert CONFIG_COSMOS_SESSION_LIST_CACHE not in auth_public_documents_client.config
+    auth_public_documents_client.config[CONFIG_COSMOS_SESSION_LIST_CACHE] = SessionListCache(30)
+
+    async def list_sessions():
+        response = await auth_public_documents_client.get(
+            "/chat_history/sessions?count=20", headers={"Authorization": "Bearer MockToken"}
+        )
+        assert response.status_code == 200
+        return await response.get_json()
+
+    first = await list_sessions()
+    assert await list_sessions() == first
+    assert len(queries) == 1
+
+    # Saving a session changes the list
+    response = await auth_public_documents_client.post(
+        "/chat_history",
+        headers={"Authorization": "Bearer MockToken"},
+        json={"id": "123", "answers": [["This is a test message", "This is a test answer"]]},
+    )
+    assert response.status_code == 201
+    await list_sessions()
+    assert len(queries) == 2
+
+
+def test_request_charge():
+    request_charge = RequestCharge()
+    request_charge({"x-ms-request-charge": "2.5"}, {})
+    request_charge({"x-ms-request-charge": "1"}, [])
+    # Queries report the previous response's headers when they're created
+    request_charge({"x-ms-request-charge": "100"}, AsyncItemPaged())
+    request_charge({}, {})
+    assert request_charge.total == 3.5
+
+
+@pytest.mark.asyncio
+async def test_chathistory_save_feedback(auth_public_documents_client, monkeypatch):
+    answers = [["First question", "First answer"]]
+    mock_read_session(monkeypatch, saved_session(answers))
+    batches = []
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        assert kwargs["partition_key"] == ["OID_X", "123"]
+        batches.append(kwargs["batch_operations"])
+        results = [{"statusCode": 200, "resourceBody": {"question": "First question"}}, {"statusCode": 200}]
+        return CosmosList(results, response_headers={})
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+    recorded = []
+    mock_record_feedback(monkeypatch, recorded)
+
+    async with auth_public_documents_client.app.app_context():
+        await save_feedback_to_cosmos("123", "123-0", "OID_X", "positive", "Helpful")
+
+    message_patch, session_patch = batches[0]
+    assert message_patch[1][0] == "123-0"
+    patch_operations = message_patch[1][1]
+    assert patch_operations[0]["path"] == "/feedback"
+    assert patch_operations[0]["value"]["type"] == "positive"
+    assert patch_operations[0]["value"]["comment"] == "Helpful"
+    assert session_patch[1][0] == "123"
+    assert session_patch[1][1][0] == {"op": "set", "path": "/feedback_types", "value": {"123-0": "positive"}}
+    assert session_patch[2] == {"if_match_etag": "etag-1"}
+    assert recorded[0].question == "First question"
+    assert recorded[0].previous_type is None
+
+
+@pytest.mark.asyncio
+async def test_chathistory_save_feedback_conflict(auth_public_documents_client, monkeypatch):
+    answers = [["First question", "First answer"]]
+    # Another tab gives the message negative feedback between the first read of the session and its patch
+    sessions = [
+        saved_session(answers),
+        {**saved_session(answers, {"123-0": {"type": "negative"}}), "_etag": "etag-2"},
+    ]
+
+    async def mock_read_item(container_proxy, item, partition_key, **kwargs):
+        return CosmosDict(sessions.pop(0), response_headers={})
+
+    monkeypatch.setattr(ContainerProxy, "read_item", mock_read_item)
+    batches = []
+
+    async def mock_execute_item_batch(container_proxy, **kwargs):
+        batches.append(kwargs["batch_operations"])
+        if len(batches) == 1:
+            raise CosmosBatchOperationError(error_index=1, headers={}, status_code=412, message="Precondition failed")
+        results = [{"statusCode": 200, "resourceBody": {"question": "First question"}}, {"statusCode": 200}]
+        return CosmosList(results, response_headers={})
+
+    monkeypatch.setattr(ContainerProxy, "execute_item_batch", mock_execute_item_batch)
+    recorded = []
+    mock_record_feedback(monkeypatch, recorded)
+
+    async with auth_public_documents_client.app.app_context():
+        await save_feedback_to_cosmos("123", "123-0", "OID_X", "positive", "Helpful")
+
+    assert len(batches) == 2
+    assert batches[1][1][2] == {"if_match_etag": "etag-2"}
+    # The analytics move the message's count from the type the other tab saved
+    assert recorded[0].previous_type == "negative"
+
+
 # Error handling tests for getting an individual chat history item
 @pytest.mark.asyncio
 async def test_chathistory_getitem_error_disabled(client, monkeypatch):
@@ -356,6 +693,30 @@ async def test_chathistory_deleteitem(auth_public_documents_client, monkeypatch)
     assert response.status_code == 204
 
 
+@pytest.mark.asyncio
+async def test_chathistory_deleteitem_feedback(auth_public_documents_client, monkeypatch):
+    deletion_query = copy.deepcopy(for_deletion_query)
+    deletion_query[0][0]["feedback_types"] = {"123-0": "negative"}
+
+    def mock_query_items(container_proxy, query, **kwargs):
+        return MockCosmosDBResultsIterator(deletion_query)
+
+    monkeypatch.setattr(ContainerProxy, "query_items", mock_query_items)
+    mock_execute_batches(monkeypatch, [])
+    recorded = []
+    mock_record_feedback(monkeypatch, recorded)
+
+    response = await auth_public_documents_client.delete(
+        "/chat_history/sessions/123",
+        headers={"Authorization": "Bearer MockToken"},
+    )
+    assert response.status_code == 204
+    # The deleted conversation's feedback is taken out of the analytics
+    assert [(event.message_id, event.previous_type, event.feedback) for event in recorded] == [
+        ("123-0", "negative", None)
+    ]
+
+
 @pytest.mark.asyncio
 async def test_chathistory_deleteitem_error_disabled(client, monkeypatch):
 
@@ -0,0 +1,152 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from chat_history.feedbackanalytics import (
+    FEEDBACK_ANALYTICS_OID,
+    FeedbackAnalytics,
+    FeedbackEvent,
+)
+
+from .mocks import MockAsyncPageIterator, MockCosmosContainer
+from scripts.cosmosdb_feedback_backfill import FeedbackBackfill
+
+
+class MockChatHistoryContainer(MockCosmosContainer):
+    """Also answers the backfill's query of the message pairs that have feedback."""
+
+    def query_items(self, query: str, parameters: list, partition_key=None, **kwargs):
+        if partition_key is not None:
+            return super().query_items(query, parameters, partition_key, **kwargs)
+        self.calls["query_items"] += 1
+        return MockAsyncPageIterator(
+            [
+                {key: item[key] for key in ("id", "entra_oid", "session_id", "question", "feedback")}
+                for item in self.items.values()
+                if item.get("type") == "message_pair" and item.get("feedback")
+            ]
+        )
+
+
+def chat_history(container: MockCosmosContainer, session_id: str, feedback_types: list, counted: dict):
+    container.store(
+        {"id": session_id, "entra_oid": "OID_X", "session_id": session_id, "type": "session", "feedback_types": counted}
+    )
+    for index, feedback_type in enumerate(feedback_types):
+        item = {
+            "id": f"{session_id}-{index}",
+            "entra_oid": "OID_X",
+            "session_id": session_id,
+            "type": "message_pair",
+            "question": f"Question {index}",
+            "response": {},
+        }
+        if feedback_type:
+            item["feedback"] = {
+                "type": feedback_type,
+                "comment": f"Comment {index}",
+                "timestamp": f"2025-01-0{index + 1}T00:00:00",
+            }
+        container.store(item)
+
+
+@pytest.mark.asyncio
+async def test_feedback_backfill():
+    container = MockChatHistoryContainer()
+    chat_history(container, "123", ["positive", None, "negative"], counted={})
+    chat_history(container, "456", ["negative", "positive"], counted={})
+    # Feedback the app already counted as it was saved
+    chat_history(container, "789", ["positive"], counted={"789-0": "positive"})
+    await FeedbackAnalytics(container).record(
+        [
+            FeedbackEvent(
+                message_id="789-0",
+                session_id="789",
+                previous_type=None,
+                feedback={"type": "positive", "comment": "Comment 0", "timestamp": "2025-02-01T00:00:00"},
+            )
+        ]
+    )
+
+    assert await FeedbackBackfill(container).backfill() == 4
+    analytics = await FeedbackAnalytics(container).read(days=100000)
+    assert analytics["total_feedback"] == 5
+    assert analytics["positive_feedback"] == 3
+    assert analytics["negative_feedback"] == 2
+    assert [entry["message_id"] for entry in analytics["recent_feedback"]] == [
+        "789-0",
+        "123-2",
+        "456-1",
+        "123-0",
+        "456-0",
+    ]
+    daily = {day["date"]: day["total"] for day in analytics["daily_feedback"]}
+    assert daily["2025-01-01"] == 2
+    assert daily["2025-01-02"] == 1
+    assert daily["2025-01-03"] == 1
+    assert container.items[("OID_X", "123", "123")]["feedback_types"] == {"123-0": "positive", "123-2": "negative"}
+
+    # Running it again doesn't count the feedback twice
+    assert await FeedbackBackfill(container).backfill() == 0
+    assert (await FeedbackAnalytics(container).read(days=100000))["total_feedback"] == 5
+
+
+@pytest.mark.asyncio
+async def test_feedback_backfill_session_changed():
+    container = MockChatHistoryContainer()
+    chat_history(container, "123", ["positive", "negative"], counted={})
+    backfill = FeedbackBackfill(container)
+    message_pairs = (await backfill.read_feedback())[("OID_X", "123")]
+    patch_item = container.patch_item
+
+    async def patch_item_after_app(item, partition_key, patch_operations, **kwargs):
+        if item == "123" and container.calls["patch_item"] == 0:
+            # The app counts the first message pair's feedback after the backfill read the session
+            await patch_item(
+                item, partition_key, [{"op": "set", "path": "/feedback_types", "value": {"123-0": "positive"}}]
+            )
+        return await patch_item(item, partition_key, patch_operations, **kwargs)
+
+    container.patch_item = patch_item_after_app  # type: ignore[method-assign]
+    uncounted = await backfill.mark_counted("OID_X", "123", message_pairs)
+    assert [item["id"] for item in uncounted] == ["123-1"]
+    assert container.items[("OID_X", "123", "123")]["feedback_types"] == {"123-0": "positive", "123-1": "negative"}
+
+
+@pytest.mark.asyncio
+async def test_feedback_backfill_matches_app():
+    """The script keeps its own copy of the aggregate updates, so they must write the items the app writes."""
+    timestamp = datetime.now(timezone.utc).isoformat()
+    feedback = {
+        "123-0": {"type": "positive", "comment": "Comment 0", "timestamp": timestamp},
+        "123-1": {"type": "negative", "comment": "Comment 1", "timestamp": timestamp},
+    }
+
+    app_container = MockChatHistoryContainer()
+    await FeedbackAnalytics(app_container).record(
+        [
+            FeedbackEvent(
+                message_id=message_id,
+                session_id="123",
+                previous_type=None,
+                feedback=message_feedback,
+                question=f"Question {index}",
+            )
+            for index, (message_id, message_feedback) in enumerate(feedback.items())
+        ]
+    )
+
+    backfill_container = MockChatHistoryContainer()
+    chat_history(backfill_container, "123", [None, None], counted={})
+    for message_id, message_feedback in feedback.items():
+        backfill_container.items[("OID_X", "123", message_id)]["feedback"] = message_feedback
+    assert await FeedbackBackfill(backfill_container).backfill() == 2
+
+    def analytics_items(container: MockCosmosContainer):
+        return {
+            key: {name: value for name, value in item.items() if name != "_etag"}
+            for key, item in container.items.items()
+            if item["entra_oid"] == FEEDBACK_ANALYTICS_OID
+        }
+
+    assert analytics_items(backfill_container) == analytics_items(app_container)
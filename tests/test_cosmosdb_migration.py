@@ -1,9 +1,17 @@
+import json
 import os
-from unittest.mock import AsyncMock, MagicMock, patch
+import tempfile
+import time
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
 
-from scripts.cosmosdb_migration import CosmosDBMigrator, migrate_cosmosdb_data
+from scripts import cosmosdb_migration
+from scripts.cosmosdb_migration import (
+    CosmosDBMigrator,
+    migrate_cosmosdb_data,
+    migration_batches,
+)
 
 # Sample old format item
 TEST_OLD_ITEM = {
@@ -92,8 +100,9 @@ async def test_migrate_method():
     mock_database = MagicMock()
     mock_client = MagicMock()
 
-    # Set up the query_items mock to return our test item
-    mock_container.query_items.return_value = MockCosmosDBResultsIterator([TEST_OLD_ITEM])
+    # Set up the change feed of the container's only feed range to return our test item
+    mock_container.read_feed_ranges = lambda: MockAsyncPageIterator([{"Range": "TEST_RANGE"}])
+    mock_container.query_items_change_feed.return_value = MockCosmosDBResultsIterator([TEST_OLD_ITEM])
 
     # Set up execute_item_batch as a spy to capture calls
     execute_batch_mock = AsyncMock()
@@ -115,8 +124,10 @@ async def test_migrate_method():
     # Call the migrate method
     await migrator.migrate()
 
-    # Verify query_items was called with the right parameters
-    mock_container.query_items.assert_called_once_with(query="SELECT * FROM c")
+    # Verify the change feed was read with the right parameters
+    mock_container.query_items_change_feed.assert_called_once_with(
+        feed_range={"Range": "TEST_RANGE"}, start_time="Beginning", max_item_count=100, response_hook=ANY
+    )
 
     # Verify execute_item_batch was called
     execute_batch_mock.assert_called_once()
@@ -185,8 +196,125 @@ async def test_migrate_cosmosdb_data(monkeypatch):
             await migrate_cosmosdb_data()
 
             # Verify the migrator was created with the right parameters
-            mock_migrator_class.assert_called_once_with("dummy_account", "dummy_db")
+            mock_migrator_class.assert_called_once_with(
+                "dummy_account",
+                "dummy_db",
+                concurrency=16,
+                request_units_per_second=None,
+                checkpoint_path=os.path.join(tempfile.gettempdir(), "cosmosdb-migration-dummy_account-dummy_db.json"),
+            )
 
             # Verify migrate and close were called
             mock_migrator.migrate.assert_called_once()
             mock_migrator.close.assert_called_once()
+
+
+def test_migration_batches_splits_long_sessions(monkeypatch):
+    old_item = {**TEST_OLD_ITEM, "answers": TEST_OLD_ITEM["answers"] * 75}
+    batches = migration_batches(old_item)
+    assert [len(batch) for batch in batches] == [100, 51]
+    assert batches[0][0][1][0]["type"] == "session"
+    message_pairs = [operation[1][0] for batch in batches for operation in batch][1:]
+    assert [message_pair["order"] for message_pair in message_pairs] == list(range(150))
+
+    monkeypatch.setattr(cosmosdb_migration, "MAX_BATCH_BYTES", 600)
+    assert [len(batch) for batch in migration_batches(TEST_OLD_ITEM)] == [2, 1]
+
+
+class MockChangeFeedPages:
+    """Helper class to mock the pages of a feed range's change feed, with a continuation token after each page"""
+
+    def __init__(self, name, pages, start):
+        self.name = name
+        self.pages = pages
+        self.index = start
+        self.continuation_token = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.index >= len(self.pages):
+            raise StopAsyncIteration
+        page = self.pages[self.index]
+        self.index += 1
+        self.continuation_token = f"{self.name}:{self.index}"
+        return MockAsyncPageIterator(list(page))
+
+
+class MockChangeFeedContainer:
+    """Helper class to mock a container whose feed ranges each have pages of old items"""
+
+    def __init__(self, feed_ranges):
+        self.feed_ranges = feed_ranges
+        self.change_feed_calls = []
+        self.migrated_ids = []
+        self.failing_id = None
+
+    async def read_feed_ranges(self):
+        for name in self.feed_ranges:
+            yield {"Range": name}
+
+    def query_items_change_feed(self, response_hook, **kwargs):
+        self.change_feed_calls.append(kwargs)
+        if "continuation" in kwargs:
+            name, start = kwargs["continuation"].split(":")
+        else:
+            name, start = kwargs["feed_range"]["Range"], 0
+        results = MagicMock()
+        results.by_page.return_value = MockChangeFeedPages(name, self.feed_ranges[name], int(start))
+        return results
+
+    async def execute_item_batch(self, batch_operations, partition_key, response_hook):
+        if partition_key[1] == self.failing_id:
+            raise Exception("Service unavailable")
+        response_hook({"x-ms-request-charge": "10.5"}, [])
+        self.migrated_ids.append(batch_operations[0][1][0]["id"])
+
+
+@pytest.mark.asyncio
+async def test_migrate_resumes_from_checkpoint(tmp_path, capsys):
+    def old_item(id):
+        return {**TEST_OLD_ITEM, "id": id}
+
+    container = MockChangeFeedContainer(
+        {"A": [[old_item("1")], [old_item("2")]], "B": [[old_item("3"), old_item("4")], [old_item("5")]]}
+    )
+    container.failing_id = "5"
+    checkpoint_path = tmp_path / "checkpoint.json"
+
+    def make_migrator():
+        migrator = CosmosDBMigrator("dummy_account", "dummy_db", checkpoint_path=str(checkpoint_path))
+        migrator.client = MagicMock()
+        migrator.old_container = container
+        migrator.new_container = container
+        return migrator
+
+    with pytest.raises(Exception, match="Service unavailable"):
+        await make_migrator().migrate()
+    assert sorted(container.migrated_ids) == ["1", "2", "3", "4"]
+    assert json.loads(checkpoint_path.read_text()) == {
+        "continuations": {json.dumps({"Range": "A"}): "A:2", json.dumps({"Range": "B"}): "B:1"}
+    }
+
+    container.failing_id = None
+    container.change_feed_calls, container.migrated_ids = [], []
+    await make_migrator().migrate()
+    assert container.change_feed_calls == [
+        {"continuation": "A:2", "max_item_count": 100},
+        {"continuation": "B:1", "max_item_count": 100},
+    ]
+    assert container.migrated_ids == ["5"]
+    assert "Total items migrated: 1, using 10 RU" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_request_unit_budget():
+    budget = cosmosdb_migration.RequestUnitBudget(request_units_per_second=1000)
+    await budget.acquire()
+    budget({"x-ms-request-charge": "1100"}, [])
+    # 100 RU over the budget take 0.1 seconds to pay back
+    started = time.monotonic()
+    await budget.acquire()
+    assert 0.08 <= time.monotonic() - started < 1
+    assert budget.total == 1100
@@ -0,0 +1,111 @@
+from collections import Counter
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+from evals.corpus_export import (
+    export_snapshot,
+    read_snapshot,
+    sample_allocation,
+    search_pages,
+    snapshot_chunks,
+    stratified_sample,
+)
+
+
+def make_chunks(counts: dict[str, int]) -> list[dict]:
+    return [
+        {
+            "id": f"{sourcefile}-{index:04}",
+            "content": f"Chunk {index} of {sourcefile}",
+            "sourcepage": f"{sourcefile}#page={index}",
+            "sourcefile": sourcefile,
+            "embedding": [0.1] * 3,
+        }
+        for sourcefile, count in counts.items()
+        for index in range(count)
+    ]
+
+
+class FakeSearchClient:
+    """Searches the chunks the way the service does, optionally rejecting ordering by a non-sortable id."""
+
+    def __init__(self, chunks: list[dict], sortable_id: bool = True):
+        self.chunks = chunks
+        self.sortable_id = sortable_id
+        self.searches: list[dict] = []
+
+    def search(self, search_text, select=None, filter=None, order_by=None, top=None):
+        self.searches.append({"filter": filter, "order_by": order_by, "top": top})
+        if order_by and not self.sortable_id:
+            error = HttpResponseError("The field 'id' is not sortable")
+            error.status_code = 400
+            raise error
+        chunks = self.chunks
+        if order_by:
+            chunks = sorted(chunks, key=lambda chunk: chunk["id"])
+        if filter:
+            last_key = filter.removeprefix("id gt '").removesuffix("'").replace("''", "'")
+            chunks = [chunk for chunk in chunks if chunk["id"] > last_key]
+        chunks = chunks[:top] if top else chunks
+        return iter([{field: chunk[field] for field in select} for chunk in chunks])
+
+
+def test_search_pages_by_key():
+    chunks = make_chunks({"a.pdf": 5, "b'quoted.pdf": 4})
+    search_client = FakeSearchClient(chunks)
+    pages = list(search_pages(search_client, page_size=4))
+    assert [len(page) for page in pages] == [4, 4, 1]
+    assert [chunk["id"] for page in pages for chunk in page] == sorted(chunk["id"] for chunk in chunks)
+    assert "embedding" not in pages[0][0]
+    assert search_client.searches[0]["filter"] is None
+    assert search_client.searches[1]["filter"] == "id gt 'a.pdf-0003'"
+    assert search_client.searches[2]["filter"] == "id gt 'b''quoted.pdf-0002'"
+
+
+def test_search_pages_without_sortable_id():
+    search_client = FakeSearchClient(make_chunks({"a.pdf": 5}), sortable_id=False)
+    pages = list(search_pages(search_client, page_size=2))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert search_client.searches[-1] == {"filter": None, "order_by": None, "top": None}
+
+
+def test_export_snapshot(tmp_path):
+    chunks = make_chunks({"a.pdf": 3, "b.pdf": 2})
+    snapshot_path = tmp_path / "snapshot.jsonl.gz"
+    assert export_snapshot(FakeSearchClient(chunks), snapshot_path, page_size=2) == 5
+    assert list(read_snapshot(snapshot_path)) == [
+        {field: chunk[field] for field in ["id", "content", "sourcepage", "sourcefile"]} for chunk in chunks
+    ]
+    assert not (tmp_path / "snapshot.jsonl.gz.tmp").exists()
+
+    # A failed export leaves the previous snapshot
+    search_client = FakeSearchClient(chunks, sortable_id=False)
+    search_client.search = lambda **kwargs: (_ for _ in ()).throw(HttpResponseError("Service unavailable"))
+    with pytest.raises(HttpResponseError):
+        export_snapshot(search_client, snapshot_path)
+    assert len(list(read_snapshot(snapshot_path))) == 5
+
+
+def test_sample_allocation():
+    counts = Counter({"large.pdf": 90, "medium.pdf": 9, "small.pdf": 1})
+    assert sample_allocation(counts, 10) == {"large.pdf": 7, "medium.pdf": 2, "small.pdf": 1}
+    assert sum(sample_allocation(counts, 50).values()) == 50
+    assert sample_allocation(counts, 2) == {"large.pdf": 1, "medium.pdf": 1, "small.pdf": 0}
+    assert sample_allocation(counts, 1000) == dict(counts)
+
+
+def test_stratified_sample(tmp_path):
+    chunks = make_chunks({"large.pdf": 90, "medium.pdf": 9, "small.pdf": 1})
+    counts = Counter(chunk["sourcefile"] for chunk in chunks)
+    sample = stratified_sample(chunks, counts, 10)
+    assert Counter(chunk["sourcefile"] for chunk in sample) == {"large.pdf": 7, "medium.pdf": 2, "small.pdf": 1}
+    assert len({chunk["id"] for chunk in sample}) == 10
+    assert stratified_sample(chunks, counts, 10) == sample
+    assert stratified_sample(chunks, counts, 10, seed=1) != sample
+
+    snapshot_path = tmp_path / "snapshot.jsonl.gz"
+    export_snapshot(FakeSearchClient(chunks), snapshot_path)
+    assert len(list(snapshot_chunks(snapshot_path))) == 100
+    assert [chunk["id"] for chunk in snapshot_chunks(snapshot_path, 10)] == [
+        chunk["id"] for chunk in stratified_sample(sorted(chunks, key=lambda chunk: chunk["id"]), counts, 10)
+    ]
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from evals.target_responses import (
+    CachedTarget,
+    ResponseCache,
+    get_responses,
+    latency_summary,
+    percentile,
+    update_results,
+)
+
+TARGET_PARAMETERS = {"overrides": {"top": 3}}
+
+
+@pytest.fixture
+def target_app():
+    """A stand-in for the app's /chat endpoint, which takes 50 ms to answer and fails for the question "fail"."""
+    app = {"requests": 0, "running": 0, "most_running": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            question = body["messages"][-1]["content"]
+            with lock:
+                app["requests"] += 1
+                app["running"] += 1
+                app["most_running"] = max(app["most_running"], app["running"])
+            time.sleep(0.05)
+            with lock:
+                app["running"] -= 1
+            if question == "fail":
+                self.send_response(500)
+                self.end_headers()
+                return
+            content = json.dumps(
+                {
+                    "message": {"content": f"Answer to {question}", "role": "assistant"},
+                    "context": {
+                        "data_points": {"text": []},
+                        "thoughts": [
+                            {"title": "Search using generated search query", "props": {"latency_ms": 20.0}},
+                            {"title": "Prompt to generate answer", "props": {}},
+                        ],
+                    },
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app["url"] = f"http://127.0.0.1:{server.server_address[1]}/chat"
+    yield app
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_responses_concurrently_and_cached(target_app, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.db"))
+    questions = [f"Question {index}" for index in range(8)] + ["fail"]
+
+    responses = get_responses(questions, target_app["url"], TARGET_PARAMETERS, cache, concurrency=4)
+    assert [response.question for response in responses] == questions
+    assert responses[0].response["message"]["content"] == "Answer to Question 0"
+    assert responses[0].latency >= 0.05
+    assert responses[0].latency_breakdown["Search using generated search query"] == 20.0
+    assert responses[0].latency_breakdown["other"] >= 30
+    assert responses[-1].response is None
+    assert target_app["most_running"] == 4
+
+    # A metric-only rerun only sends the failed question again
+    target_app["requests"] = 0
+    responses = get_responses(questions, target_app["url"], TARGET_PARAMETERS, cache, concurrency=4)
+    assert target_app["requests"] == 1
+    assert all(response.cached for response in responses[:-1])
+
+    # Other target parameters aren't answered from the cache
+    get_responses(questions[:2], target_app["url"], {"overrides": {"top": 5}}, cache)
+    assert target_app["requests"] == 3
+
+    target_app["requests"] = 0
+    get_responses(questions[:2], target_app["url"], TARGET_PARAMETERS, cache, requery=True)
+    assert target_app["requests"] == 2
+
+
+def test_cached_target(target_app, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.db"))
+    get_responses(["Question 0"], target_app["url"], TARGET_PARAMETERS, cache)
+    target_app["requests"] = 0
+
+    with CachedTarget(cache, target_app["url"]) as cached_target_url:
+        for question in ["Question 0", "Question 1"]:
+            body = {"messages": [{"content": question, "role": "user"}], "context": TARGET_PARAMETERS}
+            response = requests.post(cached_target_url, json=body)
+            assert response.json()["message"]["content"] == f"Answer to {question}"
+    # Only the question that wasn't cached was forwarded to the target
+    assert target_app["requests"] == 1
+
+
+def test_update_results(target_app, tmp_path):
+    questions = ["Question 0", "Question 1", "fail"]
+    responses = get_responses(questions, target_app["url"], TARGET_PARAMETERS, None)
+    # What the evaluator wrote, with latencies measured against the cached target
+    (tmp_path / "eval_results.jsonl").write_text(
+        "".join(
+            json.dumps({"question": question, "latency": 0.001, "gpt_relevance": 5}) + "\n" for question in questions
+        )
+    )
+    (tmp_path / "summary.json").write_text(json.dumps({"gpt_relevance": {"mean_rating": 5}, "latency": {"mean": 0}}))
+    (tmp_path / "evaluate_parameters.json").write_text(json.dumps({"target_url": "http://127.0.0.1:1234/chat"}))
+
+    update_results(tmp_path, responses, target_app["url"])
+    results = [json.loads(line) for line in (tmp_path / "eval_results.jsonl").read_text().splitlines()]
+    assert results[0]["latency"] >= 0.05
+    assert results[0]["gpt_relevance"] == 5
+    assert results[0]["latency_breakdown"]["Search using generated search query"] == 20.0
+    # A question the target failed to answer has no latency of its own to report
+    assert results[2]["latency"] == 0.001
+    assert "latency_breakdown" not in results[2]
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert summary["gpt_relevance"] == {"mean_rating": 5}
+    assert summary["latency"] == latency_summary(responses)
+    assert set(summary["latency"]) == {"mean", "max", "min", "p50", "p95", "p99"}
+    parameters = json.loads((tmp_path / "evaluate_parameters.json").read_text())
+    assert parameters["target_url"] == target_app["url"]
+
+
+def test_percentile():
+    latencies = [float(value) for value in range(1, 101)]
+    assert percentile(latencies, 50) == 50.5
+    assert percentile(latencies, 95) == pytest.approx(95.05)
+    assert percentile(latencies, 99) == pytest.approx(99.01)
+    assert percentile([2.0], 99) == 2.0
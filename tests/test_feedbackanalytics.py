@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from chat_history.feedbackanalytics import (
+    RECENT_FEEDBACK_LIMIT,
+    FeedbackAnalytics,
+    FeedbackEvent,
+)
+
+from .mocks import MockCosmosContainer
+
+
+def feedback_event(index: int, feedback_type, previous_type=None):
+    feedback = None
+    if feedback_type:
+        feedback = {"type": feedback_type, "comment": f"Comment {index}", "timestamp": f"2025-01-01T00:00:{index:02}"}
+    return FeedbackEvent(
+        message_id=f"123-{index}",
+        session_id="123",
+        previous_type=previous_type,
+        feedback=feedback,
+        question=f"Question {index}",
+    )
+
+
+@pytest.mark.asyncio
+async def test_feedback_analytics_empty():
+    analytics = await FeedbackAnalytics(MockCosmosContainer()).read()
+    assert analytics == {
+        "total_feedback": 0,
+        "positive_feedback": 0,
+        "negative_feedback": 0,
+        "recent_feedback": [],
+        "daily_feedback": [],
+    }
+
+
+@pytest.mark.asyncio
+async def test_feedback_analytics_record():
+    container = MockCosmosContainer()
+    feedback_analytics = FeedbackAnalytics(container)
+    await feedback_analytics.record([feedback_event(0, "positive"), feedback_event(1, "negative")])
+    await feedback_analytics.record([feedback_event(2, "positive")])
+
+    container.calls.clear()
+    analytics = await feedback_analytics.read()
+    # Two point reads and a query of one partition, however much feedback there is
+    assert container.calls == {"read_item": 2, "query_items": 1}
+    assert analytics["total_feedback"] == 3
+    assert analytics["positive_feedback"] == 2
+    assert analytics["negative_feedback"] == 1
+    assert [entry["message_id"] for entry in analytics["recent_feedback"]] == ["123-2", "123-1", "123-0"]
+    assert analytics["recent_feedback"][0]["question"] == "Question 2"
+    today = datetime.now(timezone.utc).date().isoformat()
+    assert analytics["daily_feedback"] == [{"date": today, "total": 3, "positive": 2, "negative": 1}]
+
+
+@pytest.mark.asyncio
+async def test_feedback_analytics_changed_and_removed():
+    container = MockCosmosContainer()
+    feedback_analytics = FeedbackAnalytics(container)
+    await feedback_analytics.record([feedback_event(0, "positive"), feedback_event(1, "positive")])
+    await feedback_analytics.record([feedback_event(0, "negative", previous_type="positive")])
+    await feedback_analytics.record([feedback_event(1, None, previous_type="positive")])
+
+    analytics = await feedback_analytics.read()
+    # The totals count the feedback the message pairs have now
+    assert analytics["total_feedback"] == 1
+    assert analytics["positive_feedback"] == 0
+    assert analytics["negative_feedback"] == 1
+    assert [entry["message_id"] for entry in analytics["recent_feedback"]] == ["123-0"]
+    assert analytics["recent_feedback"][0]["type"] == "negative"
+    # The day counts each time feedback was given
+    assert analytics["daily_feedback"][0]["total"] == 3
+
+
+@pytest.mark.asyncio
+async def test_feedback_analytics_comment_edit():
+    container = MockCosmosContainer()
+    feedback_analytics = FeedbackAnalytics(container)
+    await feedback_analytics.record([feedback_event(0, "positive")])
+    await feedback_analytics.record([feedback_event(0, "positive", previous_type="positive")])
+
+    analytics = await feedback_analytics.read()
+    assert analytics["total_feedback"] == 1
+    assert analytics["daily_feedback"][0]["total"] == 1
+    assert len(analytics["recent_feedback"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_feedback_analytics_concurrent():
+    container = MockCosmosContainer()
+    feedback_analytics = FeedbackAnalytics(container)
+    events = [feedback_event(index % 60, "positive" if index % 3 else "negative") for index in range(150)]
+    for index, event in enumerate(events):
+        event.message_id = f"{index}"
+    # Workers recording feedback at the same time don't lose each other's updates
+    for start in range(0, len(events), 4):
+        await asyncio.gather(*(feedback_analytics.record([event]) for event in events[start : start + 4]))
+
+    analytics = await feedback_analytics.read()
+    assert analytics["total_feedback"] == 150
+    assert analytics["negative_feedback"] == 50
+    assert len(analytics["recent_feedback"]) == RECENT_FEEDBACK_LIMIT
+    assert len({entry["message_id"] for entry in analytics["recent_feedback"]}) == RECENT_FEEDBACK_LIMIT
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from approaches.hedging import RequestHedger
+
+
+def create_hedger(latency: float, **kwargs) -> RequestHedger:
+    hedger = RequestHedger(min_samples=10, **kwargs)
+    hedger.latencies.extend([latency] * 10)
+    return hedger
+
+
+@pytest.mark.asyncio
+async def test_hedger_waits_for_samples():
+    hedger = RequestHedger(min_samples=10)
+    requests = 0
+
+    async def request():
+        nonlocal requests
+        requests += 1
+        return "rewritten query"
+
+    assert await hedger.run(request) == "rewritten query"
+    assert requests == 1
+    assert hedger.hedge_delay() is None
+    assert list(hedger.latencies) != []
+
+
+@pytest.mark.asyncio
+async def test_hedger_sends_duplicate_for_slow_request():
+    hedger = create_hedger(0.01, max_hedge_rate=1.0)
+    delays = [1.0, 0.0]
+    cancelled = []
+
+    async def request():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return f"answered after {delay}"
+
+    assert await hedger.run(request) == "answered after 0.0"
+    await asyncio.sleep(0)
+
+    assert cancelled == [1.0]
+    assert hedger.as_props()["hedge_rate"] == 1.0
+    assert hedger.hedge_wins == 1
+
+
+@pytest.mark.asyncio
+async def test_hedger_keeps_fast_primary():
+    hedger = create_hedger(0.05, max_hedge_rate=1.0)
+    requests = 0
+
+    async def request():
+        nonlocal requests
+        requests += 1
+        return "rewritten query"
+
+    await hedger.run(request)
+
+    assert requests == 1
+    assert hedger.hedged_calls == 0
+
+
+@pytest.mark.asyncio
+async def test_hedger_caps_hedge_rate():
+    hedger = create_hedger(0.001, max_hedge_rate=0.5)
+    requests = 0
+
+    async def request():
+        nonlocal requests
+        requests += 1
+        await asyncio.sleep(0.02)
+        return "rewritten query"
+
+    for _ in range(4):
+        await hedger.run(request)
+
+    assert hedger.hedged_calls == 2
+    assert requests == 6
+
+
+@pytest.mark.asyncio
+async def test_hedger_falls_back_when_duplicate_fails():
+    hedger = create_hedger(0.01, max_hedge_rate=1.0)
+    outcomes = [(0.05, None), (0.0, ValueError("throttled"))]
+
+    async def request():
+        delay, error = outcomes.pop(0)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return "rewritten query"
+
+    assert await hedger.run(request) == "rewritten query"
+    assert hedger.hedge_wins == 0
+
+
+@pytest.mark.asyncio
+async def test_hedger_raises_when_all_requests_fail():
+    hedger = create_hedger(0.01, max_hedge_rate=1.0)
+
+    async def request():
+        await asyncio.sleep(0.02)
+        raise ValueError("throttled")
+
+    with pytest.raises(ValueError):
+        await hedger.run(request)
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import pytest
+
+from core.ingestionqueue import JOB_FAILED, JOB_RUNNING, JOB_SUCCEEDED, IngestionQueue
+
+
+async def wait_for_status(queue: IngestionQueue, job_id: str, user_oid: str, status: str):
+    for _ in range(200):
+        job = await queue.get(job_id, user_oid)
+        if job and job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} never reached {status}: {job}")
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_processes_jobs(tmp_path):
+    ingested = []
+
+    async def ingest(user_oid: str, filename: str):
+        ingested.append((user_oid, filename))
+
+    queue = IngestionQueue(str(tmp_path / "queue.db"), ingest, poll_interval=0.01)
+    queue.start()
+    try:
+        job_id = await queue.add("OID_X", "a.txt")
+        job = await wait_for_status(queue, job_id, "OID_X", JOB_SUCCEEDED)
+    finally:
+        await queue.stop()
+    assert ingested == [("OID_X", "a.txt")]
+    assert job["filename"] == "a.txt"
+    assert job["attempts"] == 1
+    assert await queue.get(job_id, "OID_Y") is None
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_records_failures(tmp_path):
+    async def ingest(user_oid: str, filename: str):
+        raise ValueError("Unsupported file")
+
+    queue = IngestionQueue(str(tmp_path / "queue.db"), ingest, poll_interval=0.01)
+    queue.start()
+    try:
+        job_id = await queue.add("OID_X", "a.xyz")
+        job = await wait_for_status(queue, job_id, "OID_X", JOB_FAILED)
+    finally:
+        await queue.stop()
+    assert job["error"] == "Unsupported file"
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_user_concurrency(tmp_path):
+    running: dict[str, int] = {}
+    most_running: dict[str, int] = {}
+    release = asyncio.Event()
+
+    async def ingest(user_oid: str, filename: str):
+        running[user_oid] = running.get(user_oid, 0) + 1
+        most_running[user_oid] = max(most_running.get(user_oid, 0), running[user_oid])
+        await release.wait()
+        running[user_oid] -= 1
+
+    queue = IngestionQueue(str(tmp_path / "queue.db"), ingest, concurrency=3, user_concurrency=1, poll_interval=0.01)
+    queue.start()
+    try:
+        job_ids = [await queue.add("OID_X", f"{index}.txt") for index in range(3)]
+        other_job_id = await queue.add("OID_Y", "b.txt")
+        # Another user's job doesn't wait behind the first user's
+        await wait_for_status(queue, other_job_id, "OID_Y", JOB_RUNNING)
+        release.set()
+        for job_id in job_ids:
+            await wait_for_status(queue, job_id, "OID_X", JOB_SUCCEEDED)
+    finally:
+        await queue.stop()
+    assert most_running == {"OID_X": 1, "OID_Y": 1}
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_resumes_after_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+    started = asyncio.Event()
+
+    async def ingest_forever(user_oid: str, filename: str):
+        started.set()
+        await asyncio.Event().wait()
+
+    queue = IngestionQueue(path, ingest_forever, poll_interval=0.01)
+    queue.start()
+    job_id = await queue.add("OID_X", "a.txt")
+    await started.wait()
+    await queue.stop()
+
+    ingested = []
+
+    async def ingest(user_oid: str, filename: str):
+        ingested.append(filename)
+
+    restarted_queue = IngestionQueue(path, ingest, poll_interval=0.01)
+    restarted_queue.start()
+    try:
+        job = await wait_for_status(restarted_queue, job_id, "OID_X", JOB_SUCCEEDED)
+    finally:
+        await restarted_queue.stop()
+    assert ingested == ["a.txt"]
+    # Stopping the first worker handed the job back, so it isn't counted as an attempt
+    assert job["attempts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_reclaims_expired_leases(tmp_path):
+    path = str(tmp_path / "queue.db")
+
+    async def ingest(user_oid: str, filename: str):
+        pass
+
+    # A worker that stopped without handing back its job
+    crashed_queue = IngestionQueue(path, ingest, lease_seconds=0.05)
+    job_id = await crashed_queue.add("OID_X", "a.txt")
+    assert (await crashed_queue.claim())["id"] == job_id
+    assert await crashed_queue.claim() is None
+
+    queue = IngestionQueue(path, ingest, lease_seconds=0.05, max_attempts=2)
+    time.sleep(0.06)
+    assert (await queue.claim())["id"] == job_id
+    time.sleep(0.06)
+    # Each claim counts as an attempt, so the job isn't retried any more
+    assert await queue.claim() is None
+    job = await queue.get(job_id, "OID_X")
+    assert job["status"] == JOB_FAILED
+    assert job["attempts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_get_while_locked(tmp_path):
+    async def ingest(user_oid: str, filename: str):
+        pass
+
+    queue = IngestionQueue(str(tmp_path / "queue.db"), ingest)
+    job_id = await queue.add("OID_X", "a.txt")
+    writer = queue.connect()
+    try:
+        # Another worker holds the write lock, which a status poll shouldn't wait for
+        writer.execute("BEGIN IMMEDIATE")
+        started = time.monotonic()
+        job = await queue.get(job_id, "OID_X")
+        assert time.monotonic() - started < 5
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+    assert job["filename"] == "a.txt"
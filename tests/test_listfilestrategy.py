@@ -1,17 +1,20 @@
+import asyncio
 import hashlib
 import io
 import os
 import tempfile
 
+import azure.storage.filedatalake
 import pytest
 
 from prepdocslib.listfilestrategy import (
     ADLSGen2ListFileStrategy,
+    ADLSGen2ListingState,
     File,
     LocalListFileStrategy,
 )
 
-from .mocks import MockAzureCredential
+from .mocks import MockAsyncPageIterator, MockAzureCredential
 
 
 def test_file_filename():
@@ -145,3 +148,113 @@ async def test_read_adls_gen2_files(monkeypatch, mock_data_lake_service_client):
     assert files[1].acls == {"oids": ["B-USER-ID"], "groups": ["B-GROUP-ID"]}
     assert files[2].filename() == "c.txt"
     assert files[2].acls == {"oids": ["C-USER-ID"], "groups": ["C-GROUP-ID"]}
+
+
+@pytest.fixture
+def mock_data_lake_files(monkeypatch, mock_data_lake_service_client):
+    # Two files with the same name in different folders
+    data_lake = {
+        "one/a.txt": {"etag": "1", "acl": "user:A-USER-ID:r-x", "content": b"one"},
+        "two/a.txt": {"etag": "1", "acl": "user:B-USER-ID:r-x", "content": b"two"},
+        "two/b.txt": {"etag": "1", "acl": "user:B-USER-ID:r-x", "content": b"three"},
+    }
+    downloads = []
+    running = 0
+    most_running = 0
+
+    def mock_get_paths(self, *args, **kwargs):
+        return MockAsyncPageIterator(
+            [
+                azure.storage.filedatalake.PathProperties(name=path, etag=properties["etag"])
+                for path, properties in data_lake.items()
+            ]
+        )
+
+    async def mock_get_access_control(self, *args, **kwargs):
+        return {"acl": data_lake[self.path]["acl"]}
+
+    class MockDownloader:
+        def __init__(self, path):
+            self.path = path
+
+        async def readinto(self, stream):
+            nonlocal running, most_running
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            downloads.append(self.path)
+            stream.write(data_lake[self.path]["content"])
+
+    async def mock_download_file(self, *args, **kwargs):
+        return MockDownloader(self.path)
+
+    aio = azure.storage.filedatalake.aio
+    monkeypatch.setattr(aio.FileSystemClient, "get_paths", mock_get_paths)
+    monkeypatch.setattr(aio.DataLakeFileClient, "get_access_control", mock_get_access_control)
+    monkeypatch.setattr(aio.DataLakeFileClient, "download_file", mock_download_file)
+    return data_lake, downloads, lambda: most_running
+
+
+@pytest.mark.asyncio
+async def test_read_adls_gen2_files_concurrently(mock_data_lake_files):
+    _, downloads, most_running = mock_data_lake_files
+    adlsgen2_list_strategy = ADLSGen2ListFileStrategy(
+        data_lake_storage_account="a",
+        data_lake_filesystem="a",
+        data_lake_path="a",
+        credential=MockAzureCredential(),
+        concurrency=3,
+    )
+
+    contents = []
+    temp_paths = []
+    async for file in adlsgen2_list_strategy.list():
+        # The next files are downloaded while this one is being processed
+        await asyncio.sleep(0.05)
+        contents.append((file.filename(), file.content.read(), file.acls["oids"]))
+        temp_paths.append(file.content.name)
+        file.close()
+    assert most_running() == 3
+    assert contents == [
+        ("a.txt", b"one", ["A-USER-ID"]),
+        ("a.txt", b"two", ["B-USER-ID"]),
+        ("b.txt", b"three", ["B-USER-ID"]),
+    ]
+    # Each file had its own temporary path, removed once the next file was asked for
+    assert len(set(temp_paths)) == 3
+    assert not any(os.path.exists(path) for path in temp_paths)
+
+
+@pytest.mark.asyncio
+async def test_read_adls_gen2_files_skips_unchanged(mock_data_lake_files, tmp_path):
+    data_lake, downloads, _ = mock_data_lake_files
+    adlsgen2_list_strategy = ADLSGen2ListFileStrategy(
+        data_lake_storage_account="a",
+        data_lake_filesystem="a",
+        data_lake_path="a",
+        credential=MockAzureCredential(),
+        listing_state=ADLSGen2ListingState(str(tmp_path / "listing.db")),
+    )
+
+    files = adlsgen2_list_strategy.list()
+    async for file in files:
+        file.close()
+        # A file isn't remembered until the consumer asks for the next one
+        break
+    await files.aclose()
+    assert len([file async for file in adlsgen2_list_strategy.list()]) == 3
+
+    # Only the changed file is downloaded again, and a change of ACLs counts as a change
+    downloads.clear()
+    data_lake["two/a.txt"]["etag"] = "2"
+    data_lake["two/b.txt"]["acl"] = "user:C-USER-ID:r-x"
+    files = [file async for file in adlsgen2_list_strategy.list()]
+    assert sorted(downloads) == ["two/a.txt", "two/b.txt"]
+    assert [file.acls["oids"] for file in files] == [["B-USER-ID"], ["C-USER-ID"]]
+    for file in files:
+        file.close()
+
+    downloads.clear()
+    assert [file async for file in adlsgen2_list_strategy.list()] == []
+    assert downloads == []
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import pytest
+
+from core.loopmonitor import EventLoopMonitor, recommend_workers
+
+
+def test_recommend_workers():
+    # Nine workers with mostly idle loops can do with fewer
+    assert recommend_workers(0.1, workers=9, cpus=4) == 2
+    # Busy loops need more workers, but no more than there are CPUs
+    assert recommend_workers(0.9, workers=2, cpus=4) == 3
+    assert recommend_workers(1.0, workers=9, cpus=4) == 4
+    assert recommend_workers(0.0, workers=9, cpus=4) == 1
+
+
+def busy_wait(seconds: float):
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_event_loop_monitor_measures_busy_loop():
+    monitor = EventLoopMonitor(interval=0.1, workers=1, cpus=1, probe_interval=0.01)
+    asyncio.get_running_loop().call_later(0.02, busy_wait, 0.05)
+
+    utilization, max_lag = await monitor.measure()
+
+    assert utilization > 0.3
+    assert max_lag >= 0.03
+
+
+@pytest.mark.asyncio
+async def test_event_loop_monitor_stops():
+    monitor = EventLoopMonitor(interval=0.01, workers=1, cpus=1, probe_interval=0.005)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert monitor.task is not None and monitor.task.cancelled()
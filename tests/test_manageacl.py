@@ -1,6 +1,9 @@
+import json
 import logging
+import re
 
 import pytest
+from azure.core.exceptions import HttpResponseError
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.search.documents.indexes.models import (
@@ -10,6 +13,7 @@ from azure.search.documents.indexes.models import (
 )
 
 from .mocks import MockAzureCredential
+from scripts import manageacl
 from scripts.manageacl import ManageAcl
 
 
@@ -209,6 +213,120 @@ async def test_update_storage_urls(monkeypatch, caplog):
         assert "Updating storage URL for 1 search documents" in caplog.text
 
 
+class KeyOrderedIndex:
+    """Search documents keyed by id, searched in key order with the "id gt" filter and top of each page."""
+
+    def __init__(self, ids):
+        self.documents = {id: {"id": id, "oids": ["OID_EXISTS"]} for id in ids}
+        self.filters = []
+        self.merged_documents = []
+        self.failing_id = None
+
+    async def search(self, *args, **kwargs):
+        self.filters.append(kwargs["filter"])
+        assert kwargs["order_by"] == ["id asc"]
+        match = re.search(r"id gt '(.*)'", kwargs["filter"])
+        ids = [id for id in sorted(self.documents) if match is None or id > match.group(1)]
+        return AsyncSearchResultsIterator([dict(self.documents[id]) for id in reversed(ids[: kwargs["top"]])])
+
+    async def merge_documents(self, documents):
+        for document in documents:
+            if document["id"] == self.failing_id:
+                raise Exception("Service unavailable")
+        self.merged_documents.append([document["id"] for document in documents])
+
+
+def add_acl_command(**kwargs):
+    return ManageAcl(
+        service_name="SERVICE",
+        index_name="INDEX",
+        url="https://test.blob.core.windows.net/content/a.txt",
+        acl_action="add",
+        acl_type="oids",
+        acl="OID_ADD",
+        credentials=MockAzureCredential(),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_acl_pages_in_key_order(monkeypatch, caplog):
+    index = KeyOrderedIndex(["a", "b", "c", "d", "e"])
+    monkeypatch.setattr(SearchClient, "search", index.search)
+    monkeypatch.setattr(SearchClient, "merge_documents", index.merge_documents)
+    monkeypatch.setattr(manageacl, "PAGE_SIZE", 2)
+    monkeypatch.setattr(manageacl, "MERGE_BATCH_SIZE", 1)
+
+    with caplog.at_level(logging.INFO):
+        await add_acl_command().run()
+    assert index.filters == [
+        "storageUrl eq 'https://test.blob.core.windows.net/content/a.txt'",
+        "(storageUrl eq 'https://test.blob.core.windows.net/content/a.txt') and id gt 'b'",
+        "(storageUrl eq 'https://test.blob.core.windows.net/content/a.txt') and id gt 'd'",
+    ]
+    assert sorted(index.merged_documents) == [["a"], ["b"], ["c"], ["d"], ["e"]]
+    assert "Adding acl OID_ADD to 5 search documents" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_add_acl_resumes_from_checkpoint(monkeypatch, tmp_path):
+    index = KeyOrderedIndex(["a", "b", "c", "d", "e"])
+    index.failing_id = "d"
+    monkeypatch.setattr(SearchClient, "search", index.search)
+    monkeypatch.setattr(SearchClient, "merge_documents", index.merge_documents)
+    monkeypatch.setattr(manageacl, "PAGE_SIZE", 2)
+    checkpoint_path = tmp_path / "checkpoint.json"
+
+    with pytest.raises(Exception, match="Service unavailable"):
+        await add_acl_command(checkpoint_path=str(checkpoint_path)).run()
+    assert json.loads(checkpoint_path.read_text()) == {"last_key": "b", "found": 2, "changed": 2}
+
+    index.failing_id = None
+    index.filters, index.merged_documents = [], []
+    await add_acl_command(checkpoint_path=str(checkpoint_path)).run()
+    assert index.filters[0] == "(storageUrl eq 'https://test.blob.core.windows.net/content/a.txt') and id gt 'b'"
+    assert index.merged_documents == [["c", "d"], ["e"]]
+    assert not checkpoint_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_add_acl_dry_run(monkeypatch, capsys, tmp_path):
+    index = KeyOrderedIndex(["a", "b", "c", "d", "e"])
+    monkeypatch.setattr(SearchClient, "search", index.search)
+    monkeypatch.setattr(SearchClient, "merge_documents", index.merge_documents)
+    monkeypatch.setattr(manageacl, "PAGE_SIZE", 2)
+
+    await add_acl_command(dry_run=True, checkpoint_path=str(tmp_path / "checkpoint.json")).run()
+    assert index.merged_documents == []
+    assert not (tmp_path / "checkpoint.json").exists()
+    assert "Dry run: would change 5 of 5 search documents in 3 merge batches" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_add_acl_without_sortable_id(monkeypatch, caplog):
+    async def mock_search(self, *args, **kwargs):
+        if "order_by" in kwargs:
+            error = HttpResponseError("Invalid expression: id is not sortable")
+            error.status_code = 400
+            raise error
+        return AsyncSearchResultsIterator([{"id": id, "oids": []} for id in range(5)])
+
+    merged_documents = []
+
+    async def mock_merge_documents(self, *args, **kwargs):
+        merged_documents.extend(kwargs.get("documents"))
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    monkeypatch.setattr(SearchClient, "merge_documents", mock_merge_documents)
+    monkeypatch.setattr(manageacl, "PAGE_SIZE", 2)
+
+    with caplog.at_level(logging.INFO):
+        await add_acl_command().run()
+    assert len(merged_documents) == 5
+    assert "Searching the whole index at once" in caplog.text
+    assert "Adding acl OID_ADD to 5 search documents" in caplog.text
+
+
 @pytest.mark.asyncio
 async def test_enable_acls_with_missing_fields(monkeypatch, capsys):
     async def mock_get_index(self, *args, **kwargs):
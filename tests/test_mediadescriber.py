@@ -4,7 +4,11 @@ import logging
 import aiohttp
 import pytest
 
-from prepdocslib.mediadescriber import ContentUnderstandingDescriber
+from prepdocslib import mediadescriber
+from prepdocslib.mediadescriber import (
+    ContentUnderstandingDescriber,
+    MediaDescriptionCache,
+)
 
 from .mocks import MockAzureCredential, MockResponse
 
@@ -133,3 +137,58 @@ async def test_contentunderstanding_analyze(monkeypatch, caplog):
     )
     with pytest.raises(Exception):
         await describer_bad_analyze.describe_image(b"imagebytes")
+
+
+@pytest.mark.asyncio
+async def test_contentunderstanding_poll_retry_after(monkeypatch):
+    statuses = [("NotStarted", {"Retry-After": "3"}), ("Running", {}), ("Running", {}), ("Succeeded", {})]
+
+    def mock_get(self, url, **kwargs):
+        status, headers = statuses.pop(0)
+        return MockResponse(status=200, text=json.dumps({"status": status}), headers=headers)
+
+    waits = []
+
+    async def mock_sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+    monkeypatch.setattr(mediadescriber.asyncio, "sleep", mock_sleep)
+
+    describer = ContentUnderstandingDescriber(endpoint="https://example.com", credential=MockAzureCredential())
+    async with aiohttp.ClientSession() as session:
+        result = await describer.poll_api(session, "https://example.com/operations/1", {})
+    assert result == {"status": "Succeeded"}
+    # The service's Retry-After is used when it's given, otherwise the interval grows
+    assert waits == [3, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_contentunderstanding_poll_timeout(monkeypatch):
+    def mock_get(self, url, **kwargs):
+        return MockResponse(status=200, text=json.dumps({"status": "Running"}))
+
+    async def mock_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+    monkeypatch.setattr(mediadescriber.asyncio, "sleep", mock_sleep)
+    monkeypatch.setattr(mediadescriber, "POLL_TIMEOUT", 0)
+
+    describer = ContentUnderstandingDescriber(endpoint="https://example.com", credential=MockAzureCredential())
+    async with aiohttp.ClientSession() as session:
+        with pytest.raises(TimeoutError):
+            await describer.poll_api(session, "https://example.com/operations/1", {})
+
+
+def test_media_description_cache(tmp_path):
+    describer = ContentUnderstandingDescriber(endpoint="https://example.com", credential=MockAzureCredential())
+    key = describer.cache_key(b"imagebytes")
+    assert key == describer.cache_key(b"imagebytes")
+    assert key != describer.cache_key(b"otherimagebytes")
+
+    cache = MediaDescriptionCache(str(tmp_path / "media-descriptions.db"))
+    assert cache.get(key) is None
+    cache.set(key, "A pie chart")
+    # The descriptions are kept for the next ingestion
+    assert MediaDescriptionCache(str(tmp_path / "media-descriptions.db")).get(key) == "A pie chart"
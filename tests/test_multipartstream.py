@@ -0,0 +1,46 @@
+import pytest
+
+from core.multipartstream import MultipartFileStream
+
+BOUNDARY = "----boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart_body(content: bytes) -> bytes:
+    return (
+        (
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="name"\r\n\r\n'
+            "ignored\r\n"
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        ).encode()
+        + content
+        + f"\r\n--{BOUNDARY}--\r\n".encode()
+    )
+
+
+async def in_chunks(body: bytes, chunk_size: int):
+    for start in range(0, len(body), chunk_size):
+        yield body[start : start + chunk_size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+async def test_multipart_file_stream(chunk_size):
+    content = bytes(range(256)) * 1000 + b"\r\n--not-the-boundary"
+    stream = MultipartFileStream(in_chunks(multipart_body(content), chunk_size), CONTENT_TYPE, "file")
+    assert await stream.open() == "a.pdf"
+    assert b"".join([chunk async for chunk in stream.chunks()]) == content
+
+
+@pytest.mark.asyncio
+async def test_multipart_file_stream_missing_file():
+    stream = MultipartFileStream(in_chunks(multipart_body(b"x"), 1024), CONTENT_TYPE, "document")
+    assert await stream.open() is None
+
+
+def test_multipart_file_stream_not_multipart():
+    with pytest.raises(ValueError):
+        MultipartFileStream(in_chunks(b"{}", 1024), "application/json", "file")
@@ -0,0 +1,125 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+from core.openairouter import OpenAIRouterTransport
+
+CHAT_COMPLETION = {
+    "id": "test-123",
+    "object": "chat.completion",
+    "created": 1,
+    "model": "gpt-4.1-mini",
+    "choices": [
+        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "The capital is Paris."}}
+    ],
+}
+
+
+class FakeOpenAIEndpoint:
+    """A local stand-in for one Azure OpenAI endpoint, answering with a fixed status after a delay."""
+
+    def __init__(self, status_code: int = 200, delay: float = 0, headers: dict[str, str] = {}, reachable=True):
+        self.status_code = status_code
+        self.reachable = reachable
+        self.delay = delay
+        self.headers = headers
+        self.requests: list[httpx.Request] = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if not self.reachable:
+            raise httpx.ConnectError("Connection refused", request=request)
+        await asyncio.sleep(self.delay)
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, headers=self.headers, json={"error": {"message": "busy"}})
+        return httpx.Response(200, headers=self.headers, json=CHAT_COMPLETION)
+
+
+def create_client(*endpoints: FakeOpenAIEndpoint) -> tuple[AsyncAzureOpenAI, OpenAIRouterTransport]:
+    router = OpenAIRouterTransport(
+        [f"https://test{index}.openai.azure.com" for index in range(len(endpoints))],
+        transports=[httpx.MockTransport(endpoint.handler) for endpoint in endpoints],
+    )
+    client = AsyncAzureOpenAI(
+        api_version="2024-10-21",
+        azure_endpoint="https://test0.openai.azure.com",
+        api_key="test-key",
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(transport=router),
+    )
+    return client, router
+
+
+async def create_chat_completion(client: AsyncAzureOpenAI):
+    return await client.chat.completions.create(
+        model="gpt-4.1-mini", messages=[{"role": "user", "content": "What is the capital of France?"}]
+    )
+
+
+@pytest.mark.asyncio
+async def test_router_prefers_fastest_backend():
+    slow, fast = FakeOpenAIEndpoint(delay=0.05), FakeOpenAIEndpoint()
+    client, router = create_client(slow, fast)
+
+    for _ in range(5):
+        response = await create_chat_completion(client)
+        assert response.choices[0].message.content == "The capital is Paris."
+
+    # Both are tried while they have no latency measurement, afterwards the faster one takes the traffic
+    assert len(slow.requests) == 1
+    assert len(fast.requests) == 4
+    assert fast.requests[0].url.host == "test1.openai.azure.com"
+    assert fast.requests[0].headers["host"] == "test1.openai.azure.com"
+    assert router.backends[0].latency > router.backends[1].latency
+
+
+@pytest.mark.asyncio
+async def test_router_fails_over_on_throttling():
+    throttled, healthy = FakeOpenAIEndpoint(status_code=429, headers={"retry-after-ms": "60000"}), FakeOpenAIEndpoint()
+    client, router = create_client(throttled, healthy)
+
+    await create_chat_completion(client)
+    await create_chat_completion(client)
+
+    # The throttled backend is benched after its first 429, so the second request goes straight to the healthy one
+    assert len(throttled.requests) == 1
+    assert len(healthy.requests) == 2
+    assert healthy.requests[0].content == throttled.requests[0].content
+    assert router.backends[0].stats == {"requests": 1, "throttled": 1, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_router_fails_over_on_connection_error():
+    client, router = create_client(FakeOpenAIEndpoint(reachable=False), FakeOpenAIEndpoint())
+
+    response = await create_chat_completion(client)
+
+    assert response.choices[0].message.content == "The capital is Paris."
+    assert router.backends[0].stats["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_router_returns_last_error_when_all_backends_fail():
+    client, router = create_client(FakeOpenAIEndpoint(status_code=429), FakeOpenAIEndpoint(status_code=503))
+
+    with pytest.raises(openai.APIStatusError):
+        await create_chat_completion(client)
+
+    assert [backend.stats["requests"] for backend in router.backends] == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_router_avoids_backend_without_quota():
+    nearly_exhausted = FakeOpenAIEndpoint(headers={"x-ratelimit-remaining-tokens": "10"})
+    plenty = FakeOpenAIEndpoint(delay=0.01, headers={"x-ratelimit-remaining-tokens": "50000"})
+    client, router = create_client(nearly_exhausted, plenty)
+
+    for _ in range(4):
+        await create_chat_completion(client)
+
+    assert router.backends[0].remaining_tokens == 10
+    assert len(nearly_exhausted.requests) == 1
+    assert len(plenty.requests) == 3
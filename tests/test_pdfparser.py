@@ -1,3 +1,4 @@
+import asyncio
 import io
 import json
 import logging
@@ -21,8 +22,15 @@ from azure.ai.documentintelligence.models import (
 from azure.core.exceptions import HttpResponseError
 from PIL import Image, ImageChops
 
-from prepdocslib.mediadescriber import ContentUnderstandingDescriber
-from prepdocslib.pdfparser import DocumentAnalysisParser
+from prepdocslib.mediadescriber import (
+    ContentUnderstandingDescriber,
+    MediaDescriptionCache,
+)
+from prepdocslib.pdfparser import (
+    AnalyzeResultCache,
+    DocumentAnalysisParser,
+    mask_spans,
+)
 
 from .mocks import MockAzureCredential
 
@@ -105,6 +113,83 @@ def test_table_to_html_with_spans():
     assert result_html == expected_html
 
 
+def test_table_to_html_cell_order():
+    # Cells aren't always listed in row and column order
+    table = DocumentTable(
+        row_count=2,
+        column_count=2,
+        cells=[
+            DocumentTableCell(row_index=1, column_index=1, content="D"),
+            DocumentTableCell(row_index=0, column_index=1, content="B", kind="columnHeader"),
+            DocumentTableCell(row_index=1, column_index=0, content="C", kind="rowHeader"),
+            DocumentTableCell(row_index=0, column_index=0, content="A", kind="columnHeader"),
+        ],
+    )
+    assert DocumentAnalysisParser.table_to_html(table) == (
+        "<figure><table><tr><th>A</th><th>B</th></tr><tr><th>C</th><td>D</td></tr></table></figure>"
+    )
+
+
+def test_mask_spans():
+    object_spans = [
+        # Starts before the page
+        [DocumentSpan(offset=95, length=10)],
+        # Two spans, the second running past the end of the page
+        [DocumentSpan(offset=108, length=4), DocumentSpan(offset=115, length=10)],
+        # Listed last, so it covers the part of the previous object it overlaps
+        [DocumentSpan(offset=110, length=3)],
+    ]
+    assert mask_spans(100, 20, object_spans) == [
+        (0, 5, 0),
+        (5, 8, None),
+        (8, 10, 1),
+        (10, 13, 2),
+        (13, 15, None),
+        (15, 20, 1),
+    ]
+    assert mask_spans(100, 20, []) == [(0, 20, None)]
+    assert mask_spans(100, 20, [[DocumentSpan(offset=0, length=10)]]) == [(0, 20, None)]
+    assert mask_spans(100, 0, object_spans) == []
+
+
+@pytest.mark.asyncio
+async def test_pages_from_result():
+    content = "Page one <T1> text <T2-a> and <T2-b>.<!-- PageBreak -->Page two <T3> ends."
+
+    def table(page_number, *spans):
+        return DocumentTable(
+            row_count=1,
+            column_count=1,
+            cells=[DocumentTableCell(row_index=0, column_index=0, content=content[spans[0][0] + 1 : spans[0][0] + 3])],
+            bounding_regions=[BoundingRegion(page_number=page_number, polygon=[])],
+            spans=[DocumentSpan(offset=offset, length=length) for offset, length in spans],
+        )
+
+    page_break = content.index("Page two")
+    analyze_result = AnalyzeResult(
+        content=content,
+        pages=[
+            DocumentPage(page_number=1, spans=[DocumentSpan(offset=0, length=page_break)]),
+            DocumentPage(page_number=2, spans=[DocumentSpan(offset=page_break, length=len(content) - page_break)]),
+        ],
+        # The tables aren't listed in page order, and the second one has two spans
+        tables=[
+            table(2, (content.index("<T3>"), 4)),
+            table(1, (content.index("<T1>"), 4)),
+            table(1, (content.index("<T2-a>"), 6), (content.index("<T2-b>"), 6)),
+        ],
+    )
+    parser = DocumentAnalysisParser(
+        endpoint="https://example.com", credential=MockAzureCredential(), use_content_understanding=False
+    )
+    pages = [page async for page in parser.pages_from_result(analyze_result)]
+
+    html = "<figure><table><tr><td>{}</td></tr></table></figure>"
+    assert pages[0].text == f"Page one {html.format('T1')} text {html.format('T2')} and ."
+    assert pages[1].text == f"Page two {html.format('T3')} ends."
+    assert pages[1].offset == len(pages[0].text)
+
+
 @pytest.mark.asyncio
 async def test_figure_to_html_without_bounding_regions():
     doc = MagicMock()
@@ -150,6 +235,88 @@ async def test_figure_to_html_with_bounding_regions(monkeypatch, caplog):
         assert "Figure 1 has more than one bounding region, using the first one" in caplog.text
 
 
+@pytest.mark.asyncio
+async def test_describe_figures(monkeypatch, tmp_path):
+    # The second and fourth figures show the same image, and the third has no bounding region
+    images = {"1": b"logo", "2": b"chart", "3": None, "4": b"logo", "5": b"diagram"}
+    figures = [
+        DocumentFigure(
+            id=figure_id,
+            caption=DocumentCaption(content=f"Figure {figure_id}"),
+            bounding_regions=[BoundingRegion(page_number=1, polygon=[0] * 8)] if image else None,
+        )
+        for figure_id, image in images.items()
+    ]
+    monkeypatch.setattr(DocumentAnalysisParser, "crop_figure", lambda doc, figure: images[figure.id])
+
+    described = []
+    running = 0
+    most_running = 0
+
+    async def mock_describe_image(self, image_bytes):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        described.append(image_bytes)
+        return image_bytes.decode().upper()
+
+    monkeypatch.setattr(ContentUnderstandingDescriber, "describe_image", mock_describe_image)
+    describer = ContentUnderstandingDescriber("https://example.com", MockAzureCredential())
+    parser = DocumentAnalysisParser(
+        endpoint="https://example.com",
+        credential=MockAzureCredential(),
+        figure_concurrency=2,
+        media_description_cache=MediaDescriptionCache(str(tmp_path / "media-descriptions.db")),
+    )
+
+    figure_htmls = await parser.describe_figures(MagicMock(), figures, describer)
+    assert figure_htmls == [
+        "<figure><figcaption>Figure 1<br>LOGO</figcaption></figure>",
+        "<figure><figcaption>Figure 2<br>CHART</figcaption></figure>",
+        "<figure><figcaption>Figure 3</figcaption></figure>",
+        "<figure><figcaption>Figure 4<br>LOGO</figcaption></figure>",
+        "<figure><figcaption>Figure 5<br>DIAGRAM</figcaption></figure>",
+    ]
+    assert sorted(described) == [b"chart", b"diagram", b"logo"]
+    assert most_running == 2
+
+    # Ingesting the document again uses the cached descriptions
+    described.clear()
+    assert await parser.describe_figures(MagicMock(), figures, describer) == figure_htmls
+    assert described == []
+
+
+@pytest.mark.asyncio
+async def test_describe_figures_error(monkeypatch):
+    figures = [
+        DocumentFigure(id=str(index), bounding_regions=[BoundingRegion(page_number=1, polygon=[0] * 8)])
+        for index in range(4)
+    ]
+    monkeypatch.setattr(DocumentAnalysisParser, "crop_figure", lambda doc, figure: figure.id.encode())
+    cancelled = []
+
+    async def mock_describe_image(self, image_bytes):
+        if image_bytes == b"0":
+            raise Exception("Failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(image_bytes)
+            raise
+        return ""
+
+    monkeypatch.setattr(ContentUnderstandingDescriber, "describe_image", mock_describe_image)
+    describer = ContentUnderstandingDescriber("https://example.com", MockAzureCredential())
+    parser = DocumentAnalysisParser(endpoint="https://example.com", credential=MockAzureCredential())
+
+    with pytest.raises(Exception, match="Failed"):
+        await parser.describe_figures(MagicMock(), figures, describer)
+    # The other figures have stopped being described by the time the error is raised
+    assert sorted(cancelled) == [b"1", b"2", b"3"]
+
+
 @pytest.mark.asyncio
 async def test_parse_simple(monkeypatch):
     mock_poller = MagicMock()
@@ -181,6 +348,97 @@ async def test_parse_simple(monkeypatch):
     assert pages[0].text == "Page content"
 
 
+@pytest.fixture
+def five_page_pdf():
+    doc = pymupdf.open()
+    for _ in range(5):
+        doc.new_page()
+    pdf_bytes = doc.tobytes()
+
+    def open_pdf() -> io.BytesIO:
+        content = io.BytesIO(pdf_bytes)
+        content.name = "Five Pages.pdf"
+        return content
+
+    return open_pdf
+
+
+def mock_shard_analysis(monkeypatch, failing_pages=None):
+    analyzed = []
+
+    async def mock_begin_analyze_document(self, model_id, analyze_request, pages=None, **kwargs):
+        analyzed.append(pages)
+        if pages == failing_pages:
+            raise HttpResponseError("Service unavailable")
+        first_page, last_page = (int(page) for page in pages.split("-"))
+        # Each shard's result has the content of its own pages, with the page numbers of the whole document
+        content = "".join(f"Page {page_number} " for page_number in range(first_page, last_page + 1))
+        poller = MagicMock()
+        poller.result = AsyncMock(
+            return_value=AnalyzeResult(
+                content=content,
+                pages=[
+                    DocumentPage(
+                        page_number=page_number,
+                        spans=[DocumentSpan(offset=content.index(f"Page {page_number} "), length=7)],
+                    )
+                    for page_number in range(first_page, last_page + 1)
+                ],
+            )
+        )
+        return poller
+
+    monkeypatch.setattr(DocumentIntelligenceClient, "begin_analyze_document", mock_begin_analyze_document)
+    return analyzed
+
+
+@pytest.mark.asyncio
+async def test_parse_shards(monkeypatch, tmp_path, five_page_pdf):
+    analyzed = mock_shard_analysis(monkeypatch)
+    parser = DocumentAnalysisParser(
+        endpoint="https://example.com",
+        credential=MockAzureCredential(),
+        use_content_understanding=False,
+        pages_per_shard=2,
+        analyze_result_cache=AnalyzeResultCache(str(tmp_path)),
+    )
+
+    pages = [page async for page in parser.parse(five_page_pdf())]
+    assert sorted(analyzed) == ["1-2", "3-4", "5-5"]
+    assert [(page.page_num, page.offset, page.text) for page in pages] == [
+        (0, 0, "Page 1"),
+        (1, 6, "Page 2"),
+        (2, 12, "Page 3"),
+        (3, 18, "Page 4"),
+        (4, 24, "Page 5"),
+    ]
+
+    # The shards aren't analyzed again when the document is ingested again
+    analyzed.clear()
+    assert [page.text async for page in parser.parse(five_page_pdf())] == [page.text for page in pages]
+    assert analyzed == []
+
+
+@pytest.mark.asyncio
+async def test_parse_shards_retry(monkeypatch, tmp_path, five_page_pdf):
+    analyzed = mock_shard_analysis(monkeypatch, failing_pages="3-4")
+    parser = DocumentAnalysisParser(
+        endpoint="https://example.com",
+        credential=MockAzureCredential(),
+        use_content_understanding=False,
+        pages_per_shard=2,
+        analyze_result_cache=AnalyzeResultCache(str(tmp_path)),
+    )
+    with pytest.raises(HttpResponseError):
+        [page async for page in parser.parse(five_page_pdf())]
+
+    # Retrying only analyzes the shard that failed
+    analyzed = mock_shard_analysis(monkeypatch)
+    pages = [page async for page in parser.parse(five_page_pdf())]
+    assert analyzed == ["3-4"]
+    assert [page.page_num for page in pages] == [0, 1, 2, 3, 4]
+
+
 @pytest.mark.asyncio
 async def test_parse_doc_with_tables(monkeypatch):
     mock_poller = MagicMock()
@@ -0,0 +1,53 @@
+import prompty
+import pytest
+
+from approaches.promptmanager import CompiledPrompt, PromptyManager
+
+
+@pytest.mark.parametrize(
+    "prompt_name",
+    [
+        "chat_query_rewrite.prompty",
+        "chat_answer_question.prompty",
+        "ask_answer_question.prompty",
+        "chat_answer_question_vision.prompty",
+        "ask_answer_question_vision.prompty",
+    ],
+)
+def test_compiled_prompt_matches_prompty_prepare(prompt_name):
+    prompt_manager = PromptyManager()
+    prompt = prompt_manager.load_prompt(prompt_name)
+    assert isinstance(prompt, CompiledPrompt)
+
+    data = {
+        "user_query": "What is included in my plan?",
+        "past_messages": [
+            {"role": "user", "content": "What does a CEO do?"},
+            {"role": "assistant", "content": "A CEO provides strategic direction [role_library.pdf#page=1]."},
+        ],
+        "text_sources": ["Benefit_Options.pdf#page=2: There is a whistleblower policy."],
+        "include_follow_up_questions": True,
+        "injected_prompt": "Answer in a friendly tone.",
+    }
+    assert prompt_manager.render_prompt(prompt, data) == prompty.prepare(prompt.prompty, data)
+
+
+def test_compiled_prompt_system_message_is_stable():
+    prompt_manager = PromptyManager()
+    prompt = prompt_manager.load_prompt("chat_answer_question.prompty")
+
+    first = prompt_manager.render_prompt(prompt, {"user_query": "first question", "text_sources": ["a.pdf: a"]})
+    second = prompt_manager.render_prompt(prompt, {"user_query": "second question", "text_sources": ["b.pdf: b"]})
+
+    assert first[0]["role"] == "system"
+    assert first[0]["content"] == second[0]["content"]
+
+
+def test_prompts_and_tools_are_loaded_once():
+    prompt_manager = PromptyManager()
+    assert prompt_manager.load_prompt("chat_query_rewrite.prompty") is prompt_manager.load_prompt(
+        "chat_query_rewrite.prompty"
+    )
+    tools = prompt_manager.load_tools("chat_query_rewrite_tools.json")
+    assert tools is prompt_manager.load_tools("chat_query_rewrite_tools.json")
+    assert tools[0]["function"]["name"] == "search_sources"
@@ -0,0 +1,46 @@
+from approaches.queryrewrite import QueryRewriteCache, query_rewrite_skip_reason
+
+HISTORY = [
+    {"role": "user", "content": "What is included in my Northwind Health Plus plan?"},
+    {"role": "assistant", "content": "It includes medical, vision, and dental coverage."},
+]
+
+
+def test_skip_rewrite_for_short_first_question():
+    assert query_rewrite_skip_reason("Whistleblower policy", []) == "Short question without history"
+
+
+def test_skip_rewrite_for_self_contained_follow_up():
+    assert query_rewrite_skip_reason("Northwind Standard dental coverage", HISTORY) is not None
+
+
+def test_rewrite_needed_for_references_to_history():
+    assert query_rewrite_skip_reason("Does it cover eye exams?", HISTORY) is None
+    assert query_rewrite_skip_reason("What about Northwind Standard?", HISTORY) is None
+
+
+def test_rewrite_needed_for_long_or_non_english_questions():
+    long_question = "Can you tell me everything I need to know about the process for filing a claim?"
+    assert query_rewrite_skip_reason(long_question, []) is None
+    assert query_rewrite_skip_reason("¿Qué cubre mi plan?", []) is None
+    assert query_rewrite_skip_reason("?", []) is None
+
+
+def test_cache_key_depends_on_history():
+    cache = QueryRewriteCache()
+
+    assert cache.key("Eye exams", HISTORY, False) == cache.key("Eye exams", list(HISTORY), False)
+    assert cache.key("Eye exams", HISTORY, False) != cache.key("Eye exams", HISTORY[:1], False)
+    assert cache.key("Eye exams", HISTORY, False) != cache.key("Eye exams", HISTORY, True)
+
+
+def test_cache_evicts_least_recently_used():
+    cache = QueryRewriteCache(max_entries=2)
+    cache.set("a", ["query a"])
+    cache.set("b", ["query b"])
+    cache.get("a")
+    cache.set("c", ["query c"])
+
+    assert cache.get("a") == ["query a"]
+    assert cache.get("b") is None
+    assert cache.get("c") == ["query c"]
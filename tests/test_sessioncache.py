@@ -0,0 +1,35 @@
+import time
+
+from chat_history.sessioncache import SessionListCache
+
+
+def test_session_list_cache():
+    cache = SessionListCache(ttl_seconds=60)
+    cache.set("OID_X", (10, None), {"sessions": []})
+    cache.set("OID_X", (10, "next"), {"sessions": [{"id": "1"}]})
+    assert cache.get("OID_X", (10, None)) == {"sessions": []}
+    assert cache.get("OID_Y", (10, None)) is None
+
+    cache.invalidate("OID_X")
+    assert cache.get("OID_X", (10, None)) is None
+    assert cache.get("OID_X", (10, "next")) is None
+
+
+def test_session_list_cache_expiry(monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    cache = SessionListCache(ttl_seconds=30)
+    cache.set("OID_X", (10, None), {"sessions": []})
+    monkeypatch.setattr(time, "monotonic", lambda: now + 31)
+    assert cache.get("OID_X", (10, None)) is None
+
+
+def test_session_list_cache_max_users():
+    cache = SessionListCache(ttl_seconds=60, max_users=2)
+    cache.set("OID_X", (10, None), "x")
+    cache.set("OID_Y", (10, None), "y")
+    assert cache.get("OID_X", (10, None)) == "x"
+    cache.set("OID_Z", (10, None), "z")
+    # The least recently used user is dropped
+    assert cache.get("OID_Y", (10, None)) is None
+    assert cache.get("OID_X", (10, None)) == "x"
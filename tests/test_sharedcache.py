@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+
+import pytest
+
+from core.sharedcache import SLOT_HEADER, SharedMemoryCache
+
+
+def test_shared_cache_roundtrip():
+    cache = SharedMemoryCache(size_bytes=4096, slot_bytes=256)
+
+    assert cache.get("interest rates") is None
+    cache.set("interest rates", b"vector bytes")
+
+    assert cache.get("interest rates") == b"vector bytes"
+    assert cache.get("whistleblower") is None
+
+
+def test_shared_cache_vectors_keep_float32_values():
+    cache = SharedMemoryCache(size_bytes=4096, slot_bytes=SLOT_HEADER.size + 4 * 3)
+    cache.set_vector("interest rates", [0.5, -0.25, 0.125])
+
+    assert cache.get_vector("interest rates") == [0.5, -0.25, 0.125]
+
+
+def test_shared_cache_skips_values_larger_than_a_slot():
+    cache = SharedMemoryCache(size_bytes=4096, slot_bytes=SLOT_HEADER.size + 4)
+    cache.set_vector("interest rates", [0.5, 0.5])
+
+    assert cache.get_vector("interest rates") is None
+
+
+def test_shared_cache_detects_overwritten_and_torn_slots():
+    cache = SharedMemoryCache(size_bytes=256, slot_bytes=256)
+    cache.set("interest rates", b"first")
+    cache.set("whistleblower", b"second")
+
+    # With a single slot the second key replaces the first
+    assert cache.get("interest rates") is None
+    assert cache.get("whistleblower") == b"second"
+
+    # A value that is partly written by another worker fails the checksum
+    cache.memory[SLOT_HEADER.size] = ord("S")
+    assert cache.get("whistleblower") is None
+
+
+def store_in_child(cache: SharedMemoryCache):
+    cache.set("interest rates", b"from another worker")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Workers only share memory when forked")
+def test_shared_cache_is_shared_with_forked_workers():
+    cache = SharedMemoryCache(size_bytes=4096, slot_bytes=256)
+
+    worker = multiprocessing.get_context("fork").Process(target=store_in_child, args=(cache,))
+    worker.start()
+    worker.join()
+
+    assert cache.get("interest rates") == b"from another worker"
@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 from io import BytesIO
 
 import azure.core.exceptions
@@ -5,6 +7,7 @@ import azure.storage.filedatalake
 import azure.storage.filedatalake.aio
 import pytest
 from azure.search.documents.aio import SearchClient
+from azure.storage.filedatalake import FileProperties
 from azure.storage.filedatalake.aio import DataLakeDirectoryClient, DataLakeFileClient
 from openai.types.create_embedding_response import (
     CreateEmbeddingResponse,
@@ -13,11 +16,73 @@ from openai.types.create_embedding_response import (
 )
 from quart.datastructures import FileStorage
 
+import app
 from prepdocslib.embeddings import AzureOpenAIEmbeddingService
 
 from .mocks import MockClient, MockEmbeddingsClient
 
 
+def mock_file_storage(monkeypatch, ingested_hash=None):
+    """Keeps the uploaded file's content and metadata in memory, along with the uploads still in progress."""
+    stored = {"content": bytearray(), "metadata": {}, "appends": 0, "uploading": {}}
+
+    def file_state(file_client):
+        if file_client.path_name.endswith(app.UPLOAD_TEMP_SUFFIX):
+            return stored["uploading"][file_client.path_name]
+        return stored
+
+    async def mock_get_file_properties(self, *args, **kwargs):
+        if ingested_hash is None:
+            raise azure.core.exceptions.ResourceNotFoundError()
+        return FileProperties(metadata={"IngestedHash": ingested_hash})
+
+    async def mock_create_file(self, *args, **kwargs):
+        assert kwargs.get("metadata") == {"UploadedBy": "OID_X"}
+        assert self.path_name.endswith(app.UPLOAD_TEMP_SUFFIX)
+        stored["uploading"][self.path_name] = {"content": bytearray(), "metadata": kwargs["metadata"]}
+
+    async def mock_append_data(self, data, offset, length=None, **kwargs):
+        state = file_state(self)
+        assert offset == len(state["content"])
+        state["content"] += data
+        stored["appends"] += 1
+
+    async def mock_flush_data(self, offset, *args, **kwargs):
+        assert offset == len(file_state(self)["content"])
+
+    async def mock_set_metadata(self, metadata, *args, **kwargs):
+        file_state(self)["metadata"] = metadata
+
+    async def mock_rename_file(self, new_name, **kwargs):
+        assert new_name == "user-content/a.txt"
+        state = stored["uploading"].pop(self.path_name)
+        stored["content"] = state["content"]
+        stored["metadata"] = state["metadata"]
+
+    async def mock_delete_file(self, *args, **kwargs):
+        del stored["uploading"][self.path_name]
+
+    class MockDownloader:
+        def __init__(self):
+            self.properties = FileProperties(metadata=dict(stored["metadata"]))
+
+        async def readall(self):
+            return bytes(stored["content"])
+
+    async def mock_download_file(self, *args, **kwargs):
+        return MockDownloader()
+
+    monkeypatch.setattr(DataLakeFileClient, "get_file_properties", mock_get_file_properties)
+    monkeypatch.setattr(DataLakeFileClient, "create_file", mock_create_file)
+    monkeypatch.setattr(DataLakeFileClient, "append_data", mock_append_data)
+    monkeypatch.setattr(DataLakeFileClient, "flush_data", mock_flush_data)
+    monkeypatch.setattr(DataLakeFileClient, "set_metadata", mock_set_metadata)
+    monkeypatch.setattr(DataLakeFileClient, "rename_file", mock_rename_file)
+    monkeypatch.setattr(DataLakeFileClient, "delete_file", mock_delete_file)
+    monkeypatch.setattr(DataLakeFileClient, "download_file", mock_download_file)
+    return stored
+
+
 # parameterize for directory existing or not
 @pytest.mark.asyncio
 @pytest.mark.parametrize("directory_exists", [True, False])
@@ -51,12 +116,7 @@ async def test_upload_file(auth_client, monkeypatch, mock_data_lake_service_clie
 
     monkeypatch.setattr(DataLakeDirectoryClient, "get_file_client", mock_directory_get_file_client)
 
-    async def mock_upload_file(self, *args, **kwargs):
-        assert kwargs.get("overwrite") is True
-        assert kwargs.get("metadata") == {"UploadedBy": "OID_X"}
-        return None
-
-    monkeypatch.setattr(DataLakeFileClient, "upload_data", mock_upload_file)
+    stored = mock_file_storage(monkeypatch)
 
     async def mock_create_client(self, *args, **kwargs):
         # From https://platform.openai.com/docs/api-reference/embeddings/create
@@ -94,9 +154,22 @@ async def test_upload_file(auth_client, monkeypatch, mock_data_lake_service_clie
         headers={"Authorization": "Bearer test"},
         files={"file": FileStorage(BytesIO(b"foo;bar"), filename="a.txt")},
     )
-    message = (await response.get_json())["message"]
-    assert message == "File uploaded successfully"
-    assert response.status_code == 200
+    assert response.status_code == 202
+    job_id = (await response.get_json())["job_id"]
+
+    # The file is ingested in the background
+    for _ in range(100):
+        response = await auth_client.get(f"/upload_status/{job_id}", headers={"Authorization": "Bearer test"})
+        job = await response.get_json()
+        if job["status"] not in ("queued", "running"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "succeeded"
+    assert job["filename"] == "a.txt"
+    assert job["message"] == "File uploaded successfully"
+    assert stored["content"] == b"foo;bar"
+    content_hash = hashlib.sha256(b"foo;bar").hexdigest()
+    assert stored["metadata"] == {"UploadedBy": "OID_X", "ContentHash": content_hash, "IngestedHash": content_hash}
     assert len(documents_uploaded) == 1
     assert documents_uploaded[0]["id"] == "file-a_txt-612E7478747B276F696473273A205B274F49445F58275D7D-page-0"
     assert documents_uploaded[0]["sourcepage"] == "a.txt"
@@ -105,6 +178,110 @@ async def test_upload_file(auth_client, monkeypatch, mock_data_lake_service_clie
     assert documents_uploaded[0]["category"] is None
     assert documents_uploaded[0]["oids"] == ["OID_X"]
     assert directory_created[0] == (not directory_exists)
+    assert stored["uploading"] == {}
+
+
+@pytest.mark.asyncio
+async def test_upload_file_already_ingested(auth_client, monkeypatch, mock_data_lake_service_client):
+    async def mock_directory_call(self, *args, **kwargs):
+        return None
+
+    monkeypatch.setattr(DataLakeDirectoryClient, "get_directory_properties", mock_directory_call)
+    monkeypatch.setattr(DataLakeDirectoryClient, "set_access_control", mock_directory_call)
+
+    def mock_directory_get_file_client(self, *args, **kwargs):
+        return azure.storage.filedatalake.aio.DataLakeFileClient(
+            account_url="https://test.blob.core.windows.net/", file_system_name="user-content", file_path=args[0]
+        )
+
+    monkeypatch.setattr(DataLakeDirectoryClient, "get_file_client", mock_directory_get_file_client)
+    content_hash = hashlib.sha256(b"foo;bar;baz").hexdigest()
+    stored = mock_file_storage(monkeypatch, ingested_hash=content_hash)
+
+    response = await auth_client.post(
+        "/upload",
+        headers={"Authorization": "Bearer test"},
+        files={"file": FileStorage(BytesIO(b"foo;bar;baz"), filename="a.txt")},
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["message"] == "File uploaded successfully"
+    assert "job_id" not in result
+    assert stored["content"] == b"foo;bar;baz"
+    assert stored["metadata"]["IngestedHash"] == content_hash
+
+
+@pytest.mark.asyncio
+async def test_upload_file_failed(auth_client, monkeypatch, mock_data_lake_service_client):
+    async def mock_directory_call(self, *args, **kwargs):
+        return None
+
+    monkeypatch.setattr(DataLakeDirectoryClient, "get_directory_properties", mock_directory_call)
+    monkeypatch.setattr(DataLakeDirectoryClient, "set_access_control", mock_directory_call)
+
+    def mock_directory_get_file_client(self, *args, **kwargs):
+        return azure.storage.filedatalake.aio.DataLakeFileClient(
+            account_url="https://test.blob.core.windows.net/", file_system_name="user-content", file_path=args[0]
+        )
+
+    monkeypatch.setattr(DataLakeDirectoryClient, "get_file_client", mock_directory_get_file_client)
+    content_hash = hashlib.sha256(b"foo;bar").hexdigest()
+    stored = mock_file_storage(monkeypatch, ingested_hash=content_hash)
+    stored["content"] += b"foo;bar"
+    stored["metadata"] = {"UploadedBy": "OID_X", "ContentHash": content_hash, "IngestedHash": content_hash}
+
+    async def mock_flush_data(self, offset, *args, **kwargs):
+        raise azure.core.exceptions.HttpResponseError("Service unavailable")
+
+    monkeypatch.setattr(DataLakeFileClient, "flush_data", mock_flush_data)
+
+    with pytest.raises(azure.core.exceptions.HttpResponseError):
+        await auth_client.post(
+            "/upload",
+            headers={"Authorization": "Bearer test"},
+            files={"file": FileStorage(BytesIO(b"foo;bar;baz"), filename="a.txt")},
+        )
+    # The previous file is kept as it was, and the incomplete upload is removed
+    assert stored["content"] == b"foo;bar"
+    assert stored["metadata"]["IngestedHash"] == content_hash
+    assert stored["uploading"] == {}
+
+
+@pytest.mark.asyncio
+async def test_upload_file_stream(monkeypatch):
+    monkeypatch.setattr(app, "UPLOAD_APPEND_BYTES", 4)
+    stored = mock_file_storage(monkeypatch)
+
+    async def chunks():
+        for chunk in [b"foo", b";", b"bar;baz", b"!"]:
+            yield chunk
+
+    file_client = azure.storage.filedatalake.aio.DataLakeFileClient(
+        account_url="https://test.blob.core.windows.net/", file_system_name="user-content", file_path="a.txt"
+    )
+    content_hash = await app.upload_file_stream(file_client, chunks())
+    assert content_hash == hashlib.sha256(b"foo;bar;baz!").hexdigest()
+    assert stored["content"] == b"foo;bar;baz!"
+    # Small chunks are combined, so storage isn't called for each one
+    assert stored["appends"] == 3
+
+
+@pytest.mark.asyncio
+async def test_upload_file_missing(auth_client):
+    response = await auth_client.post("/upload", headers={"Authorization": "Bearer test"}, form={"name": "a.txt"})
+    assert response.status_code == 400
+    assert (await response.get_json())["message"] == "No file part in the request"
+
+
+@pytest.mark.asyncio
+async def test_upload_status_other_user(auth_client):
+    ingestion_queue = auth_client.config[app.CONFIG_INGESTION_QUEUE]
+    # Only the status is checked, so there's no need to process the job
+    await ingestion_queue.stop()
+    job_id = await ingestion_queue.add("OID_Y", "b.txt")
+
+    response = await auth_client.get(f"/upload_status/{job_id}", headers={"Authorization": "Bearer test"})
+    assert response.status_code == 404
 
 
 @pytest.mark.asyncio